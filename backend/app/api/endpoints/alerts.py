@@ -2,12 +2,14 @@ import logging
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel, Field, ConfigDict
-from sqlmodel import Session, select
+from sqlmodel import Session, select, delete
 from geoalchemy2.elements import WKTElement
 
 from app.core.auth import get_current_user
 from app.db.session import get_session
-from app.db.models import User, UserAlert
+from app.db.models import User, UserAlert, AlertObservation
+from app.db.zone_store import assign_alert_zone, release_alert_zone
+from app.core.alert_rules import RULE_TYPES
 
 logger = logging.getLogger(__name__)
 
@@ -19,8 +21,12 @@ class AlertCreate(BaseModel):
     lng: float
     radius: int
     approach: str = Field(..., max_length=100)
-    trigger_type: str = Field(default="ndvi_below", max_length=50) # ndvi_below, ndwi_above, ndmi_below, ndvi_drop_pct
+    trigger_type: str = Field(default="ndvi_below", max_length=50) # Ver RULE_TYPES en app/core/alert_rules.py
     trigger_value: float = Field(default=0.3)
+    # Umbral del segundo índice de las reglas compuestas (None: valor por defecto de la regla)
+    trigger_secondary_value: Optional[float] = Field(default=None)
+    # Observaciones de los disparadores por tendencia (None: valor por defecto de cada uno)
+    trigger_window: Optional[int] = Field(default=None, ge=2, le=24)
     frequency: str = Field(default="daily", max_length=20)
 
 class AlertResponse(BaseModel):
@@ -32,6 +38,8 @@ class AlertResponse(BaseModel):
     approach: str
     trigger_type: str
     trigger_value: float
+    trigger_secondary_value: Optional[float] = None
+    trigger_window: Optional[int] = None
     is_active: bool
     frequency: str
     last_index_value: Optional[float] = None
@@ -67,11 +75,10 @@ def create_alert(
         )
 
     # Validar trigger type
-    valid_triggers = ["ndvi_below", "ndwi_above", "ndmi_below", "ndvi_drop_pct"]
-    if alert_in.trigger_type not in valid_triggers:
+    if alert_in.trigger_type not in RULE_TYPES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Tipo de disparador inválido. Opciones válidas: {', '.join(valid_triggers)}"
+            detail=f"Tipo de disparador inválido. Opciones válidas: {', '.join(RULE_TYPES)}"
         )
 
     # Validar frequency
@@ -91,10 +98,21 @@ def create_alert(
         coordinates=WKTElement(f"POINT({alert_in.lng} {alert_in.lat})", srid=4326),
         trigger_type=alert_in.trigger_type,
         trigger_value=alert_in.trigger_value,
+        trigger_secondary_value=alert_in.trigger_secondary_value,
+        trigger_window=alert_in.trigger_window,
         frequency=alert_in.frequency,
         is_active=True
     )
-    
+
+    # Zona compartida con las alertas del mismo lugar (se evalúan juntas). Best-effort:
+    # sin zona la alerta se evalúa sola.
+    try:
+        with session.begin_nested():
+            alert.zone_id = assign_alert_zone(session, alert_in.lat, alert_in.lng, alert_in.radius)
+    except Exception as e:
+        logger.warning(f"No se pudo asignar zona compartida a la alerta de usuario {user.id}: {e}")
+        alert.zone_id = None
+
     try:
         session.add(alert)
         session.commit()
@@ -135,6 +153,9 @@ def delete_alert(
         )
         
     try:
+        # alert_observations no tiene FK (tabla particionada): su historial se borra aquí
+        session.exec(delete(AlertObservation).where(AlertObservation.alert_id == alert_id))
+        release_alert_zone(session, alert.zone_id)
         session.delete(alert)
         session.commit()
         logger.info(f"Usuario {user.id} eliminó alerta {alert_id}")
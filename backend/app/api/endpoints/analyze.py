@@ -4,7 +4,7 @@ import logging
 import uuid
 from typing import Optional
 
-from fastapi import APIRouter, Request, Depends, HTTPException, status
+from fastapi import APIRouter, Request, Depends, HTTPException, Response, status
 from fastapi.responses import HTMLResponse
 from pydantic import BaseModel, Field
 from celery.result import AsyncResult
@@ -12,49 +12,40 @@ from sqlmodel import Session, select
 import datetime
 
 from app.core.auth import get_optional_user
-from app.core.security import verify_rate_limit, analysis_limiter, status_limiter, redis_client
+from app.core.config import settings
+from app.core.security import verify_rate_limit, analysis_limiter, status_limiter, redis_client, log_event
+from app.core.gee_resilience import gee_breaker
 from app.db.session import get_session
 from app.db.models import User, UserAnalysis
+from app.db.timeseries_store import load_history_chart_data
 from app.tasks.worker import (
     process_gee_analysis,
     process_timeseries,
     persist_user_analysis,
-    ANALYSIS_LOGIC_VERSION,
-    TIMESERIES_LOGIC_VERSION,
+    lookup_durable_analysis,
+    read_no_imagery_cache,
+    buffer_api_usage,
+    build_analysis_cache_key,
+    build_timeseries_cache_key,
+)
+from app.tasks.celery_app import celery_app, route_task
+from app.tasks.admission import ADMIT, REJECT, assess_admission
+from app.tasks.results import resolve_task_result
+from app.tasks.cancellation import (
+    CANCELLED,
+    attach_to_task,
+    inflight_task_for,
+    note_task_polled,
+    pop_attached_request,
+    remember_attached_request,
+    request_cancel,
+    watch_tasks,
 )
-from app.tasks.celery_app import celery_app
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
-def build_analysis_cache_key(approach: str, radius: int, lat: float, lng: float, start_date: str = None, end_date: str = None) -> str:
-    """
-    Genera la clave de cache para un análisis dado.
-
-    Se redondea lat/lng a 4 decimales (~11m de precisión) para que selecciones
-    casi idénticas del mapa (mismo punto, distinto redondeo de float) compartan
-    cache. Sentinel-2 revisita cada ~5 días, así que un resultado sigue siendo
-    válido durante todo el TTL de la cache. Incluye ANALYSIS_LOGIC_VERSION para que
-    un cambio en las fórmulas/umbrales de worker.py invalide la cache de inmediato en
-    vez de esperar hasta 12h a que expire por TTL (ver comentario junto a esa constante).
-    """
-    key = f"analysis:{ANALYSIS_LOGIC_VERSION}:{approach}:{radius}:{round(lat, 4)}:{round(lng, 4)}"
-    if start_date and end_date:
-        key += f":{start_date}:{end_date}"
-    return key
-
-
-def build_timeseries_cache_key(radius: int, lat: float, lng: float) -> str:
-    """
-    Clave de cache para la serie temporal del Pulso Territorial. A diferencia de
-    build_analysis_cache_key, NO incluye el "approach": los mismos NDVI/NDWI/NDMI se
-    calculan igual sin importar qué enfoque haya elegido el usuario, así que dos
-    análisis de la misma ubicación+radio con distinto enfoque comparten esta cache.
-    """
-    return f"timeseries:{TIMESERIES_LOGIC_VERSION}:{radius}:{round(lat, 4)}:{round(lng, 4)}"
-
-
 def resolve_timeseries(radius: int, lat: float, lng: float) -> tuple:
     """
     Devuelve (timeseries_task_id, timeseries_result): si hay cache-hit, task_id es None y
@@ -92,8 +83,30 @@ class AnalyzeRequest(BaseModel):
     end_date: Optional[str] = Field(None, description="Fecha de término (YYYY-MM-DD) para análisis histórico")
 
 
+def serve_stale_analysis(
+    data: "AnalyzeRequest", timeseries_task_id, timeseries_result, wait_id: Optional[str], message: str
+) -> Optional[dict]:
+    """Respuesta con el último análisis de la zona aunque esté vencido (None si no hay ninguno)."""
+    stale_result = lookup_durable_analysis(
+        data.approach, data.lat, data.lng, data.radius, data.start_date, data.end_date,
+        include_expired=True,
+    )
+    if stale_result is None:
+        return None
+    return {
+        "status": "complete",
+        "task_id": f"cached-{uuid.uuid4()}",
+        "result": stale_result,
+        "stale": True,
+        "timeseries_task_id": timeseries_task_id,
+        "timeseries_result": timeseries_result,
+        "wait_id": wait_id,
+        "message": message
+    }
+
+
 @router.post("/analyze", dependencies=[Depends(verify_rate_limit(analysis_limiter))])
-def trigger_analysis(data: AnalyzeRequest, user: Optional[User] = Depends(get_optional_user)):
+def trigger_analysis(data: AnalyzeRequest, response: Response, user: Optional[User] = Depends(get_optional_user)):
     """
     Inicia un análisis satelital con Google Earth Engine.
     El procesamiento se ejecuta de forma asíncrona en Celery.
@@ -115,34 +128,135 @@ def trigger_analysis(data: AnalyzeRequest, user: Optional[User] = Depends(get_op
     timeseries_task_id, timeseries_result = (
         resolve_timeseries(data.radius, data.lat, data.lng) if user else (None, None)
     )
+    # La serie temporal se sondea recién cuando llega el análisis: comparte grupo de espera
+    # con él para no darse por abandonada mientras tanto (app/tasks/cancellation.py). El
+    # grupo vuelve como wait_id: el cliente lo manda al sondear y al cancelar.
+    watch_group = watch_tasks({timeseries_task_id: None}) if timeseries_task_id else None
 
     # Cache hit: devolver el resultado ya calculado sin encolar ni esperar a GEE.
     # Sentinel-2 solo revisita cada ~5 días, así que reanalizar el mismo punto+enfoque
     # dentro del TTL siempre da el mismo resultado.
+    cached_result = None
+    cache_message = "Resultado obtenido desde cache (análisis reciente de esta zona)."
     if redis_client:
         try:
             cached = redis_client.get(cache_key)
             if cached:
                 cached_result = json.loads(cached)
-                cached_task_id = f"cached-{uuid.uuid4()}"
-                # El worker nunca corre en un cache-hit, así que si hay un usuario logeado
-                # hay que guardar la copia de su historial personal aquí mismo.
-                if user:
-                    persist_user_analysis(
-                        user.id, cached_task_id, data.lat, data.lng, data.radius,
-                        data.approach, data.location, cached_result
-                    )
-                return {
-                    "status": "complete",
-                    "task_id": cached_task_id,
-                    "result": cached_result,
-                    "timeseries_task_id": timeseries_task_id,
-                    "timeseries_result": timeseries_result,
-                    "message": "Resultado obtenido desde cache (análisis reciente de esta zona)."
-                }
         except Exception as e:
             logger.warning(f"Error leyendo cache de análisis ({cache_key}): {e}")
 
+    # Cache negativa: esta misma consulta ya terminó hace poco sin imagen utilizable (nubes
+    # persistentes, sin pasadas) y no se ha visto una escena más nueva en la región desde
+    # entonces. Reintentar en GEE daría el mismo resultado.
+    if cached_result is None:
+        no_imagery = read_no_imagery_cache(cache_key, data.lat, data.lng)
+        if no_imagery is not None:
+            return {
+                "status": "complete",
+                "task_id": f"cached-{uuid.uuid4()}",
+                "result": no_imagery,
+                "timeseries_task_id": timeseries_task_id,
+                "timeseries_result": timeseries_result,
+                "wait_id": watch_group,
+                "message": "Sin imágenes utilizables recientes para esta zona (resultado reciente en cache)."
+            }
+
+    # Cache-miss de Redis (TTL vencido, evicción o reinicio): antes de encolar, buscar en la
+    # cache durable de PostGIS. Un hit ahí también rehidrata Redis para las siguientes.
+    if cached_result is None:
+        cached_result = lookup_durable_analysis(
+            data.approach, data.lat, data.lng, data.radius, data.start_date, data.end_date, cache_key
+        )
+        cache_message = "Resultado obtenido desde el historial persistente de análisis de esta zona."
+
+    if cached_result is not None:
+        cached_task_id = f"cached-{uuid.uuid4()}"
+        # Los cache-hits también son demanda: sin este registro, una zona popular que se
+        # sirve siempre desde cache dejaría de verse como hotspot para prewarm_analysis_cache.
+        # Va al buffer de Redis (volcado por lotes) para no escribir en la base en cada hit.
+        try:
+            buffer_api_usage(data.lat, data.lng, data.radius, data.approach, data.location, "cache_hit")
+        except Exception as e:
+            logger.warning(f"Error registrando uso de cache-hit ({cache_key}): {e}")
+        # El worker nunca corre en un cache-hit, así que si hay un usuario logeado
+        # hay que guardar la copia de su historial personal aquí mismo.
+        if user:
+            persist_user_analysis(
+                user.id, cached_task_id, data.lat, data.lng, data.radius,
+                data.approach, data.location, cached_result
+            )
+        return {
+            "status": "complete",
+            "task_id": cached_task_id,
+            "result": cached_result,
+            "timeseries_task_id": timeseries_task_id,
+            "timeseries_result": timeseries_result,
+            "wait_id": watch_group,
+            "message": cache_message
+        }
+
+    # Circuit breaker de GEE abierto (app/core/gee_resilience.py): la tarea fallaría sin
+    # llegar a GEE. Servir el último análisis de esta zona aunque esté vencido; si no hay
+    # ninguno, pedir al cliente que reintente cuando el circuito vuelva a cerrarse.
+    if gee_breaker.is_open():
+        stale_response = serve_stale_analysis(
+            data, timeseries_task_id, timeseries_result, watch_group,
+            "Google Earth Engine no está respondiendo; se muestra el último análisis disponible de esta zona."
+        )
+        if stale_response is not None:
+            return stale_response
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Google Earth Engine no está disponible en este momento. Intenta nuevamente en unos segundos.",
+            headers={"Retry-After": str(max(1, gee_breaker.retry_after_seconds()))},
+        )
+
+    # Otra solicitud idéntica ya tiene una tarea en curso: esperar esa en vez de encolar
+    # otra que calcularía lo mismo. Esta solicitud espera con su propio grupo (el de su
+    # serie temporal), y su historial se guarda cuando lea el resultado.
+    inflight_task_id = inflight_task_for(cache_key)
+    if inflight_task_id and not AsyncResult(inflight_task_id, app=celery_app).ready():
+        wait_id = attach_to_task(inflight_task_id, cache_key, group=watch_group)
+        if user:
+            remember_attached_request(inflight_task_id, wait_id, {
+                "user_id": user.id, "lat": data.lat, "lng": data.lng, "radius": data.radius,
+                "approach": data.approach, "location_name": data.location,
+            })
+        return {
+            "status": "queued",
+            "task_id": inflight_task_id,
+            "timeseries_task_id": timeseries_task_id,
+            "timeseries_result": timeseries_result,
+            "wait_id": wait_id,
+            "message": "Este análisis ya se está calculando; consulta el estado con el ID de tarea."
+        }
+
+    # Control de admisión (app/tasks/admission.py): con la cola saturada, servir el último
+    # análisis de la zona, encolar una vista previa más barata o rechazar con Retry-After
+    # en vez de dejar que la cola crezca sin límite.
+    admission = None
+    preview = False
+    if settings.ADMISSION_ENABLED:
+        queue = route_task(process_gee_analysis.name, (), {"radius": data.radius}, {})["queue"]
+        admission = assess_admission(queue)
+        if admission["decision"] != ADMIT:
+            log_event('analysis_admission', decision=admission["decision"], queue=queue,
+                      position=admission["position"], eta_s=admission["eta_s"])
+            stale_response = serve_stale_analysis(
+                data, timeseries_task_id, timeseries_result, watch_group,
+                "Hay alta demanda en este momento; se muestra el último análisis disponible de esta zona."
+            )
+            if stale_response is not None:
+                return stale_response
+            if admission["decision"] == REJECT:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="El servicio de análisis está saturado. Intenta nuevamente en unos minutos.",
+                    headers={"Retry-After": str(admission["retry_after_s"])},
+                )
+            preview = True
+
     # Encolar la tarea en Celery
     task = process_gee_analysis.delay(
         lat=data.lat,
@@ -153,23 +267,38 @@ def trigger_analysis(data: AnalyzeRequest, user: Optional[User] = Depends(get_op
         cache_key=cache_key,
         user_id=user.id if user else None,
         start_date=data.start_date,
-        end_date=data.end_date
+        end_date=data.end_date,
+        preview=preview
     )
+    wait_id = watch_tasks({task.id: cache_key}, group=watch_group)
 
-    return {
+    body = {
         "status": "queued",
         "task_id": task.id,
         "timeseries_task_id": timeseries_task_id,
         "timeseries_result": timeseries_result,
+        "wait_id": wait_id,
         "message": "Análisis encolado correctamente. Consulta el estado utilizando el ID de tarea."
     }
+    if preview:
+        body["preview"] = True
+        body["message"] = "Hay alta demanda: se encoló una vista previa del análisis (sin capa de mapa)."
+    if admission is not None:
+        body["queue"] = {"position": admission["position"], "eta_s": admission["eta_s"]}
+        body["poll_after_s"] = admission["poll_after_s"]
+        response.headers["Retry-After"] = str(admission["poll_after_s"])
+    return body
 
 
 @router.get("/analyze/status/{task_id}", dependencies=[Depends(verify_rate_limit(status_limiter))])
-def get_analysis_status(task_id: str):
+def get_analysis_status(task_id: str, wait_id: Optional[str] = None):
     """
-    Consulta el estado de una tarea de análisis satelital encolada.
+    Consulta el estado de una tarea de análisis satelital encolada. `wait_id` es el
+    comprobante que devolvió POST /analyze para esta solicitud.
     """
+    # Cada sondeo confirma que esta solicitud sigue esperando la tarea (ver cancellation.py).
+    note_task_polled(task_id, wait_id)
+
     # Consultar el estado de la tarea en Redis
     result = AsyncResult(task_id, app=celery_app)
     
@@ -179,11 +308,27 @@ def get_analysis_status(task_id: str):
     }
     
     if result.state == "SUCCESS":
-        response["status"] = "success"
-        response["result"] = result.result
+        # El backend de Celery guarda solo un puntero a la cache del análisis (results.py).
+        task_result = resolve_task_result(result.result)
+        if task_result is None:
+            response["status"] = "failed"
+            response["error"] = "El resultado de este análisis ya expiró. Vuelve a ejecutarlo."
+        else:
+            response["status"] = "success"
+            response["result"] = task_result
+            # Solicitud enganchada a la tarea de otro usuario: el worker no guardó su historial
+            attached = pop_attached_request(task_id, wait_id)
+            if attached:
+                persist_user_analysis(
+                    attached["user_id"], task_id, attached["lat"], attached["lng"], attached["radius"],
+                    attached["approach"], attached["location_name"], task_result
+                )
     elif result.state == "FAILURE":
         response["status"] = "failed"
         response["error"] = str(result.info or "Error interno en el worker.")
+    elif result.state == "REVOKED":
+        response["status"] = "cancelled"
+        response["error"] = "El análisis fue cancelado."
     elif result.state == "STARTED":
         response["status"] = "running"
         response["message"] = "El análisis está siendo procesado por Google Earth Engine..."
@@ -194,6 +339,32 @@ def get_analysis_status(task_id: str):
     return response
 
 
+@router.delete("/analyze/{task_id}", dependencies=[Depends(verify_rate_limit(status_limiter))])
+def cancel_analysis(task_id: str, wait_id: str):
+    """
+    Cancela un análisis (o su serie temporal) que el usuario ya no espera: al cerrar el
+    panel o lanzar otro análisis. Si la tarea aún está en cola se revoca; si ya corre, se
+    detiene en el próximo punto de control entre etapas de GEE. Si otra solicitud espera
+    el mismo resultado, la tarea sigue y solo se suelta a quien la canceló.
+
+    Requiere el wait_id de la solicitud: el task_id solo no basta, porque se comparte con
+    las solicitudes idénticas de otros usuarios.
+    """
+    outcome = request_cancel(task_id, wait_id)
+    if outcome is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No hay una solicitud con ese comprobante esperando esta tarea."
+        )
+    if outcome == CANCELLED:
+        try:
+            celery_app.control.revoke(task_id)
+        except Exception as e:
+            logger.warning(f"Error revocando la tarea {task_id}: {e}")
+    log_event('task_cancel_requested', task_id=task_id, outcome=outcome)
+    return {"task_id": task_id, "status": outcome}
+
+
 @router.get("/analyze/export/{task_id}", response_class=HTMLResponse)
 def export_analysis_pdf(task_id: str, session: Session = Depends(get_session)):
     """
@@ -208,8 +379,8 @@ def export_analysis_pdf(task_id: str, session: Session = Depends(get_session)):
     if not analysis:
         # Fallback: si no está en la base de datos, intentar leer de Celery/Redis
         result = AsyncResult(task_id, app=celery_app)
-        if result.state == "SUCCESS":
-            res_data = result.result
+        res_data = resolve_task_result(result.result) if result.state == "SUCCESS" else None
+        if res_data is not None:
             
             # Armar un objeto temporal
             class TempAnalysis:
@@ -233,6 +404,11 @@ def export_analysis_pdf(task_id: str, session: Session = Depends(get_session)):
                 detail="Análisis no encontrado o no ha sido completado todavía."
             )
 
+    # El Pulso Territorial puede estar referenciado en la tabla compartida en vez de embebido.
+    chart_data = analysis.chart_data
+    if isinstance(analysis, UserAnalysis) and chart_data is None:
+        chart_data = load_history_chart_data(session, [analysis]).get(analysis.id)
+
     # Formatear el enfoque para presentación
     approach_titles = {
         "mining": "Gestión de Relaves y Minería",
@@ -267,9 +443,9 @@ def export_analysis_pdf(task_id: str, session: Session = Depends(get_session)):
                 """
     
     chart_section = ""
-    if analysis.chart_data:
+    if chart_data:
         chart_rows = ""
-        for pt in analysis.chart_data:
+        for pt in chart_data:
             safe_pt_date = html.escape(str(pt.get('date', '')))
             chart_rows += f"""
             <tr>
@@ -16,6 +16,9 @@ from app.core.auth import (
 from app.core.security import verify_rate_limit, auth_limiter, me_limiter
 from app.db.session import get_session
 from app.db.models import User, UserAnalysis
+from app.db.timeseries_store import load_history_chart_data, store_covers_chart_data
+from app.core.cells import location_cell
+from app.tasks.worker import TIMESERIES_LOGIC_VERSION
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -135,7 +138,7 @@ class AnalysisHistoryItem(BaseModel):
     interpreted_result: Optional[str] = None
 
 
-def _to_history_item(row: UserAnalysis) -> AnalysisHistoryItem:
+def _to_history_item(row: UserAnalysis, chart_data: Optional[list] = None) -> AnalysisHistoryItem:
     return AnalysisHistoryItem(
         task_id=row.task_id,
         location_name=row.location_name,
@@ -145,7 +148,7 @@ def _to_history_item(row: UserAnalysis) -> AnalysisHistoryItem:
         approach=row.approach,
         timestamp=row.created_at.strftime("%d/%m/%Y %H:%M:%S"),
         indices=row.indices,
-        chart_data=row.chart_data,
+        chart_data=row.chart_data if row.chart_data is not None else chart_data,
         map_layer={"url": row.map_layer_url} if row.map_layer_url else None,
         meta_date=row.image_date,
         interpreted_result=row.interpretation,
@@ -171,7 +174,9 @@ def list_my_analyses(
         .limit(50)
     ).all()
 
-    return [_to_history_item(r) for r in rows]
+    # Las filas que referencian la serie temporal compartida se resuelven en una sola consulta.
+    shared_charts = load_history_chart_data(session, rows)
+    return [_to_history_item(r, shared_charts.get(r.id)) for r in rows]
 
 
 class AnalysisPatchRequest(BaseModel):
@@ -191,6 +196,11 @@ def patch_analysis(
     del resultado satelital inicial (que ya se muestra de inmediato): la interpretación de
     Gemini y/o la serie temporal del Pulso Territorial. Ambos campos son opcionales y solo
     se actualiza lo que venga en el body.
+
+    Si todos los puntos del Pulso Territorial ya están, con los mismos valores, en la tabla
+    compartida timeseries_points (el caso normal: process_timeseries los guardó antes de
+    responder), el historial guarda solo una referencia a la celda y a la versión de lógica
+    en vez de una copia del chart_data.
     """
     row = session.exec(
         select(UserAnalysis)
@@ -204,7 +214,13 @@ def patch_analysis(
     if data.interpretation is not None:
         row.interpretation = data.interpretation
     if data.chart_data is not None:
-        row.chart_data = data.chart_data
+        if store_covers_chart_data(session, row, data.chart_data, TIMESERIES_LOGIC_VERSION):
+            row.timeseries_cell = location_cell(row.lat, row.lng)
+            row.timeseries_radius = row.radius
+            row.timeseries_logic_version = TIMESERIES_LOGIC_VERSION
+            row.chart_data = None
+        else:
+            row.chart_data = data.chart_data
 
     session.add(row)
     session.commit()
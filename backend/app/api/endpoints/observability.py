@@ -10,12 +10,19 @@ from app.db.session import engine, get_session
 from app.db.models import PageVisit, ApiUsageLog
 from app.core.security import redis_client
 from app.api.endpoints.chat import gemini_available
-from app.core.gee import init_gee
+from app.core.gee import gee_session
+from app.core.gee_governor import gee_governor
+from app.core.gee_resilience import gee_breaker
+from app.core.gee_scheduler import read_published_metrics
+from app.tasks.celery_app import queue_depths
 
 router = APIRouter()
 
+# Función síncrona a propósito: la base de datos, Redis (métricas publicadas, cuota GEE) y
+# el broker (profundidad de colas) son llamadas bloqueantes, así que FastAPI la corre en
+# su threadpool y un broker o Redis lento no detiene el event loop.
 @router.get("/observability")
-async def get_observability_snapshot(
+def get_observability_snapshot(
     request: Request,
     response: Response,
     session: Session = Depends(get_session)
@@ -72,6 +79,9 @@ async def get_observability_snapshot(
                 pass
     except Exception:
         gee_ok = False
+    # La sesión del proceso (app/core/gee.py) es la fuente principal: lista = inicializada
+    # en el lifespan y con token vigente o renovándose en segundo plano.
+    gee_ok = gee_ok or gee_session.ready
 
     critical_checks = {
         "database": db_connected,
@@ -106,6 +116,14 @@ async def get_observability_snapshot(
             "api_usage_logs_table": api_usage_logs_table_ok,
             "ready": bool(page_visits_table_ok and api_usage_logs_table_ok)
         }
+        payload["earth_engine"] = gee_session.snapshot()
+        # Cola de llamadas GEE de cada worker vivo (profundidad, espera, límite AIMD).
+        payload["gee_scheduler"] = read_published_metrics()
+        # Utilización de la cuota GEE compartida por todos los workers.
+        payload["gee_quota"] = gee_governor.snapshot()
+        payload["gee_circuit_breaker"] = gee_breaker.snapshot()
+        # Tareas en espera por cola de Celery (interactive, heavy, premium-timeseries, ...).
+        payload["celery_queues"] = queue_depths()
 
     if overall_status != "healthy":
         response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
@@ -0,0 +1,150 @@
+"""
+Motor de reglas de alertas, vectorizado con NumPy.
+
+La evaluación de disparadores era una cadena de if/elif por alerta intercalada con la E/S
+de GEE. Ahora, con los índices de un lote ya obtenidos, las alertas se pasan a una tabla
+en columnas (alert_table: un arreglo por atributo, una fila por alerta) y cada regla se
+evalúa como una operación sobre todas las filas que la usan:
+
+* Umbrales simples (THRESHOLD_RULES): ndvi_below, ndwi_above, ndmi_below. Como antes,
+  solo aplican si la alerta vigila ese índice (alert_index_for en tasks_periodic.py).
+* Compuestas (COMPOSITE_RULES): dos índices con dos umbrales, trigger_value para el
+  primero y trigger_secondary_value (o el valor por defecto de la regla) para el segundo.
+* Por tendencia (TREND_TRIGGERS, app/core/alert_trends.py): sobre el historial de
+  alert_observations.
+
+Agregar una regla de umbral o compuesta es agregar una entrada a su tabla.
+"""
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.core.alert_trends import TREND_TRIGGERS, describe_trend, evaluate_trends, trend_window
+
+# Columnas de la matriz de índices de alert_table.
+RULE_INDICES = ("NDVI", "NDWI", "NDMI")
+
+# regla: (índice, comparación con trigger_value)
+THRESHOLD_RULES = {
+    "ndvi_below": ("NDVI", "below"),
+    "ndwi_above": ("NDWI", "above"),
+    "ndmi_below": ("NDMI", "below"),
+}
+
+# regla: ((índice, comparación) con trigger_value, (índice, comparación) con el umbral
+# secundario, umbral secundario por defecto)
+COMPOSITE_RULES = {
+    # Vegetación débil y además seca (estrés hídrico)
+    "vegetation_water_stress": (("NDVI", "below"), ("NDMI", "below"), 0.0),
+    # Agua en superficie sobre un cultivo que pierde vigor (anegamiento)
+    "waterlogged_crop": (("NDWI", "above"), ("NDVI", "below"), 0.3),
+}
+
+RULE_TYPES = tuple(THRESHOLD_RULES) + tuple(COMPOSITE_RULES) + TREND_TRIGGERS
+
+_COMPARISON_LABELS = {"below": "menor a", "above": "mayor a"}
+
+
+def rule_indices(trigger_type: str) -> set:
+    """Índices que la regla necesita además del vigilado (solo las compuestas piden otros)."""
+    if trigger_type in COMPOSITE_RULES:
+        (first, _), (second, _), _ = COMPOSITE_RULES[trigger_type]
+        return {first, second}
+    return set()
+
+
+def _compare(values: np.ndarray, comparison: str, thresholds: np.ndarray) -> np.ndarray:
+    # NaN compara como False: un índice faltante nunca dispara
+    return values < thresholds if comparison == "below" else values > thresholds
+
+
+def alert_table(
+    alerts: Sequence,
+    indices: Sequence[Dict[str, float]],
+    watched: Sequence[str],
+) -> Dict[str, np.ndarray]:
+    """
+    Tabla en columnas de un lote: id, rule, threshold, secondary (NaN: por defecto),
+    window, watched (columna del índice vigilado), indices (n × RULE_INDICES, NaN si falta)
+    y current (valor del índice vigilado). `indices` y `watched` van alineados con `alerts`.
+    """
+    n = len(alerts)
+    matrix = np.full((n, len(RULE_INDICES)), np.nan)
+    for i, values in enumerate(indices):
+        for j, name in enumerate(RULE_INDICES):
+            if values.get(name) is not None:
+                matrix[i, j] = values[name]
+    watched_columns = np.array([RULE_INDICES.index(name) for name in watched], dtype=int)
+    secondary = [alert.trigger_secondary_value for alert in alerts]
+    return {
+        "id": np.array([alert.id for alert in alerts], dtype=np.int64),
+        "rule": np.array([alert.trigger_type or "" for alert in alerts], dtype=object),
+        "threshold": np.array([alert.trigger_value for alert in alerts], dtype=float),
+        "secondary": np.array([np.nan if v is None else v for v in secondary], dtype=float),
+        "window": np.array([trend_window(alert.trigger_type, alert.trigger_window) for alert in alerts], dtype=int),
+        "watched": watched_columns,
+        "indices": matrix,
+        "current": matrix[np.arange(n), watched_columns] if n else np.empty(0),
+    }
+
+
+def evaluate_rules(table: Dict[str, np.ndarray], history: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """
+    Evalúa todas las reglas de la tabla. `history` es la matriz de history_matrix alineada
+    con sus filas (sin ella, las reglas por tendencia solo ven la observación actual).
+
+    Devuelve triggered más las estadísticas de tendencia de evaluate_trends por fila.
+    """
+    rule = table["rule"]
+    n = len(rule)
+    triggered = np.zeros(n, dtype=bool)
+
+    for name, (index_name, comparison) in THRESHOLD_RULES.items():
+        column = RULE_INDICES.index(index_name)
+        rows = (rule == name) & (table["watched"] == column)
+        triggered |= rows & _compare(table["indices"][:, column], comparison, table["threshold"])
+
+    for name, ((first, first_cmp), (second, second_cmp), default) in COMPOSITE_RULES.items():
+        rows = rule == name
+        if not rows.any():
+            continue
+        secondary = np.where(np.isnan(table["secondary"]), default, table["secondary"])
+        triggered |= (
+            rows
+            & _compare(table["indices"][:, RULE_INDICES.index(first)], first_cmp, table["threshold"])
+            & _compare(table["indices"][:, RULE_INDICES.index(second)], second_cmp, secondary)
+        )
+
+    if history is None:
+        history = np.full((n, 1), np.nan)
+    trends = evaluate_trends(rule, table["threshold"], table["window"], table["current"], history)
+    # ndvi_drop_pct solo aplica a alertas que vigilan NDVI
+    trend_rows = np.isin(rule, TREND_TRIGGERS) & ~(
+        (rule == "ndvi_drop_pct") & (table["watched"] != RULE_INDICES.index("NDVI"))
+    )
+    triggered |= trend_rows & trends["triggered"]
+
+    return {**trends, "triggered": triggered}
+
+
+def describe_rule(table: Dict[str, np.ndarray], result: Dict[str, np.ndarray], i: int) -> str:
+    """Descripción del disparador de la fila `i` para el correo."""
+    rule = table["rule"][i]
+    threshold = float(table["threshold"][i])
+    if rule in THRESHOLD_RULES:
+        index_name, comparison = THRESHOLD_RULES[rule]
+        return f"{index_name} {_COMPARISON_LABELS[comparison]} {threshold}"
+    if rule in COMPOSITE_RULES:
+        (first, first_cmp), (second, second_cmp), default = COMPOSITE_RULES[rule]
+        secondary = default if np.isnan(table["secondary"][i]) else float(table["secondary"][i])
+        return (
+            f"{first} {_COMPARISON_LABELS[first_cmp]} {threshold} y "
+            f"{second} {_COMPARISON_LABELS[second_cmp]} {secondary}"
+        )
+    stats = {key: float(values[i]) for key, values in result.items() if key != "triggered"}
+    return describe_trend(rule, RULE_INDICES[table["watched"][i]], threshold, stats)
+
+
+def triggered_rows(result: Dict[str, np.ndarray]) -> List[int]:
+    """Filas disparadas, en el orden de la tabla."""
+    return np.flatnonzero(result["triggered"]).tolist()
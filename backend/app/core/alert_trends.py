@@ -0,0 +1,124 @@
+"""
+Disparadores de alertas por tendencia, vectorizados con NumPy.
+
+Con solo last_index_value, ndvi_drop_pct comparaba contra una única lectura anterior y
+cualquier regla más rica habría necesitado más llamadas a GEE. El historial vive en
+alert_observations (app/db/observation_store.py): aquí las ventanas recientes de todas
+las alertas de un lote se alinean en una matriz (una fila por alerta, la observación más
+reciente a la derecha, NaN donde no hay historial) y cada regla se evalúa de una vez
+sobre el lote completo:
+
+* ndvi_drop_pct: caída porcentual del valor actual respecto al promedio de las últimas
+  `window` observaciones.
+* zscore_anomaly: |z| del valor actual respecto a media y desviación de las últimas
+  `window` observaciones (al menos MIN_ZSCORE_OBSERVATIONS).
+* consecutive_below: el índice quedó bajo el umbral en las últimas `window`
+  observaciones seguidas, incluida la actual.
+"""
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+TREND_TRIGGERS = ("ndvi_drop_pct", "zscore_anomaly", "consecutive_below")
+
+# Observaciones por regla cuando la alerta no define trigger_window.
+DEFAULT_TREND_WINDOWS = {"ndvi_drop_pct": 3, "zscore_anomaly": 8, "consecutive_below": 3}
+
+# Con menos observaciones la desviación estándar no dice nada.
+MIN_ZSCORE_OBSERVATIONS = 3
+
+# Columnas de la matriz de historial: la ventana más larga que se puede pedir.
+MAX_TREND_WINDOW = 24
+
+
+def trend_window(trigger_type: str, window: Optional[int]) -> int:
+    """Ventana efectiva de la regla (la de la alerta o la por defecto), entre 1 y MAX_TREND_WINDOW."""
+    value = window or DEFAULT_TREND_WINDOWS.get(trigger_type, 1)
+    return int(min(MAX_TREND_WINDOW, max(1, value)))
+
+
+def history_matrix(histories: Sequence[Sequence[float]], width: int = MAX_TREND_WINDOW) -> np.ndarray:
+    """
+    Alinea las historias (la más antigua primero) a la derecha en una matriz n × width,
+    con NaN donde una alerta tiene menos observaciones. Los None cuentan como faltantes.
+    """
+    matrix = np.full((len(histories), width), np.nan)
+    for i, values in enumerate(histories):
+        tail = [np.nan if v is None else v for v in list(values)[-width:]]
+        if tail:
+            matrix[i, width - len(tail):] = tail
+    return matrix
+
+
+def evaluate_trends(
+    trigger_types: Sequence[str],
+    thresholds: Sequence[float],
+    windows: Sequence[int],
+    current: Sequence[float],
+    history: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    """
+    Evalúa las reglas de tendencia de un lote. `history` es la matriz de history_matrix
+    (sin la observación actual); el resto son vectores alineados con sus filas.
+
+    Devuelve vectores por alerta: triggered, baseline (promedio de la ventana),
+    drop_pct, zscore, streak (observaciones seguidas bajo el umbral, incluida la actual) y
+    observations (observaciones en la ventana).
+    """
+    trigger_types = np.asarray(trigger_types)
+    thresholds = np.asarray(thresholds, dtype=float)
+    current = np.asarray(current, dtype=float)
+    n, width = history.shape
+    windows = np.clip(np.asarray(windows, dtype=int), 1, width)
+
+    # Solo las últimas `window` columnas de cada fila forman su ventana.
+    in_window = np.arange(width)[None, :] >= (width - windows)[:, None]
+    baseline_values = np.where(in_window, history, np.nan)
+    observations = np.sum(~np.isnan(baseline_values), axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        baseline = np.nansum(baseline_values, axis=1) / observations
+        deviation = np.sqrt(np.nansum((baseline_values - baseline[:, None]) ** 2, axis=1) / observations)
+        drop_pct = (baseline - current) / baseline * 100
+        zscore = (current - baseline) / deviation
+
+    # Racha: recorrer de la actual hacia atrás hasta la primera observación que no rompe
+    # el umbral (NaN compara como False y también corta la racha).
+    series = np.concatenate([history, current[:, None]], axis=1)
+    breaches = series < thresholds[:, None]
+    streak = np.cumprod(breaches[:, ::-1], axis=1).sum(axis=1)
+
+    triggered = np.zeros(n, dtype=bool)
+    triggered |= (trigger_types == "ndvi_drop_pct") & (observations > 0) & (baseline != 0) & (drop_pct >= thresholds)
+    triggered |= (
+        (trigger_types == "zscore_anomaly")
+        & (observations >= MIN_ZSCORE_OBSERVATIONS)
+        & (deviation > 0)
+        & (np.abs(zscore) >= thresholds)
+    )
+    triggered |= (trigger_types == "consecutive_below") & (streak >= windows)
+
+    return {
+        "triggered": triggered,
+        "baseline": baseline,
+        "drop_pct": drop_pct,
+        "zscore": zscore,
+        "streak": streak,
+        "observations": observations,
+    }
+
+
+def describe_trend(trigger_type: str, index_name: str, threshold: float, stats: Dict[str, float]) -> str:
+    """Descripción del disparador para el correo, con los valores de la fila evaluada."""
+    if trigger_type == "ndvi_drop_pct":
+        return (
+            f"Caída de {index_name} mayor o igual a {threshold}% respecto al promedio de las últimas "
+            f"{int(stats['observations'])} observaciones ({stats['baseline']:.4f}; caída calculada: {stats['drop_pct']:.1f}%)"
+        )
+    if trigger_type == "zscore_anomaly":
+        return (
+            f"Anomalía de {index_name}: {stats['zscore']:+.1f} desviaciones estándar respecto a las últimas "
+            f"{int(stats['observations'])} observaciones (umbral ±{threshold})"
+        )
+    return f"{index_name} menor a {threshold} en {int(stats['streak'])} observaciones consecutivas"
+
@@ -0,0 +1,37 @@
+"""
+Discretización espacial compartida por todo lo que se indexa "por ubicación":
+la cache de Redis, las tablas durables de resultados y la deduplicación entre usuarios.
+
+Mantener aquí una única definición de "misma ubicación" evita que dos caches con
+precisiones distintas dejen de compartir trabajo de Google Earth Engine sin que nadie lo note.
+"""
+
+# 4 decimales (~11m), la misma precisión que ya usan build_analysis_cache_key y
+# build_timeseries_cache_key (worker.py) para que selecciones casi idénticas del mapa
+# caigan en la misma celda.
+CELL_DECIMALS = 4
+
+# El frontend solo ofrece radios de 2, 5 y 10 km; la API acepta cualquier entero entre
+# 100 y 50000. Agrupar en pasos de 100m no cambia nada para el frontend y hace que radios
+# casi idénticos enviados por la API (p.ej. 1990 vs 2000) compartan resultados.
+RADIUS_BUCKET_M = 100
+
+
+def location_cell(lat: float, lng: float) -> str:
+    """Identificador estable de la celda (~11m) que contiene el punto dado."""
+    return f"{round(lat, CELL_DECIMALS):.{CELL_DECIMALS}f}:{round(lng, CELL_DECIMALS):.{CELL_DECIMALS}f}"
+
+
+def radius_bucket(radius: int) -> int:
+    """Radio del buffer redondeado al paso de RADIUS_BUCKET_M más cercano."""
+    return max(RADIUS_BUCKET_M, int(round(radius / RADIUS_BUCKET_M)) * RADIUS_BUCKET_M)
+
+
+# Región gruesa (~11km) usada para señales que aplican a toda una zona y no a un punto,
+# como "llegó una pasada Sentinel-2 nueva por aquí" (un tile S2 mide ~110km).
+REGION_DECIMALS = 1
+
+
+def region_cell(lat: float, lng: float) -> str:
+    """Identificador de la región gruesa (~11km) que contiene el punto dado."""
+    return f"{round(lat, REGION_DECIMALS):.{REGION_DECIMALS}f}:{round(lng, REGION_DECIMALS):.{REGION_DECIMALS}f}"
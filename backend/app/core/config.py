@@ -56,6 +56,68 @@ class Settings(BaseSettings):
     OBSERVABILITY_TOKEN: Optional[str] = Field(default=None)
     LOG_LEVEL: str = Field(default="INFO")
 
+    # Precalentamiento de la cache de análisis (ver prewarm_analysis_cache en tasks_periodic.py)
+    PREWARM_ENABLED: bool = Field(default=True)
+    PREWARM_GEE_BUDGET: int = Field(default=20)          # Máximo de análisis GEE por corrida
+    PREWARM_LOOKBACK_DAYS: int = Field(default=7)
+    PREWARM_TOP_N: int = Field(default=50)
+    PREWARM_MIN_HITS: int = Field(default=3)
+    PREWARM_REFRESH_WITHIN_S: int = Field(default=6 * 60 * 60)  # Refrescar si expira antes de esto
+    PREWARM_OFFPEAK_HOURS_UTC: str = Field(default="6-10")      # 02:00-06:00 en Chile continental
+    # Días que un análisis vencido sigue en analysis_results como respaldo cuando GEE no responde
+    ANALYSIS_RESULT_RETENTION_DAYS: int = Field(default=30)
+    # Volcado por lotes de los cache-hits de /analyze a api_usage_logs (ver flush_api_usage_buffer)
+    USAGE_FLUSH_SECONDS: int = Field(default=60)
+    USAGE_FLUSH_BATCH: int = Field(default=5000)          # Registros por INSERT
+
+    # Cuota compartida de Google Earth Engine entre todos los workers (ver app/core/gee_governor.py)
+    GEE_GOVERNOR_ENABLED: bool = Field(default=True)
+    GEE_QUOTA_MAX_CONCURRENT: int = Field(default=40)     # Solicitudes concurrentes del proyecto
+    GEE_QUOTA_REQUESTS_PER_S: float = Field(default=20.0)
+    GEE_QUOTA_BURST: int = Field(default=40)
+    # Fracción de la capacidad que puede usar cada clase; el resto queda para las superiores
+    GEE_GOVERNOR_CLASS_SHARES: str = Field(default="interactive=1.0,timeseries=0.75,alerts=0.5")
+    # Duplicar llamadas GEE que superan el p95 de su operación (ver app/core/gee_resilience.py)
+    GEE_HEDGE_REQUESTS: bool = Field(default=True)
+
+    # Análisis con radio igual o mayor se encolan en la cola "heavy" (ver celery_app.py)
+    CELERY_HEAVY_RADIUS_M: int = Field(default=15000)
+    # Las tareas devuelven un puntero a la cache en vez del resultado completo (app/tasks/results.py)
+    CELERY_SLIM_RESULTS: bool = Field(default=True)
+    # Vigencia de los registros de estado en el backend de Celery (el frontend sondea por minutos)
+    CELERY_RESULT_EXPIRES_S: int = Field(default=60 * 60)
+    # Una tarea que nadie sondea durante este tiempo se abandona (ver app/tasks/cancellation.py)
+    TASK_ABANDON_GRACE_S: int = Field(default=30)
+    # Control de admisión de POST /analyze (ver app/tasks/admission.py)
+    ADMISSION_ENABLED: bool = Field(default=True)
+    # Tareas simultáneas por cola (igual a la concurrencia de sus workers)
+    ADMISSION_QUEUE_SLOTS: str = Field(default="interactive=8,heavy=2")
+    ADMISSION_DEGRADE_ETA_S: int = Field(default=90)    # Sobre esto: resultado vencido o vista previa
+    ADMISSION_REJECT_ETA_S: int = Field(default=300)    # Sobre esto: 503 con Retry-After
+    # Evaluación de alertas por lotes: un reduceRegions por celda de escena (ver tasks_periodic.py)
+    ALERT_BATCH_GRID_DEG: float = Field(default=1.0)     # ~ una tesela MGRS de Sentinel-2 (110 km)
+    ALERT_BATCH_MAX_FEATURES: int = Field(default=500)   # Zonas por reduceRegions (límite de getInfo: 5000)
+    ALERT_BATCH_TIMEOUT_S: int = Field(default=60)
+    # Corrida de alertas repartida en subtareas (chord) por fragmentos de lotes de escena
+    ALERT_SHARD_SIZE: int = Field(default=1000)          # Alertas por subtarea
+    ALERT_PAGE_SIZE: int = Field(default=5000)           # Filas por lectura del cursor del coordinador
+    # Revisión continua: cada alerta tiene su hora dentro de la ventana de su frecuencia
+    ALERT_TICK_SECONDS: int = Field(default=300)         # Cada cuánto se encolan las alertas vencidas
+    ALERT_TICK_MAX_ALERTS: int = Field(default=5000)     # Alertas vencidas encoladas por tick, como máximo
+    ALERT_CLAIM_LEASE_S: int = Field(default=30 * 60)    # Reserva de una alerta encolada hasta su evaluación
+    ALERT_HISTORY_DAYS: int = Field(default=180)         # Historial leído para los disparadores por tendencia
+    # Alertas del mismo lugar comparten zona si tienen el mismo radio y sus centros
+    # están a menos de esta fracción del radio (5 %: ~94 % de superposición)
+    ALERT_ZONE_MAX_SHIFT: float = Field(default=0.05)
+    # Bandeja de salida de correos (ver app/tasks/tasks_notifications.py)
+    NOTIFICATION_DRAIN_SECONDS: int = Field(default=30)      # Cada cuánto se drena notification_outbox
+    NOTIFICATION_DRAIN_LIMIT: int = Field(default=1000)      # Correos nuevos tomados por drenaje
+    NOTIFICATION_RETRY_GROUPS: int = Field(default=50)       # Solicitudes fallidas reintentadas por drenaje
+    NOTIFICATION_CONCURRENCY: int = Field(default=4)         # Solicitudes simultáneas al proveedor
+    NOTIFICATION_CLAIM_LEASE_S: int = Field(default=5 * 60)  # Reserva de un correo tomado hasta su envío
+    NOTIFICATION_RETRY_BASE_S: int = Field(default=60)       # Espera del primer reintento (se duplica)
+    NOTIFICATION_MAX_ATTEMPTS: int = Field(default=6)
+
     # Railway / Infrastructure
     PORT: int = Field(default=5000)
     RAILWAY_ENVIRONMENT: Optional[str] = Field(default=None)
@@ -71,6 +133,42 @@ class Settings(BaseSettings):
             return ["*"]
         return [origin.strip() for origin in self.ALLOWED_ORIGINS.split(",") if origin.strip()]
 
+    @property
+    def prewarm_offpeak_hours(self) -> set:
+        """Horas UTC (0-23) en que corre el precalentamiento, desde un rango "inicio-fin" (fin exclusivo)."""
+        try:
+            start, end = (int(h) for h in self.PREWARM_OFFPEAK_HOURS_UTC.split("-", 1))
+        except ValueError:
+            logger.warning(f"PREWARM_OFFPEAK_HOURS_UTC inválido: {self.PREWARM_OFFPEAK_HOURS_UTC!r}")
+            return set()
+        if start <= end:
+            return set(range(start, end))
+        return set(range(start, 24)) | set(range(0, end))
+
+    @property
+    def gee_governor_class_shares(self) -> Dict[str, float]:
+        """Fracción de la cuota GEE por clase de prioridad, desde "clase=fracción,..."."""
+        shares = {}
+        for part in self.GEE_GOVERNOR_CLASS_SHARES.split(","):
+            name, _, value = part.partition("=")
+            try:
+                shares[name.strip()] = min(1.0, max(0.0, float(value)))
+            except ValueError:
+                logger.warning(f"GEE_GOVERNOR_CLASS_SHARES inválido: {part!r}")
+        return shares
+
+    @property
+    def admission_queue_slots(self) -> Dict[str, int]:
+        """Tareas simultáneas por cola de Celery, desde "cola=slots,..."."""
+        slots = {}
+        for part in self.ADMISSION_QUEUE_SLOTS.split(","):
+            name, _, value = part.partition("=")
+            try:
+                slots[name.strip()] = max(1, int(value))
+            except ValueError:
+                logger.warning(f"ADMISSION_QUEUE_SLOTS inválido: {part!r}")
+        return slots
+
     @property
     def db_config(self) -> Dict[str, Any]:
         """
@@ -1,12 +1,34 @@
 import ee
 import os
 import json
+import time
+import datetime
 import logging
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from google.auth.transport.requests import Request as GoogleAuthRequest
 from google.oauth2 import service_account
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Conexiones HTTP keep-alive hacia los endpoints de Earth Engine por proceso. El cliente
+# de ee usa por defecto un requests.Session con 10 conexiones por host: con más hilos
+# haciendo getInfo/getMapId en paralelo, las sobrantes se abren y cierran en cada llamada.
+GEE_HTTP_POOL_SIZE = 32
+
+# Renovar el token OAuth este margen antes de que expire (los tokens duran ~1h), para que
+# ninguna llamada a GEE tenga que pagar el refresh sincrónico dentro de una tarea.
+GEE_TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+GEE_TOKEN_CHECK_INTERVAL_SECONDS = 60
+
+# Si la inicialización falla, no reintentarla en cada tarea (re-parsear credenciales y
+# descubrir la API cuesta segundos); como máximo una vez por este intervalo.
+GEE_INIT_RETRY_SECONDS = 30
+
 def init_gee() -> bool:
     """
     Inicializa Google Earth Engine.
@@ -74,3 +96,164 @@ def init_gee() -> bool:
     except Exception as e:
         logger.error(f"Error crítico inicializando GEE: {e}")
         return False
+
+
+def _ee_state():
+    """Estado global del cliente de ee (credenciales, sesión HTTP), o None si no está disponible."""
+    try:
+        return ee.data._get_state()
+    except Exception:
+        return None
+
+
+def _pooled_http_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=GEE_HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class GeeSessionManager:
+    """
+    Sesión de Earth Engine compartida por todo el proceso (worker de Celery o API).
+
+    Inicializa ee una sola vez (init_gee), instala un pool de conexiones HTTP para los
+    endpoints de GEE y mantiene el token OAuth renovado en un hilo de fondo. Las tareas
+    solo llaman a ensure_ready(), que en el caso normal no hace I/O. Si el proceso fue
+    forkeado después de inicializar (prefork de Celery), se re-inicializa en el hijo:
+    las conexiones del padre no se pueden compartir.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._ready = False
+        self._http: Optional[requests.Session] = None
+        self._refresher: Optional[threading.Thread] = None
+        self._last_attempt = 0.0
+        self.initialized_at: Optional[datetime.datetime] = None
+        self.last_refresh_at: Optional[datetime.datetime] = None
+        self.last_error: Optional[str] = None
+        self.init_count = 0
+        self.refresh_count = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._ready and self._pid == os.getpid()
+
+    def initialize(self, force: bool = False) -> bool:
+        """Inicializa ee en este proceso (idempotente). Devuelve True si quedó listo."""
+        with self._lock:
+            if self.ready and not force:
+                return True
+            return self._initialize_locked()
+
+    def _initialize_locked(self) -> bool:
+        self._last_attempt = time.monotonic()
+        self._ready = False
+        self._pid = os.getpid()
+
+        # data.initialize solo crea su requests.Session si no hay una: instalar antes la
+        # nuestra (con pool más grande) hace que el cliente de la API la reutilice.
+        self._http = _pooled_http_session()
+        state = _ee_state()
+        if state is not None:
+            state.requests_session = self._http
+
+        if not init_gee():
+            self.last_error = "init_gee failed"
+            return False
+
+        self._ready = True
+        self.init_count += 1
+        self.initialized_at = datetime.datetime.now(datetime.timezone.utc)
+        self.last_error = None
+        self._refresh_token_locked()
+        self._start_refresher()
+        return True
+
+    def ensure_ready(self) -> bool:
+        """
+        Punto de entrada de las tareas: sin costo si la sesión ya está lista y el token
+        vigente. Si no, inicializa o renueva (con el reintento acotado por
+        GEE_INIT_RETRY_SECONDS cuando la inicialización viene fallando).
+        """
+        if self.ready and not self._token_expiring():
+            return True
+        with self._lock:
+            if not self.ready:
+                if self._pid == os.getpid() and time.monotonic() - self._last_attempt < GEE_INIT_RETRY_SECONDS:
+                    return False
+                return self._initialize_locked()
+            if self._token_expiring():
+                self._refresh_token_locked()
+            return True
+
+    def _credentials(self):
+        state = _ee_state()
+        return getattr(state, "credentials", None) if state is not None else None
+
+    def _token_expiring(self) -> bool:
+        credentials = self._credentials()
+        if credentials is None or not hasattr(credentials, "refresh"):
+            return False
+        expiry = getattr(credentials, "expiry", None)
+        if expiry is None:
+            return not getattr(credentials, "token", None)
+        # google-auth usa datetimes naive en UTC.
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return expiry - GEE_TOKEN_REFRESH_MARGIN <= now
+
+    def _refresh_token_locked(self) -> None:
+        credentials = self._credentials()
+        if credentials is None or not hasattr(credentials, "refresh"):
+            return
+        try:
+            credentials.refresh(GoogleAuthRequest(session=self._http))
+            self.refresh_count += 1
+            self.last_refresh_at = datetime.datetime.now(datetime.timezone.utc)
+        except Exception as e:
+            # El token actual puede seguir vigente unos minutos; el próximo ciclo reintenta.
+            self.last_error = f"token refresh failed: {e}"
+            logger.warning(f"No se pudo renovar el token de GEE: {e}")
+
+    def _start_refresher(self) -> None:
+        # Tras un fork el hilo del padre no existe en el hijo (is_alive() es False).
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        self._refresher = threading.Thread(
+            target=self._refresh_loop, name="gee-token-refresher", daemon=True
+        )
+        self._refresher.start()
+
+    def _refresh_loop(self) -> None:
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(GEE_TOKEN_CHECK_INTERVAL_SECONDS)
+            if not self._ready or not self._token_expiring():
+                continue
+            with self._lock:
+                if self._token_expiring():
+                    self._refresh_token_locked()
+
+    def snapshot(self) -> dict:
+        """Estado de la sesión para /observability."""
+        credentials = self._credentials()
+        expiry = getattr(credentials, "expiry", None)
+        return {
+            "ready": self.ready,
+            "pid": self._pid,
+            "initialized_at": self.initialized_at.isoformat() if self.initialized_at else None,
+            "init_count": self.init_count,
+            "last_token_refresh_at": self.last_refresh_at.isoformat() if self.last_refresh_at else None,
+            "token_refresh_count": self.refresh_count,
+            "token_expires_at": expiry.replace(tzinfo=datetime.timezone.utc).isoformat() if expiry else None,
+            "http_pool_size": GEE_HTTP_POOL_SIZE,
+            "last_error": self.last_error,
+        }
+
+
+# Una sesión por proceso: los workers la inicializan en worker_process_init (worker.py) y
+# la API en su lifespan (main.py).
+gee_session = GeeSessionManager()
@@ -0,0 +1,230 @@
+"""
+Gobernador distribuido de cuota de Google Earth Engine.
+
+GEE limita las solicitudes concurrentes y la tasa por proyecto, pero cada proceso worker
+solo ve su propia cola (app/core/gee_scheduler.py). Este módulo coordina a todos los
+procesos a través de Redis antes de cada llamada bloqueante (getInfo, getMapId):
+
+* un semáforo con leases (ZSET con vencimiento por miembro): limita las llamadas en vuelo
+  en todo el proyecto; el lease vence solo si un worker muere con la llamada tomada,
+* un token bucket: limita la tasa sostenida y permite ráfagas hasta `burst`,
+* una pausa global corta tras un 429, para que el resto de los workers no siga golpeando
+  la cuota mientras se recupera (evita tormentas de errores).
+
+Ambos límites se adquieren juntos en un script Lua (atómico en Redis). Cada clase de
+prioridad solo puede usar su fracción de la capacidad (GEE_GOVERNOR_CLASS_SHARES): el
+resto queda reservado para las clases superiores. Sin Redis, o si Redis falla, la llamada
+se ejecuta sin gobernar (fail-open), igual que el resto de las caches del proyecto.
+"""
+import contextlib
+import logging
+import random
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+from app.core.config import settings
+from app.core.security import redis_client
+
+logger = logging.getLogger(__name__)
+
+GOVERNOR_SEMAPHORE_KEY = "gee_gov:inflight"
+GOVERNOR_BUCKET_KEY = "gee_gov:bucket"
+GOVERNOR_BACKOFF_KEY = "gee_gov:backoff"
+
+# Vigencia del lease: mayor que el timeout más largo de una llamada GEE (60s en
+# process_timeseries), para no liberar slots de llamadas que siguen en curso.
+LEASE_MS = 120 * 1000
+
+# Pausa global tras un 429: suficiente para que se vacíe la ráfaga que lo provocó.
+THROTTLE_BACKOFF_MS = 2000
+
+# Espera máxima por un slot antes de rendirse (las llamadas interactivas ya esperan con
+# timeouts de 15-30s en resolve_with_timeout).
+MAX_WAIT_SECONDS = 30.0
+MIN_POLL_SECONDS = 0.02
+MAX_POLL_SECONDS = 1.0
+
+# KEYS: semáforo, bucket, pausa. ARGV: lease_id, lease_ms, max_concurrent, share,
+# tokens por ms, burst. Devuelve {1, 0} si adquirió, {0, ms_sugeridos_de_espera} si no.
+_ACQUIRE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local paused = redis.call('PTTL', KEYS[3])
+if paused > 0 then
+  return {0, paused}
+end
+
+local lease_ms = tonumber(ARGV[2])
+local share = tonumber(ARGV[4])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local cap = math.max(1, math.floor(tonumber(ARGV[3]) * share))
+if redis.call('ZCARD', KEYS[1]) >= cap then
+  return {0, 50}
+end
+
+local rate = tonumber(ARGV[5])
+local burst = tonumber(ARGV[6])
+local bucket = redis.call('HMGET', KEYS[2], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local reserve = burst * (1 - share)
+if tokens - 1 < reserve then
+  redis.call('HSET', KEYS[2], 'tokens', tostring(tokens), 'ts', now)
+  return {0, math.ceil((reserve + 1 - tokens) / rate)}
+end
+redis.call('HSET', KEYS[2], 'tokens', tostring(tokens - 1), 'ts', now)
+redis.call('PEXPIRE', KEYS[2], 3600000)
+redis.call('ZADD', KEYS[1], now + lease_ms, ARGV[1])
+redis.call('PEXPIRE', KEYS[1], lease_ms * 2)
+return {1, 0}
+"""
+
+
+class GeeQuotaWaitTimeout(TimeoutError):
+    """No se obtuvo un slot de la cuota GEE dentro de MAX_WAIT_SECONDS."""
+
+
+class GeeQuotaWaitCancelled(Exception):
+    """Quien esperaba la llamada se rindió (la canceló) antes de obtener un slot."""
+
+
+def is_throttling_error(exc: BaseException) -> bool:
+    """True si la excepción de GEE indica límite de tasa o cuota (429, "Too many concurrent aggregations")."""
+    message = str(exc).lower()
+    return "429" in message or "too many" in message or "quota" in message
+
+
+class GeeGovernor:
+    """Semáforo + token bucket compartidos en Redis para todas las llamadas a GEE."""
+
+    def __init__(self):
+        self._script = None
+        self._script_client = None
+        self.acquired: Dict[str, int] = {}
+        self.waited_seconds: Dict[str, float] = {}
+        self.timeouts: Dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.GEE_GOVERNOR_ENABLED and redis_client)
+
+    def _acquire_script(self):
+        # register_script se cachea por cliente (usa EVALSHA y recarga solo si hace falta).
+        if self._script is None or self._script_client is not redis_client:
+            self._script = redis_client.register_script(_ACQUIRE_LUA)
+            self._script_client = redis_client
+        return self._script
+
+    def _try_acquire(self, priority: str, lease_id: str) -> int:
+        """0 si adquirió; si no, milisegundos sugeridos de espera."""
+        share = settings.gee_governor_class_shares.get(priority, 1.0)
+        acquired, wait_ms = self._acquire_script()(
+            keys=[GOVERNOR_SEMAPHORE_KEY, GOVERNOR_BUCKET_KEY, GOVERNOR_BACKOFF_KEY],
+            args=[
+                lease_id,
+                LEASE_MS,
+                settings.GEE_QUOTA_MAX_CONCURRENT,
+                share,
+                settings.GEE_QUOTA_REQUESTS_PER_S / 1000.0,
+                settings.GEE_QUOTA_BURST,
+            ],
+        )
+        return 0 if int(acquired) else max(1, int(wait_ms))
+
+    def acquire(self, priority: str, abort: Optional[Callable[[], bool]] = None) -> Optional[str]:
+        """
+        Bloquea hasta obtener un slot para `priority` y devuelve el id del lease (None si el
+        gobernador está deshabilitado o Redis falló: la llamada sigue sin gobernar). Con
+        `abort`, deja de esperar (GeeQuotaWaitCancelled) apenas devuelva True.
+        """
+        if not self.enabled:
+            return None
+        lease_id = uuid.uuid4().hex
+        started = time.monotonic()
+        try:
+            while True:
+                if abort is not None and abort():
+                    raise GeeQuotaWaitCancelled(f"Llamada GEE '{priority}' cancelada esperando cuota")
+                wait_ms = self._try_acquire(priority, lease_id)
+                waited = time.monotonic() - started
+                if not wait_ms:
+                    self.acquired[priority] = self.acquired.get(priority, 0) + 1
+                    self.waited_seconds[priority] = self.waited_seconds.get(priority, 0.0) + waited
+                    return lease_id
+                if waited >= MAX_WAIT_SECONDS:
+                    self.timeouts[priority] = self.timeouts.get(priority, 0) + 1
+                    raise GeeQuotaWaitTimeout(
+                        f"Sin cuota GEE disponible para '{priority}' tras {waited:.1f}s"
+                    )
+                # Jitter: que los workers que esperan no reintenten todos en el mismo instante.
+                pause = min(MAX_POLL_SECONDS, max(MIN_POLL_SECONDS, wait_ms / 1000.0))
+                time.sleep(pause * random.uniform(0.8, 1.2))
+        except (GeeQuotaWaitTimeout, GeeQuotaWaitCancelled):
+            raise
+        except Exception as e:
+            logger.warning(f"Gobernador GEE no disponible, llamada sin gobernar: {e}")
+            return None
+
+    def release(self, lease_id: Optional[str]) -> None:
+        if not lease_id or not redis_client:
+            return
+        try:
+            redis_client.zrem(GOVERNOR_SEMAPHORE_KEY, lease_id)
+        except Exception as e:
+            # El lease vence solo a los LEASE_MS.
+            logger.warning(f"Error liberando lease GEE {lease_id}: {e}")
+
+    def note_throttled(self) -> None:
+        """Pausa global corta tras un 429 de GEE (todos los workers dejan de adquirir)."""
+        if not self.enabled:
+            return
+        try:
+            redis_client.set(GOVERNOR_BACKOFF_KEY, "1", px=THROTTLE_BACKOFF_MS, nx=True)
+        except Exception as e:
+            logger.warning(f"Error registrando pausa de cuota GEE: {e}")
+
+    @contextlib.contextmanager
+    def slot(self, priority: str, abort: Optional[Callable[[], bool]] = None):
+        """Slot de la cuota compartida para el bloque (ver acquire); un 429 dentro pausa a todos."""
+        lease_id = self.acquire(priority, abort=abort)
+        try:
+            yield
+        except Exception as e:
+            if is_throttling_error(e):
+                self.note_throttled()
+            raise
+        finally:
+            self.release(lease_id)
+
+    def snapshot(self) -> dict:
+        """Utilización de la cuota compartida (Redis) y esperas de este proceso por clase."""
+        data = {
+            "enabled": self.enabled,
+            "max_concurrent": settings.GEE_QUOTA_MAX_CONCURRENT,
+            "requests_per_s": settings.GEE_QUOTA_REQUESTS_PER_S,
+            "burst": settings.GEE_QUOTA_BURST,
+            "class_shares": settings.gee_governor_class_shares,
+            "acquired": dict(self.acquired),
+            "avg_wait_s": {
+                p: round(self.waited_seconds.get(p, 0.0) / n, 3) for p, n in self.acquired.items() if n
+            },
+            "wait_timeouts": dict(self.timeouts),
+        }
+        if not self.enabled:
+            return data
+        try:
+            now_ms = int(time.time() * 1000)
+            inflight = redis_client.zcount(GOVERNOR_SEMAPHORE_KEY, now_ms, "+inf")
+            tokens = redis_client.hget(GOVERNOR_BUCKET_KEY, "tokens")
+            data["inflight"] = inflight
+            data["utilisation"] = round(inflight / max(1, settings.GEE_QUOTA_MAX_CONCURRENT), 3)
+            data["tokens_available"] = round(float(tokens), 2) if tokens is not None else None
+            data["backoff_ms"] = max(0, redis_client.pttl(GOVERNOR_BACKOFF_KEY))
+        except Exception as e:
+            logger.warning(f"Error leyendo utilización de cuota GEE: {e}")
+        return data
+
+
+gee_governor = GeeGovernor()
@@ -0,0 +1,331 @@
+"""
+Llamadas resilientes a Google Earth Engine: reintentos clasificados, solicitudes
+duplicadas ("hedging") para los rezagados y un circuit breaker compartido.
+
+* Reintentos: los errores se clasifican en cuota (429, "Too many concurrent
+  aggregations"), transitorios (5xx, cortes de red, timeouts) y permanentes (errores de
+  la consulta). Solo los dos primeros se reintentan, con backoff "decorrelated jitter"
+  (base más larga para cuota) y sin pasarse del plazo que dio el llamador.
+* Hedging: si una llamada tarda más que el p95 observado para esa operación, se encola
+  un duplicado y gana el primero que responda. Todas las llamadas de lectura de GEE
+  (getInfo, getMapId) son idempotentes. Se suspende mientras haya errores de cuota.
+* Circuit breaker: tras varios fallos finales seguidos (ya reintentados), el circuito se
+  abre unos segundos en Redis para todos los procesos. Mientras está abierto, las tareas
+  fallan sin llamar a GEE y trigger_analysis (analyze.py) sirve la cache aunque esté
+  vencida en vez de encolar tareas condenadas a fallar.
+"""
+import collections
+import concurrent.futures
+import logging
+import random
+import socket
+import threading
+import time
+from typing import Callable, Deque, Dict, Optional
+
+from app.core.config import settings
+from app.core.gee_governor import GeeQuotaWaitTimeout, is_throttling_error
+from app.core.security import redis_client
+
+logger = logging.getLogger(__name__)
+
+ERROR_QUOTA = "quota"
+ERROR_TRANSIENT = "transient"
+ERROR_PERMANENT = "permanent"
+
+MAX_ATTEMPTS = 3
+# (base, tope) en segundos del backoff por tipo de error.
+BACKOFF_SECONDS = {
+    ERROR_QUOTA: (1.0, 8.0),
+    ERROR_TRANSIENT: (0.2, 4.0),
+}
+
+# Hedging: se necesita historial suficiente para que el p95 signifique algo, y nunca se
+# duplica antes de este mínimo (las llamadas rápidas no justifican el costo).
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY_SECONDS = 0.5
+# Sin hedging durante este tiempo tras un error de cuota: duplicar agravaría el 429.
+HEDGE_QUOTA_QUIET_SECONDS = 30.0
+# Un intento aún en cola (planificador o cuota) no se duplica: se vuelve a mirar cada
+# tanto si ya empezó a correr para contar el retraso desde ese momento.
+HEDGE_RECHECK_SECONDS = 0.1
+
+BREAKER_FAILURE_THRESHOLD = 8
+BREAKER_WINDOW_SECONDS = 60
+BREAKER_OPEN_SECONDS = 30
+# Un plazo vencido cuenta como fallo solo si un intento lleva al menos esto corriendo en
+# GEE: un intento aún en cola, o un plazo que el llamador recortó a su presupuesto
+# restante, no dicen nada de la salud de GEE.
+BREAKER_SLOW_CALL_SECONDS = 20.0
+BREAKER_FAILURES_KEY = "gee_breaker:failures"
+BREAKER_OPEN_KEY = "gee_breaker:open"
+
+_TRANSIENT_MARKERS = (
+    "500", "502", "503", "504", "internal error", "backend error", "service unavailable",
+    "temporarily unavailable", "deadline exceeded", "timed out", "connection reset",
+    "connection aborted", "broken pipe",
+)
+
+
+class GeeCircuitOpenError(RuntimeError):
+    """El circuit breaker de GEE está abierto: la llamada no se intentó."""
+
+
+def classify_gee_error(exc: BaseException) -> str:
+    """Clasifica un error de GEE en cuota, transitorio o permanente (solo los dos primeros se reintentan)."""
+    if isinstance(exc, GeeQuotaWaitTimeout) or is_throttling_error(exc):
+        return ERROR_QUOTA
+    if isinstance(exc, (ConnectionError, TimeoutError, socket.timeout, concurrent.futures.TimeoutError)):
+        return ERROR_TRANSIENT
+    message = str(exc).lower()
+    if any(marker in message for marker in _TRANSIENT_MARKERS):
+        return ERROR_TRANSIENT
+    return ERROR_PERMANENT
+
+
+def decorrelated_backoff(previous: Optional[float], kind: str) -> float:
+    """Siguiente espera con "decorrelated jitter": uniforme entre la base y 3x la anterior, con tope."""
+    base, cap = BACKOFF_SECONDS.get(kind, BACKOFF_SECONDS[ERROR_TRANSIENT])
+    return min(cap, random.uniform(base, max(base, (previous or base) * 3)))
+
+
+class _LatencyTracker:
+    """Latencias recientes por operación, para el umbral de hedging."""
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self.last_quota_error = 0.0
+
+    def record(self, op_name: str, seconds: float) -> None:
+        with self._lock:
+            self._samples[op_name].append(seconds)
+
+    def p95(self, op_name: str) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(op_name, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def hedge_delay(self, op_name: str) -> Optional[float]:
+        if not settings.GEE_HEDGE_REQUESTS:
+            return None
+        if time.monotonic() - self.last_quota_error < HEDGE_QUOTA_QUIET_SECONDS:
+            return None
+        p95 = self.p95(op_name)
+        return max(HEDGE_MIN_DELAY_SECONDS, p95) if p95 is not None else None
+
+
+latency_tracker = _LatencyTracker()
+
+
+class GeeCircuitBreaker:
+    """
+    Circuit breaker compartido por todos los procesos vía Redis (en memoria si no hay
+    Redis). Cuenta fallos finales consecutivos; al llegar al umbral abre el circuito por
+    BREAKER_OPEN_SECONDS. Al cerrarse queda "medio abierto": un solo fallo más lo reabre,
+    un éxito lo resetea.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._open_until = 0.0
+
+    def retry_after_seconds(self) -> int:
+        """Segundos que le quedan abierto al circuito (0 si está cerrado)."""
+        if redis_client:
+            try:
+                return max(0, int(redis_client.ttl(BREAKER_OPEN_KEY)))
+            except Exception as e:
+                logger.warning(f"Error leyendo circuit breaker de GEE: {e}")
+                return 0
+        return max(0, int(round(self._open_until - time.monotonic())))
+
+    def is_open(self) -> bool:
+        return self.retry_after_seconds() > 0
+
+    def record_success(self) -> None:
+        if redis_client:
+            try:
+                redis_client.delete(BREAKER_FAILURES_KEY)
+            except Exception as e:
+                logger.warning(f"Error actualizando circuit breaker de GEE: {e}")
+            return
+        with self._lock:
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        if redis_client:
+            try:
+                failures = redis_client.incr(BREAKER_FAILURES_KEY)
+                if failures == 1:
+                    redis_client.expire(BREAKER_FAILURES_KEY, BREAKER_WINDOW_SECONDS)
+                if failures >= BREAKER_FAILURE_THRESHOLD:
+                    self._trip(failures)
+                    redis_client.set(BREAKER_OPEN_KEY, "1", ex=BREAKER_OPEN_SECONDS)
+                    redis_client.set(
+                        BREAKER_FAILURES_KEY, BREAKER_FAILURE_THRESHOLD - 1,
+                        ex=BREAKER_OPEN_SECONDS + BREAKER_WINDOW_SECONDS,
+                    )
+            except Exception as e:
+                logger.warning(f"Error actualizando circuit breaker de GEE: {e}")
+            return
+        with self._lock:
+            self._failures += 1
+            if self._failures >= BREAKER_FAILURE_THRESHOLD:
+                self._trip(self._failures)
+                self._open_until = time.monotonic() + BREAKER_OPEN_SECONDS
+                self._failures = BREAKER_FAILURE_THRESHOLD - 1
+
+    def _trip(self, failures: int) -> None:
+        logger.error(
+            f"Circuit breaker de GEE abierto por {BREAKER_OPEN_SECONDS}s tras {failures} fallos seguidos"
+        )
+
+    def snapshot(self) -> dict:
+        return {
+            "open": self.is_open(),
+            "retry_after_s": self.retry_after_seconds(),
+            "failure_threshold": BREAKER_FAILURE_THRESHOLD,
+        }
+
+
+gee_breaker = GeeCircuitBreaker()
+
+
+class GeeCall:
+    """
+    Llamada a GEE ya encolada, con la interfaz de un Future (result(timeout)). El primer
+    intento se encola al crearla, así varias llamadas de una tarea siguen corriendo en
+    paralelo; los reintentos y el duplicado se manejan al resolverla, dentro del plazo
+    `timeout` que da el llamador.
+    """
+
+    def __init__(self, submit: Callable, fn: Callable, args: tuple, op_name: str):
+        self._submit = submit
+        self._fn = fn
+        self._args = args
+        self.op_name = op_name
+        self.attempts = 0
+        self.hedged = False
+        self._pending: Dict[concurrent.futures.Future, float] = {}
+        self._open_error: Optional[GeeCircuitOpenError] = None
+        if gee_breaker.is_open():
+            self._open_error = GeeCircuitOpenError(
+                f"Google Earth Engine no disponible (circuit breaker abierto), operación '{op_name}'"
+            )
+        else:
+            self._start_attempt()
+
+    def _start_attempt(self) -> None:
+        self.attempts += 1
+        self._pending[self._submit(self._fn, *self._args)] = time.monotonic()
+
+    @staticmethod
+    def _started_at(future: concurrent.futures.Future, submitted: float) -> Optional[float]:
+        """
+        Cuándo empezó a correr el intento en GEE, o None si sigue en cola. started_at lo
+        fija el planificador al ejecutar; un executor que no lo fija usa la hora del envío.
+        """
+        started = getattr(future, "started_at", None)
+        if started is not None:
+            return started
+        return submitted if future.running() or future.done() else None
+
+    def _stalled_in_gee(self) -> bool:
+        """True si algún intento lleva BREAKER_SLOW_CALL_SECONDS corriendo (no en cola) en GEE."""
+        now = time.monotonic()
+        return any(
+            future.running() and now - self._started_at(future, submitted) >= BREAKER_SLOW_CALL_SECONDS
+            for future, submitted in self._pending.items()
+        )
+
+    def _cancel_pending(self) -> None:
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+
+    def cancel(self) -> bool:
+        """Cancela los intentos aún encolados (los que ya corren en GEE terminan solos)."""
+        self._cancel_pending()
+        return True
+
+    def _final_error(self, exc: BaseException, kind: str) -> BaseException:
+        """Error definitivo de la llamada (los de cuota/transitorios cuentan para el breaker)."""
+        if kind != ERROR_PERMANENT:
+            gee_breaker.record_failure()
+        return exc
+
+    def result(self, timeout: Optional[float] = None):
+        if self._open_error is not None:
+            raise self._open_error
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        backoff = None
+        hedge_delay = latency_tracker.hedge_delay(self.op_name)
+
+        while True:
+            now = time.monotonic()
+            wait_for = max(0.0, deadline - now) if deadline is not None else None
+            hedge_at = None
+            if hedge_delay is not None and not self.hedged and len(self._pending) == 1:
+                # El retraso se cuenta desde que el intento corre en GEE, no desde el envío:
+                # la espera en cola no es lentitud de GEE y duplicar ahí solo suma trabajo
+                # a la cola congestionada.
+                [(pending, submitted)] = self._pending.items()
+                started = self._started_at(pending, submitted)
+                if started is not None:
+                    hedge_at = started + hedge_delay
+                next_check = hedge_at if hedge_at is not None else now + HEDGE_RECHECK_SECONDS
+                wait_for = max(0.0, next_check - now) if wait_for is None else min(wait_for, max(0.0, next_check - now))
+
+            done, _ = concurrent.futures.wait(
+                list(self._pending), timeout=wait_for, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            if not done:
+                if deadline is not None and time.monotonic() >= deadline:
+                    stalled = self._stalled_in_gee()
+                    self._cancel_pending()
+                    if stalled:
+                        gee_breaker.record_failure()
+                    raise concurrent.futures.TimeoutError()
+                if hedge_at is not None and time.monotonic() >= hedge_at:
+                    # Rezagado: encolar un duplicado y quedarse con el primero que responda.
+                    self.hedged = True
+                    self._pending[self._submit(self._fn, *self._args)] = time.monotonic()
+                continue
+
+            future = done.pop()
+            submitted = self._pending.pop(future)
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is None:
+                # Latencia de GEE, sin la espera en cola ni la de cuota (alimenta el p95 del hedging)
+                latency_tracker.record(self.op_name, time.monotonic() - self._started_at(future, submitted))
+                gee_breaker.record_success()
+                self._cancel_pending()
+                return future.result()
+
+            kind = classify_gee_error(error)
+            if kind == ERROR_QUOTA:
+                latency_tracker.last_quota_error = time.monotonic()
+            if self._pending:
+                # El duplicado sigue en curso: esperar su respuesta antes de reintentar.
+                continue
+            if kind == ERROR_PERMANENT or self.attempts >= MAX_ATTEMPTS:
+                raise self._final_error(error, kind)
+
+            backoff = decorrelated_backoff(backoff, kind)
+            if deadline is not None and time.monotonic() + backoff >= deadline:
+                raise self._final_error(error, kind)
+            logger.warning(
+                f"GEE '{self.op_name}' falló ({kind}: {error}); reintento {self.attempts + 1} en {backoff:.2f}s"
+            )
+            time.sleep(backoff)
+            if gee_breaker.is_open():
+                raise GeeCircuitOpenError(
+                    f"Google Earth Engine no disponible (circuit breaker abierto), operación '{self.op_name}'"
+                ) from error
+            self._start_attempt()
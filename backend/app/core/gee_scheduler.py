@@ -0,0 +1,296 @@
+"""
+Planificador de llamadas a Google Earth Engine dentro de un proceso worker.
+
+Reemplaza al ThreadPoolExecutor global de worker.py: todas las llamadas bloqueantes a GEE
+(getInfo, getMapId) pasan por una cola con
+
+* clases de prioridad: interactive > timeseries > alerts (las alertas y el trabajo de
+  fondo, como el precalentamiento de la cache, nunca desplazan a un análisis interactivo),
+* un tope de llamadas en vuelo por tarea, con turno rotativo entre tareas de la misma
+  clase, para que una tarea que encola muchas llamadas no acapare el pool,
+* concurrencia total adaptativa (AIMD): sube de a poco mientras GEE responde rápido y se
+  reduce a la mitad ante un 429/cuota excedida o latencias de congestión.
+
+La tarea actual (clase y dueño) se asocia al hilo con bind_task(); worker.py lo hace en
+las señales task_prerun/task_postrun de Celery. Cada llamada además toma un slot de la
+cuota compartida entre procesos (app/core/gee_governor.py) antes de ejecutarse; mientras
+lo espera sigue pendiente, así quien la espera puede cancelarla al vencer su timeout, y
+esa espera no cuenta como latencia de GEE.
+"""
+import collections
+import concurrent.futures
+import contextvars
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Callable, Deque, Dict, Optional
+
+from app.core.gee import GEE_HTTP_POOL_SIZE
+from app.core.gee_governor import GeeQuotaWaitCancelled, gee_governor, is_throttling_error
+from app.core.security import redis_client
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_CLASSES = ("interactive", "timeseries", "alerts")
+DEFAULT_PRIORITY = "interactive"
+
+# Concurrencia total: arranca en el valor del antiguo executor fijo y nunca supera el pool
+# HTTP de la sesión GEE (más hilos que conexiones solo agregaría espera por sockets).
+GEE_MAX_CONCURRENCY = GEE_HTTP_POOL_SIZE
+GEE_INITIAL_CONCURRENCY = 10
+GEE_MIN_CONCURRENCY = 2
+
+# Llamadas en vuelo por tarea: un análisis interactivo encola 3 en paralelo (estadísticas,
+# fecha y getMapId); 4 las deja correr juntas y deja espacio para otras tareas.
+GEE_PER_TASK_CONCURRENCY = 4
+
+# Una llamada más lenta que esto se trata como señal de congestión, igual que un 429.
+GEE_CONGESTION_LATENCY_SECONDS = 20.0
+# Tras una reducción, ignorar más señales por este tiempo: un mismo pico de 429 golpea a
+# varias llamadas en vuelo a la vez y no debe colapsar el límite al mínimo.
+GEE_DECREASE_COOLDOWN_SECONDS = 5.0
+
+# Métricas publicadas en Redis para /observability (una clave por proceso worker).
+GEE_METRICS_KEY_PREFIX = "gee_scheduler:"
+GEE_METRICS_TTL_SECONDS = 60
+GEE_METRICS_PUBLISH_INTERVAL_SECONDS = 10.0
+
+_task_context: contextvars.ContextVar = contextvars.ContextVar(
+    "gee_task_context", default=(DEFAULT_PRIORITY, None)
+)
+
+
+def bind_task(priority: str, owner: Optional[str]) -> None:
+    """Asocia la clase de prioridad y el dueño (id de tarea) a las llamadas GEE de este hilo."""
+    if priority not in PRIORITY_CLASSES:
+        priority = DEFAULT_PRIORITY
+    _task_context.set((priority, owner))
+
+
+def unbind_task() -> None:
+    _task_context.set((DEFAULT_PRIORITY, None))
+
+
+class _WorkItem:
+    __slots__ = ("fn", "args", "future", "priority", "owner", "enqueued_at")
+
+    def __init__(self, fn, args, priority, owner):
+        self.fn = fn
+        self.args = args
+        self.future = concurrent.futures.Future()
+        self.priority = priority
+        self.owner = owner
+        self.enqueued_at = time.monotonic()
+
+
+class GeeScheduler:
+    """Cola de prioridad con reparto justo entre tareas y concurrencia AIMD (ver módulo)."""
+
+    def __init__(
+        self,
+        max_concurrency: int = GEE_MAX_CONCURRENCY,
+        initial_concurrency: int = GEE_INITIAL_CONCURRENCY,
+        min_concurrency: int = GEE_MIN_CONCURRENCY,
+        per_task_concurrency: int = GEE_PER_TASK_CONCURRENCY,
+    ):
+        self.max_concurrency = max_concurrency
+        self.initial_concurrency = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.per_task_concurrency = per_task_concurrency
+        self._cv = threading.Condition()
+        self._pid: Optional[int] = None
+        self._reset()
+
+    def _reset(self) -> None:
+        # Los hilos no sobreviven a un fork (prefork de Celery): el estado se recrea por pid.
+        self._pid = os.getpid()
+        self._queues: Dict[str, "collections.OrderedDict[Optional[str], Deque[_WorkItem]]"] = {
+            p: collections.OrderedDict() for p in PRIORITY_CLASSES
+        }
+        self._inflight = 0
+        self._inflight_by_owner: collections.Counter = collections.Counter()
+        self._limit = float(self.initial_concurrency)
+        self._last_decrease = 0.0
+        self._threads = []
+        self._waits: Dict[str, Deque[float]] = {p: collections.deque(maxlen=200) for p in PRIORITY_CLASSES}
+        self._latencies: Deque[float] = collections.deque(maxlen=200)
+        self._throttled = 0
+        self._completed = 0
+        self._last_publish = 0.0
+
+    def _ensure_threads_locked(self) -> None:
+        if self._pid != os.getpid():
+            self._reset()
+        while len(self._threads) < self.max_concurrency:
+            thread = threading.Thread(
+                target=self._run, name=f"gee-call-{len(self._threads)}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_concurrency, min(self.max_concurrency, int(self._limit)))
+
+    def submit(self, fn: Callable, *args, priority: Optional[str] = None, owner: Optional[str] = None) -> concurrent.futures.Future:
+        """
+        Encola `fn(*args)` y devuelve un Future. Sin `priority`/`owner` explícitos usa los
+        de la tarea asociada al hilo actual (bind_task).
+        """
+        bound_priority, bound_owner = _task_context.get()
+        item = _WorkItem(fn, args, priority or bound_priority, owner if owner is not None else bound_owner)
+        with self._cv:
+            self._ensure_threads_locked()
+            self._queues[item.priority].setdefault(item.owner, collections.deque()).append(item)
+            self._cv.notify()
+        return item.future
+
+    def _next_item_locked(self) -> Optional[_WorkItem]:
+        if self._inflight >= self.limit:
+            return None
+        for priority in PRIORITY_CLASSES:
+            owners = self._queues[priority]
+            for owner in list(owners):
+                if owner is not None and self._inflight_by_owner[owner] >= self.per_task_concurrency:
+                    continue
+                queue = owners.pop(owner)
+                item = queue.popleft()
+                if queue:
+                    # Turno rotativo: el dueño vuelve al final de su clase.
+                    owners[owner] = queue
+                return item
+        return None
+
+    def _run(self) -> None:
+        while True:
+            with self._cv:
+                item = self._next_item_locked()
+                while item is None:
+                    self._cv.wait()
+                    item = self._next_item_locked()
+                self._inflight += 1
+                self._inflight_by_owner[item.owner] += 1
+                self._waits[item.priority].append(time.monotonic() - item.enqueued_at)
+
+            result, error, latency = None, None, None
+            try:
+                # Slot de la cuota compartida entre todos los workers (gee_governor.py). La
+                # llamada sigue pendiente mientras lo espera: si el llamador se rinde y la
+                # cancela, el hilo deja de esperar.
+                with gee_governor.slot(item.priority, abort=item.future.cancelled):
+                    run = item.future.set_running_or_notify_cancel()
+                    if run:
+                        # La latencia de GEE se mide desde que hay slot, sin la espera de cuota
+                        started = time.monotonic()
+                        # GeeCall distingue una llamada lenta en GEE de una que espera turno
+                        item.future.started_at = started
+                        try:
+                            result = item.fn(*item.args)
+                        finally:
+                            latency = time.monotonic() - started
+            except GeeQuotaWaitCancelled:
+                run = False
+            except BaseException as e:
+                error = e
+                # Sin slot (GeeQuotaWaitTimeout) la llamada no alcanzó a marcarse en curso
+                run = item.future.running() or item.future.set_running_or_notify_cancel()
+
+            # Registrar el resultado antes de resolver el Future: quien espera la llamada
+            # ya ve el límite ajustado.
+            with self._cv:
+                self._inflight -= 1
+                self._inflight_by_owner[item.owner] -= 1
+                if self._inflight_by_owner[item.owner] <= 0:
+                    del self._inflight_by_owner[item.owner]
+                if latency is not None:
+                    self._record_outcome_locked(latency, error is not None and is_throttling_error(error))
+                self._cv.notify_all()
+
+            if run:
+                if error is not None:
+                    item.future.set_exception(error)
+                else:
+                    item.future.set_result(result)
+            self._maybe_publish()
+
+    def _record_outcome_locked(self, latency: float, throttled: bool) -> None:
+        self._completed += 1
+        self._latencies.append(latency)
+        if throttled:
+            self._throttled += 1
+        now = time.monotonic()
+        if throttled or latency >= GEE_CONGESTION_LATENCY_SECONDS:
+            if now - self._last_decrease >= GEE_DECREASE_COOLDOWN_SECONDS:
+                self._limit = max(float(self.min_concurrency), self._limit / 2)
+                self._last_decrease = now
+                logger.warning(
+                    f"GEE congestionado ({'429' if throttled else f'{latency:.1f}s'}): "
+                    f"concurrencia reducida a {self.limit}"
+                )
+        else:
+            # Aumento aditivo: +1 por cada `limit` llamadas exitosas.
+            self._limit = min(float(self.max_concurrency), self._limit + 1 / max(self._limit, 1.0))
+
+    def snapshot(self) -> dict:
+        """Profundidad de cola, espera y límite actual (métricas para /observability)."""
+        with self._cv:
+            def _stats(values):
+                ordered = sorted(values)
+                if not ordered:
+                    return {"p50_s": None, "p95_s": None}
+                return {
+                    "p50_s": round(ordered[len(ordered) // 2], 3),
+                    "p95_s": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+                }
+
+            return {
+                "pid": self._pid,
+                "concurrency_limit": self.limit,
+                "inflight": self._inflight,
+                "queue_depth": {p: sum(len(q) for q in self._queues[p].values()) for p in PRIORITY_CLASSES},
+                "queue_wait": {p: _stats(self._waits[p]) for p in PRIORITY_CLASSES},
+                "latency": _stats(self._latencies),
+                "completed": self._completed,
+                "throttled": self._throttled,
+            }
+
+    def _maybe_publish(self) -> None:
+        now = time.monotonic()
+        if now - self._last_publish < GEE_METRICS_PUBLISH_INTERVAL_SECONDS:
+            return
+        self._last_publish = now
+        if not redis_client:
+            return
+        try:
+            redis_client.setex(
+                f"{GEE_METRICS_KEY_PREFIX}{socket.gethostname()}:{os.getpid()}",
+                GEE_METRICS_TTL_SECONDS,
+                json.dumps(self.snapshot()),
+            )
+        except Exception as e:
+            logger.warning(f"Error publicando métricas del planificador GEE: {e}")
+
+
+def read_published_metrics() -> list:
+    """Snapshots publicados por los workers vivos (best-effort, lista vacía sin Redis)."""
+    if not redis_client:
+        return []
+    try:
+        keys = list(redis_client.scan_iter(match=f"{GEE_METRICS_KEY_PREFIX}*", count=100))
+        if not keys:
+            return []
+        return [
+            {"worker": key.decode() if isinstance(key, bytes) else key, **json.loads(raw)}
+            for key, raw in zip(keys, redis_client.mget(keys))
+            if raw
+        ]
+    except Exception as e:
+        logger.warning(f"Error leyendo métricas del planificador GEE: {e}")
+        return []
+
+
+# Un planificador por proceso worker (compartido por todas las tareas del proceso).
+gee_scheduler = GeeScheduler()
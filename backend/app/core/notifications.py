@@ -1,26 +1,35 @@
+"""
+Correos de alerta vía Resend.
+
+Los correos no se envían desde la revisión de alertas: se encolan en notification_outbox
+(app/db/outbox_store.py) y drain_notification_outbox (app/tasks/tasks_notifications.py)
+los despacha aparte. Aquí se arma el correo de cada destinatario (un resumen si tiene
+varias alertas disparadas) y se envían los lotes con un cliente HTTP asíncrono compartido,
+con un número acotado de solicitudes simultáneas.
+"""
+import asyncio
 import logging
+from typing import Dict, List, Tuple
+
 import httpx
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
-def send_alert_email(to_email: str, location_name: str, trigger_desc: str, index_name: str, current_value: float) -> bool:
-    """Envía un correo de alerta de anomalía a un usuario usando Resend."""
-    resend_api_key = settings.RESEND_API_KEY
-    if not resend_api_key:
-        logger.warning("RESEND_API_KEY no configurado. Ignorando envío de correo de alerta.")
-        return False
-        
-    from_email = "GeoFeedback Alertas <alertas@geofeedback.cl>"
-    
-    subject = f"⚠️ [GeoFeedback] Alerta de Anomalía Territorial en {location_name}"
-    
-    html_content = f"""
-    <div style="font-family: sans-serif; max-width: 600px; margin: auto; padding: 20px; border: 1px solid #eee; border-radius: 8px; background-color: #fcfcfc;">
-        <h2 style="color: #d9534f; border-bottom: 2px solid #d9534f; padding-bottom: 10px;">Alerta de Cambio Territorial</h2>
-        <p>Hola,</p>
-        <p>Tu punto de monitoreo activo en <strong>{location_name}</strong> ha registrado un cambio que cumple con tu disparador configurado:</p>
-        
+RESEND_BATCH_URL = "https://api.resend.com/emails/batch"
+# Correos por solicitud al endpoint de lotes de Resend (límite del proveedor).
+RESEND_BATCH_LIMIT = 100
+
+FROM_EMAIL = "GeoFeedback Alertas <alertas@geofeedback.cl>"
+
+# Resultado de una solicitud de lote
+DELIVERY_SENT = "sent"
+DELIVERY_RETRY = "retry"        # Red, 429, 5xx o solicitud idéntica aún en curso: se reintenta
+DELIVERY_FAILED = "failed"      # Rechazo definitivo del proveedor (4xx)
+
+
+def _alert_table_html(item: dict) -> str:
+    return f"""
         <table style="width: 100%; border-collapse: collapse; margin: 20px 0;">
             <tr style="background-color: #f2f2f2;">
                 <th style="padding: 10px; text-align: left; border: 1px solid #ddd;">Detalle</th>
@@ -28,53 +37,110 @@ def send_alert_email(to_email: str, location_name: str, trigger_desc: str, index
             </tr>
             <tr>
                 <td style="padding: 10px; border: 1px solid #ddd;">Ubicación</td>
-                <td style="padding: 10px; border: 1px solid #ddd;">{location_name}</td>
+                <td style="padding: 10px; border: 1px solid #ddd;">{item['location_name']}</td>
             </tr>
             <tr>
                 <td style="padding: 10px; border: 1px solid #ddd;">Índice Analizado</td>
-                <td style="padding: 10px; border: 1px solid #ddd;">{index_name}</td>
+                <td style="padding: 10px; border: 1px solid #ddd;">{item['index_name']}</td>
             </tr>
             <tr>
                 <td style="padding: 10px; border: 1px solid #ddd;">Condición configurada</td>
-                <td style="padding: 10px; border: 1px solid #ddd;">{trigger_desc}</td>
+                <td style="padding: 10px; border: 1px solid #ddd;">{item['trigger_desc']}</td>
             </tr>
             <tr>
                 <td style="padding: 10px; border: 1px solid #ddd; font-weight: bold; color: #d9534f;">Último Valor Registrado</td>
-                <td style="padding: 10px; border: 1px solid #ddd; font-weight: bold; color: #d9534f;">{current_value:.4f}</td>
+                <td style="padding: 10px; border: 1px solid #ddd; font-weight: bold; color: #d9534f;">{item['current_value']:.4f}</td>
             </tr>
         </table>
-        
+        """
+
+
+def build_alert_email(to_email: str, items: List[dict]) -> dict:
+    """
+    Correo de un destinatario para sus alertas disparadas (payloads de notification_outbox:
+    location_name, trigger_desc, index_name, current_value). Con varias alertas se envía un
+    solo correo de resumen en vez de uno por alerta.
+    """
+    if len(items) == 1:
+        subject = f"⚠️ [GeoFeedback] Alerta de Anomalía Territorial en {items[0]['location_name']}"
+        intro = (
+            f"<p>Tu punto de monitoreo activo en <strong>{items[0]['location_name']}</strong> ha registrado "
+            f"un cambio que cumple con tu disparador configurado:</p>"
+        )
+    else:
+        subject = f"⚠️ [GeoFeedback] {len(items)} Alertas de Anomalía Territorial"
+        intro = (
+            f"<p>{len(items)} de tus puntos de monitoreo activos han registrado cambios que cumplen "
+            f"con sus disparadores configurados:</p>"
+        )
+
+    html_content = f"""
+    <div style="font-family: sans-serif; max-width: 600px; margin: auto; padding: 20px; border: 1px solid #eee; border-radius: 8px; background-color: #fcfcfc;">
+        <h2 style="color: #d9534f; border-bottom: 2px solid #d9534f; padding-bottom: 10px;">Alerta de Cambio Territorial</h2>
+        <p>Hola,</p>
+        {intro}
+        {''.join(_alert_table_html(item) for item in items)}
         <p>Te recomendamos ingresar a <a href="https://geofeedback.cl" style="color: #0275d8; text-decoration: none; font-weight: bold;">GeoFeedback Chile</a> para explorar la última imagen satelital en el mapa interactivo y revisar el diagnóstico de <strong>GeoBot</strong>.</p>
-        
+
         <hr style="border: 0; border-top: 1px solid #eee; margin-top: 30px;" />
         <p style="font-size: 12px; color: #777; text-align: center;">Este es un servicio de alerta automatizado de GeoFeedback.cl. Puedes desactivar esta alerta en cualquier momento desde tu panel de usuario.</p>
     </div>
     """
-    
-    email_data = {
-        "from": from_email,
+
+    return {
+        "from": FROM_EMAIL,
         "to": [to_email],
         "subject": subject,
         "html": html_content
     }
-    
-    try:
-        with httpx.Client(timeout=15.0) as client:
-            res = client.post(
-                "https://api.resend.com/emails",
-                json=email_data,
+
+
+async def _post_batch(
+    client: httpx.AsyncClient, semaphore: asyncio.Semaphore, key: str, emails: List[dict]
+) -> Tuple[str, str]:
+    """Envía un lote con su Idempotency-Key. Devuelve (resultado, error)."""
+    async with semaphore:
+        try:
+            res = await client.post(
+                RESEND_BATCH_URL,
+                json=emails,
                 headers={
-                    "Authorization": f"Bearer {resend_api_key}",
-                    "Content-Type": "application/json"
+                    "Authorization": f"Bearer {settings.RESEND_API_KEY}",
+                    "Content-Type": "application/json",
+                    "Idempotency-Key": key,
                 }
             )
-            
-            if res.status_code in [200, 201]:
-                logger.info(f"Correo de alerta enviado exitosamente a {to_email}")
-                return True
-            else:
-                logger.error(f"Error al enviar correo de alerta de Resend: {res.status_code} - {res.text}")
-                return False
-    except Exception as e:
-        logger.error(f"Error de red/sistema enviando correo de alerta: {e}")
-        return False
+        except Exception as e:
+            logger.error(f"Error de red/sistema enviando lote de {len(emails)} correos: {e}")
+            return DELIVERY_RETRY, str(e)[:500]
+
+    if res.status_code in [200, 201]:
+        logger.info(f"Lote de {len(emails)} correos de alerta enviado")
+        return DELIVERY_SENT, ""
+    error = f"{res.status_code} - {res.text}"[:500]
+    logger.error(f"Error al enviar lote de correos a Resend: {error}")
+    if res.status_code in [409, 429] or res.status_code >= 500:
+        return DELIVERY_RETRY, error
+    return DELIVERY_FAILED, error
+
+
+async def _send_batches(batches: Dict[str, List[dict]]) -> Dict[str, Tuple[str, str]]:
+    concurrency = max(1, settings.NOTIFICATION_CONCURRENCY)
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=15.0, limits=limits) as client:
+        results = await asyncio.gather(*(
+            _post_batch(client, semaphore, key, emails) for key, emails in batches.items()
+        ))
+    return dict(zip(batches, results))
+
+
+def send_email_batches(batches: Dict[str, List[dict]]) -> Dict[str, Tuple[str, str]]:
+    """
+    Envía lotes de correos ({idempotency_key: [correo]}, hasta RESEND_BATCH_LIMIT por lote)
+    con un cliente HTTP asíncrono compartido y a lo más NOTIFICATION_CONCURRENCY solicitudes
+    simultáneas. Devuelve {idempotency_key: (resultado, error)}.
+    """
+    if not batches:
+        return {}
+    return asyncio.run(_send_batches(batches))
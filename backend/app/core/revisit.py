@@ -0,0 +1,133 @@
+"""
+Vigencia de los resultados cacheados según el calendario de pasadas de Sentinel-2.
+
+Un análisis sigue siendo "el más reciente" hasta que Sentinel-2 vuelve a pasar sobre el
+tile y la nueva escena aparece en Earth Engine. En vez de un TTL plano, la vigencia de
+cada entrada se calcula desde la fecha de adquisición de su imagen:
+
+* la cadencia de revisita del tile (5 días por defecto, menos en tiles cubiertos por dos
+  órbitas relativas, aprendida de las escenas que ya vimos; ver note_tile_pass),
+* un margen de ingesta tras la pasada esperada, durante el cual se re-chequea seguido,
+* y el historial de nubosidad de la zona: si casi ninguna pasada resulta utilizable, la
+  entrada sobrevive a la próxima pasada.
+"""
+import datetime
+import logging
+import re
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Constelación Sentinel-2 (dos satélites en la misma órbita, desfasados 180°): cada punto
+# se revisita cada 5 días en el ecuador. Los tiles en la zona de traslape de dos órbitas
+# relativas tienen pasadas más seguidas; eso se aprende por tile (note_tile_pass).
+S2_REVISIT_DAYS = 5
+MIN_LEARNED_REVISIT_DAYS = 1
+
+# Una escena puede tardar en aparecer en COPERNICUS/S2_SR_HARMONIZED tras la pasada.
+# Durante este margen la entrada se re-chequea cada POST_PASS_RECHECK_SECONDS en vez de
+# quedar vigente hasta la pasada siguiente (lo que serviría datos viejos varios días).
+INGESTION_GRACE = datetime.timedelta(days=3)
+POST_PASS_RECHECK_SECONDS = 6 * 60 * 60
+
+MIN_TTL_SECONDS = 15 * 60
+MAX_TTL_SECONDS = 2 * S2_REVISIT_DAYS * 24 * 60 * 60
+
+# Si menos de esta fracción de las pasadas esperadas resultó utilizable en la zona, es
+# improbable que la próxima cambie el resultado: la entrada vive hasta la siguiente.
+CLOUDY_SKIP_USABLE_RATIO = 0.34
+
+# system:index de S2_SR_HARMONIZED: "<datatake>_<granule>_T<MGRS>", p.ej.
+# "20260701T143731_20260701T144052_T19HBD".
+_TILE_RE = re.compile(r"_T(\d{2}[A-Z]{3})$")
+
+
+def tile_from_scene_id(scene_id: Optional[str]) -> Optional[str]:
+    """Tile MGRS (p.ej. "19HBD") a partir del id de escena, o None si no se reconoce."""
+    if not scene_id:
+        return None
+    match = _TILE_RE.search(scene_id)
+    return match.group(1) if match else None
+
+
+def _parse_date(value: Optional[str]) -> Optional[datetime.datetime]:
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def usable_pass_ratio(usable_dates: int, window_days: int, revisit_days: int = S2_REVISIT_DAYS) -> Optional[float]:
+    """Fracción de las pasadas esperadas en la ventana que resultaron utilizables (None sin historial)."""
+    if usable_dates <= 0 or window_days <= 0:
+        return None
+    expected = max(1, window_days // revisit_days)
+    return min(1.0, usable_dates / expected)
+
+
+def adaptive_ttl_seconds(
+    image_date: Optional[str],
+    default_ttl: int,
+    revisit_days: int = S2_REVISIT_DAYS,
+    usable_ratio: Optional[float] = None,
+    now: Optional[datetime.datetime] = None,
+) -> int:
+    """
+    Segundos que un resultado basado en una imagen de `image_date` (YYYY-MM-DD) puede
+    seguir cacheado. Sin fecha reconocible devuelve `default_ttl`.
+    """
+    acquired = _parse_date(image_date)
+    if acquired is None:
+        return default_ttl
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    step = datetime.timedelta(days=max(MIN_LEARNED_REVISIT_DAYS, revisit_days))
+
+    # Primera pasada esperada cuya ventana de ingesta aún no termina.
+    next_pass = acquired + step
+    while next_pass + INGESTION_GRACE <= now:
+        next_pass += step
+
+    if next_pass <= now:
+        # La pasada ya ocurrió pero la escena todavía no aparece: re-chequear pronto.
+        ttl = POST_PASS_RECHECK_SECONDS
+    else:
+        if usable_ratio is not None and usable_ratio < CLOUDY_SKIP_USABLE_RATIO:
+            next_pass += step
+        ttl = int((next_pass - now).total_seconds())
+
+    return max(MIN_TTL_SECONDS, min(MAX_TTL_SECONDS, ttl))
+
+
+def learned_revisit_days(redis_client, tile: Optional[str]) -> int:
+    """Cadencia de revisita aprendida para el tile (S2_REVISIT_DAYS si no hay datos)."""
+    if not redis_client or not tile:
+        return S2_REVISIT_DAYS
+    try:
+        gap = redis_client.hget(f"s2tile:{tile}", "revisit_days")
+        return int(gap) if gap else S2_REVISIT_DAYS
+    except Exception as e:
+        logger.warning(f"Error leyendo cadencia de revisita del tile {tile}: {e}")
+        return S2_REVISIT_DAYS
+
+
+def note_tile_pass(redis_client, tile: Optional[str], image_date: Optional[str]) -> None:
+    """
+    Registra una escena del tile y ajusta su cadencia aprendida: el menor salto entre
+    fechas consecutivas vistas, nunca por encima de S2_REVISIT_DAYS (solo vemos pasadas
+    utilizables, así que un salto observado más largo no prueba una cadencia más lenta).
+    """
+    acquired = _parse_date(image_date)
+    if not redis_client or not tile or acquired is None:
+        return
+    key = f"s2tile:{tile}"
+    try:
+        last, gap = redis_client.hmget(key, "last_date", "revisit_days")
+        last_date = _parse_date(last.decode()) if last else None
+        if last_date is not None and acquired <= last_date:
+            return
+        revisit = int(gap) if gap else S2_REVISIT_DAYS
+        if last_date is not None:
+            revisit = max(MIN_LEARNED_REVISIT_DAYS, min(revisit, (acquired - last_date).days))
+        redis_client.hset(key, mapping={"last_date": image_date, "revisit_days": revisit})
+    except Exception as e:
+        logger.warning(f"Error registrando pasada del tile {tile}: {e}")
@@ -0,0 +1,143 @@
+"""
+Cache durable de análisis en PostGIS (tabla analysis_results).
+
+Es el segundo nivel detrás de Redis: process_gee_analysis guarda aquí cada resultado
+exitoso y trigger_analysis (analyze.py) lo consulta cuando Redis no tiene la clave, antes
+de encolar una tarea nueva en Celery. Así una evicción o reinicio de Redis no manda toda la
+siguiente ola de tráfico directo a Google Earth Engine.
+"""
+import datetime
+import logging
+from typing import List, Optional
+
+from geoalchemy2.elements import WKTElement
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import Session, select, func
+
+from app.core.cells import CELL_DECIMALS, location_cell, radius_bucket
+from app.db.models import AnalysisResult, ApiUsageLog
+
+logger = logging.getLogger(__name__)
+
+def build_date_range(start_date: Optional[str], end_date: Optional[str]) -> str:
+    """Mismo criterio que build_analysis_cache_key: el rango solo cuenta si vienen ambas fechas."""
+    return f"{start_date}:{end_date}" if start_date and end_date else ""
+
+
+def _point(lat: float, lng: float) -> WKTElement:
+    return WKTElement(f"POINT({lng} {lat})", srid=4326)
+
+
+def find_analysis_result(
+    session: Session,
+    approach: str,
+    lat: float,
+    lng: float,
+    radius: int,
+    date_range: str,
+    logic_version: str,
+    include_expired: bool = False,
+) -> Optional[AnalysisResult]:
+    """
+    Análisis vigente de la misma clave que build_analysis_cache_key: celda (location_cell),
+    enfoque, radio exacto, rango de fechas y versión de lógica. Así el payload que rehidrata
+    Redis es el mismo que se habría calculado para esa clave. Con `include_expired` también
+    devuelve el resultado vencido, para servir algo cuando GEE no está disponible.
+    """
+    query = (
+        select(AnalysisResult)
+        .where(AnalysisResult.cell == location_cell(lat, lng))
+        .where(AnalysisResult.approach == approach)
+        .where(AnalysisResult.radius == radius)
+        .where(AnalysisResult.date_range == date_range)
+        .where(AnalysisResult.logic_version == logic_version)
+    )
+    if not include_expired:
+        query = query.where(AnalysisResult.expires_at > datetime.datetime.now(datetime.timezone.utc))
+    return session.exec(query.limit(1)).first()
+
+
+def save_analysis_result(
+    session: Session,
+    approach: str,
+    lat: float,
+    lng: float,
+    radius: int,
+    date_range: str,
+    logic_version: str,
+    payload: dict,
+    ttl_seconds: int,
+) -> None:
+    """
+    Guarda un análisis exitoso en la cache durable: si la clave ya tiene fila (otro cálculo
+    de la misma celda, o un precalentamiento), la reemplaza en vez de sumar otra. No hace commit.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    stmt = pg_insert(AnalysisResult.__table__).values(
+        cell=location_cell(lat, lng),
+        approach=approach,
+        radius=radius,
+        radius_bucket=radius_bucket(radius),
+        logic_version=logic_version,
+        date_range=date_range,
+        scene_id=(payload.get("meta") or {}).get("scene_id"),
+        coordinates=_point(lat, lng),
+        payload=payload,
+        created_at=now,
+        expires_at=now + datetime.timedelta(seconds=ttl_seconds),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["cell", "approach", "radius", "date_range", "logic_version"],
+        set_={
+            "scene_id": stmt.excluded.scene_id,
+            "coordinates": stmt.excluded.coordinates,
+            "payload": stmt.excluded.payload,
+            "created_at": stmt.excluded.created_at,
+            "expires_at": stmt.excluded.expires_at,
+        },
+    )
+    session.execute(stmt)
+
+
+def prune_analysis_results(session: Session, expired_before: datetime.datetime) -> int:
+    """Elimina los análisis vencidos antes de `expired_before` y devuelve cuántos. No hace commit."""
+    result = session.execute(delete(AnalysisResult).where(AnalysisResult.expires_at < expired_before))
+    return result.rowcount or 0
+
+
+def remaining_ttl_seconds(row: AnalysisResult) -> int:
+    """Segundos de vigencia que le quedan a una fila (para rehidratar Redis con el mismo plazo)."""
+    expires_at = row.expires_at
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0, int((expires_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()))
+
+
+def find_usage_hotspots(session: Session, since: datetime.datetime, limit: int, min_hits: int) -> List[dict]:
+    """
+    Ternas (ubicación, enfoque, radio) más pedidas desde `since`, agrupando api_usage_logs
+    en la misma grilla de 4 decimales de las claves de cache para que cada hotspot
+    corresponda exactamente a una entrada de cache. Incluye cache-hits y cálculos frescos.
+    """
+    snapped = func.ST_SnapToGrid(ApiUsageLog.coordinates, 10 ** -CELL_DECIMALS)
+    lat = func.ST_Y(snapped).label("lat")
+    lng = func.ST_X(snapped).label("lng")
+    hits = func.count().label("hits")
+    rows = session.exec(
+        select(lat, lng, ApiUsageLog.approach, ApiUsageLog.radius, hits)
+        .where(ApiUsageLog.timestamp >= since)
+        .where(ApiUsageLog.endpoint == "/api/v1/analyze")
+        .where(ApiUsageLog.status.in_(["success", "cache_hit"]))
+        .where(ApiUsageLog.radius.is_not(None))
+        .where(ApiUsageLog.coordinates.is_not(None))
+        .group_by(lat, lng, ApiUsageLog.approach, ApiUsageLog.radius)
+        .having(func.count() >= min_hits)
+        .order_by(hits.desc())
+        .limit(limit)
+    ).all()
+    return [
+        {"lat": round(r.lat, CELL_DECIMALS), "lng": round(r.lng, CELL_DECIMALS),
+         "approach": r.approach, "radius": r.radius, "hits": r.hits}
+        for r in rows
+    ]
@@ -1,7 +1,7 @@
 import datetime
 from typing import Optional, Any
 from sqlmodel import SQLModel, Field, Column
-from sqlalchemy import text
+from sqlalchemy import text, Index
 from sqlalchemy.dialects.postgresql import JSONB
 from geoalchemy2 import Geometry
 
@@ -44,6 +44,10 @@ class ApiUsageLog(SQLModel, table=True):
     )
     
     approach: str = Field(max_length=100)
+    # Radio del análisis: junto con la ubicación y el enfoque identifica la entrada de cache
+    # que prewarm_analysis_cache debe mantener caliente. NULL en filas anteriores a la columna.
+    radius: Optional[int] = Field(default=None)
+    # "success" / "failed" desde el worker; "cache_hit" cuando /analyze respondió desde cache.
     status: str = Field(default="success", max_length=50)
 
 
@@ -102,10 +106,105 @@ class UserAnalysis(SQLModel, table=True):
     image_date: Optional[str] = Field(default=None, max_length=30)
     interpretation: Optional[str] = Field(default=None)
 
+    # Referencia a la serie temporal compartida (tabla timeseries_points) en vez de una
+    # copia embebida en chart_data. Si están presentes, chart_data queda en NULL y el
+    # historial se reconstruye desde la tabla compartida (ver app/db/timeseries_store.py),
+    # con los puntos de la versión de lógica con que se mostró.
+    timeseries_cell: Optional[str] = Field(default=None, max_length=32)
+    timeseries_radius: Optional[int] = Field(default=None)
+    timeseries_logic_version: Optional[str] = Field(default=None, max_length=10)
+
+
+class TimeseriesPoint(SQLModel, table=True):
+    """
+    Un punto del Pulso Territorial (NDVI/NDWI/NDMI medios de una pasada Sentinel-2) para
+    una celda+radio exacto, compartido entre todos los usuarios. process_timeseries solo le
+    pide a GEE las pasadas posteriores al último punto guardado de la celda. Cada versión de
+    la lógica tiene sus propios puntos: un cambio de versión no reescribe los que referencia
+    el historial.
+    """
+    __tablename__ = "timeseries_points"
+    __table_args__ = (
+        Index(
+            "ux_timeseries_points_key",
+            "cell", "radius", "logic_version", "acquisition_date",
+            unique=True,
+        ),
+        {"schema": "metadata"},
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    cell: str = Field(max_length=32)
+    radius: int
+    acquisition_date: datetime.date
+    ndvi: Optional[float] = Field(default=None)
+    ndwi: Optional[float] = Field(default=None)
+    ndmi: Optional[float] = Field(default=None)
+    clouds: Optional[float] = Field(default=None)
+    logic_version: str = Field(max_length=10)
+    created_at: datetime.datetime = Field(
+        default_factory=datetime.datetime.now,
+        sa_column_kwargs={"server_default": text("CURRENT_TIMESTAMP")}
+    )
+
+
+class AnalysisResult(SQLModel, table=True):
+    """
+    Cache durable de análisis completos (mismo payload que guarda cache_analysis_result en
+    Redis). Sobrevive a evicciones/reinicios de Redis y permite reutilizar un análisis entre
+    usuarios más allá del TTL de Redis: trigger_analysis la consulta tras un cache-miss de
+    Redis y antes de encolar en Celery (ver app/db/analysis_store.py). Una fila por clave de
+    Redis (celda, enfoque, radio exacto, rango y versión): recalcular la actualiza.
+    """
+    __tablename__ = "analysis_results"
+    __table_args__ = (
+        Index(
+            "ux_analysis_results_key",
+            "cell", "approach", "radius", "date_range", "logic_version",
+            unique=True,
+        ),
+        Index("ix_analysis_results_expires_at", "expires_at"),
+        {"schema": "metadata"},
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    cell: str = Field(max_length=32)
+    approach: str = Field(max_length=100)
+    radius: int
+    radius_bucket: int
+    logic_version: str = Field(max_length=10)
+    # "" para el análisis de la imagen más reciente; "YYYY-MM-DD:YYYY-MM-DD" para rangos históricos.
+    date_range: str = Field(default="", max_length=21)
+    scene_id: Optional[str] = Field(default=None, max_length=100)
+
+    # Centro exacto del análisis; el índice GIST permite la búsqueda KNN/ST_DWithin.
+    coordinates: Any = Field(
+        sa_column=Column(
+            Geometry(geometry_type="POINT", srid=4326, spatial_index=True),
+            nullable=False
+        )
+    )
+
+    payload: dict = Field(sa_column=Column(JSONB, nullable=False))
+    created_at: datetime.datetime = Field(
+        default_factory=datetime.datetime.now,
+        sa_column_kwargs={"server_default": text("CURRENT_TIMESTAMP")}
+    )
+    expires_at: datetime.datetime
+
 
 class UserAlert(SQLModel, table=True):
     __tablename__ = "user_alerts"
-    __table_args__ = {"schema": "metadata"}
+    __table_args__ = (
+        # Índice parcial para el tick de alertas (tasks_periodic.py): solo las activas,
+        # por próxima revisión.
+        Index(
+            "ix_user_alerts_next_due",
+            "next_due_at",
+            postgresql_where=text("is_active"),
+        ),
+        {"schema": "metadata"},
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="metadata.users.id", index=True)
@@ -131,9 +230,123 @@ class UserAlert(SQLModel, table=True):
     frequency: str = Field(max_length=20, default="daily")
     
     # Alertas personalizables:
-    # ndvi_below, ndwi_above, ndmi_below, ndvi_drop_pct
+    # ndvi_below, ndwi_above, ndmi_below, compuestas (vegetation_water_stress,
+    # waterlogged_crop) y por tendencia (ndvi_drop_pct, zscore_anomaly, consecutive_below);
+    # ver app/core/alert_rules.py
     trigger_type: str = Field(max_length=50, default="ndvi_below")
     trigger_value: float = Field(default=0.3)
+    # Umbral del segundo índice de las reglas compuestas (NULL: valor por defecto de la regla)
+    trigger_secondary_value: Optional[float] = Field(default=None)
     
     last_checked_at: Optional[datetime.datetime] = Field(default=None)
     last_index_value: Optional[float] = Field(default=None)
+    # Adquisición de la escena Sentinel-2 más reciente usada en la última evaluación: sin
+    # escena más nueva, la alerta no se vuelve a calcular (ver tasks_periodic.py)
+    last_scene_at: Optional[datetime.datetime] = Field(default=None)
+    # De dónde salió last_index_value: "gee" o la cache reutilizada (ver tasks_periodic.py)
+    last_value_source: Optional[str] = Field(default=None, max_length=32)
+    # Observaciones que usan los disparadores por tendencia: promedio base de ndvi_drop_pct
+    # y zscore_anomaly, o racha requerida de consecutive_below (NULL: valor por defecto)
+    trigger_window: Optional[int] = Field(default=None)
+    # Próxima revisión: repartida dentro de la ventana de su frecuencia según la zona (o el
+    # id) de la alerta (NULL: alerta nueva, se revisa en el próximo tick)
+    next_due_at: Optional[datetime.datetime] = Field(default=None)
+    # Zona compartida con las alertas del mismo lugar (alert_zones; NULL: se evalúa sola)
+    zone_id: Optional[int] = Field(default=None, index=True)
+
+
+class AlertZone(SQLModel, table=True):
+    """
+    Lugar monitoreado por una o más alertas (de uno o varios usuarios): centro y radio con
+    que se evalúan todas sus alertas, una sola vez por pasada. Las alertas se asignan al
+    crearse y se liberan al borrarse (ver app/db/zone_store.py).
+    """
+    __tablename__ = "alert_zones"
+    __table_args__ = {"schema": "metadata"}
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    lat: float
+    lng: float
+    # Radio exacto de sus alertas: todas se evalúan con el mismo buffer que pidieron
+    radius: int = Field(index=True)
+    # El índice GIST sirve la búsqueda de la zona más cercana al crear una alerta
+    coordinates: Any = Field(
+        sa_column=Column(
+            Geometry(geometry_type="POINT", srid=4326, spatial_index=True),
+            nullable=False
+        )
+    )
+    member_count: int = Field(default=0)
+    created_at: datetime.datetime = Field(
+        default_factory=datetime.datetime.now,
+        sa_column_kwargs={"server_default": text("CURRENT_TIMESTAMP")}
+    )
+
+
+class AlertObservation(SQLModel, table=True):
+    """
+    Valores de índices de una alerta en una pasada Sentinel-2 (historial para los
+    disparadores por tendencia, ver app/core/alert_trends.py). Particionada por mes de
+    adquisición: las lecturas de la ventana reciente de un lote de alertas solo tocan las
+    particiones del período, y la clave primaria (alerta, fecha) sirve los rangos por alerta.
+    Las particiones mensuales las crea app/db/observation_store.py.
+    """
+    __tablename__ = "alert_observations"
+    __table_args__ = {
+        "schema": "metadata",
+        "postgresql_partition_by": "RANGE (acquisition_date)",
+    }
+
+    # Sin FK: la tabla particionada se limpia al borrar la alerta (endpoints/alerts.py)
+    alert_id: int = Field(primary_key=True)
+    acquisition_date: datetime.date = Field(primary_key=True)
+    # Adquisición de la escena más reciente del mosaico evaluado (identifica la pasada)
+    scene_at: Optional[datetime.datetime] = Field(default=None)
+    ndvi: Optional[float] = Field(default=None)
+    ndwi: Optional[float] = Field(default=None)
+    ndmi: Optional[float] = Field(default=None)
+    source: Optional[str] = Field(default=None, max_length=32)
+    created_at: datetime.datetime = Field(
+        default_factory=datetime.datetime.now,
+        sa_column_kwargs={"server_default": text("CURRENT_TIMESTAMP")}
+    )
+
+
+class NotificationOutbox(SQLModel, table=True):
+    """
+    Correos por enviar (patrón outbox). La revisión de alertas los escribe en la misma
+    transacción que la actualización de la alerta y drain_notification_outbox
+    (app/tasks/tasks_notifications.py) los envía aparte, agrupados por destinatario: la
+    latencia del proveedor de correo no frena la evaluación en GEE.
+    """
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        # Índice parcial del drenaje: solo las pendientes, por próximo intento.
+        Index(
+            "ix_notification_outbox_pending",
+            "next_attempt_at",
+            postgresql_where=text("status = 'pending'"),
+        ),
+        {"schema": "metadata"},
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    # Identifica el evento (p.ej. alerta + pasada): un mismo evento se encola una sola vez
+    event_key: str = Field(max_length=200, unique=True)
+    alert_id: Optional[int] = Field(default=None)
+    to_email: str = Field(max_length=255)
+    # Datos del correo (location_name, trigger_desc, index_name, current_value)
+    payload: dict = Field(sa_column=Column(JSONB, nullable=False))
+    status: str = Field(default="pending", max_length=20)  # pending, sent, failed, skipped
+    attempts: int = Field(default=0)
+    # Próximo intento (NULL: lo antes posible); el drenaje lo adelanta como reserva al tomarla
+    next_attempt_at: Optional[datetime.datetime] = Field(default=None)
+    # Idempotency-Key de la solicitud al proveedor: un reintento repite la misma solicitud
+    # con la misma clave y el proveedor no duplica el envío
+    delivery_key: Optional[str] = Field(default=None, max_length=64, index=True)
+    last_error: Optional[str] = Field(default=None, max_length=500)
+    sent_at: Optional[datetime.datetime] = Field(default=None)
+    created_at: datetime.datetime = Field(
+        default_factory=datetime.datetime.now,
+        sa_column_kwargs={"server_default": text("CURRENT_TIMESTAMP")}
+    )
@@ -0,0 +1,87 @@
+"""
+Historial de valores de las alertas (tabla particionada alert_observations).
+
+check_alert_shard (tasks_periodic.py) agrega una observación por alerta evaluada y pasada
+Sentinel-2, y lee la ventana reciente de todo un lote en una sola consulta para los
+disparadores por tendencia: el historial nunca se vuelve a pedir a GEE.
+"""
+import datetime
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import Session, select
+
+from app.db.models import AlertObservation
+
+logger = logging.getLogger(__name__)
+
+OBSERVATIONS_TABLE = "metadata.alert_observations"
+
+
+def month_start(day: datetime.date) -> datetime.date:
+    return day.replace(day=1)
+
+
+def _next_month(day: datetime.date) -> datetime.date:
+    return (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def partition_name(day: datetime.date) -> str:
+    """Partición mensual que contiene `day` (p.ej. alert_observations_2026_10)."""
+    return f"alert_observations_{day.year:04d}_{day.month:02d}"
+
+
+def ensure_month_partitions(session: Session, days: Iterable[datetime.date]) -> None:
+    """
+    Crea (si faltan) las particiones mensuales que contienen `days`. Es idempotente y
+    barato: se llama antes de cada inserción con los meses de las pasadas del lote.
+    No hace commit: el llamador decide el límite de la transacción.
+    """
+    for start in sorted({month_start(d) for d in days}):
+        session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS metadata.{partition_name(start)} "
+            f"PARTITION OF {OBSERVATIONS_TABLE} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{_next_month(start).isoformat()}')"
+        ))
+
+
+def insert_observations(session: Session, rows: List[dict]) -> int:
+    """
+    Agrega observaciones ({alert_id, acquisition_date, scene_at, ndvi, ndwi, ndmi, source}).
+    Una misma alerta y pasada se guarda una sola vez. No hace commit.
+    """
+    if not rows:
+        return 0
+    ensure_month_partitions(session, [r["acquisition_date"] for r in rows])
+    stmt = pg_insert(AlertObservation.__table__).values(rows)
+    session.execute(stmt.on_conflict_do_nothing(index_elements=["alert_id", "acquisition_date"]))
+    return len(rows)
+
+
+def load_recent_observations(
+    session: Session, alert_ids: List[int], since: datetime.date
+) -> Dict[int, List[dict]]:
+    """
+    Observaciones de varias alertas desde `since` con una sola consulta (solo las
+    particiones del período), la más antigua primero. Devuelve {alert_id: [observación]}.
+    """
+    if not alert_ids:
+        return {}
+    rows = session.exec(
+        select(AlertObservation)
+        .where(AlertObservation.alert_id.in_(alert_ids))
+        .where(AlertObservation.acquisition_date >= since)
+        .order_by(AlertObservation.alert_id, AlertObservation.acquisition_date)
+    ).all()
+    history = defaultdict(list)
+    for r in rows:
+        history[r.alert_id].append({
+            "date": r.acquisition_date,
+            "NDVI": r.ndvi,
+            "NDWI": r.ndwi,
+            "NDMI": r.ndmi,
+        })
+    return dict(history)
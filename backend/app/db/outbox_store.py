@@ -0,0 +1,128 @@
+"""
+Bandeja de salida de correos (tabla notification_outbox).
+
+check_alert_shard (tasks_periodic.py) encola un correo por alerta disparada en la misma
+transacción que la actualización de la alerta; drain_notification_outbox
+(tasks_notifications.py) toma las pendientes con reserva (FOR UPDATE SKIP LOCKED, como el
+tick de alertas) y registra el resultado de cada envío.
+"""
+import datetime
+import hashlib
+import logging
+from collections import defaultdict
+from typing import Dict, List
+
+from sqlalchemy import func, or_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import Session, select
+
+from app.db.models import NotificationOutbox
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = "pending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"      # Sin proveedor de correo configurado
+
+
+def enqueue_notifications(session: Session, rows: List[dict]) -> int:
+    """
+    Encola correos ({event_key, alert_id, to_email, payload}). Un evento ya encolado
+    (misma event_key, p.ej. la misma pasada reevaluada tras vencer su reserva) se ignora.
+    No hace commit: va en la transacción de quien lo llama.
+    """
+    if not rows:
+        return 0
+    values = [{**row, "status": STATUS_PENDING, "attempts": 0} for row in rows]
+    stmt = pg_insert(NotificationOutbox.__table__).values(values)
+    session.execute(stmt.on_conflict_do_nothing(index_elements=["event_key"]))
+    return len(rows)
+
+
+def delivery_key(ids: List[int]) -> str:
+    """Idempotency-Key estable de una solicitud al proveedor: depende solo de sus filas."""
+    return hashlib.sha256(",".join(str(i) for i in sorted(ids)).encode()).hexdigest()
+
+
+def _due(now: datetime.datetime):
+    return (
+        NotificationOutbox.status == STATUS_PENDING,
+        or_(NotificationOutbox.next_attempt_at.is_(None), NotificationOutbox.next_attempt_at <= now),
+    )
+
+
+def _lock_whole_groups(session: Session, now: datetime.datetime, keys: List[str]) -> List[NotificationOutbox]:
+    """
+    Bloquea (FOR UPDATE SKIP LOCKED) las filas vencidas de los grupos `keys` y devuelve solo
+    las de los grupos que quedaron bloqueados completos. Si otro drenaje tiene parte de un
+    grupo, se deja entero para él: reenviar una parte con la misma Idempotency-Key sería
+    otra solicitud con la clave de la original.
+    """
+    locked = session.exec(
+        select(NotificationOutbox)
+        .where(*_due(now), NotificationOutbox.delivery_key.in_(keys))
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not locked:
+        return []
+    due_counts = dict(session.exec(
+        select(NotificationOutbox.delivery_key, func.count())
+        .where(*_due(now), NotificationOutbox.delivery_key.in_(keys))
+        .group_by(NotificationOutbox.delivery_key)
+    ).all())
+    by_key = defaultdict(list)
+    for row in locked:
+        by_key[row.delivery_key].append(row)
+    return [row for key, rows in by_key.items() if len(rows) == due_counts.get(key) for row in rows]
+
+
+def claim_notifications(
+    session: Session, now: datetime.datetime, limit: int, retry_groups: int, lease_s: int
+) -> Dict[str, List[dict]]:
+    """
+    Toma correos vencidos y los reserva moviendo next_attempt_at `lease_s` hacia adelante.
+    Los reintentos se toman por grupos completos de delivery_key (hasta `retry_groups`; un
+    grupo que otro drenaje tiene a medias se salta), así se reenvía exactamente la misma
+    solicitud con la misma clave; los nuevos (hasta
+    `limit`) se agrupan por el llamador. Devuelve {delivery_key o "": [fila]} con filas
+    planas (id, to_email, payload, attempts), ordenadas por id.
+
+    No hace commit: el llamador confirma la reserva antes de enviar.
+    """
+    retry_keys = session.exec(
+        select(NotificationOutbox.delivery_key)
+        .where(*_due(now), NotificationOutbox.delivery_key.is_not(None))
+        .group_by(NotificationOutbox.delivery_key)
+        .order_by(func.min(NotificationOutbox.id))
+        .limit(retry_groups)
+    ).all()
+    claimed = []
+    if retry_keys:
+        claimed += _lock_whole_groups(session, now, retry_keys)
+    claimed += session.exec(
+        select(NotificationOutbox)
+        .where(*_due(now), NotificationOutbox.delivery_key.is_(None))
+        .order_by(NotificationOutbox.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if claimed:
+        session.execute(
+            update(NotificationOutbox)
+            .where(NotificationOutbox.id.in_([row.id for row in claimed]))
+            .values(next_attempt_at=now + datetime.timedelta(seconds=lease_s))
+        )
+
+    groups = defaultdict(list)
+    for row in sorted(claimed, key=lambda r: r.id):
+        groups[row.delivery_key or ""].append({
+            "id": row.id, "to_email": row.to_email, "payload": row.payload, "attempts": row.attempts,
+        })
+    return dict(groups)
+
+
+def write_delivery_results(session: Session, rows: List[dict]) -> None:
+    """UPDATE en bloque por clave primaria con el resultado de cada fila (no hace commit)."""
+    if rows:
+        session.execute(update(NotificationOutbox), rows)
@@ -1,3 +1,4 @@
+import datetime
 import logging
 from sqlmodel import SQLModel, create_engine, Session
 from app.core.config import settings
@@ -44,6 +45,163 @@ def init_db():
                 ALTER TABLE metadata.user_alerts 
                 ADD COLUMN IF NOT EXISTS frequency VARCHAR(20) DEFAULT 'daily';
             """))
+            # 3. Referencia a la serie temporal compartida en user_analyses
+            session.execute(text("""
+                ALTER TABLE metadata.user_analyses
+                ADD COLUMN IF NOT EXISTS timeseries_cell VARCHAR(32);
+            """))
+            session.execute(text("""
+                ALTER TABLE metadata.user_analyses
+                ADD COLUMN IF NOT EXISTS timeseries_radius INTEGER;
+            """))
+            # 4. Radio del análisis en api_usage_logs (hotspots para precalentar la cache)
+            session.execute(text("""
+                ALTER TABLE metadata.api_usage_logs
+                ADD COLUMN IF NOT EXISTS radius INTEGER;
+            """))
+            # 5. Marca de la última escena evaluada en user_alerts
+            session.execute(text("""
+                ALTER TABLE metadata.user_alerts
+                ADD COLUMN IF NOT EXISTS last_scene_at TIMESTAMP;
+            """))
+            # 6. Próxima revisión de cada alerta y su índice parcial (tablas ya creadas)
+            session.execute(text("""
+                ALTER TABLE metadata.user_alerts
+                ADD COLUMN IF NOT EXISTS next_due_at TIMESTAMP;
+            """))
+            session.execute(text("""
+                DROP INDEX IF EXISTS metadata.ix_user_alerts_active_due;
+            """))
+            session.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_user_alerts_next_due
+                ON metadata.user_alerts (next_due_at)
+                WHERE is_active;
+            """))
+            # 7. Origen del último valor de cada alerta (GEE o cache reutilizada)
+            session.execute(text("""
+                ALTER TABLE metadata.user_alerts
+                ADD COLUMN IF NOT EXISTS last_value_source VARCHAR(32);
+            """))
+            # 8. Ventana de los disparadores por tendencia y particiones de alert_observations
+            session.execute(text("""
+                ALTER TABLE metadata.user_alerts
+                ADD COLUMN IF NOT EXISTS trigger_window INTEGER;
+            """))
+            from app.db.observation_store import ensure_month_partitions
+            today = datetime.date.today()
+            ensure_month_partitions(session, [today, today + datetime.timedelta(days=31)])
+            # 9. Umbral secundario de las reglas compuestas de alertas
+            session.execute(text("""
+                ALTER TABLE metadata.user_alerts
+                ADD COLUMN IF NOT EXISTS trigger_secondary_value DOUBLE PRECISION;
+            """))
+            # 10. Zona compartida de cada alerta (las existentes se asignan en el paso 12)
+            session.execute(text("""
+                ALTER TABLE metadata.user_alerts
+                ADD COLUMN IF NOT EXISTS zone_id INTEGER;
+            """))
+            session.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_metadata_user_alerts_zone_id
+                ON metadata.user_alerts (zone_id);
+            """))
+            # 11. Cache durable con una fila por clave de Redis (celda + radio exacto). Las filas
+            # anteriores no guardan el radio exacto: se descartan (el próximo análisis las recalcula).
+            session.execute(text("""
+                ALTER TABLE metadata.analysis_results
+                ADD COLUMN IF NOT EXISTS cell VARCHAR(32);
+            """))
+            session.execute(text("""
+                ALTER TABLE metadata.analysis_results
+                ADD COLUMN IF NOT EXISTS radius INTEGER;
+            """))
+            session.execute(text("""
+                DELETE FROM metadata.analysis_results WHERE cell IS NULL OR radius IS NULL;
+            """))
+            session.execute(text("""
+                ALTER TABLE metadata.analysis_results
+                ALTER COLUMN cell SET NOT NULL,
+                ALTER COLUMN radius SET NOT NULL;
+            """))
+            session.execute(text("""
+                DROP INDEX IF EXISTS metadata.ix_analysis_results_lookup;
+            """))
+            session.execute(text("""
+                CREATE UNIQUE INDEX IF NOT EXISTS ux_analysis_results_key
+                ON metadata.analysis_results (cell, approach, radius, date_range, logic_version);
+            """))
+            session.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_analysis_results_expires_at
+                ON metadata.analysis_results (expires_at);
+            """))
+            # 12. Zonas por radio exacto. Las zonas agrupadas por tramo de radio se disuelven y
+            # sus alertas, junto con las que aún no tienen zona, se reasignan una vez.
+            session.execute(text("""
+                ALTER TABLE metadata.alert_zones
+                ADD COLUMN IF NOT EXISTS radius INTEGER;
+            """))
+            session.execute(text("""
+                UPDATE metadata.user_alerts SET zone_id = NULL
+                WHERE zone_id IN (SELECT id FROM metadata.alert_zones WHERE radius IS NULL);
+            """))
+            session.execute(text("""
+                DELETE FROM metadata.alert_zones WHERE radius IS NULL;
+            """))
+            session.execute(text("""
+                ALTER TABLE metadata.alert_zones
+                ALTER COLUMN radius SET NOT NULL,
+                DROP COLUMN IF EXISTS radius_bucket;
+            """))
+            session.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_metadata_alert_zones_radius
+                ON metadata.alert_zones (radius);
+            """))
+            from app.db.zone_store import backfill_alert_zones
+            backfill_alert_zones(session)
+            # 13. Serie temporal compartida por radio exacto y versión de lógica. Los puntos ya
+            # guardados conservan su radio de tramo (el que leían sus historiales) y cada
+            # historial que los referencia queda fijado a la versión con que se guardaron.
+            session.execute(text("""
+                ALTER TABLE metadata.timeseries_points
+                ADD COLUMN IF NOT EXISTS radius INTEGER;
+            """))
+            session.execute(text("""
+                DO $$ BEGIN
+                    IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_schema = 'metadata'
+                               AND table_name = 'timeseries_points' AND column_name = 'radius_bucket') THEN
+                        UPDATE metadata.timeseries_points SET radius = radius_bucket WHERE radius IS NULL;
+                        ALTER TABLE metadata.timeseries_points DROP COLUMN radius_bucket;
+                    END IF;
+                END $$;
+            """))
+            session.execute(text("""
+                ALTER TABLE metadata.timeseries_points
+                ALTER COLUMN radius SET NOT NULL;
+            """))
+            session.execute(text("""
+                CREATE UNIQUE INDEX IF NOT EXISTS ux_timeseries_points_key
+                ON metadata.timeseries_points (cell, radius, logic_version, acquisition_date);
+            """))
+            session.execute(text("""
+                DO $$ BEGIN
+                    IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_schema = 'metadata'
+                               AND table_name = 'user_analyses' AND column_name = 'timeseries_radius_bucket') THEN
+                        UPDATE metadata.user_analyses SET timeseries_radius = timeseries_radius_bucket
+                        WHERE timeseries_radius IS NULL;
+                        ALTER TABLE metadata.user_analyses DROP COLUMN timeseries_radius_bucket;
+                    END IF;
+                END $$;
+            """))
+            session.execute(text("""
+                ALTER TABLE metadata.user_analyses
+                ADD COLUMN IF NOT EXISTS timeseries_logic_version VARCHAR(10);
+            """))
+            session.execute(text("""
+                UPDATE metadata.user_analyses ua SET timeseries_logic_version = (
+                    SELECT MAX(p.logic_version) FROM metadata.timeseries_points p
+                    WHERE p.cell = ua.timeseries_cell AND p.radius = ua.timeseries_radius
+                )
+                WHERE ua.timeseries_cell IS NOT NULL AND ua.timeseries_logic_version IS NULL;
+            """))
             session.commit()
             
         logger.info("Base de datos inicializada (Tablas creadas/verificadas y migraciones ejecutadas).")
@@ -0,0 +1,191 @@
+"""
+Almacén compartido de la serie temporal del Pulso Territorial (tabla timeseries_points).
+
+Una misma celda+radio (radio exacto, el mismo con que se calcula en GEE) se calcula una
+sola vez en Google Earth Engine y se reutiliza entre usuarios: process_timeseries
+(worker.py) lee lo ya guardado antes de ir a GEE y solo pide las pasadas nuevas, y el
+historial de cada usuario referencia la celda y la versión de lógica en vez de guardar una
+copia propia del chart_data.
+"""
+import datetime
+import logging
+import math
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import Session, select
+
+from app.core.cells import location_cell
+from app.db.models import TimeseriesPoint, UserAnalysis
+
+logger = logging.getLogger(__name__)
+
+# Ventana que calcula process_timeseries (y que se reconstruye para el historial).
+TIMESERIES_WINDOW_DAYS = 60
+
+INDEX_FIELDS = ('ndvi', 'ndwi', 'ndmi', 'clouds')
+
+
+def _point_to_dict(point: TimeseriesPoint) -> dict:
+    """Mismo formato de punto que devuelve process_timeseries al frontend."""
+    return {
+        'date': point.acquisition_date.isoformat(),
+        'ndvi': point.ndvi,
+        'ndwi': point.ndwi,
+        'ndmi': point.ndmi,
+        'clouds': point.clouds,
+    }
+
+
+def load_timeseries_points(
+    session: Session,
+    cell: str,
+    radius: int,
+    since: datetime.date,
+    logic_version: str,
+    until: Optional[datetime.date] = None,
+) -> List[dict]:
+    """
+    Puntos guardados de una celda+radio desde `since` (inclusive) calculados con
+    `logic_version`, ordenados por fecha.
+    """
+    query = (
+        select(TimeseriesPoint)
+        .where(TimeseriesPoint.cell == cell)
+        .where(TimeseriesPoint.radius == radius)
+        .where(TimeseriesPoint.logic_version == logic_version)
+        .where(TimeseriesPoint.acquisition_date >= since)
+    )
+    if until is not None:
+        query = query.where(TimeseriesPoint.acquisition_date <= until)
+    rows = session.exec(query.order_by(TimeseriesPoint.acquisition_date)).all()
+    return [_point_to_dict(r) for r in rows]
+
+
+def load_points_on_dates(session: Session, keys: Iterable[tuple], logic_version: str) -> Dict[tuple, dict]:
+    """
+    Puntos guardados para varios (celda, radio, fecha de pasada) con una sola consulta.
+    Devuelve {(cell, radius, date): punto}; las combinaciones sin punto no aparecen.
+    """
+    keys = list(set(keys))
+    if not keys:
+        return {}
+    rows = session.exec(
+        select(TimeseriesPoint)
+        .where(tuple_(TimeseriesPoint.cell, TimeseriesPoint.radius, TimeseriesPoint.acquisition_date).in_(keys))
+        .where(TimeseriesPoint.logic_version == logic_version)
+    ).all()
+    return {(r.cell, r.radius, r.acquisition_date): _point_to_dict(r) for r in rows}
+
+
+def upsert_timeseries_points(
+    session: Session, cell: str, radius: int, chart_data: Iterable[dict], logic_version: str
+) -> int:
+    """
+    Inserta (o actualiza, si la fecha ya existía para esta versión de lógica) los puntos de
+    `chart_data` para la celda. Los puntos de otras versiones no se tocan.
+    No hace commit: el llamador decide el límite de la transacción.
+    """
+    values = [
+        {
+            'cell': cell,
+            'radius': radius,
+            'acquisition_date': datetime.date.fromisoformat(p['date']),
+            'ndvi': p.get('ndvi'),
+            'ndwi': p.get('ndwi'),
+            'ndmi': p.get('ndmi'),
+            'clouds': p.get('clouds'),
+            'logic_version': logic_version,
+        }
+        for p in chart_data
+        if p.get('date')
+    ]
+    if not values:
+        return 0
+
+    stmt = pg_insert(TimeseriesPoint.__table__).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['cell', 'radius', 'logic_version', 'acquisition_date'],
+        set_={
+            'ndvi': stmt.excluded.ndvi,
+            'ndwi': stmt.excluded.ndwi,
+            'ndmi': stmt.excluded.ndmi,
+            'clouds': stmt.excluded.clouds,
+        },
+    )
+    session.execute(stmt)
+    return len(values)
+
+
+def merge_chart_data(stored: List[dict], fresh: List[dict]) -> List[dict]:
+    """Une puntos guardados y recién calculados (los frescos ganan) ordenados por fecha."""
+    by_date = {p['date']: p for p in stored}
+    by_date.update({p['date']: p for p in fresh})
+    return [by_date[d] for d in sorted(by_date)]
+
+
+def _history_window(row: UserAnalysis) -> tuple:
+    end = row.created_at.date() + datetime.timedelta(days=1)
+    return end - datetime.timedelta(days=TIMESERIES_WINDOW_DAYS), end
+
+
+def _same_point(stored: dict, shown: dict) -> bool:
+    """True si el punto mostrado tiene los mismos valores que el guardado."""
+    for field in INDEX_FIELDS:
+        a, b = stored.get(field), shown.get(field)
+        if a is None or b is None:
+            if a is not b:
+                return False
+        elif not math.isclose(a, b, abs_tol=1e-6):
+            return False
+    return True
+
+
+def store_covers_chart_data(session: Session, row: UserAnalysis, chart_data: List[dict], logic_version: str) -> bool:
+    """
+    True si cada punto de `chart_data` ya está, con los mismos valores, en la tabla
+    compartida para la celda+radio del análisis y `logic_version`, es decir, si el historial
+    puede referenciarla en vez de copiar los puntos.
+    """
+    if not chart_data:
+        return False
+    since, until = _history_window(row)
+    stored = load_timeseries_points(
+        session, location_cell(row.lat, row.lng), row.radius, since, logic_version, until
+    )
+    by_date = {p['date']: p for p in stored}
+    return all(p.get('date') in by_date and _same_point(by_date[p['date']], p) for p in chart_data)
+
+
+def load_history_chart_data(session: Session, rows: List[UserAnalysis]) -> Dict[int, List[dict]]:
+    """
+    Reconstruye el chart_data de las filas de historial que referencian la tabla compartida,
+    con una sola consulta para todas ellas. Devuelve {row.id: chart_data}.
+    """
+    referencing = [r for r in rows if r.chart_data is None and r.timeseries_cell]
+    if not referencing:
+        return {}
+
+    keys = {(r.timeseries_cell, r.timeseries_radius, r.timeseries_logic_version) for r in referencing}
+    since = min(_history_window(r)[0] for r in referencing)
+    points = session.exec(
+        select(TimeseriesPoint)
+        .where(tuple_(TimeseriesPoint.cell, TimeseriesPoint.radius, TimeseriesPoint.logic_version).in_(list(keys)))
+        .where(TimeseriesPoint.acquisition_date >= since)
+        .order_by(TimeseriesPoint.acquisition_date)
+    ).all()
+
+    grouped: Dict[tuple, List[TimeseriesPoint]] = {}
+    for p in points:
+        grouped.setdefault((p.cell, p.radius, p.logic_version), []).append(p)
+
+    chart_by_row = {}
+    for r in referencing:
+        start, end = _history_window(r)
+        chart_by_row[r.id] = [
+            _point_to_dict(p)
+            for p in grouped.get((r.timeseries_cell, r.timeseries_radius, r.timeseries_logic_version), [])
+            if start <= p.acquisition_date <= end
+        ]
+    return chart_by_row
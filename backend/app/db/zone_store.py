@@ -0,0 +1,105 @@
+"""
+Zonas compartidas de alertas (tabla alert_zones).
+
+Muchos usuarios ponen alertas sobre el mismo predio, pueblo o cuenca con radios parecidos
+y cada una se evaluaba por separado en GEE. Al crear una alerta se la asigna a la zona
+existente con el mismo radio cuyo centro está a menos de ALERT_ZONE_MAX_SHIFT × radio, o
+a una zona nueva centrada en ella; al borrarla se libera
+y una zona sin alertas se elimina. check_alert_shard (tasks_periodic.py) reduce una sola
+vez cada zona y reparte el valor entre sus alertas: el costo en GEE crece con los lugares
+distintos, no con los suscriptores.
+"""
+import logging
+import math
+from typing import Optional
+
+from geoalchemy2.elements import WKTElement
+from sqlalchemy import delete, update
+from sqlmodel import Session, select, func
+
+from app.core.config import settings
+from app.db.models import AlertZone, UserAlert
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6_371_000
+METERS_PER_DEGREE = 111_320
+
+# Zonas candidatas revisadas (las más cercanas) al asignar una alerta.
+ZONE_CANDIDATES = 5
+
+
+def _point(lat: float, lng: float) -> WKTElement:
+    return WKTElement(f"POINT({lng} {lat})", srid=4326)
+
+
+def distance_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Distancia de gran círculo (haversine) en metros."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def find_alert_zone(session: Session, lat: float, lng: float, radius: int) -> Optional[AlertZone]:
+    """Zona existente que coincide con el punto y el radio (ver docstring del módulo), si hay."""
+    max_shift_m = settings.ALERT_ZONE_MAX_SHIFT * radius
+    # Prefiltro en grados sobre el índice GIST (holgado en longitud); la distancia real se
+    # verifica después en metros.
+    tolerance_deg = max_shift_m / (METERS_PER_DEGREE * max(0.01, math.cos(math.radians(lat))))
+    point = _point(lat, lng)
+    candidates = session.exec(
+        select(AlertZone)
+        .where(AlertZone.radius == radius)
+        .where(func.ST_DWithin(AlertZone.coordinates, point, tolerance_deg))
+        .order_by(AlertZone.coordinates.distance_centroid(point))
+        .limit(ZONE_CANDIDATES)
+    ).all()
+    for zone in candidates:
+        if distance_m(lat, lng, zone.lat, zone.lng) <= max_shift_m:
+            return zone
+    return None
+
+
+def assign_alert_zone(session: Session, lat: float, lng: float, radius: int) -> int:
+    """
+    Suma una alerta a su zona (la crea si no existe) y devuelve el id de la zona. No hace
+    commit: va en la transacción que crea la alerta.
+    """
+    zone = find_alert_zone(session, lat, lng, radius)
+    if zone is not None:
+        session.execute(
+            update(AlertZone).where(AlertZone.id == zone.id).values(member_count=AlertZone.member_count + 1)
+        )
+        return zone.id
+    zone = AlertZone(lat=lat, lng=lng, radius=radius, coordinates=_point(lat, lng), member_count=1)
+    session.add(zone)
+    session.flush()
+    return zone.id
+
+
+def release_alert_zone(session: Session, zone_id: Optional[int]) -> None:
+    """Resta una alerta de su zona y elimina la zona si queda vacía. No hace commit."""
+    if zone_id is None:
+        return
+    session.execute(
+        update(AlertZone).where(AlertZone.id == zone_id).values(member_count=AlertZone.member_count - 1)
+    )
+    session.execute(delete(AlertZone).where(AlertZone.id == zone_id, AlertZone.member_count <= 0))
+
+
+def backfill_alert_zones(session: Session) -> int:
+    """Asigna zona a las alertas creadas antes de que existieran las zonas. No hace commit."""
+    alerts = session.exec(
+        select(UserAlert.id, UserAlert.lat, UserAlert.lng, UserAlert.radius)
+        .where(UserAlert.zone_id.is_(None))
+        .order_by(UserAlert.id)
+    ).all()
+    for alert in alerts:
+        zone_id = assign_alert_zone(session, alert.lat, alert.lng, alert.radius)
+        session.execute(update(UserAlert).where(UserAlert.id == alert.id).values(zone_id=zone_id))
+    if alerts:
+        logger.info(f"{len(alerts)} alertas asignadas a zonas compartidas.")
+    return len(alerts)
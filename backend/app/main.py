@@ -7,7 +7,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from sqlmodel import Session
 
 from app.core.config import settings
-from app.core.gee import init_gee
+from app.core.gee import gee_session
 from app.db.session import init_db, get_session
 from app.db.models import PageVisit
 from app.core.security import verify_rate_limit, visit_limiter, hash_ip, get_client_ip
@@ -46,8 +46,8 @@ async def lifespan(app: FastAPI):
     if not db_ok:
         logger.error("No se pudo conectar o inicializar la base de datos.")
         
-    # 2. Inicializar Google Earth Engine
-    gee_ok = init_gee()
+    # 2. Inicializar Google Earth Engine (una vez por proceso, con renovación de token)
+    gee_ok = gee_session.initialize()
     if not gee_ok:
         logger.error("No se pudo inicializar Google Earth Engine.")
         
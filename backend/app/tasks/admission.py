@@ -0,0 +1,132 @@
+"""
+Control de admisión de POST /analyze.
+
+Bajo carga, trigger_analysis encolaba todo y el usuario solo veía "queued" por minutos.
+Antes de encolar se estima la espera con la profundidad de la cola destino
+(queue_depths en celery_app.py) y la duración típica reciente de las tareas de esa cola,
+que cada tarea registra al terminar (record_task_duration, desde timings['total_s']):
+
+    eta ≈ (posición / slots de la cola + 1) × mediana de duración
+
+Según la espera estimada:
+
+* ADMIT: se encola y la respuesta trae posición, ETA y cada cuánto sondear (poll_after_s,
+  también como Retry-After).
+* DEGRADE (eta > ADMISSION_DEGRADE_ETA_S): se sirve el último análisis de la zona aunque
+  esté vencido o, si no hay, se encola en modo vista previa (sin capa de mapa).
+* REJECT (eta > ADMISSION_REJECT_ETA_S): 503 con Retry-After, salvo que haya un resultado
+  vencido que servir. Así la cola no crece sin límite y la API sigue respondiendo.
+
+Sin broker o sin Redis la admisión no bloquea nada (fail-open).
+"""
+import logging
+import statistics
+import threading
+import time
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.core.security import redis_client
+from app.tasks.celery_app import queue_depths
+
+logger = logging.getLogger(__name__)
+
+ADMIT = "admit"
+DEGRADE = "degrade"
+REJECT = "reject"
+
+DURATIONS_KEY_PREFIX = "admission:durations:"
+DURATION_SAMPLES = 200
+# Duración supuesta mientras una cola no tiene historial.
+DEFAULT_TASK_SECONDS = 20.0
+
+# La profundidad de las colas se lee del broker como mucho una vez por este intervalo por
+# proceso: una ráfaga de POST /analyze no debe convertirse en una ráfaga al broker.
+DEPTH_CACHE_SECONDS = 2.0
+
+MIN_POLL_SECONDS = 2
+MAX_POLL_SECONDS = 30
+MAX_RETRY_AFTER_SECONDS = 300
+
+_depth_lock = threading.Lock()
+_depth_cache: Dict[str, object] = {"at": 0.0, "depths": {}}
+
+
+def record_task_duration(queue: str, seconds: float) -> None:
+    """Registra la duración de una tarea terminada en la ventana móvil de su cola (best-effort)."""
+    if not redis_client or not queue:
+        return
+    try:
+        key = f"{DURATIONS_KEY_PREFIX}{queue}"
+        pipe = redis_client.pipeline()
+        pipe.lpush(key, round(seconds, 2))
+        pipe.ltrim(key, 0, DURATION_SAMPLES - 1)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Error registrando duración de tarea ({queue}): {e}")
+
+
+def typical_duration(queue: str) -> float:
+    """Mediana de las duraciones recientes de la cola (DEFAULT_TASK_SECONDS sin historial)."""
+    if not redis_client:
+        return DEFAULT_TASK_SECONDS
+    try:
+        samples = [float(v) for v in redis_client.lrange(f"{DURATIONS_KEY_PREFIX}{queue}", 0, -1)]
+    except Exception as e:
+        logger.warning(f"Error leyendo duraciones de la cola {queue}: {e}")
+        return DEFAULT_TASK_SECONDS
+    return statistics.median(samples) if samples else DEFAULT_TASK_SECONDS
+
+
+def queue_depth(queue: str) -> Optional[int]:
+    """Profundidad de la cola (cacheada DEPTH_CACHE_SECONDS); None si el broker no respondió."""
+    with _depth_lock:
+        if time.monotonic() - _depth_cache["at"] > DEPTH_CACHE_SECONDS:
+            _depth_cache["depths"] = queue_depths()
+            _depth_cache["at"] = time.monotonic()
+        return _depth_cache["depths"].get(queue)
+
+
+def poll_interval(eta_seconds: float) -> int:
+    """
+    Intervalo de sondeo sugerido: unas cinco consultas durante la espera estimada, sin
+    pasar de la mitad del período de gracia (un cliente que sondea menos se da por ido,
+    ver cancellation.py).
+    """
+    ceiling = min(MAX_POLL_SECONDS, max(MIN_POLL_SECONDS, settings.TASK_ABANDON_GRACE_S // 2))
+    return int(min(ceiling, max(MIN_POLL_SECONDS, round(eta_seconds / 5))))
+
+
+def assess_admission(queue: str) -> dict:
+    """
+    Decide si una tarea nueva para `queue` se admite, se degrada o se rechaza, con la
+    posición y la espera estimadas que se devuelven al cliente.
+    """
+    depth = queue_depth(queue)
+    if depth is None:
+        return {
+            "decision": ADMIT, "queue": queue, "position": None, "eta_s": None,
+            "poll_after_s": MIN_POLL_SECONDS, "retry_after_s": MIN_POLL_SECONDS,
+        }
+
+    slots = max(1, settings.admission_queue_slots.get(queue, 1))
+    duration = typical_duration(queue)
+    position = depth + 1
+    eta = (depth // slots + 1) * duration
+
+    decision = ADMIT
+    if eta > settings.ADMISSION_REJECT_ETA_S:
+        decision = REJECT
+    elif eta > settings.ADMISSION_DEGRADE_ETA_S:
+        decision = DEGRADE
+    return {
+        "decision": decision,
+        "queue": queue,
+        "position": position,
+        "eta_s": int(round(eta)),
+        "poll_after_s": poll_interval(eta),
+        # Rechazo: reintentar cuando la cola haya bajado del umbral de rechazo.
+        "retry_after_s": int(min(MAX_RETRY_AFTER_SECONDS, max(
+            MIN_POLL_SECONDS, round(eta - settings.ADMISSION_REJECT_ETA_S + duration)
+        ))),
+    }
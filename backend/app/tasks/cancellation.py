@@ -0,0 +1,270 @@
+"""
+Cancelación cooperativa y detección de tareas abandonadas.
+
+Cuando un usuario cierra la pestaña o lanza otro análisis, sus tareas encoladas
+(process_gee_analysis, process_timeseries) seguían corriendo y gastando cuota GEE. Aquí
+se lleva, en Redis, quién sigue esperando cada tarea:
+
+* Al encolar, POST /analyze registra las tareas de la solicitud (análisis + serie
+  temporal) en un mismo grupo, con un latido que vence a los TASK_ABANDON_GRACE_S. El id
+  del grupo vuelve al cliente como wait_id: es el comprobante de esa solicitud.
+* Cada sondeo a GET /analyze/status con su wait_id renueva el latido de ese grupo.
+* Cada tarea y cada clave de cache tienen un conjunto de grupos que esperan su resultado:
+  una segunda solicitud idéntica se engancha a la tarea en curso (inflight_task_for) con
+  su propio grupo en vez de encolar otra.
+* DELETE /analyze/{task_id} con el wait_id suelta solo ese grupo; si nadie más espera la
+  tarea, la marca como cancelada y la revoca (si aún no empezó). Sin un wait_id que espere
+  la tarea no se cancela nada: el mismo task_id se comparte entre usuarios.
+
+Las tareas llaman a raise_if_cancelled() entre etapas de GEE: se detienen si fueron
+canceladas o si ningún grupo que espera su cache tiene el latido vigente. Las tareas sin
+registro (precalentamiento, alertas) nunca se consideran abandonadas. Sin Redis, o si
+Redis falla, todo queda como antes (fail-open: la tarea sigue).
+"""
+import json
+import logging
+import uuid
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.core.security import redis_client
+
+logger = logging.getLogger(__name__)
+
+CANCEL_KEY_PREFIX = "task:cancel:"      # task_id -> marca de cancelación explícita
+WATCH_KEY_PREFIX = "task:watch:"        # task_id -> {"group", "cache_key"}
+GROUPS_KEY_PREFIX = "task:groups:"      # task_id -> grupos (wait_id) que esperan la tarea
+ATTACHED_KEY_PREFIX = "task:attached:"  # task_id:grupo -> análisis a guardar en el historial
+ALIVE_KEY_PREFIX = "task:alive:"        # grupo -> latido (vence tras el período de gracia)
+WAITERS_KEY_PREFIX = "task:waiters:"    # clave de cache -> grupos que esperan su resultado
+INFLIGHT_KEY_PREFIX = "task:inflight:"  # clave de cache -> task_id que la está calculando
+
+# Vigencia de los registros: más que el límite duro de una tarea más su espera en cola.
+WATCH_TTL_SECONDS = 60 * 60
+CANCEL_TTL_SECONDS = 60 * 60
+# La marca de "tarea en curso" vence antes: si el worker murió a mitad de la tarea, las
+# solicitudes nuevas no deben quedar enganchadas a ella más que el límite duro de Celery.
+INFLIGHT_TTL_SECONDS = 10 * 60
+
+CANCELLED = "cancelled"
+DETACHED = "detached"
+
+
+class TaskCancelled(Exception):
+    """La tarea fue cancelada o nadie espera ya su resultado."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def watch_tasks(tasks: Dict[str, Optional[str]], group: Optional[str] = None) -> Optional[str]:
+    """
+    Registra las tareas de una solicitud ({task_id: cache_key}) en un mismo grupo con
+    latido vigente (`group` para sumar tareas a uno ya creado). Devuelve el id del grupo
+    (None si no hay Redis).
+    """
+    if not redis_client or not tasks:
+        return None
+    group = group or uuid.uuid4().hex
+    try:
+        pipe = redis_client.pipeline()
+        pipe.set(f"{ALIVE_KEY_PREFIX}{group}", 1, ex=settings.TASK_ABANDON_GRACE_S)
+        for task_id, cache_key in tasks.items():
+            pipe.set(
+                f"{WATCH_KEY_PREFIX}{task_id}",
+                json.dumps({"group": group, "cache_key": cache_key}),
+                ex=WATCH_TTL_SECONDS,
+            )
+            pipe.sadd(f"{GROUPS_KEY_PREFIX}{task_id}", group)
+            pipe.expire(f"{GROUPS_KEY_PREFIX}{task_id}", WATCH_TTL_SECONDS)
+            if cache_key:
+                pipe.sadd(f"{WAITERS_KEY_PREFIX}{cache_key}", group)
+                pipe.expire(f"{WAITERS_KEY_PREFIX}{cache_key}", WATCH_TTL_SECONDS)
+                pipe.set(f"{INFLIGHT_KEY_PREFIX}{cache_key}", task_id, ex=INFLIGHT_TTL_SECONDS, nx=True)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Error registrando tareas en espera: {e}")
+        return None
+    return group
+
+
+def attach_to_task(task_id: str, cache_key: str, group: Optional[str] = None) -> Optional[str]:
+    """
+    Suma el grupo de otra solicitud (`group`, p.ej. el de su serie temporal, o uno nuevo)
+    a los que esperan la tarea en curso de `cache_key`. Devuelve el id del grupo.
+    """
+    if not redis_client:
+        return None
+    group = group or uuid.uuid4().hex
+    try:
+        pipe = redis_client.pipeline()
+        pipe.set(f"{ALIVE_KEY_PREFIX}{group}", 1, ex=settings.TASK_ABANDON_GRACE_S)
+        pipe.sadd(f"{WAITERS_KEY_PREFIX}{cache_key}", group)
+        pipe.expire(f"{WAITERS_KEY_PREFIX}{cache_key}", WATCH_TTL_SECONDS)
+        pipe.sadd(f"{GROUPS_KEY_PREFIX}{task_id}", group)
+        pipe.expire(f"{GROUPS_KEY_PREFIX}{task_id}", WATCH_TTL_SECONDS)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Error enganchando solicitud a la tarea {task_id}: {e}")
+        return None
+    return group
+
+
+def inflight_task_for(cache_key: str) -> Optional[str]:
+    """Tarea registrada que está calculando `cache_key` (None si no hay o fue cancelada)."""
+    if not redis_client or not cache_key:
+        return None
+    try:
+        task_id = redis_client.get(f"{INFLIGHT_KEY_PREFIX}{cache_key}")
+        if not task_id:
+            return None
+        task_id = task_id.decode() if isinstance(task_id, bytes) else task_id
+        if redis_client.exists(f"{CANCEL_KEY_PREFIX}{task_id}"):
+            return None
+        return task_id
+    except Exception as e:
+        logger.warning(f"Error leyendo tarea en curso ({cache_key}): {e}")
+        return None
+
+
+def clear_inflight(cache_key: str, task_id: str) -> None:
+    """La tarea terminó: las próximas solicitudes leen la cache en vez de engancharse."""
+    if not redis_client or not cache_key:
+        return
+    try:
+        key = f"{INFLIGHT_KEY_PREFIX}{cache_key}"
+        current = redis_client.get(key)
+        if current and (current.decode() if isinstance(current, bytes) else current) == task_id:
+            redis_client.delete(key)
+    except Exception as e:
+        logger.warning(f"Error limpiando tarea en curso ({cache_key}): {e}")
+
+
+def _watch(task_id: str) -> Optional[dict]:
+    raw = redis_client.get(f"{WATCH_KEY_PREFIX}{task_id}")
+    return json.loads(raw) if raw else None
+
+
+def _is_waiting(task_id: str, group: Optional[str]) -> bool:
+    return bool(group) and bool(redis_client.sismember(f"{GROUPS_KEY_PREFIX}{task_id}", group))
+
+
+def note_task_polled(task_id: str, group: Optional[str]) -> None:
+    """Renueva el latido del grupo `group` (wait_id) si espera la tarea sondeada (GET /analyze/status)."""
+    if not redis_client or not group:
+        return
+    try:
+        if _is_waiting(task_id, group):
+            redis_client.set(f"{ALIVE_KEY_PREFIX}{group}", 1, ex=settings.TASK_ABANDON_GRACE_S)
+    except Exception as e:
+        logger.warning(f"Error renovando latido de la tarea {task_id}: {e}")
+
+
+def remember_attached_request(task_id: str, group: Optional[str], request: dict) -> None:
+    """
+    Guarda los datos de una solicitud enganchada de un usuario logeado (user_id, lat, lng,
+    radius, approach, location_name): el worker solo guarda el historial de quien encoló la
+    tarea, así que el de esta solicitud se guarda cuando su cliente lee el resultado.
+    """
+    if not redis_client or not group:
+        return
+    try:
+        redis_client.set(f"{ATTACHED_KEY_PREFIX}{task_id}:{group}", json.dumps(request), ex=WATCH_TTL_SECONDS)
+    except Exception as e:
+        logger.warning(f"Error registrando solicitud enganchada a la tarea {task_id}: {e}")
+
+
+def pop_attached_request(task_id: str, group: Optional[str]) -> Optional[dict]:
+    """Datos guardados por remember_attached_request (una sola vez: la lectura los borra)."""
+    if not redis_client or not group:
+        return None
+    try:
+        key = f"{ATTACHED_KEY_PREFIX}{task_id}:{group}"
+        pipe = redis_client.pipeline()
+        pipe.get(key)
+        pipe.delete(key)
+        raw, _ = pipe.execute()
+        return json.loads(raw) if raw else None
+    except Exception as e:
+        logger.warning(f"Error leyendo solicitud enganchada a la tarea {task_id}: {e}")
+        return None
+
+
+def _live_groups(key: str) -> int:
+    groups = [g.decode() if isinstance(g, bytes) else g for g in redis_client.smembers(key)]
+    if not groups:
+        return 0
+    alive = redis_client.mget([f"{ALIVE_KEY_PREFIX}{g}" for g in groups])
+    return sum(1 for a in alive if a)
+
+
+def _live_waiters(cache_key: str) -> int:
+    return _live_groups(f"{WAITERS_KEY_PREFIX}{cache_key}")
+
+
+def request_cancel(task_id: str, group: Optional[str]) -> Optional[str]:
+    """
+    Cancela la tarea para la solicitud del grupo `group` (wait_id de DELETE
+    /analyze/{task_id}). Si otra solicitud sigue esperando la tarea o su clave de cache,
+    la tarea sigue y solo se suelta ese grupo (DETACHED); si no, queda marcada como
+    cancelada (CANCELLED). Devuelve None si el grupo no espera la tarea (o no hay Redis
+    para comprobarlo): nadie puede cancelar la solicitud de otro.
+    """
+    if not redis_client:
+        return None
+    try:
+        if not _is_waiting(task_id, group):
+            return None
+        watch = _watch(task_id) or {}
+        cache_key = watch.get("cache_key")
+        redis_client.delete(f"{ALIVE_KEY_PREFIX}{group}")
+        redis_client.delete(f"{ATTACHED_KEY_PREFIX}{task_id}:{group}")
+        redis_client.srem(f"{GROUPS_KEY_PREFIX}{task_id}", group)
+        if cache_key:
+            redis_client.srem(f"{WAITERS_KEY_PREFIX}{cache_key}", group)
+        if _live_groups(f"{GROUPS_KEY_PREFIX}{task_id}") or (cache_key and _live_waiters(cache_key)):
+            return DETACHED
+        if cache_key:
+            clear_inflight(cache_key, task_id)
+        redis_client.set(f"{CANCEL_KEY_PREFIX}{task_id}", 1, ex=CANCEL_TTL_SECONDS)
+    except Exception as e:
+        logger.warning(f"Error registrando cancelación de la tarea {task_id}: {e}")
+        return None
+    return CANCELLED
+
+
+def is_cancel_requested(task_id: str) -> bool:
+    if not redis_client or not task_id:
+        return False
+    try:
+        return bool(redis_client.exists(f"{CANCEL_KEY_PREFIX}{task_id}"))
+    except Exception as e:
+        logger.warning(f"Error leyendo cancelación de la tarea {task_id}: {e}")
+        return False
+
+
+def is_abandoned(task_id: str) -> bool:
+    """True si la tarea está registrada y ningún grupo que espera su resultado sigue vivo."""
+    if not redis_client or not task_id:
+        return False
+    try:
+        watch = _watch(task_id)
+        if not watch:
+            return False
+        if redis_client.exists(f"{ALIVE_KEY_PREFIX}{watch['group']}"):
+            return False
+        if _live_groups(f"{GROUPS_KEY_PREFIX}{task_id}"):
+            return False
+        return not (watch.get("cache_key") and _live_waiters(watch["cache_key"]))
+    except Exception as e:
+        logger.warning(f"Error evaluando abandono de la tarea {task_id}: {e}")
+        return False
+
+
+def raise_if_cancelled(task_id: str) -> None:
+    """Punto de control entre etapas de GEE: lanza TaskCancelled si la tarea ya no sirve."""
+    if is_cancel_requested(task_id):
+        raise TaskCancelled(CANCELLED)
+    if is_abandoned(task_id):
+        raise TaskCancelled("abandoned")
@@ -1,7 +1,13 @@
 import os
+import logging
+from typing import Dict, Optional
+
 from celery import Celery
+from kombu import Exchange, Queue
 from app.core.config import settings
 
+logger = logging.getLogger(__name__)
+
 # Obtener URL de Redis de la configuración.
 # Para evitar colisiones en Redis, podemos añadir /1 para usar la DB 1 de Redis para Celery.
 redis_url = settings.REDIS_URL or "redis://localhost:6379/0"
@@ -15,12 +21,46 @@ if settings.REDIS_URL and not redis_url.endswith("/0") and not redis_url.endswit
     else:
         redis_url = f"{redis_url}/1"
 
+# Colas por clase de trabajo. Un análisis interactivo (un usuario mirando el spinner) no
+# debe quedar detrás de la revisión de alertas ni de una ráfaga de series temporales:
+# cada cola se consume con su propio worker y su propia concurrencia (WORKER_QUEUES /
+# WORKER_CONCURRENCY en el Dockerfile). Un worker sin -Q consume todas, como antes.
+QUEUE_INTERACTIVE = "interactive"
+QUEUE_HEAVY = "heavy"                        # Análisis de radio grande (reduceRegion costoso)
+QUEUE_TIMESERIES = "premium-timeseries"
+QUEUE_BATCH = "batch"                        # Precalentamiento de cache y tareas sin ruta
+QUEUE_PERIODIC = "periodic"                  # Tareas de Celery Beat
+QUEUE_NOTIFICATIONS = "notifications"        # Envío de correos (espera HTTP, no GEE)
+TASK_QUEUES = (QUEUE_INTERACTIVE, QUEUE_HEAVY, QUEUE_TIMESERIES, QUEUE_BATCH, QUEUE_PERIODIC, QUEUE_NOTIFICATIONS)
+
+
+def route_task(name, args, kwargs, options, task=None, **kw) -> Optional[Dict[str, str]]:
+    """
+    Router de Celery (task_routes): decide la cola según la tarea y sus argumentos, para
+    separar lo que un usuario espera en pantalla de lo que corre en segundo plano.
+    """
+    kwargs = kwargs or {}
+    if name == "app.tasks.worker.process_gee_analysis":
+        if kwargs.get("prewarm"):
+            return {"queue": QUEUE_BATCH}
+        if (kwargs.get("radius") or 0) >= settings.CELERY_HEAVY_RADIUS_M:
+            return {"queue": QUEUE_HEAVY}
+        return {"queue": QUEUE_INTERACTIVE}
+    if name == "app.tasks.worker.process_timeseries":
+        return {"queue": QUEUE_TIMESERIES}
+    if name.startswith("app.tasks.tasks_periodic."):
+        return {"queue": QUEUE_PERIODIC}
+    if name.startswith("app.tasks.tasks_notifications."):
+        return {"queue": QUEUE_NOTIFICATIONS}
+    return None
+
+
 # Inicializar Celery
 celery_app = Celery(
     "geofeedback_tasks",
     broker=redis_url,
     backend=redis_url,
-    include=["app.tasks.worker", "app.tasks.tasks_periodic"]  # Importar módulos para registrar las tareas
+    include=["app.tasks.worker", "app.tasks.tasks_periodic", "app.tasks.tasks_notifications"]  # Importar módulos para registrar las tareas
 )
 
 # Configuraciones adicionales
@@ -33,10 +73,53 @@ celery_app.conf.update(
     task_track_started=True,          # Permite al frontend saber si la tarea inició
     task_time_limit=300,             # Límite de tiempo estricto: 5 minutos
     task_soft_time_limit=240,        # Límite suave: 4 minutos (emite excepción)
+    task_queues=[Queue(name, Exchange(name), routing_key=name) for name in TASK_QUEUES],
+    task_default_queue=QUEUE_BATCH,
+    task_routes=(route_task,),
+    result_expires=settings.CELERY_RESULT_EXPIRES_S,  # Solo estado + puntero a la cache (results.py)
+    worker_prefetch_multiplier=1,    # Tareas largas: no reservar trabajo que otro worker libre podría tomar
     beat_schedule={
-        "check-active-alerts-daily": {
+        "check-due-alerts": {
             "task": "app.tasks.tasks_periodic.check_active_alerts",
-            "schedule": 86400.0,       # Ejecutar una vez al día (en segundos)
+            # Tick frecuente: solo encola las alertas vencidas (next_due_at), repartidas en el día
+            "schedule": float(settings.ALERT_TICK_SECONDS),
+        },
+        "drain-notification-outbox": {
+            "task": "app.tasks.tasks_notifications.drain_notification_outbox",
+            # Correos encolados por la revisión de alertas (y reintentos vencidos)
+            "schedule": float(settings.NOTIFICATION_DRAIN_SECONDS),
+        },
+        "prewarm-analysis-cache-hourly": {
+            "task": "app.tasks.tasks_periodic.prewarm_analysis_cache",
+            "schedule": 3600.0,        # Cada hora; la tarea solo trabaja en horas valle
+        },
+        "flush-api-usage-buffer": {
+            "task": "app.tasks.tasks_periodic.flush_api_usage_buffer",
+            # Cache-hits de /analyze acumulados en Redis hacia api_usage_logs
+            "schedule": float(settings.USAGE_FLUSH_SECONDS),
+        },
+        "prune-analysis-results-daily": {
+            "task": "app.tasks.tasks_periodic.prune_analysis_results",
+            "schedule": 24 * 3600.0,   # Vencidos más allá de ANALYSIS_RESULT_RETENTION_DAYS
         }
     }
 )
+
+
+def queue_depths() -> Dict[str, Optional[int]]:
+    """Mensajes en espera por cola en el broker (None si no se pudo leer esa cola)."""
+    depths: Dict[str, Optional[int]] = {}
+    try:
+        with celery_app.connection_for_read() as conn:
+            conn.ensure_connection(max_retries=1, interval_start=0, interval_step=0)
+            channel = conn.default_channel
+            for name in TASK_QUEUES:
+                try:
+                    depths[name] = channel.queue_declare(queue=name, passive=True).message_count
+                except Exception as e:
+                    logger.warning(f"Error leyendo profundidad de la cola {name}: {e}")
+                    depths[name] = None
+    except Exception as e:
+        logger.warning(f"Broker de Celery no disponible para medir colas: {e}")
+        return {name: None for name in TASK_QUEUES}
+    return depths
@@ -0,0 +1,56 @@
+"""
+Presupuesto de tiempo por tarea de Celery.
+
+Las tareas tienen un límite suave (task_soft_time_limit en celery_app.py) y cada espera a
+GEE tenía su propio timeout fijo, sin saber cuánto tiempo le quedaba a la tarea. Un
+TaskDeadline se crea al inicio de la tarea y se pasa a resolve_with_timeout /
+get_info_with_timeout: cada espera toma el mínimo entre su tope y lo que queda, y los
+pasos opcionales (fecha de la imagen, capa de mapa) se omiten si el presupuesto no alcanza.
+
+Siempre se reserva un margen final para las escrituras (Redis, PostGIS): una tarea que se
+queda sin tiempo devuelve lo mejor que tiene en vez de morir a mitad de un commit.
+"""
+import time
+from typing import Optional
+
+from app.tasks.celery_app import celery_app
+
+# Margen que se descuenta del límite suave para guardar el resultado (cache, durable,
+# historial) después de la última espera a GEE.
+WRITE_RESERVE_SECONDS = 20.0
+
+
+class TaskDeadline:
+    """Plazo absoluto (reloj monotónico) de una tarea, descontado el margen de escritura."""
+
+    def __init__(self, budget_seconds: float, reserve_seconds: float = WRITE_RESERVE_SECONDS):
+        self.budget_seconds = budget_seconds
+        self.reserve_seconds = reserve_seconds
+        self._end = time.monotonic() + budget_seconds
+
+    @classmethod
+    def for_task(cls, task, reserve_seconds: float = WRITE_RESERVE_SECONDS) -> "TaskDeadline":
+        """Deadline a partir del límite suave de la tarea (override por llamada o global de Celery)."""
+        soft_limit: Optional[float] = None
+        timelimit = getattr(getattr(task, "request", None), "timelimit", None)
+        if timelimit and timelimit[1]:
+            soft_limit = timelimit[1]
+        if soft_limit is None:
+            soft_limit = getattr(task, "soft_time_limit", None) or celery_app.conf.task_soft_time_limit
+        return cls(float(soft_limit), reserve_seconds)
+
+    def remaining(self) -> float:
+        """Segundos disponibles para trabajo GEE (ya descontado el margen de escritura)."""
+        return self._end - self.reserve_seconds - time.monotonic()
+
+    def timeout(self, cap: float) -> float:
+        """Timeout para una espera: su tope `cap`, recortado a lo que queda (nunca negativo)."""
+        return max(0.0, min(cap, self.remaining()))
+
+    def allows(self, seconds: float) -> bool:
+        """True si todavía quedan al menos `seconds` para un paso más."""
+        return self.remaining() >= seconds
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
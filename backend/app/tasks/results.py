@@ -0,0 +1,51 @@
+"""
+Resultados compactos en el backend de resultados de Celery.
+
+process_gee_analysis y process_timeseries ya guardan su resultado completo en la cache de
+Redis (cache_analysis_result). Devolverlo además como valor de la tarea lo duplicaba en
+el backend de Celery, donde quedaba un día. Con CELERY_SLIM_RESULTS la tarea devuelve
+solo un registro de estado con un puntero a la entrada de cache, y GET /analyze/status
+resuelve el resultado desde ahí.
+
+Si la cache no estaba disponible al terminar la tarea, el resultado se devuelve completo
+como antes: el puntero solo se usa cuando la escritura en cache tuvo éxito.
+"""
+import json
+import logging
+from typing import Any, Optional
+
+from app.core.config import settings
+from app.core.security import redis_client
+
+logger = logging.getLogger(__name__)
+
+RESULT_REF_FIELD = "result_ref"
+
+
+def compact_task_result(cache_key: str, result: dict, cached: bool) -> dict:
+    """Valor a devolver por la tarea: puntero a la cache si se pudo escribir, o el resultado completo."""
+    if not settings.CELERY_SLIM_RESULTS or not cached or not cache_key:
+        return result
+    return {"status": result.get("status", "success"), RESULT_REF_FIELD: {"cache_key": cache_key}}
+
+
+def is_result_ref(value: Any) -> bool:
+    return isinstance(value, dict) and isinstance(value.get(RESULT_REF_FIELD), dict)
+
+
+def resolve_task_result(value: Any) -> Optional[Any]:
+    """
+    Resultado completo de una tarea a partir de su valor en el backend de Celery. Si es un
+    puntero, lo lee de la cache; devuelve None si la entrada ya venció o Redis falló.
+    """
+    if not is_result_ref(value):
+        return value
+    cache_key = value[RESULT_REF_FIELD].get("cache_key")
+    if not redis_client or not cache_key:
+        return None
+    try:
+        cached = redis_client.get(cache_key)
+    except Exception as e:
+        logger.warning(f"Error resolviendo resultado desde cache ({cache_key}): {e}")
+        return None
+    return json.loads(cached) if cached else None
@@ -0,0 +1,149 @@
+"""
+Drenaje de la bandeja de salida de correos (notification_outbox).
+
+La revisión de alertas enviaba cada correo con una solicitud HTTP síncrona (y un cliente
+nuevo) dentro del ciclo de evaluación: un proveedor lento frenaba las llamadas a GEE.
+Ahora check_alert_shard solo encola (app/db/outbox_store.py) y esta tarea, en su propia
+cola, despacha lo pendiente cada NOTIFICATION_DRAIN_SECONDS:
+
+* Un correo por destinatario: varias alertas disparadas del mismo usuario van en un
+  resumen (build_alert_email).
+* Los resúmenes se envían en lotes de RESEND_BATCH_LIMIT por solicitud, varias solicitudes
+  a la vez con un cliente asíncrono compartido (send_email_batches).
+* Cada solicitud lleva una Idempotency-Key (delivery_key) guardada con la reserva: si
+  falla, se reintenta la misma solicitud con la misma clave, con espera creciente, hasta
+  NOTIFICATION_MAX_ATTEMPTS intentos; el proveedor no duplica un envío que sí llegó.
+"""
+import datetime
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from sqlmodel import Session
+
+from app.tasks.celery_app import celery_app
+from app.db.session import engine
+from app.db.outbox_store import (
+    STATUS_FAILED, STATUS_PENDING, STATUS_SENT, STATUS_SKIPPED,
+    claim_notifications, delivery_key, write_delivery_results,
+)
+from app.core.config import settings
+from app.core.notifications import (
+    DELIVERY_RETRY, DELIVERY_SENT, RESEND_BATCH_LIMIT, build_alert_email, send_email_batches,
+)
+from app.core.security import log_event
+
+logger = logging.getLogger(__name__)
+
+# Espera máxima entre reintentos (las claves de idempotencia del proveedor duran 24 h).
+MAX_RETRY_DELAY_S = 60 * 60
+
+
+def _by_recipient(rows: List[dict]) -> Dict[str, List[dict]]:
+    recipients = defaultdict(list)
+    for row in rows:
+        recipients[row["to_email"]].append(row)
+    return recipients
+
+
+def plan_batches(rows: List[dict]) -> Dict[str, List[dict]]:
+    """
+    Agrupa correos nuevos en solicitudes: un resumen por destinatario y hasta
+    RESEND_BATCH_LIMIT destinatarios por solicitud. Devuelve {delivery_key: [fila]}.
+    """
+    digests = list(_by_recipient(rows).values())
+    batches = {}
+    for i in range(0, len(digests), RESEND_BATCH_LIMIT):
+        chunk = [row for digest in digests[i:i + RESEND_BATCH_LIMIT] for row in digest]
+        batches[delivery_key([row["id"] for row in chunk])] = chunk
+    return batches
+
+
+def batch_emails(rows: List[dict]) -> List[dict]:
+    """Correos de una solicitud: uno por destinatario (mismo contenido en cada reintento)."""
+    return [
+        build_alert_email(to_email, [row["payload"] for row in digest])
+        for to_email, digest in _by_recipient(rows).items()
+    ]
+
+
+def retry_delay(attempts: int) -> datetime.timedelta:
+    """Espera antes del reintento número `attempts` (se duplica en cada intento fallido)."""
+    return datetime.timedelta(
+        seconds=min(MAX_RETRY_DELAY_S, settings.NOTIFICATION_RETRY_BASE_S * 2 ** max(0, attempts - 1))
+    )
+
+
+def _result_row(row: dict, status: str, attempts: int, error: str = None, sent_at=None, next_attempt_at=None) -> dict:
+    # Todas las filas con las mismas columnas: un solo executemany
+    return {
+        "id": row["id"], "status": status, "attempts": attempts, "last_error": error,
+        "sent_at": sent_at, "next_attempt_at": next_attempt_at,
+    }
+
+
+@celery_app.task(name="app.tasks.tasks_notifications.drain_notification_outbox")
+def drain_notification_outbox():
+    """
+    Toma los correos pendientes (reintentos vencidos primero, con su misma solicitud, y
+    hasta NOTIFICATION_DRAIN_LIMIT nuevos), los envía y registra el resultado de cada uno.
+    Si el worker muere a mitad de camino, la reserva vence y se reintenta con la misma clave.
+    """
+    started_at = time.time()
+    now = datetime.datetime.now(datetime.UTC)
+
+    with Session(engine) as session:
+        groups = claim_notifications(
+            session, now,
+            limit=settings.NOTIFICATION_DRAIN_LIMIT,
+            retry_groups=settings.NOTIFICATION_RETRY_GROUPS,
+            lease_s=settings.NOTIFICATION_CLAIM_LEASE_S,
+        )
+        new_batches = plan_batches(groups.pop("", []))
+        # La clave queda guardada con la reserva, antes de la primera solicitud
+        write_delivery_results(session, [
+            {"id": row["id"], "delivery_key": key} for key, rows in new_batches.items() for row in rows
+        ])
+        session.commit()
+    batches = {**groups, **new_batches}
+    if not batches:
+        return {"status": "idle", "notifications": 0}
+
+    summary = {
+        "status": "success", "notifications": sum(len(rows) for rows in batches.values()),
+        "requests": len(batches), "sent": 0, "retried": 0, "failed": 0, "skipped": 0,
+    }
+    updates = []
+    if not settings.RESEND_API_KEY:
+        logger.warning("RESEND_API_KEY no configurado. Ignorando envío de correos de alerta.")
+        for rows in batches.values():
+            updates += [_result_row(row, STATUS_SKIPPED, row["attempts"]) for row in rows]
+        summary["skipped"] = len(updates)
+    else:
+        results = send_email_batches({key: batch_emails(rows) for key, rows in batches.items()})
+        finished_at = datetime.datetime.now(datetime.UTC)
+        for key, rows in batches.items():
+            outcome, error = results[key]
+            for row in rows:
+                attempts = row["attempts"] + 1
+                if outcome == DELIVERY_SENT:
+                    updates.append(_result_row(row, STATUS_SENT, attempts, sent_at=finished_at))
+                    summary["sent"] += 1
+                elif outcome == DELIVERY_RETRY and attempts < settings.NOTIFICATION_MAX_ATTEMPTS:
+                    updates.append(_result_row(
+                        row, STATUS_PENDING, attempts, error, next_attempt_at=finished_at + retry_delay(attempts)
+                    ))
+                    summary["retried"] += 1
+                else:
+                    updates.append(_result_row(row, STATUS_FAILED, attempts, error))
+                    summary["failed"] += 1
+
+    with Session(engine) as session:
+        write_delivery_results(session, updates)
+        session.commit()
+
+    summary["duration_s"] = round(time.time() - started_at, 1)
+    log_event('notification_drain', **summary)
+    logger.info(f"Drenaje de correos finalizado: {summary}")
+    return summary
@@ -1,138 +1,724 @@
 import datetime
+import hashlib
+import json
 import logging
+import math
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
 import ee
+from celery import chord
+from sqlalchemy import and_, or_, update
 from sqlmodel import Session, select
 from app.tasks.celery_app import celery_app
-from app.tasks.worker import init_gee, get_sentinel2_image, calculate_indices, get_info_with_timeout
+from app.tasks.deadline import TaskDeadline
+from app.tasks.worker import (
+    gee_session,
+    get_sentinel2_collection,
+    calculate_indices,
+    get_info_with_timeout,
+    process_gee_analysis,
+    build_analysis_cache_key,
+    build_timeseries_cache_key,
+    flush_buffered_api_usage,
+    TIMESERIES_LOGIC_VERSION,
+)
 from app.db.session import engine
-from app.db.models import UserAlert, User
-from app.core.notifications import send_alert_email
+from app.db.models import AlertZone, UserAlert, User
+from app.db.analysis_store import find_usage_hotspots, prune_analysis_results as prune_expired_analyses
+from app.db.timeseries_store import load_points_on_dates
+from app.db.observation_store import insert_observations, load_recent_observations
+from app.db.outbox_store import enqueue_notifications
+from app.core.alert_trends import TREND_TRIGGERS, history_matrix
+from app.core.alert_rules import alert_table, describe_rule, evaluate_rules, rule_indices, triggered_rows
+from app.core.cells import location_cell
+from app.core.config import settings
+from app.core.security import log_event, redis_client
 
 logger = logging.getLogger(__name__)
 
+# Mientras un precalentamiento está encolado/corriendo, no volver a encolar la misma clave
+# en la siguiente corrida horaria (un análisis GEE tarda bastante menos que esto).
+PREWARM_LOCK_SECONDS = 15 * 60
+
+# Presupuesto mínimo para empezar a evaluar un lote más de alertas: los lotes que no
+# alcanzan conservan su reserva y se vuelven a encolar cuando esta vence.
+ALERT_STEP_MIN_SECONDS = 20
+
+# Índices que se reducen para cada zona de alerta en una sola pasada.
+ALERT_INDICES = ["NDVI", "NDWI", "NDMI"]
+
+# Origen del valor con que se evaluó una alerta (user_alerts.last_value_source).
+SOURCE_GEE = "gee"
+SOURCE_ANALYSIS_CACHE = "analysis_cache"          # Análisis de un usuario en Redis
+SOURCE_TIMESERIES_CACHE = "timeseries_cache"      # Pulso Territorial en Redis
+SOURCE_TIMESERIES_STORE = "timeseries_store"      # Tabla compartida timeseries_points
+
+# Ventana de cada frecuencia: una alerta se revisa una vez por ventana, a una hora fija
+# dentro de ella que depende de su id (la carga de GEE se reparte en el día/semana).
+ALERT_FREQUENCY_WINDOWS = {
+    "daily": 24 * 60 * 60,
+    "weekly": 7 * 24 * 60 * 60,
+}
+
+# Columnas que la corrida necesita de cada alerta (y el correo del dueño): se leen como
+# filas planas, sin cargar entidades ORM ni la geometría PostGIS.
+ALERT_ROW_COLUMNS = (
+    UserAlert.id, UserAlert.location_name, UserAlert.lat, UserAlert.lng, UserAlert.radius,
+    UserAlert.approach, UserAlert.frequency, UserAlert.trigger_type, UserAlert.trigger_value,
+    UserAlert.trigger_secondary_value, UserAlert.trigger_window, UserAlert.last_index_value, UserAlert.last_scene_at,
+    UserAlert.zone_id, User.email,
+    # Centro y radio de la zona compartida (NULL sin zona: se usa el de la propia alerta)
+    AlertZone.lat.label("zone_lat"), AlertZone.lng.label("zone_lng"), AlertZone.radius.label("zone_radius"),
+)
+
+
+def next_alert_due_at(
+    alert_id: int, frequency: str, after: datetime.datetime, zone_id: Optional[int] = None
+) -> datetime.datetime:
+    """
+    Próxima revisión de la alerta posterior a `after`: la ventana de su frecuencia se
+    divide según un hash estable del id, así cada alerta cae siempre a la misma hora dentro
+    de la ventana y el conjunto queda repartido de forma pareja.
+
+    Las alertas de una zona compartida usan el hash de la zona: todas vencen a la misma
+    hora (las semanales, el mismo día a la hora de las diarias, porque la semana es un
+    múltiplo exacto del día) y se evalúan juntas con una sola reducción.
+    """
+    window = ALERT_FREQUENCY_WINDOWS.get(frequency, ALERT_FREQUENCY_WINDOWS["daily"])
+    seed = f"zone:{zone_id}" if zone_id is not None else f"alert:{alert_id}"
+    phase = int(hashlib.sha1(seed.encode()).hexdigest(), 16) % window
+    after_ts = after.timestamp()
+    due_ts = math.floor(after_ts / window) * window + phase
+    if due_ts <= after_ts:
+        due_ts += window
+    return datetime.datetime.fromtimestamp(due_ts, datetime.UTC)
+
+
+def due_alerts_condition(now: datetime.datetime):
+    """
+    Predicado SQL de las alertas a encolar: activas, con la próxima revisión vencida (o
+    nuevas), de un usuario con correo (requiere el join a users). Lo sirve el índice
+    parcial ix_user_alerts_next_due.
+    """
+    return and_(
+        UserAlert.is_active == True,
+        or_(UserAlert.next_due_at.is_(None), UserAlert.next_due_at <= now),
+        User.email.is_not(None),
+    )
+
+
+def alert_rows_query(alert_ids: List[int]):
+    """Filas (ALERT_ROW_COLUMNS) de las alertas de `alert_ids` que siguen activas y con correo."""
+    return (
+        select(*ALERT_ROW_COLUMNS)
+        .join(User, User.id == UserAlert.user_id)
+        .outerjoin(AlertZone, AlertZone.id == UserAlert.zone_id)
+        .where(UserAlert.id.in_(alert_ids), UserAlert.is_active == True, User.email.is_not(None))
+    )
+
+
+def alert_index_for(alert: UserAlert) -> str:
+    """Índice que vigila la alerta según su enfoque y su tipo de disparador."""
+    if alert.approach in ["water-management", "flood-risk", "real-estate"]:
+        return "NDWI"
+    if alert.approach in ["agriculture", "fire-risk"]:
+        return "NDMI" if alert.trigger_type == "ndmi_below" else "NDVI"
+    if alert.trigger_type == "ndwi_above":
+        return "NDWI"
+    if alert.trigger_type == "ndmi_below":
+        return "NDMI"
+    return "NDVI"
+
+
+def scene_group_key(lat: float, lng: float) -> str:
+    """Celda de ALERT_BATCH_GRID_DEG grados (del orden de una tesela Sentinel-2) que contiene el punto."""
+    cell = settings.ALERT_BATCH_GRID_DEG
+    return f"{math.floor(lat / cell)}:{math.floor(lng / cell)}"
+
+
+def zone_groups(alerts) -> Dict[int, list]:
+    """
+    Alertas agrupadas por zona compartida (alert_zones), en el orden recibido:
+    {id de la primera alerta de la zona: [alertas]}. Las alertas sin zona van solas.
+    """
+    groups, first = {}, {}
+    for alert in alerts:
+        key = ("zone", alert.zone_id) if alert.zone_id is not None else ("alert", alert.id)
+        groups.setdefault(first.setdefault(key, alert.id), []).append(alert)
+    return groups
+
+
+def group_alerts_by_scene(alerts) -> list:
+    """
+    Agrupa las alertas por celda de escena, en lotes de hasta ALERT_BATCH_MAX_FEATURES
+    zonas: cada lote se evalúa con un solo reduceRegions. Las alertas de una zona
+    compartida quedan en el mismo lote y cuentan como una sola zona.
+    """
+    groups = defaultdict(list)
+    for members in zone_groups(alerts).values():
+        groups[scene_group_key(members[0].lat, members[0].lng)].append(members)
+    size = max(1, settings.ALERT_BATCH_MAX_FEATURES)
+    return [
+        [alert for members in zones[i:i + size] for alert in members]
+        for _, zones in sorted(groups.items())
+        for i in range(0, len(zones), size)
+    ]
+
+
+def _alert_zones(groups: Dict[int, list]):
+    """
+    FeatureCollection con una zona (punto + radio) por grupo de zone_groups, identificada
+    por el alert_id de su primera alerta: la zona compartida si la hay, si no la de la alerta.
+    """
+    features = []
+    for alert_id, members in groups.items():
+        alert = members[0]
+        if alert.zone_lat is not None:
+            center, radius = [alert.zone_lng, alert.zone_lat], alert.zone_radius
+        else:
+            center, radius = [alert.lng, alert.lat], alert.radius
+        features.append(ee.Feature(ee.Geometry.Point(center).buffer(radius), {"alert_id": alert_id}))
+    return ee.FeatureCollection(features)
+
+
+def _spread(groups: Dict[int, list], by_zone: dict) -> dict:
+    """Reparte el resultado de cada zona ({alert_id representante: valor}) entre sus alertas."""
+    return {
+        alert.id: by_zone[alert_id]
+        for alert_id, members in groups.items() if alert_id in by_zone
+        for alert in members
+    }
+
+
+def _as_utc(value: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    """Las fechas leídas de PostGIS vuelven sin zona horaria: se interpretan como UTC."""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=datetime.UTC)
+    return value
+
+
+def latest_scene_times(alerts: List[UserAlert], deadline: TaskDeadline) -> Dict[int, Optional[datetime.datetime]]:
+    """
+    Adquisición de la escena más reciente sobre la zona de cada alerta del lote, en una
+    sola llamada barata a GEE (solo metadatos de la colección, sin reducir píxeles).
+    Devuelve {alert_id: fecha UTC}, None para zonas sin escenas en el período.
+    """
+    groups = zone_groups(alerts)
+    zones = _alert_zones(groups)
+    scenes = get_sentinel2_collection(zones.geometry())
+    newest = zones.map(
+        lambda zone: zone.set("latest_scene_ms", scenes.filterBounds(zone.geometry()).aggregate_max("system:time_start"))
+    ).select(["alert_id", "latest_scene_ms"], None, False)
+    info = get_info_with_timeout(newest, timeout=settings.ALERT_BATCH_TIMEOUT_S, deadline=deadline)
+
+    latest = {}
+    for feature in (info or {}).get("features", []):
+        props = feature.get("properties") or {}
+        millis = props.get("latest_scene_ms")
+        latest[props.get("alert_id")] = (
+            datetime.datetime.fromtimestamp(millis / 1000, datetime.UTC) if millis is not None else None
+        )
+    return _spread(groups, latest)
+
+
+def _cached_json(raw) -> Optional[dict]:
+    try:
+        return json.loads(raw) if raw else None
+    except ValueError:
+        return None
+
+
+def _analysis_cache_indices(result: Optional[dict], scene_date: str) -> Dict[str, float]:
+    """Promedios crudos de los índices en un análisis cacheado, si se calculó sobre la pasada `scene_date`."""
+    if not result or result.get("status") != "success":
+        return {}
+    meta = result.get("meta") or {}
+    if meta.get("date") != scene_date:
+        return {}
+    return {name: float(v) for name, v in (meta.get("indices") or {}).items() if name in ALERT_INDICES and v is not None}
+
+
+def _point_indices(point: Optional[dict]) -> Dict[str, float]:
+    """Índices de un punto de serie temporal (claves en minúscula) con los nombres de ALERT_INDICES."""
+    return {name: float(point[name.lower()]) for name in ALERT_INDICES if (point or {}).get(name.lower()) is not None}
+
+
+def _timeseries_indices(chart_data: Optional[list], scene_date: str) -> Dict[str, float]:
+    """Índices del punto de la serie temporal de la pasada `scene_date`."""
+    for point in chart_data or []:
+        if point.get("date") == scene_date:
+            return _point_indices(point)
+    return {}
+
+
+def cached_alert_values(alerts: list, scene_times: Dict[int, Optional[datetime.datetime]]) -> Dict[int, tuple]:
+    """
+    Índices de cada alerta tomados de lo que ya se calculó para la misma zona y la misma
+    pasada Sentinel-2, antes de ir a GEE: el análisis de un usuario en Redis (misma
+    ubicación, radio y enfoque), el Pulso Territorial en Redis (misma ubicación y radio) y,
+    al final, la tabla compartida timeseries_points (mismo radio exacto: un punto de otro
+    radio no es el valor de esta alerta). Una MGET y una consulta por lote.
+
+    Devuelve {alert_id: ({índice: valor}, origen)} solo para las alertas cuyos índices
+    (el vigilado y los de su regla) se resolvieron (best-effort).
+    """
+    wanted = {}
+    for alert in alerts:
+        scene_at = scene_times.get(alert.id)
+        if scene_at is not None:
+            needed = {alert_index_for(alert)} | rule_indices(alert.trigger_type)
+            wanted[alert.id] = (alert, needed, scene_at.date().isoformat())
+    found = {}
+    if not wanted:
+        return found
+
+    if redis_client:
+        try:
+            keys = []
+            for alert, _, _ in wanted.values():
+                keys.append(build_analysis_cache_key(alert.approach, alert.radius, alert.lat, alert.lng))
+                keys.append(build_timeseries_cache_key(alert.radius, alert.lat, alert.lng))
+            cached = redis_client.mget(keys)
+            for i, (alert_id, (_, needed, scene_date)) in enumerate(wanted.items()):
+                indices = _analysis_cache_indices(_cached_json(cached[2 * i]), scene_date)
+                if needed <= indices.keys():
+                    found[alert_id] = (indices, SOURCE_ANALYSIS_CACHE)
+                    continue
+                indices = _timeseries_indices((_cached_json(cached[2 * i + 1]) or {}).get("chart_data"), scene_date)
+                if needed <= indices.keys():
+                    found[alert_id] = (indices, SOURCE_TIMESERIES_CACHE)
+        except Exception as e:
+            logger.warning(f"Error leyendo caches de análisis para alertas: {e}")
+
+    missing = {
+        alert_id: (location_cell(alert.lat, alert.lng), alert.radius, datetime.date.fromisoformat(scene_date))
+        for alert_id, (alert, _, scene_date) in wanted.items()
+        if alert_id not in found
+    }
+    if missing:
+        try:
+            # Sesión propia: un error de lectura no debe abortar la transacción de escrituras del lote
+            with Session(engine) as read_session:
+                points = load_points_on_dates(read_session, missing.values(), TIMESERIES_LOGIC_VERSION)
+            for alert_id, key in missing.items():
+                indices = _point_indices(points.get(key))
+                if wanted[alert_id][1] <= indices.keys():
+                    found[alert_id] = (indices, SOURCE_TIMESERIES_STORE)
+        except Exception as e:
+            logger.warning(f"Error leyendo serie temporal compartida para alertas: {e}")
+    return found
+
+
+def evaluate_alert_batch(alerts: List[UserAlert], deadline: TaskDeadline) -> Dict[int, Dict[str, float]]:
+    """
+    Promedios de ALERT_INDICES en la zona de cada alerta del lote, con una sola llamada a
+    GEE: las zonas van como FeatureCollection a un reduceRegions sobre el mosaico de las
+    escenas recientes (ordenadas por fecha, la más reciente queda encima en cada píxel,
+    igual que la imagen más reciente que usaba la evaluación de a una).
+
+    Las alertas de una misma zona compartida se reducen una sola vez y reciben el mismo
+    valor. Devuelve {alert_id: {índice: valor}}; las zonas sin píxeles válidos no traen índices.
+    """
+    groups = zone_groups(alerts)
+    zones = _alert_zones(groups)
+    scenes = get_sentinel2_collection(zones.geometry()).sort('system:time_start')
+    stats = calculate_indices(scenes.mosaic()).select(ALERT_INDICES).reduceRegions(
+        collection=zones,
+        reducer=ee.Reducer.mean(),
+        scale=20,
+    )
+    info = get_info_with_timeout(stats, timeout=settings.ALERT_BATCH_TIMEOUT_S, deadline=deadline)
+
+    values = {}
+    for feature in (info or {}).get("features", []):
+        props = feature.get("properties") or {}
+        values[props.get("alert_id")] = {
+            name: float(props[name]) for name in ALERT_INDICES if props.get(name) is not None
+        }
+    return _spread(groups, values)
+
+
+def trend_histories(
+    alerts: list, scene_times: Optional[Dict[int, Optional[datetime.datetime]]]
+) -> List[List[float]]:
+    """
+    Historial del índice vigilado de cada alerta (la observación más antigua primero),
+    alineado con `alerts`: una consulta a alert_observations para las alertas con reglas
+    por tendencia; el resto queda vacío. ndvi_drop_pct sin historial usa last_index_value
+    como base, igual que antes de guardar observaciones (best-effort).
+    """
+    trend_ids = [alert.id for alert in alerts if alert.trigger_type in TREND_TRIGGERS]
+    history = {}
+    if trend_ids:
+        try:
+            since = (datetime.datetime.now(datetime.UTC) - datetime.timedelta(days=settings.ALERT_HISTORY_DAYS)).date()
+            # Sesión propia: un error de lectura no debe abortar la transacción de escrituras del lote
+            with Session(engine) as read_session:
+                history = load_recent_observations(read_session, trend_ids, since)
+        except Exception as e:
+            logger.warning(f"Error leyendo historial de {len(trend_ids)} alertas por tendencia: {e}")
+
+    series = []
+    for alert in alerts:
+        index_name = alert_index_for(alert)
+        scene_at = scene_times.get(alert.id) if scene_times is not None else None
+        # La pasada actual no forma parte de su propia base (puede estar guardada si un
+        # intento anterior se cortó después de escribir)
+        past = [
+            obs[index_name] for obs in history.get(alert.id, [])
+            if scene_at is None or obs["date"] < scene_at.date()
+        ]
+        if not past and alert.trigger_type == "ndvi_drop_pct" and alert.last_index_value is not None:
+            past = [alert.last_index_value]
+        series.append(past)
+    return series
+
+
+def pack_alert_shards(alerts) -> List[List[int]]:
+    """
+    Reparte los ids de alerta en fragmentos de hasta ALERT_SHARD_SIZE alertas sin partir
+    los lotes de escena: cada fragmento es una subtarea con su propia sesión y presupuesto.
+    """
+    shards, current = [], []
+    for batch in group_alerts_by_scene(alerts):
+        if current and len(current) + len(batch) > settings.ALERT_SHARD_SIZE:
+            shards.append(current)
+            current = []
+        current.extend(alert.id for alert in batch)
+    if current:
+        shards.append(current)
+    return shards
+
+
+def _write_alert_updates(
+    session: Session, evaluated: List[dict], checked: List[dict], observations: List[dict], notifications: List[dict]
+) -> None:
+    """
+    Escribe el resultado de un lote con UPDATE en bloque por clave primaria (sin cargar ni
+    rastrear entidades), encola los correos de las disparadas en la misma transacción y
+    agrega las observaciones de la pasada al historial.
+    """
+    # Un executemany por forma de fila: evaluadas (valor + escena) y solo revisadas
+    for rows in (evaluated, checked):
+        if rows:
+            session.execute(update(UserAlert), rows)
+    enqueue_notifications(session, notifications)
+    if observations:
+        try:
+            # Savepoint: si falla el historial, las alertas igual quedan actualizadas
+            with session.begin_nested():
+                insert_observations(session, observations)
+        except Exception as e:
+            logger.warning(f"Error guardando {len(observations)} observaciones de alertas: {e}")
+
+
+def _check_alert_batch(session: Session, batch: list, deadline: TaskDeadline, summary: Dict[str, int]) -> None:
+    """
+    Evalúa un lote de escena, encola los correos que correspondan y escribe el resultado
+    en la sesión. Sentinel-2 pasa cada ~5 días: las alertas cuya escena más reciente ya
+    fue evaluada (last_scene_at) solo se marcan revisadas, sin reducir píxeles.
+    """
+    checked_at = datetime.datetime.now(datetime.UTC)
+    try:
+        scene_times = latest_scene_times(batch, deadline)
+    except Exception as e:
+        # Sin la consulta barata se evalúa todo el lote, como antes.
+        logger.warning(f"Error consultando escenas recientes del lote ({scene_group_key(batch[0].lat, batch[0].lng)}): {e}")
+        scene_times = None
+
+    def checked_row(alert) -> dict:
+        return {
+            "id": alert.id,
+            "last_checked_at": checked_at,
+            "next_due_at": next_alert_due_at(alert.id, alert.frequency, checked_at, alert.zone_id),
+        }
+
+    # Las alertas sin escena nueva o sin imágenes esperan a su próxima ventana; las que
+    # fallan en GEE quedan vencidas y se reintentan al vencer su reserva.
+    pending, checked = [], []
+    for alert in batch:
+        if scene_times is None:
+            pending.append(alert)
+            continue
+        scene_at = scene_times.get(alert.id)
+        if scene_at is None:
+            logger.warning(f"No se encontraron imágenes satelitales recientes para la alerta {alert.id} ({alert.location_name}).")
+            summary["failed"] += 1
+            checked.append(checked_row(alert))
+        elif alert.last_scene_at and scene_at <= _as_utc(alert.last_scene_at):
+            summary["unchanged"] += 1
+            checked.append(checked_row(alert))
+        else:
+            pending.append(alert)
+
+    # Lo que ya está calculado para la misma pasada no se vuelve a pedir a GEE.
+    values = cached_alert_values(pending, scene_times) if pending and scene_times is not None else {}
+    summary["reused"] += len(values)
+    to_compute = [alert for alert in pending if alert.id not in values]
+    if to_compute:
+        try:
+            batch_values = evaluate_alert_batch(to_compute, deadline)
+        except Exception as e:
+            logger.error(f"Error evaluando lote de {len(to_compute)} alertas ({scene_group_key(to_compute[0].lat, to_compute[0].lng)}): {e}")
+            summary["failed"] += len(to_compute)
+            pending = [alert for alert in pending if alert.id in values]
+        else:
+            for alert in to_compute:
+                indices = batch_values.get(alert.id, {})
+                if alert_index_for(alert) in indices:
+                    values[alert.id] = (indices, SOURCE_GEE)
+
+    ready = []
+    for alert in pending:
+        if alert.id in values:
+            ready.append(alert)
+        else:
+            logger.warning(f"No se pudo extraer el promedio para el índice {alert_index_for(alert)} en alerta {alert.id}.")
+            summary["failed"] += 1
+
+    # Todas las reglas del lote de una vez (app/core/alert_rules.py)
+    try:
+        table = alert_table(ready, [values[alert.id][0] for alert in ready], [alert_index_for(alert) for alert in ready])
+        result = evaluate_rules(table, history_matrix(trend_histories(ready, scene_times)))
+        triggers = {int(table["id"][i]): describe_rule(table, result, i) for i in triggered_rows(result)}
+    except Exception as e:
+        logger.error(f"Error evaluando reglas de {len(ready)} alertas: {e}")
+        summary["failed"] += len(ready)
+        ready, triggers = [], {}
+
+    evaluated, observations, notifications = [], [], []
+    for alert in ready:
+        try:
+            index_to_select = alert_index_for(alert)
+            indices, source = values[alert.id]
+            current_value = indices[index_to_select]
+            logger.info(f"Alerta {alert.id} ({alert.location_name}): {index_to_select} actual = {current_value:.4f} ({source})")
+            trigger_desc = triggers.get(alert.id)
+            scene_at = scene_times[alert.id] if scene_times is not None else None
+            # Si se disparó el evento, encolar el correo (lo envía drain_notification_outbox)
+            if trigger_desc is not None:
+                logger.info(f"¡DISPARADO! Alerta {alert.id} cumple condición. Encolando correo...")
+                notifications.append({
+                    # Un correo por alerta y pasada, aunque la pasada se reevalúe
+                    "event_key": f"alert:{alert.id}:{(scene_at or checked_at).isoformat()}",
+                    "alert_id": alert.id,
+                    "to_email": alert.email,
+                    "payload": {
+                        "location_name": alert.location_name,
+                        "trigger_desc": trigger_desc,
+                        "index_name": index_to_select,
+                        "current_value": current_value,
+                    },
+                })
+                summary["triggered"] += 1
+
+            evaluated.append({
+                **checked_row(alert),
+                "last_index_value": current_value,
+                "last_value_source": source,
+                "last_scene_at": scene_at or alert.last_scene_at,
+            })
+            # Sin la fecha de la pasada no hay dónde ubicar la observación en el historial
+            if scene_at is not None:
+                observations.append({
+                    "alert_id": alert.id,
+                    "acquisition_date": scene_at.date(),
+                    "scene_at": scene_at,
+                    "ndvi": indices.get("NDVI"),
+                    "ndwi": indices.get("NDWI"),
+                    "ndmi": indices.get("NDMI"),
+                    "source": source,
+                })
+            summary["evaluated"] += 1
+
+        except Exception as e:
+            logger.error(f"Error procesando la alerta periódica {alert.id} ({alert.location_name}): {e}")
+            summary["failed"] += 1
+
+    # Actualizar los registros de las alertas en la base de datos
+    _write_alert_updates(session, evaluated, checked, observations, notifications)
+
+
 @celery_app.task(name="app.tasks.tasks_periodic.check_active_alerts")
 def check_active_alerts():
     """
-    Tarea periódica ejecutada por Celery Beat para procesar todas las alertas activas
-    de los usuarios, calcular los índices de Earth Engine más recientes y enviar
-    correos electrónicos si se cumplen las condiciones de alerta.
+    Tick periódico (Celery Beat, cada ALERT_TICK_SECONDS) de la revisión de alertas: en vez
+    de evaluar todas una vez al día, cada alerta tiene su próxima revisión (next_due_at)
+    repartida dentro de la ventana de su frecuencia, y el tick solo encola las vencidas.
+
+    Recorre con un cursor del servidor (de a ALERT_PAGE_SIZE filas) hasta
+    ALERT_TICK_MAX_ALERTS alertas vencidas, las más atrasadas primero, y las reserva
+    moviendo su next_due_at ALERT_CLAIM_LEASE_S hacia adelante (FOR UPDATE SKIP LOCKED:
+    dos ticks solapados no toman la misma alerta). Luego las reparte en fragmentos por
+    celda de escena (pack_alert_shards) y lanza un chord de check_alert_shard que cierra
+    summarize_alert_run. Cada fragmento fija la próxima revisión de lo que evaluó; si un
+    worker muere, la reserva vence y la alerta se vuelve a encolar.
     """
-    logger.info("Iniciando verificación periódica de alertas de usuarios...")
-    
-    # Asegurar inicialización de Earth Engine
+    started_at = time.time()
+    now = datetime.datetime.now(datetime.UTC)
+
+    with Session(engine) as session:
+        rows = list(session.exec(
+            select(UserAlert.id, UserAlert.lat, UserAlert.lng, UserAlert.zone_id)
+            .join(User, User.id == UserAlert.user_id)
+            .where(due_alerts_condition(now))
+            .order_by(UserAlert.next_due_at.asc().nulls_first())
+            .limit(settings.ALERT_TICK_MAX_ALERTS)
+            .with_for_update(of=UserAlert, skip_locked=True)
+            .execution_options(yield_per=settings.ALERT_PAGE_SIZE)
+        ))
+        if rows:
+            session.execute(
+                update(UserAlert)
+                .where(UserAlert.id.in_([row.id for row in rows]))
+                .values(next_due_at=now + datetime.timedelta(seconds=settings.ALERT_CLAIM_LEASE_S))
+            )
+        session.commit()
+
+    shards = pack_alert_shards(rows)
+    if not shards:
+        return {"status": "idle", "alerts": 0, "shards": 0}
+
+    logger.info(f"{len(rows)} alertas vencidas; se reparten en {len(shards)} fragmentos.")
+    chord(check_alert_shard.s(alert_ids) for alert_ids in shards)(summarize_alert_run.s(started_at))
+    return {"status": "dispatched", "alerts": len(rows), "shards": len(shards)}
+
+
+@celery_app.task(name="app.tasks.tasks_periodic.check_alert_shard", bind=True)
+def check_alert_shard(self, alert_ids: List[int]):
+    """
+    Evalúa un fragmento de alertas con su propia sesión de base de datos, confirmando el
+    avance tras cada lote de escena. Nunca lanza: devuelve sus contadores para el resumen
+    del chord (evaluated, reused, unchanged, triggered, failed, skipped, deferred).
+    """
+    summary = {
+        "alerts": len(alert_ids), "evaluated": 0, "reused": 0, "unchanged": 0, "triggered": 0,
+        "failed": 0, "skipped": 0, "deferred": 0,
+    }
     try:
-        ee.Initialize()
-    except Exception:
-        logger.warning("GEE no inicializado en el hilo actual de Beat/Worker. Reintentando...")
-        init_gee()
+        # Asegurar inicialización de Earth Engine (sesión compartida del proceso)
+        gee_session.ensure_ready()
+        deadline = TaskDeadline.for_task(self)
+
+        with Session(engine) as session:
+            # Alertas del fragmento que siguen activas, con el correo del dueño en la misma consulta
+            alerts = session.exec(alert_rows_query(alert_ids)).all()
+            summary["skipped"] = len(alert_ids) - len(alerts)
+
+            batches = group_alerts_by_scene(alerts)
+            for i, batch in enumerate(batches):
+                if not deadline.allows(ALERT_STEP_MIN_SECONDS):
+                    summary["deferred"] = sum(len(b) for b in batches[i:])
+                    logger.warning(f"Presupuesto del fragmento agotado: {summary['deferred']} alertas se reencolan al vencer su reserva.")
+                    break
+                _check_alert_batch(session, batch, deadline, summary)
+                session.commit()
+    except Exception as e:
+        logger.error(f"Error procesando fragmento de {len(alert_ids)} alertas: {e}")
+        summary["failed"] = summary["alerts"] - summary["evaluated"] - summary["unchanged"] - summary["skipped"] - summary["deferred"]
+    return summary
+
+
+@celery_app.task(name="app.tasks.tasks_periodic.summarize_alert_run")
+def summarize_alert_run(shard_summaries: List[Dict[str, int]], started_at: float):
+    """Callback del chord: suma los contadores de los fragmentos y registra la corrida."""
+    summary = {"status": "success", "shards": len(shard_summaries)}
+    for key in ("alerts", "evaluated", "reused", "unchanged", "triggered", "failed", "skipped", "deferred"):
+        summary[key] = sum((s or {}).get(key, 0) for s in shard_summaries)
+    summary["duration_s"] = round(time.time() - started_at, 1)
+    log_event('alert_run', **summary)
+    logger.info(f"Verificación periódica de alertas finalizada: {summary}")
+    return summary
+
+
+@celery_app.task(name="app.tasks.tasks_periodic.prewarm_analysis_cache")
+def prewarm_analysis_cache(force: bool = False):
+    """
+    Tarea periódica (Celery Beat, cada hora) que mantiene caliente la cache de análisis
+    de las zonas más consultadas, para que el primer usuario del día no espere a GEE.
+
+    Toma los hotspots recientes de api_usage_logs (ubicación, enfoque, radio), descarta
+    los que siguen en Redis con vigencia de sobra y encola process_gee_analysis para el
+    resto, empezando por los ya vencidos o más próximos a vencer, hasta agotar el
+    presupuesto PREWARM_GEE_BUDGET. Solo corre en horas valle (PREWARM_OFFPEAK_HOURS_UTC)
+    salvo que se llame con `force=True`.
+    """
+    if not settings.PREWARM_ENABLED or not redis_client:
+        return {"status": "skipped", "reason": "disabled"}
 
+    now = datetime.datetime.now(datetime.UTC)
+    if not force and now.hour not in settings.prewarm_offpeak_hours:
+        return {"status": "skipped", "reason": "peak_hours"}
+
+    since = now - datetime.timedelta(days=settings.PREWARM_LOOKBACK_DAYS)
     with Session(engine) as session:
-        # Consultar todas las alertas activas
-        alerts = session.exec(select(UserAlert).where(UserAlert.is_active == True)).all()
-        logger.info(f"Se encontraron {len(alerts)} alertas activas para procesar.")
-        
-        for alert in alerts:
-            # Si es semanal, saltar si ya se revisó en los últimos 6 días
-            if alert.frequency == "weekly" and alert.last_checked_at:
-                days_since_check = (datetime.datetime.now(datetime.UTC) - alert.last_checked_at).days
-                if days_since_check < 6:
-                    logger.info(f"Saltando alerta semanal {alert.id} ({alert.location_name}) - revisada hace {days_since_check} días.")
-                    continue
+        hotspots = find_usage_hotspots(session, since, settings.PREWARM_TOP_N, settings.PREWARM_MIN_HITS)
 
-            # Obtener el usuario
-            user = session.get(User, alert.user_id)
-            if not user or not user.email:
-                logger.warning(f"Usuario {alert.user_id} no encontrado o sin correo para alerta {alert.id}. Saltando.")
-                continue
-                
-            try:
-                # Ejecutar análisis rápido de Earth Engine para el punto
-                point = ee.Geometry.Point([alert.lng, alert.lat])
-                roi = point.buffer(alert.radius)
-                
-                s2_image = get_sentinel2_image(roi)
-                if not s2_image:
-                    logger.warning(f"No se encontraron imágenes satelitales recientes para la alerta {alert.id} ({alert.location_name}).")
-                    continue
-                    
-                s2_indices = calculate_indices(s2_image)
-                mean_reducer = ee.Reducer.mean()
-                
-                # Seleccionar el índice correspondiente
-                index_to_select = "NDVI"
-                if alert.approach in ["water-management", "flood-risk", "real-estate"]:
-                    index_to_select = "NDWI"
-                elif alert.approach in ["agriculture", "fire-risk"]:
-                    if alert.trigger_type == "ndmi_below":
-                        index_to_select = "NDMI"
-                    else:
-                        index_to_select = "NDVI"
-                else:
-                    if alert.trigger_type == "ndwi_above":
-                        index_to_select = "NDWI"
-                    elif alert.trigger_type == "ndmi_below":
-                        index_to_select = "NDMI"
-                    else:
-                        index_to_select = "NDVI"
-
-                stats_image = s2_indices.select([index_to_select])
-                
-                # Reducir región para obtener el promedio
-                stats = stats_image.reduceRegion(
-                    reducer=mean_reducer,
-                    geometry=roi,
-                    scale=20,
-                    maxPixels=1e8
-                )
-                
-                stats_val = get_info_with_timeout(stats, timeout=20)
-                if not stats_val or index_to_select not in stats_val:
-                    logger.warning(f"No se pudo extraer el promedio para el índice {index_to_select} en alerta {alert.id}.")
-                    continue
-                    
-                current_value = float(stats_val[index_to_select])
-                logger.info(f"Alerta {alert.id} ({alert.location_name}): {index_to_select} actual = {current_value:.4f}")
-                
-                # Evaluar disparador/trigger
-                triggered = False
-                trigger_desc = ""
-                
-                if alert.trigger_type == "ndvi_below" and index_to_select == "NDVI":
-                    triggered = current_value < alert.trigger_value
-                    trigger_desc = f"NDVI menor a {alert.trigger_value}"
-                elif alert.trigger_type == "ndwi_above" and index_to_select == "NDWI":
-                    triggered = current_value > alert.trigger_value
-                    trigger_desc = f"NDWI mayor a {alert.trigger_value}"
-                elif alert.trigger_type == "ndmi_below" and index_to_select == "NDMI":
-                    triggered = current_value < alert.trigger_value
-                    trigger_desc = f"NDMI menor a {alert.trigger_value}"
-                elif alert.trigger_type == "ndvi_drop_pct" and index_to_select == "NDVI":
-                    if alert.last_index_value is not None:
-                        # Caída de porcentaje respecto al último valor guardado
-                        drop_pct = ((alert.last_index_value - current_value) / alert.last_index_value) * 100
-                        triggered = drop_pct >= alert.trigger_value
-                        trigger_desc = f"Caída de NDVI mayor o igual a {alert.trigger_value}% (último valor: {alert.last_index_value:.4f}, caída calculada: {drop_pct:.1f}%)"
-                    else:
-                        logger.info(f"Primer chequeo para alerta {alert.id} con caída porcentual. Guardando valor base.")
-                
-                # Si se disparó el evento, enviar correo electrónico
-                if triggered:
-                    logger.info(f"¡DISPARADO! Alerta {alert.id} cumple condición. Enviando correo...")
-                    send_alert_email(
-                        to_email=user.email,
-                        location_name=alert.location_name,
-                        trigger_desc=trigger_desc,
-                        index_name=index_to_select,
-                        current_value=current_value
-                    )
-                
-                # Actualizar el registro de la alerta en la base de datos
-                alert.last_checked_at = datetime.datetime.now(datetime.UTC)
-                alert.last_index_value = current_value
-                session.add(alert)
-                
-            except Exception as e:
-                logger.error(f"Error procesando la alerta periódica {alert.id} ({alert.location_name}): {e}")
-                
+    candidates = []
+    for spot in hotspots:
+        cache_key = build_analysis_cache_key(spot["approach"], spot["radius"], spot["lat"], spot["lng"])
+        ttl = redis_client.ttl(cache_key)  # -2: no existe, -1: sin expiración
+        if ttl == -1 or ttl > settings.PREWARM_REFRESH_WITHIN_S:
+            continue
+        candidates.append((max(ttl, 0), -spot["hits"], cache_key, spot))
+    candidates.sort(key=lambda c: (c[0], c[1]))
+
+    enqueued = 0
+    for _, _, cache_key, spot in candidates:
+        if enqueued >= settings.PREWARM_GEE_BUDGET:
+            break
+        if not redis_client.set(f"prewarm:lock:{cache_key}", 1, nx=True, ex=PREWARM_LOCK_SECONDS):
+            continue
+        process_gee_analysis.delay(
+            lat=spot["lat"],
+            lng=spot["lng"],
+            radius=spot["radius"],
+            approach=spot["approach"],
+            location_name="Precalentamiento de cache",
+            cache_key=cache_key,
+            prewarm=True,
+        )
+        enqueued += 1
+
+    summary = {"status": "success", "hotspots": len(hotspots), "candidates": len(candidates), "enqueued": enqueued}
+    log_event('cache_prewarm', **summary)
+    return summary
+
+
+@celery_app.task(name="app.tasks.tasks_periodic.prune_analysis_results")
+def prune_analysis_results():
+    """
+    Tarea periódica (Celery Beat, diaria) que borra de analysis_results los análisis vencidos
+    hace más de ANALYSIS_RESULT_RETENTION_DAYS. Hasta entonces siguen sirviendo de respaldo
+    (resultado vencido) cuando GEE no responde o la cola está saturada.
+    """
+    cutoff = datetime.datetime.now(datetime.UTC) - datetime.timedelta(days=settings.ANALYSIS_RESULT_RETENTION_DAYS)
+    with Session(engine) as session:
+        deleted = prune_expired_analyses(session, cutoff)
         session.commit()
-    logger.info("Verificación periódica de alertas finalizada.")
+
+    summary = {"status": "success", "deleted": deleted}
+    log_event('analysis_results_pruned', **summary)
+    return summary
+
+
+@celery_app.task(name="app.tasks.tasks_periodic.flush_api_usage_buffer")
+def flush_api_usage_buffer():
+    """
+    Tarea periódica (Celery Beat, cada USAGE_FLUSH_SECONDS) que vuelca a api_usage_logs los
+    cache-hits que /analyze dejó en Redis, en lotes de USAGE_FLUSH_BATCH filas por INSERT.
+    Vacía el buffer completo en cada corrida para que no crezca entre una y otra.
+    """
+    written = 0
+    while True:
+        try:
+            flushed = flush_buffered_api_usage(settings.USAGE_FLUSH_BATCH)
+        except Exception as e:
+            logger.warning(f"Error volcando el buffer de uso a api_usage_logs: {e}")
+            break
+        written += flushed
+        if flushed < settings.USAGE_FLUSH_BATCH:
+            break
+    return {"status": "success", "written": written}
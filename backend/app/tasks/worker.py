@@ -5,42 +5,363 @@ import datetime
 import logging
 import concurrent.futures
 import ee
-from celery.signals import worker_process_init
+from celery import concurrency as celery_concurrency
+from celery import states
+from celery.exceptions import Ignore
+from celery.signals import task_postrun, task_prerun, worker_init, worker_process_init
+from sqlalchemy import insert
 from sqlmodel import Session
 from geoalchemy2.elements import WKTElement
 
 from app.tasks.celery_app import celery_app
-from app.core.gee import init_gee
+from app.tasks.deadline import TaskDeadline
+from app.tasks.results import compact_task_result
+from app.tasks.admission import record_task_duration
+from app.tasks.cancellation import TaskCancelled, clear_inflight, raise_if_cancelled
+from app.core.gee import gee_session
+from app.core.gee_scheduler import bind_task, gee_scheduler, unbind_task
+from app.core.gee_resilience import GeeCall
 from app.core.security import log_event, redis_client
+from app.core.cells import location_cell, region_cell
+from app.core.revisit import (
+    MAX_TTL_SECONDS,
+    adaptive_ttl_seconds,
+    learned_revisit_days,
+    note_tile_pass,
+    tile_from_scene_id,
+    usable_pass_ratio,
+)
 from app.db.session import engine
 from app.db.models import ApiUsageLog, UserAnalysis
+from app.db.analysis_store import (
+    build_date_range,
+    find_analysis_result,
+    save_analysis_result,
+    remaining_ttl_seconds,
+)
+from app.db.timeseries_store import (
+    TIMESERIES_WINDOW_DAYS,
+    load_timeseries_points,
+    upsert_timeseries_points,
+    merge_chart_data,
+)
 
 logger = logging.getLogger(__name__)
 
-# Executor persistente para llamadas a GEE con timeout wall-clock
-_GEE_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=10)
+# Clase de prioridad de las llamadas GEE de cada tarea (ver app/core/gee_scheduler.py).
+# Las tareas no listadas y los precalentamientos (prewarm=True) van como "alerts".
+GEE_TASK_PRIORITIES = {
+    "app.tasks.worker.process_gee_analysis": "interactive",
+    "app.tasks.worker.process_timeseries": "timeseries",
+    "app.tasks.tasks_periodic.check_active_alerts": "alerts",
+}
 
-# TTL de la cache de resultados de análisis: Sentinel-2 revisita cada ~5 días,
-# así que un resultado sigue siendo representativo durante medio día.
-ANALYSIS_CACHE_TTL_SECONDS = 12 * 60 * 60# Incluida en la cache key (ver build_analysis_cache_key en analyze.py). Incrementar esta
+# TTL por defecto de la cache de resultados: solo se usa cuando no se conoce la fecha de la
+# imagen. Con fecha, la vigencia se calcula según la próxima pasada de Sentinel-2 sobre el
+# tile (ver app/core/revisit.py) y aplica igual a Redis y a la cache durable de PostGIS.
+ANALYSIS_CACHE_TTL_SECONDS = 12 * 60 * 60
+
+# Pasos opcionales del análisis (fecha de la imagen, capa de mapa): solo se esperan si al
+# presupuesto de la tarea le quedan al menos estos segundos; si no, el resultado sale sin
+# ellos ("meta.degraded") y se cachea poco tiempo para que la próxima consulta lo complete.
+OPTIONAL_STEP_MIN_SECONDS = 5
+DEGRADED_CACHE_TTL_SECONDS = 15 * 60
+
+# TTL de la cache negativa ("no hay imagen utilizable"): corto, porque una pasada nueva
+# puede llegar en cualquier momento. Además se invalida antes si se ve una escena más
+# nueva en la región (ver note_scene_seen). Para rangos históricos ya cerrados no puede
+# llegar nada nuevo, así que se usa el TTL normal.
+NO_IMAGERY_CACHE_TTL_SECONDS = 3 * 60 * 60
+
+# Última fecha de escena Sentinel-2 vista por región (~11km): señal barata de "llegó una
+# pasada nueva" para invalidar la cache negativa antes de su TTL.
+SCENE_SEEN_TTL_SECONDS = 30 * 24 * 60 * 60
+
+# Índices derivados de Sentinel-2 (calculate_indices). Si todos los que pidió un enfoque
+# vuelven en None, la ROI quedó entera bajo nubes/no-data en la imagen elegida.
+S2_INDEX_BANDS = {'NDVI', 'NDWI', 'MNDWI', 'NDMI', 'NBR', 'NDBI', 'SAVI', 'EVI', 'BSI', 'NDRE'}
+
+# Promedios crudos que el resultado guarda en meta.indices (además de los valores
+# formateados de "data") para que la revisión de alertas reutilice el análisis cacheado.
+REUSABLE_INDEX_BANDS = ('NDVI', 'NDWI', 'NDMI')
+
+# Incluida en la cache key (ver build_analysis_cache_key más abajo). Incrementar esta
 # versión cuando cambie la lógica de negocio que produce el resultado cacheado (fórmulas,
 # umbrales, paleta de cada enfoque más abajo) para invalidar de inmediato lo ya cacheado en
 # vez de esperar hasta 12h a que expire por TTL y quedar sirviendo resultados con lógica vieja.
 ANALYSIS_LOGIC_VERSION = "v3"
 
 # Misma idea que ANALYSIS_LOGIC_VERSION pero para la cache de process_timeseries (ver
-# build_timeseries_cache_key en analyze.py).
+# build_timeseries_cache_key más abajo).
 TIMESERIES_LOGIC_VERSION = "v2"
 
 
-def cache_analysis_result(cache_key: str, result: dict) -> None:
-    """Guarda el resultado exitoso de un análisis en Redis (best-effort, nunca falla la tarea)."""
+def build_analysis_cache_key(approach: str, radius: int, lat: float, lng: float, start_date: str = None, end_date: str = None) -> str:
+    """
+    Genera la clave de cache para un análisis dado.
+
+    Se redondea lat/lng a 4 decimales (~11m de precisión) para que selecciones
+    casi idénticas del mapa (mismo punto, distinto redondeo de float) compartan
+    cache. Sentinel-2 revisita cada ~5 días, así que un resultado sigue siendo
+    válido durante todo el TTL de la cache. Incluye ANALYSIS_LOGIC_VERSION para que
+    un cambio en las fórmulas/umbrales de este módulo invalide la cache de inmediato en
+    vez de esperar hasta 12h a que expire por TTL (ver comentario junto a esa constante).
+    """
+    key = f"analysis:{ANALYSIS_LOGIC_VERSION}:{approach}:{radius}:{round(lat, 4)}:{round(lng, 4)}"
+    if start_date and end_date:
+        key += f":{start_date}:{end_date}"
+    return key
+
+
+def build_timeseries_cache_key(radius: int, lat: float, lng: float) -> str:
+    """
+    Clave de cache para la serie temporal del Pulso Territorial. A diferencia de
+    build_analysis_cache_key, NO incluye el "approach": los mismos NDVI/NDWI/NDMI se
+    calculan igual sin importar qué enfoque haya elegido el usuario, así que dos
+    análisis de la misma ubicación+radio con distinto enfoque comparten esta cache.
+    """
+    return f"timeseries:{TIMESERIES_LOGIC_VERSION}:{radius}:{round(lat, 4)}:{round(lng, 4)}"
+
+
+def build_no_imagery_cache_key(cache_key: str) -> str:
+    """Clave de la cache negativa: la misma clave del análisis con un prefijo propio."""
+    return f"noimagery:{cache_key}"
+
+
+def note_scene_seen(lat: float, lng: float, image_date: str) -> None:
+    """Registra que hay una escena de `image_date` (YYYY-MM-DD) para la región del punto (best-effort)."""
+    if not redis_client or not image_date:
+        return
+    key = f"scene_seen:{region_cell(lat, lng)}"
+    try:
+        current = redis_client.get(key)
+        if current is None or current.decode() < image_date:
+            redis_client.setex(key, SCENE_SEEN_TTL_SECONDS, image_date)
+    except Exception as e:
+        logger.warning(f"Error registrando escena vista ({key}): {e}")
+
+
+def no_imagery_result(reason: str, message: str) -> dict:
+    """Resultado de advertencia cuando no hay imagen utilizable (mismo formato que ve el frontend)."""
+    return {"status": "warning", "reason": reason, "message": message, "retry": False}
+
+
+def cache_no_imagery_result(cache_key: str, lat: float, lng: float, result: dict, historical: bool = False) -> None:
+    """
+    Guarda en la cache negativa un resultado "sin imagen" (best-effort, nunca falla la tarea).
+    Se anota la última escena vista en la región en ese momento, para detectar después si
+    llegó una más nueva (ver read_no_imagery_cache).
+    """
     if not redis_client or not cache_key:
         return
+    ttl = ANALYSIS_CACHE_TTL_SECONDS if historical else NO_IMAGERY_CACHE_TTL_SECONDS
+    try:
+        seen = redis_client.get(f"scene_seen:{region_cell(lat, lng)}")
+        entry = {**result, "scene_seen_at_check": seen.decode() if seen else ""}
+        redis_client.setex(build_no_imagery_cache_key(cache_key), ttl, json.dumps(entry))
+    except Exception as e:
+        logger.warning(f"Error escribiendo cache negativa de análisis ({cache_key}): {e}")
+
+
+def read_no_imagery_cache(cache_key: str, lat: float, lng: float):
+    """
+    Devuelve el resultado "sin imagen" cacheado para `cache_key`, o None. Si desde que se
+    guardó se vio una escena más nueva en la región, la entrada se descarta para que el
+    próximo análisis vuelva a intentar con GEE.
+    """
+    if not redis_client or not cache_key:
+        return None
+    negative_key = build_no_imagery_cache_key(cache_key)
+    try:
+        cached, seen = redis_client.mget(negative_key, f"scene_seen:{region_cell(lat, lng)}")
+        if not cached:
+            return None
+        entry = json.loads(cached)
+        if seen and seen.decode() > entry.get("scene_seen_at_check", ""):
+            redis_client.delete(negative_key)
+            return None
+        return entry
+    except Exception as e:
+        logger.warning(f"Error leyendo cache negativa de análisis ({cache_key}): {e}")
+        return None
+
+
+def cache_analysis_result(cache_key: str, result: dict, ttl_seconds: int = ANALYSIS_CACHE_TTL_SECONDS) -> bool:
+    """
+    Guarda el resultado exitoso de un análisis en Redis (best-effort, nunca falla la tarea).
+    Devuelve True si quedó escrito (la tarea puede devolver solo un puntero, ver results.py).
+    """
+    if not redis_client or not cache_key:
+        return False
     try:
-        redis_client.setex(cache_key, ANALYSIS_CACHE_TTL_SECONDS, json.dumps(result))
+        redis_client.setex(cache_key, ttl_seconds, json.dumps(result))
+        return True
     except Exception as e:
         logger.warning(f"Error escribiendo cache de análisis ({cache_key}): {e}")
+        return False
+
+
+def persist_durable_analysis(
+    approach: str,
+    lat: float,
+    lng: float,
+    radius: int,
+    start_date: str,
+    end_date: str,
+    analysis_result: dict,
+    ttl_seconds: int = ANALYSIS_CACHE_TTL_SECONDS,
+) -> None:
+    """Guarda el resultado en la cache durable de PostGIS (best-effort, nunca falla la tarea)."""
+    try:
+        with Session(engine) as session:
+            save_analysis_result(
+                session, approach, lat, lng, radius, build_date_range(start_date, end_date),
+                ANALYSIS_LOGIC_VERSION, analysis_result, ttl_seconds,
+            )
+            session.commit()
+    except Exception as e:
+        logger.warning(f"Error guardando análisis en cache durable ({approach}, {lat}, {lng}): {e}")
+
+
+def lookup_durable_analysis(
+    approach: str,
+    lat: float,
+    lng: float,
+    radius: int,
+    start_date: str = None,
+    end_date: str = None,
+    cache_key: str = None,
+    include_expired: bool = False,
+):
+    """
+    Busca un análisis vigente en la cache durable de PostGIS. Si lo encuentra y viene
+    `cache_key`, rehidrata Redis con la vigencia que le queda para que las siguientes
+    solicitudes vuelvan a resolverse desde Redis. Devuelve el payload o None (best-effort).
+    `include_expired` acepta también resultados vencidos (que nunca rehidratan Redis).
+    """
+    try:
+        with Session(engine) as session:
+            row = find_analysis_result(
+                session, approach, lat, lng, radius, build_date_range(start_date, end_date),
+                ANALYSIS_LOGIC_VERSION, include_expired=include_expired,
+            )
+            if row is None:
+                return None
+            payload, ttl = row.payload, remaining_ttl_seconds(row)
+    except Exception as e:
+        logger.warning(f"Error leyendo cache durable de análisis ({approach}, {lat}, {lng}): {e}")
+        return None
+
+    if redis_client and cache_key and ttl > 0:
+        try:
+            redis_client.setex(cache_key, ttl, json.dumps(payload))
+        except Exception as e:
+            logger.warning(f"Error rehidratando cache de análisis ({cache_key}): {e}")
+    return payload
+
+
+def _usage_row(lat: float, lng: float, radius: int, approach: str, location_name: str, status: str, timestamp=None) -> dict:
+    row = {
+        "endpoint": "/api/v1/analyze",
+        "location_name": location_name[:255],
+        "coordinates": WKTElement(f"POINT({lng} {lat})", srid=4326),
+        "approach": approach,
+        "radius": radius,
+        "status": status,
+    }
+    if timestamp is not None:
+        row["timestamp"] = timestamp
+    return row
+
+
+def record_api_usage(
+    lat: float, lng: float, radius: int, approach: str, location_name: str, status: str
+) -> None:
+    """Registra un análisis en api_usage_logs (estadísticas públicas y hotspots de precalentamiento)."""
+    with Session(engine) as session:
+        session.add(ApiUsageLog(**_usage_row(lat, lng, radius, approach, location_name, status)))
+        session.commit()
+
+
+# Cache-hits de /analyze pendientes de escribir en api_usage_logs (lista de Redis que
+# flush_api_usage_buffer en tasks_periodic.py vuelca por lotes).
+USAGE_BUFFER_KEY = "usage:buffer"
+
+
+def buffer_api_usage(
+    lat: float, lng: float, radius: int, approach: str, location_name: str, status: str
+) -> None:
+    """
+    Como record_api_usage, pero sin tocar la base de datos en la respuesta: deja el registro
+    en Redis para el siguiente volcado por lotes. Sin Redis, lo escribe directamente.
+    """
+    if not redis_client:
+        record_api_usage(lat, lng, radius, approach, location_name, status)
+        return
+    redis_client.rpush(USAGE_BUFFER_KEY, json.dumps({
+        "lat": lat, "lng": lng, "radius": radius, "approach": approach,
+        "location_name": location_name, "status": status,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }))
+
+
+def flush_buffered_api_usage(limit: int) -> int:
+    """
+    Escribe en api_usage_logs, con un solo INSERT, hasta `limit` registros del buffer de
+    Redis y devuelve cuántos. Si la escritura falla, los devuelve al buffer.
+    """
+    if not redis_client:
+        return 0
+    pipe = redis_client.pipeline()
+    pipe.lrange(USAGE_BUFFER_KEY, 0, limit - 1)
+    pipe.ltrim(USAGE_BUFFER_KEY, limit, -1)
+    entries, _ = pipe.execute()
+    if not entries:
+        return 0
+    rows = []
+    for entry in entries:
+        try:
+            e = json.loads(entry)
+            rows.append(_usage_row(
+                e["lat"], e["lng"], e["radius"], e["approach"], e["location_name"], e["status"],
+                timestamp=datetime.datetime.fromisoformat(e["timestamp"]),
+            ))
+        except Exception as ex:
+            logger.warning(f"Registro de uso inválido en el buffer ({entry!r}): {ex}")
+    if not rows:
+        return 0
+    try:
+        with Session(engine) as session:
+            session.execute(insert(ApiUsageLog.__table__), rows)
+            session.commit()
+    except Exception:
+        redis_client.rpush(USAGE_BUFFER_KEY, *entries)
+        raise
+    return len(rows)
+
+
+def analysis_cache_ttl(
+    lat: float, lng: float, radius: int, image_date: str, scene_id: str, historical: bool
+) -> int:
+    """
+    Vigencia de un análisis recién calculado: hasta la próxima pasada esperada de
+    Sentinel-2 sobre su tile, considerando la nubosidad histórica de la zona (los puntos
+    utilizables del Pulso Territorial de la misma celda+radio). Un rango histórico ya
+    cerrado no puede cambiar, así que recibe la vigencia máxima.
+    """
+    if historical:
+        return MAX_TTL_SECONDS
+    tile = tile_from_scene_id(scene_id)
+    note_tile_pass(redis_client, tile, image_date)
+    revisit_days = learned_revisit_days(redis_client, tile)
+    window_start = datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=TIMESERIES_WINDOW_DAYS)
+    history = read_stored_timeseries(location_cell(lat, lng), radius, window_start)
+    return adaptive_ttl_seconds(
+        image_date,
+        ANALYSIS_CACHE_TTL_SECONDS,
+        revisit_days=revisit_days,
+        usable_ratio=usable_pass_ratio(len(history), TIMESERIES_WINDOW_DAYS, revisit_days),
+    )
 
 
 def persist_user_analysis(
@@ -83,37 +404,138 @@ def persist_user_analysis(
         logger.error(f"Error guardando historial de usuario (task {task_id}, user {user_id}): {e}")
 
 
-def submit_gee_getinfo(ee_object):
-    """Encola una llamada getInfo() de Earth Engine en el executor sin bloquear el hilo actual."""
-    return _GEE_EXECUTOR.submit(ee_object.getInfo)
+def read_stored_timeseries(cell: str, radius: int, since: datetime.date) -> list:
+    """Puntos ya guardados en timeseries_points para la celda (best-effort: [] si falla la BD)."""
+    try:
+        with Session(engine) as session:
+            return load_timeseries_points(session, cell, radius, since, TIMESERIES_LOGIC_VERSION)
+    except Exception as e:
+        logger.warning(f"Error leyendo serie temporal compartida ({cell}, r={radius}): {e}")
+        return []
 
 
-def resolve_with_timeout(future, timeout=30, op_name="GEE operation"):
-    """Espera el resultado de un Future ya encolado (getInfo, getMapId, etc.) con límite de tiempo wall-clock."""
+def store_timeseries_points(cell: str, radius: int, chart_data: list) -> None:
+    """Agrega los puntos recién calculados a timeseries_points (best-effort, nunca falla la tarea)."""
+    if not chart_data:
+        return
+    try:
+        with Session(engine) as session:
+            upsert_timeseries_points(session, cell, radius, chart_data, TIMESERIES_LOGIC_VERSION)
+            session.commit()
+    except Exception as e:
+        logger.warning(f"Error guardando serie temporal compartida ({cell}, r={radius}): {e}")
+
+
+def submit_gee_call(fn, *args, op_name="GEE operation"):
+    """
+    Encola una llamada bloqueante a Earth Engine en el planificador sin bloquear el hilo
+    actual. Devuelve un GeeCall (interfaz de Future) que al resolverse reintenta errores
+    de cuota/transitorios y duplica la llamada si se queda rezagada.
+    """
+    return GeeCall(gee_scheduler.submit, fn, args, op_name)
+
+
+def submit_gee_getinfo(ee_object, op_name="getInfo"):
+    """Encola una llamada getInfo() de Earth Engine en el planificador sin bloquear el hilo actual."""
+    return submit_gee_call(ee_object.getInfo, op_name=op_name)
+
+
+def resolve_with_timeout(future, timeout=30, op_name="GEE operation", deadline: TaskDeadline = None):
+    """
+    Espera el resultado de una llamada ya encolada (getInfo, getMapId, etc.) con límite de
+    tiempo wall-clock. Los reintentos y el duplicado de un GeeCall caben dentro de `timeout`.
+    Con `deadline` (presupuesto de la tarea), `timeout` es solo un tope: se espera como
+    máximo lo que le queda a la tarea.
+    """
+    if deadline is not None:
+        timeout = deadline.timeout(timeout)
     try:
         return future.result(timeout=timeout)
     except concurrent.futures.TimeoutError as e:
-        logger.error(f"Operación GEE ({op_name}) excedió el timeout de {timeout}s")
-        raise TimeoutError(f"Google Earth Engine operation '{op_name}' timed out after {timeout} seconds") from e
+        future.cancel()
+        logger.error(f"Operación GEE ({op_name}) excedió el timeout de {timeout:.1f}s")
+        raise TimeoutError(f"Google Earth Engine operation '{op_name}' timed out after {timeout:.1f} seconds") from e
 
 
-def get_info_with_timeout(ee_object, timeout=30):
+def get_info_with_timeout(ee_object, timeout=30, deadline: TaskDeadline = None):
     """Ejecuta getInfo() de Earth Engine en un hilo con límite de tiempo wall-clock."""
-    return resolve_with_timeout(submit_gee_getinfo(ee_object), timeout=timeout, op_name="getInfo")
+    return resolve_with_timeout(submit_gee_getinfo(ee_object), timeout=timeout, op_name="getInfo", deadline=deadline)
 
-# Registrar la inicialización de Earth Engine al iniciar el worker process de Celery.
+# Registrar la inicialización de Earth Engine al iniciar el worker process de Celery: una
+# sola vez por proceso hijo (tras el fork), con token renovado en segundo plano.
 @worker_process_init.connect
 def configure_gee_workers(*args, **kwargs):
     logger.info("Worker process inicializado: conectando a Google Earth Engine...")
-    success = init_gee()
+    success = gee_session.initialize()
     if success:
         logger.info("Conexión a GEE exitosa en el worker.")
     else:
         logger.error("Falla crítica: No se pudo conectar a GEE en el worker.")
 
 
+# Pools sin procesos hijos: toda la concurrencia vive en el proceso principal del worker.
+IO_WORKER_POOLS = ("threads", "gevent", "eventlet", "solo")
+
+
+def worker_pool_name(worker) -> str:
+    """Nombre corto del pool de un WorkController ("prefork", "threads", "gevent", ...)."""
+    pool_cls = getattr(worker, "pool_cls", None) or "prefork"
+    if isinstance(pool_cls, str):
+        # Alias todavía sin resolver (worker_init se emite antes de cargar los bootsteps).
+        pool_cls = celery_concurrency.get_implementation(pool_cls)
+    module = getattr(pool_cls, "__module__", "") or ""
+    name = module.rsplit(".", 1)[-1]
+    return {"thread": "threads"}.get(name, name)
+
+
+# Perfil IO (pool threads/gevent): worker_process_init solo se emite en los hijos del
+# prefork, así que la sesión GEE se inicializa aquí, una vez para todo el proceso. Todas
+# las tareas comparten la sesión, su pool HTTP y el planificador de llamadas GEE, que ya
+# son thread-safe; con prefork no se toca nada (inicializar antes del fork no sirve).
+@worker_init.connect
+def configure_gee_io_worker(sender=None, **kwargs):
+    pool = worker_pool_name(sender)
+    if pool not in IO_WORKER_POOLS:
+        return
+    logger.info(f"Worker con pool '{pool}': conectando a Google Earth Engine una vez para todo el proceso...")
+    if gee_session.initialize():
+        logger.info("Conexión a GEE exitosa en el worker.")
+    else:
+        logger.error("Falla crítica: No se pudo conectar a GEE en el worker.")
+
+
+def stop_cancelled_task(task, exc: TaskCancelled):
+    """Detiene una tarea cancelada o abandonada: queda REVOKED, sin contarse como fallo."""
+    logger.info(f"Tarea {task.request.id} detenida ({exc.reason}) antes de seguir consultando GEE")
+    log_event('task_cancelled', task_id=task.request.id, task=task.name, reason=exc.reason)
+    try:
+        task.update_state(state=states.REVOKED, meta={"reason": exc.reason})
+    except Exception as e:
+        logger.warning(f"Error marcando la tarea {task.request.id} como cancelada: {e}")
+    raise Ignore()
+
+
+@task_prerun.connect
+def bind_gee_task(task_id=None, task=None, kwargs=None, **_):
+    """Asocia las llamadas GEE de la tarea que empieza a su clase de prioridad y a su id."""
+    priority = GEE_TASK_PRIORITIES.get(getattr(task, "name", None), "alerts")
+    if kwargs and kwargs.get("prewarm"):
+        priority = "alerts"
+    bind_task(priority, task_id)
+
+
+@task_postrun.connect
+def unbind_gee_task(**_):
+    unbind_task()
+
+
 def get_sentinel2_image(roi, start_date_str=None, end_date_str=None):
     """Obtiene la imagen Sentinel-2 más reciente y libre de nubes para la ROI."""
+    return get_sentinel2_collection(roi, start_date_str, end_date_str).sort('system:time_start', False).first()
+
+
+def get_sentinel2_collection(roi, start_date_str=None, end_date_str=None):
+    """Escenas Sentinel-2 con menos de 50% de nubes que tocan la ROI en el período (6 meses por defecto)."""
     if end_date_str:
         try:
             end_date = datetime.datetime.strptime(end_date_str, "%Y-%m-%d") + datetime.timedelta(days=1)
@@ -130,13 +552,10 @@ def get_sentinel2_image(roi, start_date_str=None, end_date_str=None):
     else:
         start_date = end_date - datetime.timedelta(days=180) # 6 meses
     
-    col = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
+    return (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
             .filterBounds(roi)
             .filterDate(start_date, end_date)
-            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 50))
-            .sort('system:time_start', False))
-            
-    return col.first()
+            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 50)))
 
 
 def calculate_indices(image):
@@ -180,29 +599,41 @@ def calculate_indices(image):
 @celery_app.task(name="app.tasks.worker.process_gee_analysis", bind=True)
 def process_gee_analysis(
     self, lat: float, lng: float, radius: int, approach: str, location_name: str,
-    cache_key: str = None, user_id: int = None, start_date: str = None, end_date: str = None
+    cache_key: str = None, user_id: int = None, start_date: str = None, end_date: str = None,
+    prewarm: bool = False, preview: bool = False
 ):
     """
     Tarea asíncrona de Celery para realizar análisis territorial usando Google Earth Engine.
     Guarda los logs en la base de datos de PostGIS e informa el estado.
     Si `cache_key` viene dado, el resultado exitoso se guarda en Redis con ese key
     para que futuras solicitudes idénticas se respondan sin volver a golpear GEE.
+    Además se guarda en la cache durable de PostGIS (analysis_results), que sobrevive a
+    evicciones de Redis y se comparte entre usuarios.
     Si `user_id` viene dado (usuario logeado), el resultado exitoso también se guarda
     en su historial personal (tabla user_analyses).
+    `prewarm=True` marca las ejecuciones encoladas por prewarm_analysis_cache
+    (tasks_periodic.py), que no se registran en api_usage_logs.
+    `preview=True` (control de admisión con la cola saturada, ver admission.py) omite la
+    capa de mapa: el resultado se marca como degradado y se cachea poco tiempo.
     """
     logger.info(f"Iniciando tarea {self.request.id}: {approach} en ({lat}, {lng}), radio={radius}m")
     
-    # Asegurar que Earth Engine esté inicializado
-    try:
-        ee.Initialize()
-    except Exception:
-        logger.warning("GEE no inicializado en el hilo actual. Reintentando...")
-        init_gee()
+    # Sesión GEE del proceso (inicializada en worker_process_init): sin costo si ya está lista.
+    gee_session.ensure_ready()
 
+    deadline = TaskDeadline.for_task(self)
+    degraded = []
     timings = {}
     t_task_start = time.monotonic()
+    is_historical = bool(
+        start_date and end_date
+        and end_date < datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+    )
 
     try:
+        # La tarea pudo pasar un buen rato en cola: no gastar cuota si ya nadie la espera.
+        raise_if_cancelled(self.request.id)
+
         point = ee.Geometry.Point([lng, lat])
         roi = point.buffer(radius)
 
@@ -294,42 +725,94 @@ def process_gee_analysis(
                     geometry=roi,
                     scale=scale,
                     maxPixels=1e9
-                )
+                ),
+                op_name="reduceRegion",
             )
             if stats_image is not None
             else None
         )
 
-        date_future = submit_gee_getinfo(ee.Date(s2_image.get('system:time_start')).format('YYYY-MM-dd'))
-        map_future = _GEE_EXECUTOR.submit(vis_image.getMapId, vis_params)
+        # Fecha e id de escena en un solo getInfo (el id identifica la pasada en la cache durable).
+        date_future = submit_gee_getinfo(ee.Dictionary({
+            'date': ee.Date(s2_image.get('system:time_start')).format('YYYY-MM-dd'),
+            'scene_id': s2_image.get('system:index'),
+        }), op_name="image date")
+        map_future = None if preview else submit_gee_call(vis_image.getMapId, vis_params, op_name="getMapId")
 
         # Resolver estadísticas de reducción espectral
         if stats_future is not None:
             try:
-                stats = resolve_with_timeout(stats_future, timeout=30, op_name="reduceRegion")
+                stats = resolve_with_timeout(stats_future, timeout=30, op_name="reduceRegion", deadline=deadline)
             except Exception as e:
                 if "empty" in str(e).lower() or "collection" in str(e).lower():
                     logger.warning(f"No hay imágenes Sentinel-2 disponibles para la ROI: {e}")
-                    return {
-                        "status": "warning",
-                        "message": "No se encontraron imágenes satelitales libres de nubes en los últimos 6 meses para esta ubicación.",
-                        "retry": False
-                    }
+                    warning = no_imagery_result(
+                        "empty_collection",
+                        "No se encontraron imágenes satelitales libres de nubes en los últimos 6 meses para esta ubicación."
+                    )
+                    cache_no_imagery_result(cache_key, lat, lng, warning, historical=is_historical)
+                    return warning
                 raise e
         else:
             stats = {}
         timings['gee_stats_s'] = round(time.monotonic() - t_parallel, 2)
 
-        # Resolver fecha de la imagen
+        # Punto de control entre etapas: la fecha y la capa de mapa siguen en cola.
         try:
-            image_date = resolve_with_timeout(date_future, timeout=15, op_name="image date")
-        except Exception as e:
-            logger.error(f"Error getting image date from GEE: {e}")
-            image_date = "Fecha de captura no disponible"
+            raise_if_cancelled(self.request.id)
+        except TaskCancelled:
+            date_future.cancel()
+            if map_future is not None:
+                map_future.cancel()
+            raise
+
+        # Imagen encontrada, pero la ROI quedó entera bajo nubes/no-data: reduceRegion
+        # devuelve None en todos los índices Sentinel-2 del enfoque.
+        s2_stats = [stats[b] for b in S2_INDEX_BANDS if b in stats]
+        if s2_stats and all(v is None for v in s2_stats):
+            logger.warning(f"Sin píxeles válidos de Sentinel-2 en la ROI ({lat}, {lng}, r={radius}m)")
+            warning = no_imagery_result(
+                "no_valid_pixels",
+                "La imagen satelital más reciente no tiene píxeles válidos (nubes o sin datos) sobre esta ubicación."
+            )
+            cache_no_imagery_result(cache_key, lat, lng, warning, historical=is_historical)
+            return warning
 
-        # Resolver capa de mapa
-        map_id_dict = resolve_with_timeout(map_future, timeout=30, op_name="getMapId")
-        tile_url = map_id_dict['tile_fetcher'].url_format
+        # Resolver fecha e id de escena de la imagen (opcional: se omite sin presupuesto)
+        scene_id = None
+        image_date = "Fecha de captura no disponible"
+        if deadline.allows(OPTIONAL_STEP_MIN_SECONDS):
+            try:
+                image_meta = resolve_with_timeout(date_future, timeout=15, op_name="image date", deadline=deadline)
+                image_date = image_meta.get('date')
+                scene_id = image_meta.get('scene_id')
+            except Exception as e:
+                logger.error(f"Error getting image date from GEE: {e}")
+        else:
+            date_future.cancel()
+            degraded.append("image_date")
+
+        # Resolver capa de mapa (opcional ante falta de presupuesto: los datos ya están)
+        map_layer = None
+        if preview:
+            degraded.append("map_layer")
+        elif deadline.allows(OPTIONAL_STEP_MIN_SECONDS):
+            # Solo un timeout recortado por el presupuesto degrada; uno normal sigue fallando.
+            budget_limited = not deadline.allows(30)
+            try:
+                map_id_dict = resolve_with_timeout(map_future, timeout=30, op_name="getMapId", deadline=deadline)
+                map_layer = {
+                    "url": map_id_dict['tile_fetcher'].url_format,
+                    "attribution": "Google Earth Engine"
+                }
+            except TimeoutError as e:
+                if not budget_limited:
+                    raise
+                logger.warning(f"Sin presupuesto para la capa de mapa ({self.request.id}): {e}")
+                degraded.append("map_layer")
+        else:
+            map_future.cancel()
+            degraded.append("map_layer")
         timings['gee_total_parallel_s'] = round(time.monotonic() - t_parallel, 2)
 
         timings['gee_parallel_wall_s'] = round(time.monotonic() - t_parallel, 2)
@@ -444,18 +927,14 @@ def process_gee_analysis(
             approach=approach,
             **timings
         )
+        # Duración de referencia para las ETA del control de admisión (solo corridas completas).
+        if not degraded:
+            record_task_duration((self.request.delivery_info or {}).get("routing_key"), timings['total_s'])
 
-        # Guardar log en la base de datos de PostGIS
-        with Session(engine) as session:
-            log = ApiUsageLog(
-                endpoint="/api/v1/analyze",
-                location_name=location_name[:255],
-                coordinates=WKTElement(f"POINT({lng} {lat})", srid=4326),
-                approach=approach,
-                status="success"
-            )
-            session.add(log)
-            session.commit()
+        # Guardar log en la base de datos de PostGIS (los precalentamientos de cache no son
+        # uso real: no cuentan en las estadísticas ni realimentan los hotspots).
+        if not prewarm:
+            record_api_usage(lat, lng, radius, approach, location_name, "success")
 
         # Resultado que el API de FastAPI leerá al completar la tarea
         analysis_result = {
@@ -463,44 +942,106 @@ def process_gee_analysis(
             "approach": approach,
             "data": results,
             "area_m2": area_m2,
-            "map_layer": {
-                "url": tile_url,
-                "attribution": "Google Earth Engine"
-            },
+            "map_layer": map_layer,
             "meta": {
                 "satellite": "Sentinel-2 MSI (Level-2A)",
                 "terrain": "Copernicus DEM GLO-30",
                 "date": image_date,
+                "scene_id": scene_id,
                 "buffer_radius_m": radius,
+                "indices": {b: stats[b] for b in REUSABLE_INDEX_BANDS if stats.get(b) is not None},
                 "timings": timings
             }
         }
 
-        cache_analysis_result(cache_key, analysis_result)
+        cache_ttl = analysis_cache_ttl(lat, lng, radius, image_date, scene_id, is_historical)
+        if degraded:
+            # Resultado parcial por falta de presupuesto: cache corta y fuera de la durable,
+            # para que la próxima consulta lo calcule completo.
+            analysis_result["meta"]["degraded"] = degraded
+            if preview:
+                analysis_result["meta"]["preview"] = True
+            cache_ttl = min(cache_ttl, DEGRADED_CACHE_TTL_SECONDS)
+            log_event('analysis_degraded', task_id=self.request.id, skipped=degraded,
+                      remaining_s=round(deadline.remaining(), 1))
+        log_event('analysis_cache_ttl', task_id=self.request.id, ttl_s=cache_ttl, image_date=image_date)
+        cached = cache_analysis_result(cache_key, analysis_result, cache_ttl)
+        note_scene_seen(lat, lng, image_date if scene_id else None)
+        if not degraded:
+            persist_durable_analysis(approach, lat, lng, radius, start_date, end_date, analysis_result, cache_ttl)
         persist_user_analysis(user_id, self.request.id, lat, lng, radius, approach, location_name, analysis_result)
 
-        return analysis_result
+        return compact_task_result(cache_key, analysis_result, cached)
+
+    except TaskCancelled as e:
+        stop_cancelled_task(self, e)
 
     except Exception as e:
         logger.error(f"Error en análisis GEE asíncrono: {e}", exc_info=True)
         # Registrar fallo en la BD
         try:
-            with Session(engine) as session:
-                log = ApiUsageLog(
-                    endpoint="/api/v1/analyze",
-                    location_name=location_name[:255],
-                    coordinates=WKTElement(f"POINT({lng} {lat})", srid=4326),
-                    approach=approach,
-                    status="failed"
-                )
-                session.add(log)
-                session.commit()
+            if not prewarm:
+                record_api_usage(lat, lng, radius, approach, location_name, "failed")
         except Exception as db_err:
             logger.error(f"Error logging failed task to database: {db_err}")
 
         # Lanzar excepción para marcar la tarea de Celery como fallida
         raise e
 
+    finally:
+        clear_inflight(cache_key, self.request.id)
+
+
+def fetch_timeseries_points(lat: float, lng: float, radius: int, start_date, end_date, deadline: TaskDeadline = None) -> list:
+    """Calcula en GEE los puntos NDVI/NDWI/NDMI de cada pasada Sentinel-2 entre las fechas dadas."""
+    point = ee.Geometry.Point([lng, lat])
+    roi = point.buffer(radius)
+
+    col = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
+            .filterBounds(roi)
+            .filterDate(start_date, end_date)
+            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 60))
+            .sort('system:time_start'))
+
+    def extract_indices(image):
+        indices = calculate_indices(image)
+        stats = indices.select(['NDVI', 'NDWI', 'NDMI']).reduceRegion(
+            reducer=ee.Reducer.mean(),
+            geometry=roi,
+            scale=20,
+            maxPixels=1e9
+        )
+        return ee.Feature(None, {
+            'date': ee.Date(image.get('system:time_start')).format('YYYY-MM-dd'),
+            'clouds': image.get('CLOUDY_PIXEL_PERCENTAGE'),
+            'ndvi': stats.get('NDVI'),
+            'ndwi': stats.get('NDWI'),
+            'ndmi': stats.get('NDMI'),
+        })
+
+    # Un solo getInfo() para TODA la colección (mismo patrón de batching de A2 en
+    # process_gee_analysis): construir N features (una por pasada satelital) y evaluarlas
+    # en una única llamada, en vez de una llamada por imagen.
+    feature_collection = ee.FeatureCollection(col.map(extract_indices))
+    fc_info = get_info_with_timeout(feature_collection, timeout=60, deadline=deadline)
+
+    chart_data = []
+    for feature in fc_info.get('features', []):
+        props = feature.get('properties', {}) or {}
+        # Pasadas donde la ROI específica quedó totalmente cubierta por nubes/no-data
+        # (aunque el CLOUDY_PIXEL_PERCENTAGE global de la imagen esté bajo el umbral)
+        # devuelven None en reduceRegion; se descartan en vez de graficar un cero falso.
+        if props.get('ndvi') is None:
+            continue
+        chart_data.append({
+            'date': props.get('date'),
+            'ndvi': round(props.get('ndvi', 0), 4),
+            'ndwi': round(props.get('ndwi', 0), 4),
+            'ndmi': round(props.get('ndmi', 0), 4),
+            'clouds': round(props.get('clouds', 0), 1) if props.get('clouds') is not None else None,
+        })
+    return chart_data
+
 
 @celery_app.task(name="app.tasks.worker.process_timeseries", bind=True)
 def process_timeseries(self, lat: float, lng: float, radius: int, cache_key: str = None):
@@ -513,67 +1054,73 @@ def process_timeseries(self, lat: float, lng: float, radius: int, cache_key: str
     A diferencia del análisis principal, el resultado NO depende del "approach": los mismos
     tres índices se calculan siempre igual, así que una sola serie temporal por
     ubicación+radio puede reutilizarse sin importar qué enfoque haya elegido el usuario.
+    Los puntos se guardan en la tabla compartida timeseries_points (por celda y radio
+    exacto, el mismo con que se calculan), así que entre usuarios distintos solo se piden a
+    GEE las pasadas aún no calculadas.
     """
-    try:
-        ee.Initialize()
-    except Exception:
-        logger.warning("GEE no inicializado en el hilo actual. Reintentando...")
-        init_gee()
+    gee_session.ensure_ready()
+    deadline = TaskDeadline.for_task(self)
 
     try:
-        point = ee.Geometry.Point([lng, lat])
-        roi = point.buffer(radius)
+        cell = location_cell(lat, lng)
 
         end_date = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
-        start_date = end_date - datetime.timedelta(days=60)
-
-        col = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
-                .filterBounds(roi)
-                .filterDate(start_date, end_date)
-                .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 60))
-                .sort('system:time_start'))
-
-        def extract_indices(image):
-            indices = calculate_indices(image)
-            stats = indices.select(['NDVI', 'NDWI', 'NDMI']).reduceRegion(
-                reducer=ee.Reducer.mean(),
-                geometry=roi,
-                scale=20,
-                maxPixels=1e9
-            )
-            return ee.Feature(None, {
-                'date': ee.Date(image.get('system:time_start')).format('YYYY-MM-dd'),
-                'clouds': image.get('CLOUDY_PIXEL_PERCENTAGE'),
-                'ndvi': stats.get('NDVI'),
-                'ndwi': stats.get('NDWI'),
-                'ndmi': stats.get('NDMI'),
-            })
-
-        # Un solo getInfo() para TODA la colección (mismo patrón de batching de A2 en
-        # process_gee_analysis): construir N features (una por pasada satelital) y evaluarlas
-        # en una única llamada, en vez de una llamada por imagen.
-        feature_collection = ee.FeatureCollection(col.map(extract_indices))
-        fc_info = get_info_with_timeout(feature_collection, timeout=60)
-
-        chart_data = []
-        for feature in fc_info.get('features', []):
-            props = feature.get('properties', {}) or {}
-            # Pasadas donde la ROI específica quedó totalmente cubierta por nubes/no-data
-            # (aunque el CLOUDY_PIXEL_PERCENTAGE global de la imagen esté bajo el umbral)
-            # devuelven None en reduceRegion; se descartan en vez de graficar un cero falso.
-            if props.get('ndvi') is None:
-                continue
-            chart_data.append({
-                'date': props.get('date'),
-                'ndvi': round(props.get('ndvi', 0), 4),
-                'ndwi': round(props.get('ndwi', 0), 4),
-                'ndmi': round(props.get('ndmi', 0), 4),
-                'clouds': round(props.get('clouds', 0), 1) if props.get('clouds') is not None else None,
-            })
+        start_date = end_date - datetime.timedelta(days=TIMESERIES_WINDOW_DAYS)
+
+        # Lo que otro usuario ya calculó para esta celda+radio no se vuelve a pedir a GEE:
+        # solo se consultan las pasadas posteriores al último punto guardado.
+        stored = read_stored_timeseries(cell, radius, start_date.date())
+        fetch_start = start_date
+        if stored:
+            last_stored = datetime.datetime.strptime(stored[-1]['date'], "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
+            fetch_start = max(start_date, last_stored + datetime.timedelta(days=1))
 
+        needs_gee = fetch_start.date() < end_date.date()
+        fresh = []
+        degraded = False
+        if needs_gee:
+            raise_if_cancelled(self.request.id)
+            try:
+                fresh = fetch_timeseries_points(lat, lng, radius, fetch_start, end_date, deadline)
+            except TimeoutError as e:
+                # Sin presupuesto para las pasadas nuevas: servir lo ya guardado (si hay) en
+                # vez de fallar; la cache corta hace que la próxima consulta lo complete.
+                if not stored:
+                    raise
+                logger.warning(f"Serie temporal parcial ({cell}, r={radius}): {e}")
+                degraded = True
+            store_timeseries_points(cell, radius, fresh)
+            if fresh:
+                note_scene_seen(lat, lng, fresh[-1]['date'])
+
+        log_event(
+            'timeseries_store',
+            task_id=self.request.id,
+            cell=cell,
+            radius=radius,
+            reused_points=len(stored),
+            computed_points=len(fresh),
+            gee_called=needs_gee,
+            degraded=degraded,
+        )
+
+        chart_data = merge_chart_data(stored, fresh)
         result = {"status": "success", "chart_data": chart_data}
-        cache_analysis_result(cache_key, result)
-        return result
+        # Misma vigencia por revisita que el análisis principal: la serie solo cambia
+        # cuando llega una pasada nueva, y su propio chart_data es el historial de nubosidad.
+        cache_ttl = adaptive_ttl_seconds(
+            chart_data[-1]['date'] if chart_data else None,
+            ANALYSIS_CACHE_TTL_SECONDS,
+            usable_ratio=usable_pass_ratio(len(chart_data), TIMESERIES_WINDOW_DAYS),
+        )
+        if degraded:
+            result["degraded"] = True
+            cache_ttl = min(cache_ttl, DEGRADED_CACHE_TTL_SECONDS)
+        cached = cache_analysis_result(cache_key, result, cache_ttl)
+        return compact_task_result(cache_key, result, cached)
+
+    except TaskCancelled as e:
+        stop_cancelled_task(self, e)
 
     except Exception as e:
         logger.error(f"Error en cálculo de serie temporal: {e}", exc_info=True)
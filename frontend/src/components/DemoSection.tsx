@@ -13,6 +13,15 @@ import { DemoResultsCards } from './demo/DemoResultsCards'
 // Declare google as a global variable to satisfy TypeScript
 declare const google: any
 
+// Solicitud de análisis en curso: sus tareas pendientes (análisis y serie temporal), el
+// comprobante wait_id y los timers de sondeo, para detenerla y cancelarla en el backend.
+type PendingRequest = {
+  taskIds: string[]
+  waitId: string | null
+  timers: number[]
+  cancelled: boolean
+}
+
 // Define the approaches configuration
 const approachesConfig: Record<string, { name: string; enName: string; indices: string[] }> = {
   agriculture: { name: 'Agroindustria Inteligente', enName: 'Smart Agribusiness', indices: ['NDVI', 'NDMI', 'SAVI', 'NDRE', 'BSI'] },
@@ -271,6 +280,34 @@ const DemoSectionContent: React.FC<{ mapsKey: string }> = ({ mapsKey }) => {
   const circleRef = useRef<any>(null)
   const geeLayerRef = useRef<any>(null)
   const latestTaskIdRef = useRef<string | null>(null)
+  const pendingRequestRef = useRef<PendingRequest | null>(null)
+
+  // Detiene los sondeos de la solicitud en curso y cancela sus tareas que siguen pendientes
+  // (DELETE con el wait_id): si nadie más espera el mismo resultado, el worker no sigue
+  // gastando cuota de GEE en un análisis que el usuario ya dejó.
+  const cancelPendingRequest = () => {
+    const request = pendingRequestRef.current
+    if (!request) return
+    pendingRequestRef.current = null
+    request.cancelled = true
+    request.timers.forEach(timer => clearTimeout(timer))
+    if (!request.waitId) return
+    for (const taskId of request.taskIds) {
+      fetch(`/api/v1/analyze/${taskId}?wait_id=${encodeURIComponent(request.waitId)}`, {
+        method: 'DELETE',
+        keepalive: true,
+      }).catch(() => {})
+    }
+  }
+
+  // Al salir de la vista o cerrar la pestaña, cancelar lo que aún se está esperando
+  useEffect(() => {
+    window.addEventListener('pagehide', cancelPendingRequest)
+    return () => {
+      window.removeEventListener('pagehide', cancelPendingRequest)
+      cancelPendingRequest()
+    }
+  }, [])
 
   // Sync Google Map type selection
   useEffect(() => {
@@ -531,6 +568,8 @@ const DemoSectionContent: React.FC<{ mapsKey: string }> = ({ mapsKey }) => {
   const handleAnalyze = async () => {
     if (!selectedLocation || !selectedApproach) return
 
+    // Un análisis nuevo reemplaza al anterior: dejar de esperarlo y cancelarlo
+    cancelPendingRequest()
     setIsAnalyzing(true)
     setPollingStatus('Encolando análisis...')
     setActiveAnalysis(null)
@@ -558,11 +597,21 @@ const DemoSectionContent: React.FC<{ mapsKey: string }> = ({ mapsKey }) => {
         const queueData = await res.json()
         const tsTaskId = queueData.timeseries_task_id ?? null
         const tsResult = queueData.timeseries_result ?? null
+        const complete = queueData.status === 'complete'
+        // Comprobante de esta solicitud: se manda en cada sondeo para seguir esperando la
+        // tarea y al cancelarla
+        const request: PendingRequest = {
+          taskIds: [complete ? null : queueData.task_id, tsTaskId].filter((id): id is string => !!id),
+          waitId: queueData.wait_id ?? null,
+          timers: [],
+          cancelled: false,
+        }
+        pendingRequestRef.current = request
 
-        if (queueData.status === 'complete') {
-          handleAnalysisResult(queueData.task_id, queueData.result, tsTaskId, tsResult)
+        if (complete) {
+          handleAnalysisResult(queueData.task_id, queueData.result, tsTaskId, tsResult, request)
         } else {
-          pollCeleryTask(queueData.task_id, tsTaskId, tsResult)
+          pollCeleryTask(queueData.task_id, tsTaskId, tsResult, request, queueData.poll_after_s, queueData.queue?.eta_s)
         }
       } else {
         const errorData = await res.json().catch(() => ({}))
@@ -577,30 +626,60 @@ const DemoSectionContent: React.FC<{ mapsKey: string }> = ({ mapsKey }) => {
     }
   }
 
-  const pollCeleryTask = (taskId: string, tsTaskId: string | null, tsResult: any | null) => {
+  const taskStatusUrl = (taskId: string, waitId: string | null) =>
+    waitId
+      ? `/api/v1/analyze/status/${taskId}?wait_id=${encodeURIComponent(waitId)}`
+      : `/api/v1/analyze/status/${taskId}`
+
+  // Una tarea que terminó (bien o mal) ya no se cancela
+  const settleTask = (request: PendingRequest, taskId: string) => {
+    request.taskIds = request.taskIds.filter(id => id !== taskId)
+    if (!request.taskIds.length && pendingRequestRef.current === request) {
+      pendingRequestRef.current = null
+    }
+  }
+
+  const pollCeleryTask = (
+    taskId: string,
+    tsTaskId: string | null,
+    tsResult: any | null,
+    request: PendingRequest,
+    pollAfterS?: number,
+    etaS?: number | null
+  ) => {
     let intervalId: number
+    // Control de admisión del backend: intervalo de sondeo sugerido y espera estimada en cola
+    const pollMs = Math.max(2, pollAfterS ?? 2) * 1000
+    const queuedMessage = etaS
+      ? `En cola de trabajadores Celery (espera estimada ~${etaS} s)...`
+      : 'En cola de trabajadores Celery...'
 
     const checkStatus = async () => {
       try {
-        const res = await fetch(`/api/v1/analyze/status/${taskId}`)
+        const res = await fetch(taskStatusUrl(taskId, request.waitId))
+        if (request.cancelled) return
         if (res.ok) {
           const data = await res.json()
+          if (request.cancelled) return
 
           if (data.status === 'success') {
             clearInterval(intervalId)
-            handleAnalysisResult(taskId, data.result, tsTaskId, tsResult)
-          } else if (data.status === 'failed') {
+            settleTask(request, taskId)
+            handleAnalysisResult(taskId, data.result, tsTaskId, tsResult, request)
+          } else if (data.status === 'failed' || data.status === 'cancelled') {
             clearInterval(intervalId)
+            settleTask(request, taskId)
             setPollingStatus(null)
             setIsAnalyzing(false)
             alert(data.error || 'Error procesando las imágenes satelitales.')
           } else if (data.status === 'running') {
             setPollingStatus('Procesando bandas en Google Earth Engine...')
           } else {
-            setPollingStatus('En cola de trabajadores Celery...')
+            setPollingStatus(queuedMessage)
           }
         }
       } catch (err) {
+        if (request.cancelled) return
         clearInterval(intervalId)
         setPollingStatus(null)
         setIsAnalyzing(false)
@@ -608,11 +687,17 @@ const DemoSectionContent: React.FC<{ mapsKey: string }> = ({ mapsKey }) => {
       }
     }
 
-    setTimeout(checkStatus, 500)
-    intervalId = setInterval(checkStatus, 2000)
+    intervalId = setInterval(checkStatus, pollMs)
+    request.timers.push(setTimeout(checkStatus, 500), intervalId)
   }
 
-  const handleAnalysisResult = (taskId: string, result: any, tsTaskId: string | null, tsResult: any | null) => {
+  const handleAnalysisResult = (
+    taskId: string,
+    result: any,
+    tsTaskId: string | null,
+    tsResult: any | null,
+    request: PendingRequest
+  ) => {
     const newAnalysis: AnalysisResult = {
       task_id: taskId,
       location_name: selectedLocation!.name,
@@ -636,10 +721,15 @@ const DemoSectionContent: React.FC<{ mapsKey: string }> = ({ mapsKey }) => {
     setIsInterpreting(true)
     bumpInterpretationToken()
     fetchInterpretation(newAnalysis)
-    fetchTimeseries(newAnalysis, tsTaskId, tsResult)
+    fetchTimeseries(newAnalysis, tsTaskId, tsResult, request)
   }
 
-  const fetchTimeseries = (analysis: AnalysisResult, tsTaskId: string | null, tsResultInline: any | null) => {
+  const fetchTimeseries = (
+    analysis: AnalysisResult,
+    tsTaskId: string | null,
+    tsResultInline: any | null,
+    request: PendingRequest
+  ) => {
     const applyChartData = async (chartData: AnalysisResult['chart_data']) => {
       const current = useStore.getState().activeAnalysis
       if (latestTaskIdRef.current === analysis.task_id && current?.task_id === analysis.task_id) {
@@ -677,26 +767,31 @@ const DemoSectionContent: React.FC<{ mapsKey: string }> = ({ mapsKey }) => {
 
     const checkStatus = async () => {
       try {
-        const res = await fetch(`/api/v1/analyze/status/${tsTaskId}`)
+        const res = await fetch(taskStatusUrl(tsTaskId, request.waitId))
+        if (request.cancelled) return
         if (res.ok) {
           const data = await res.json()
+          if (request.cancelled) return
           if (data.status === 'success') {
             clearInterval(intervalId)
+            settleTask(request, tsTaskId)
             applyChartData(data.result?.chart_data || [])
-          } else if (data.status === 'failed') {
+          } else if (data.status === 'failed' || data.status === 'cancelled') {
             clearInterval(intervalId)
+            settleTask(request, tsTaskId)
             if (latestTaskIdRef.current === analysis.task_id) setIsPulseLoading(false)
           }
         }
       } catch (err) {
+        if (request.cancelled) return
         clearInterval(intervalId)
         if (latestTaskIdRef.current === analysis.task_id) setIsPulseLoading(false)
         console.error('Error consultando el Pulso Territorial:', err)
       }
     }
 
-    setTimeout(checkStatus, 800)
     intervalId = setInterval(checkStatus, 3000)
+    request.timers.push(setTimeout(checkStatus, 800), intervalId)
   }
 
   const fetchInterpretation = async (analysis: AnalysisResult) => {
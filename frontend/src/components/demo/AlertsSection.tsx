@@ -109,6 +109,10 @@ export const AlertsSection: React.FC<AlertsSectionProps> = ({
                   <option value="ndwi_above">NDWI (Inundación/Agua) mayor que</option>
                   <option value="ndmi_below">NDMI (Humedad Suelo) menor que</option>
                   <option value="ndvi_drop_pct">Caída de NDVI (%) mayor o igual a</option>
+                  <option value="zscore_anomaly">Anomalía del índice (desviaciones estándar) mayor o igual a</option>
+                  <option value="consecutive_below">Índice menor que, en pasadas seguidas</option>
+                  <option value="vegetation_water_stress">NDVI menor que, con NDMI negativo (estrés hídrico)</option>
+                  <option value="waterlogged_crop">NDWI mayor que, con NDVI bajo 0.3 (anegamiento)</option>
                 </select>
               </div>
 
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Benchmark de pools de Celery para tareas ligadas a GEE
+======================================================
+Compara el pool prefork (un proceso por tarea en vuelo) con el perfil IO (threads, o
+gevent si está instalado) para el tipo de trabajo de los workers de GeoFeedback: tareas
+que pasan casi todo su tiempo esperando respuestas HTTP de Earth Engine.
+
+Para cada pool levanta un worker real (celery -A ... worker) contra el broker de
+REDIS_URL, encola N tareas que simulan un análisis (espera de red + algo de CPU para
+armar el resultado) y mide:
+
+- tareas/s completadas,
+- RSS pico del worker (proceso principal + hijos) y RSS por tarea concurrente.
+
+No llama a GEE: la latencia se simula para que el benchmark sea reproducible y no
+consuma cuota. El worker sí importa app.tasks.worker, así que la memoria base de cada
+proceso (ee, SQLAlchemy, etc.) es la real.
+
+Uso:
+    REDIS_URL=redis://localhost:6379/0 python scripts/benchmark_worker_pools.py \\
+        --tasks 200 --latency 1.5 --pools prefork:4 threads:40
+
+Autor: GeoFeedback Chile
+"""
+
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app.tasks.celery_app import celery_app  # noqa: E402
+import app.tasks.worker  # noqa: E402,F401  (memoria base real del worker)
+
+BENCHMARK_QUEUE = "benchmark"
+
+
+@celery_app.task(name="benchmark.simulated_gee_analysis")
+def simulated_gee_analysis(latency_s: float, cpu_iterations: int) -> dict:
+    """Simula un análisis: espera de red equivalente a getInfo/getMapId y armado del resultado."""
+    time.sleep(latency_s)
+    acc = 0.0
+    for i in range(cpu_iterations):
+        acc += (i % 7) * 0.5
+    return {"status": "success", "checksum": acc}
+
+
+def _children(pid: int) -> list:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", encoding="utf-8") as f:
+            return [int(c) for c in f.read().split()]
+    except OSError:
+        return []
+
+
+def _rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def tree_rss_mb(pid: int) -> float:
+    """RSS del proceso y todos sus descendientes (solo Linux, vía /proc)."""
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        total += _rss_kb(current)
+        pending.extend(_children(current))
+    return total / 1024.0
+
+
+def pool_available(pool: str) -> bool:
+    if pool in ("gevent", "eventlet"):
+        return importlib.util.find_spec(pool) is not None
+    return True
+
+
+def run_pool(pool: str, concurrency: int, tasks: int, latency_s: float, cpu_iterations: int) -> dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([BACKEND_DIR, os.path.dirname(os.path.abspath(__file__))]))
+    worker = subprocess.Popen(
+        [
+            sys.executable, "-m", "celery", "-A", "benchmark_worker_pools", "worker",
+            "--pool", pool, "--concurrency", str(concurrency), "--queues", BENCHMARK_QUEUE,
+            "--loglevel", "warning", "--without-gossip", "--without-mingle", "--without-heartbeat",
+            "-n", f"benchmark-{pool}@%h",
+        ],
+        env=env,
+    )
+    try:
+        # Esperar a que el worker responda antes de medir.
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if celery_app.control.ping(destination=[f"benchmark-{pool}@{os.uname().nodename}"], timeout=1):
+                break
+        baseline_mb = tree_rss_mb(worker.pid)
+
+        started = time.monotonic()
+        results = [
+            simulated_gee_analysis.apply_async(args=(latency_s, cpu_iterations), queue=BENCHMARK_QUEUE)
+            for _ in range(tasks)
+        ]
+        peak_mb = baseline_mb
+        for result in results:
+            while not result.ready():
+                peak_mb = max(peak_mb, tree_rss_mb(worker.pid))
+                time.sleep(0.05)
+        elapsed = time.monotonic() - started
+        failed = sum(1 for r in results if not r.successful())
+    finally:
+        worker.terminate()
+        worker.wait(timeout=30)
+
+    return {
+        "pool": pool,
+        "concurrency": concurrency,
+        "tasks": tasks,
+        "failed": failed,
+        "elapsed_s": round(elapsed, 2),
+        "tasks_per_s": round(tasks / elapsed, 2),
+        "baseline_rss_mb": round(baseline_mb, 1),
+        "peak_rss_mb": round(peak_mb, 1),
+        "rss_per_concurrent_task_mb": round(peak_mb / concurrency, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de pools de Celery para tareas ligadas a GEE")
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=1.5, help="Espera simulada de GEE por tarea (s)")
+    parser.add_argument("--cpu-iterations", type=int, default=20000)
+    parser.add_argument(
+        "--pools", nargs="+", default=["prefork:4", "threads:40", "gevent:100"],
+        help="Pares pool:concurrencia a comparar",
+    )
+    args = parser.parse_args()
+
+    rows = []
+    for spec in args.pools:
+        pool, _, concurrency = spec.partition(":")
+        if not pool_available(pool):
+            print(f"[omitido] {pool}: el paquete no está instalado")
+            continue
+        print(f"Midiendo {pool} (concurrencia {concurrency})...")
+        rows.append(run_pool(pool, int(concurrency or 4), args.tasks, args.latency, args.cpu_iterations))
+
+    print()
+    print(f"{'pool':<10}{'conc':>6}{'tareas/s':>10}{'RSS pico MB':>13}{'MB/tarea':>10}{'fallidas':>10}")
+    for row in rows:
+        print(
+            f"{row['pool']:<10}{row['concurrency']:>6}{row['tasks_per_s']:>10}"
+            f"{row['peak_rss_mb']:>13}{row['rss_per_concurrent_task_mb']:>10}{row['failed']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
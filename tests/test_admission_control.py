@@ -0,0 +1,113 @@
+"""Regresiones para el control de admisión de POST /analyze (app/tasks/admission.py).
+
+Con la cola saturada, el endpoint ya no encola todo: devuelve posición/ETA y un intervalo
+de sondeo, sirve el último resultado vencido o una vista previa, y sobre el umbral de
+rechazo responde 503 con Retry-After.
+"""
+import os
+import sys
+import unittest
+from unittest.mock import patch, MagicMock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from fastapi.testclient import TestClient
+from app.main import app
+import app.core.auth as auth_module
+import app.core.security as security_module
+import app.tasks.admission as admission_module
+from app.core.config import settings
+
+
+def _assess(depth, durations=()):
+    redis = MagicMock()
+    redis.lrange.return_value = [str(d) for d in durations]
+    with patch.object(admission_module, "queue_depth", return_value=depth), \
+            patch.object(admission_module, "redis_client", redis):
+        return admission_module.assess_admission("interactive")
+
+
+class AssessAdmissionTests(unittest.TestCase):
+    def test_eta_uses_queue_slots_and_median_duration(self):
+        slots = settings.admission_queue_slots["interactive"]
+        decision = _assess(depth=slots * 2, durations=[10, 12, 14])
+
+        self.assertEqual(decision["decision"], admission_module.ADMIT)
+        self.assertEqual(decision["position"], slots * 2 + 1)
+        self.assertEqual(decision["eta_s"], 36)
+        self.assertGreaterEqual(decision["poll_after_s"], admission_module.MIN_POLL_SECONDS)
+
+    def test_poll_interval_stays_under_the_abandon_grace_period(self):
+        self.assertLessEqual(admission_module.poll_interval(10_000), settings.TASK_ABANDON_GRACE_S // 2)
+
+    def test_thresholds(self):
+        slots = settings.admission_queue_slots["interactive"]
+        self.assertEqual(_assess(depth=slots * 5, durations=[20])["decision"], admission_module.DEGRADE)
+        rejected = _assess(depth=slots * 20, durations=[20])
+        self.assertEqual(rejected["decision"], admission_module.REJECT)
+        self.assertGreater(rejected["retry_after_s"], 0)
+
+    def test_unknown_depth_admits(self):
+        self.assertEqual(_assess(depth=None)["decision"], admission_module.ADMIT)
+
+
+class AdmissionEndpointTests(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        app.dependency_overrides[auth_module.get_optional_user] = lambda: None
+        security_module.analysis_limiter._requests.clear()
+        self.payload = {"lat": -33.45, "lng": -70.66, "radius": 2000, "approach": "agriculture", "location": "Test"}
+
+    def tearDown(self):
+        app.dependency_overrides.clear()
+        security_module.analysis_limiter._requests.clear()
+
+    def _post(self, decision, stale=None):
+        admission = {"decision": decision, "queue": "interactive", "position": 41, "eta_s": 120,
+                     "poll_after_s": 15, "retry_after_s": 90}
+        mock_delay = MagicMock()
+        mock_delay.return_value.id = "task-1"
+        with patch("app.api.endpoints.analyze.redis_client", None), \
+                patch("app.api.endpoints.analyze.assess_admission", return_value=admission), \
+                patch("app.api.endpoints.analyze.lookup_durable_analysis",
+                      side_effect=lambda *a, include_expired=False, **kw: stale if include_expired else None), \
+                patch("app.tasks.worker.process_gee_analysis.delay", mock_delay):
+            return self.client.post("/api/v1/analyze", json=self.payload), mock_delay
+
+    def test_queued_response_carries_position_eta_and_poll_hint(self):
+        response, mock_delay = self._post(admission_module.ADMIT)
+
+        body = response.json()
+        self.assertEqual(body["queue"], {"position": 41, "eta_s": 120})
+        self.assertEqual(body["poll_after_s"], 15)
+        self.assertEqual(response.headers["Retry-After"], "15")
+        self.assertFalse(mock_delay.call_args.kwargs["preview"])
+
+    def test_overload_serves_stale_result_first(self):
+        stale = {"status": "success", "approach": "agriculture", "data": {}}
+        response, mock_delay = self._post(admission_module.REJECT, stale=stale)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["stale"])
+        mock_delay.assert_not_called()
+
+    def test_degraded_admission_enqueues_a_preview(self):
+        response, mock_delay = self._post(admission_module.DEGRADE)
+
+        self.assertTrue(response.json()["preview"])
+        self.assertTrue(mock_delay.call_args.kwargs["preview"])
+
+    def test_rejection_returns_503_with_retry_after(self):
+        response, mock_delay = self._post(admission_module.REJECT)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "90")
+        mock_delay.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
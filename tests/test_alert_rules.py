@@ -0,0 +1,82 @@
+"""Regresiones para el motor de reglas vectorizado de alertas (app/core/alert_rules.py).
+
+Con los índices del lote ya obtenidos, todas las reglas (umbrales, compuestas y por
+tendencia) se evalúan como operaciones NumPy sobre una tabla en columnas.
+"""
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import numpy as np
+
+from app.core.alert_rules import alert_table, describe_rule, evaluate_rules, triggered_rows
+from app.core.alert_trends import history_matrix
+
+
+def _alert(alert_id, trigger_type, trigger_value, secondary=None, window=None):
+    return SimpleNamespace(id=alert_id, trigger_type=trigger_type, trigger_value=trigger_value,
+                           trigger_secondary_value=secondary, trigger_window=window)
+
+
+def _run(rows, history=None):
+    """rows: [(alerta, {índice: valor}, índice vigilado)]."""
+    alerts, indices, watched = zip(*rows)
+    table = alert_table(alerts, indices, watched)
+    result = evaluate_rules(table, history_matrix(history) if history is not None else None)
+    return table, result
+
+
+class AlertRulesTests(unittest.TestCase):
+    def test_threshold_rules_apply_only_to_the_watched_index(self):
+        table, result = _run([
+            (_alert(1, "ndvi_below", 0.4), {"NDVI": 0.3}, "NDVI"),
+            (_alert(2, "ndvi_below", 0.4), {"NDVI": 0.3, "NDWI": 0.1}, "NDWI"),
+            (_alert(3, "ndwi_above", 0.2), {"NDWI": 0.5}, "NDWI"),
+            (_alert(4, "ndmi_below", 0.1), {"NDVI": 0.3}, "NDMI"),  # Índice faltante
+        ])
+
+        self.assertEqual(triggered_rows(result), [0, 2])
+        self.assertEqual(describe_rule(table, result, 0), "NDVI menor a 0.4")
+
+    def test_composite_rules_use_the_secondary_threshold_or_its_default(self):
+        table, result = _run([
+            (_alert(1, "vegetation_water_stress", 0.4), {"NDVI": 0.3, "NDMI": -0.1}, "NDVI"),
+            (_alert(2, "vegetation_water_stress", 0.4), {"NDVI": 0.3, "NDMI": 0.1}, "NDVI"),
+            (_alert(3, "vegetation_water_stress", 0.4, secondary=0.2), {"NDVI": 0.3, "NDMI": 0.1}, "NDVI"),
+            (_alert(4, "waterlogged_crop", 0.2), {"NDWI": 0.5, "NDVI": 0.6}, "NDWI"),
+        ])
+
+        self.assertEqual(triggered_rows(result), [0, 2])
+        self.assertEqual(describe_rule(table, result, 2), "NDVI menor a 0.4 y NDMI menor a 0.2")
+
+    def test_trend_rules_share_the_batch_with_threshold_rules(self):
+        table, result = _run([
+            (_alert(1, "ndvi_below", 0.4), {"NDVI": 0.5}, "NDVI"),
+            (_alert(2, "ndvi_drop_pct", 20), {"NDVI": 0.4}, "NDVI"),
+            (_alert(3, "ndvi_drop_pct", 20), {"NDWI": 0.4}, "NDWI"),  # Solo sobre NDVI
+            (_alert(4, "consecutive_below", 0.3, window=2), {"NDVI": 0.2}, "NDVI"),
+        ], history=[[], [0.6], [0.6], [0.25]])
+
+        self.assertEqual(triggered_rows(result), [1, 3])
+        self.assertIn("caída calculada: 33.3%", describe_rule(table, result, 1))
+
+    def test_large_batches_are_evaluated_in_one_pass(self):
+        n = 100_000
+        rng = np.random.default_rng(7)
+        values = rng.uniform(0, 1, n)
+        rows = [(_alert(i, "ndvi_below", 0.4), {"NDVI": v}, "NDVI") for i, v in enumerate(values)]
+
+        _, result = _run(rows)
+
+        self.assertEqual(int(result["triggered"].sum()), int((values < 0.4).sum()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+"""Regresiones para la corrida de alertas repartida en subtareas (tasks_periodic.py).
+
+check_active_alerts (tick frecuente) solo reserva las alertas vencidas y lanza un chord
+de check_alert_shard (fragmentos por celda de escena) con summarize_alert_run como cierre.
+"""
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import app.tasks.tasks_periodic as periodic
+from app.core.config import settings
+
+
+def _row(alert_id, lat, lng, zone_id=None):
+    return SimpleNamespace(id=alert_id, lat=lat, lng=lng, zone_id=zone_id)
+
+
+class PackShardsTests(unittest.TestCase):
+    def test_scene_batches_are_never_split_across_shards(self):
+        alerts = [_row(i, -33.5, -70.5) for i in range(1, 4)] + [_row(i, -38.7, -72.6) for i in range(4, 6)]
+        with patch.object(settings, "ALERT_SHARD_SIZE", 4):
+            shards = periodic.pack_alert_shards(alerts)
+
+        self.assertEqual(sorted(map(sorted, shards)), [[1, 2, 3], [4, 5]])
+
+
+class CoordinatorTests(unittest.TestCase):
+    def _run(self, rows):
+        session = MagicMock()
+        session.__enter__.return_value = session
+        session.exec.return_value = iter(rows)
+        with patch.object(periodic, "Session", return_value=session), \
+                patch.object(periodic, "chord") as mock_chord:
+            return periodic.check_active_alerts(), mock_chord, session
+
+    def test_tick_claims_due_alerts_and_fans_out_a_chord(self):
+        rows = [_row(1, -33.5, -70.5), _row(2, -33.5, -70.5), _row(3, -38.7, -72.6)]
+        result, mock_chord, session = self._run(rows)
+
+        query = session.exec.call_args.args[0]
+        self.assertEqual(query.get_execution_options()["yield_per"], settings.ALERT_PAGE_SIZE)
+        self.assertEqual(query._limit, settings.ALERT_TICK_MAX_ALERTS)
+        self.assertTrue(query._for_update_arg.skip_locked)
+        # Las alertas encoladas quedan reservadas antes de lanzar el chord
+        session.execute.assert_called_once()
+        session.commit.assert_called_once()
+        self.assertEqual(result, {"status": "dispatched", "alerts": 3, "shards": 1})
+        header = list(mock_chord.call_args.args[0])
+        self.assertEqual([sorted(sig.args[0]) for sig in header], [[1, 2, 3]])
+        mock_chord.return_value.assert_called_once()
+
+    def test_tick_without_due_alerts_is_idle(self):
+        result, mock_chord, session = self._run([])
+
+        mock_chord.assert_not_called()
+        session.execute.assert_not_called()
+        self.assertEqual(result["status"], "idle")
+
+
+class SummaryTests(unittest.TestCase):
+    def test_summary_adds_up_shard_counters(self):
+        shards = [
+            {"alerts": 3, "evaluated": 2, "triggered": 1, "failed": 1, "skipped": 0, "deferred": 0},
+            {"alerts": 2, "evaluated": 0, "triggered": 0, "failed": 0, "skipped": 1, "deferred": 1},
+        ]
+        with patch.object(periodic, "log_event") as mock_log:
+            summary = periodic.summarize_alert_run(shards, started_at=0)
+
+        self.assertEqual(summary["shards"], 2)
+        self.assertEqual((summary["evaluated"], summary["triggered"], summary["failed"]), (2, 1, 1))
+        self.assertEqual((summary["skipped"], summary["deferred"]), (1, 1))
+        mock_log.assert_called_once()
+
+    def test_a_crashing_shard_reports_its_alerts_as_failed(self):
+        with patch.object(periodic, "gee_session") as mock_session:
+            mock_session.ensure_ready.side_effect = RuntimeError("GEE caído")
+            summary = periodic.check_alert_shard([1, 2])
+
+        self.assertEqual(summary["failed"], 2)
+
+    def test_shard_budget_comes_from_the_running_task(self):
+        seen = {}
+
+        def for_task(task):
+            seen["task_id"] = task.request.id
+            raise RuntimeError("sin presupuesto")
+
+        with patch.object(periodic, "gee_session"), \
+                patch.object(periodic.TaskDeadline, "for_task", side_effect=for_task):
+            periodic.check_alert_shard.apply(args=([1],), task_id="shard-1").get()
+
+        # El presupuesto se lee del request de la ejecución en curso, no del objeto del módulo
+        self.assertEqual(seen["task_id"], "shard-1")
+
+
+if __name__ == "__main__":
+    unittest.main()
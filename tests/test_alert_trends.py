@@ -0,0 +1,123 @@
+"""Regresiones para los disparadores de alertas por tendencia (app/core/alert_trends.py).
+
+Cada alerta evaluada agrega una observación a alert_observations (tabla particionada por
+mes); ndvi_drop_pct, zscore_anomaly y consecutive_below se evalúan de una vez por lote
+sobre ese historial, sin volver a pedirlo a GEE.
+"""
+import datetime
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+
+import app.tasks.tasks_periodic as periodic
+import app.db.observation_store as observation_store
+from app.core.alert_trends import evaluate_trends, history_matrix
+from app.db.models import AlertObservation
+
+
+def _evaluate(trigger_type, threshold, window, current, history):
+    result = evaluate_trends([trigger_type], [threshold], [window], [current], history_matrix([history]))
+    return {key: values[0] for key, values in result.items()}
+
+
+class TrendEngineTests(unittest.TestCase):
+    def test_drop_is_measured_against_the_rolling_mean(self):
+        # Promedio de las últimas 3: 0.6; 0.45 es una caída de 25 %
+        result = _evaluate("ndvi_drop_pct", 20, 3, 0.45, [0.1, 0.5, 0.6, 0.7])
+
+        self.assertTrue(result["triggered"])
+        self.assertAlmostEqual(result["baseline"], 0.6)
+        self.assertAlmostEqual(result["drop_pct"], 25.0)
+
+    def test_zscore_needs_enough_history(self):
+        history = [0.50, 0.52, 0.48, 0.51, 0.49]
+        self.assertTrue(_evaluate("zscore_anomaly", 3, 8, 0.30, history)["triggered"])
+        self.assertFalse(_evaluate("zscore_anomaly", 3, 8, 0.50, history)["triggered"])
+        self.assertFalse(_evaluate("zscore_anomaly", 3, 8, 0.30, history[:2])["triggered"])
+
+    def test_consecutive_breaches_are_counted_back_from_the_current_pass(self):
+        result = _evaluate("consecutive_below", 0.3, 3, 0.2, [0.1, 0.4, 0.25, 0.28])
+
+        self.assertEqual(result["streak"], 3)
+        self.assertTrue(result["triggered"])
+        self.assertFalse(_evaluate("consecutive_below", 0.3, 3, 0.2, [0.25, 0.4, 0.28])["triggered"])
+
+    def test_rows_are_evaluated_together_and_gaps_do_not_trigger(self):
+        result = evaluate_trends(
+            ["ndvi_drop_pct", "consecutive_below", "zscore_anomaly"], [10, 0.3, 2], [3, 2, 8],
+            [0.3, 0.2, 0.9], history_matrix([[], [None], [0.5, 0.5, 0.5]]),
+        )
+
+        # Sin historial, con un hueco en la racha y con desviación cero: nada se dispara
+        self.assertEqual(result["triggered"].tolist(), [False, False, False])
+
+
+class ObservationStoreTests(unittest.TestCase):
+    def test_table_is_partitioned_by_month(self):
+        ddl = str(CreateTable(AlertObservation.__table__).compile(dialect=postgresql.dialect()))
+        self.assertIn("PARTITION BY RANGE (acquisition_date)", ddl)
+        self.assertIn("PRIMARY KEY (alert_id, acquisition_date)", ddl)
+
+        session = MagicMock()
+        observation_store.ensure_month_partitions(session, [datetime.date(2026, 12, 3), datetime.date(2026, 12, 20)])
+        session.execute.assert_called_once()
+        self.assertIn("FROM ('2026-12-01') TO ('2027-01-01')", str(session.execute.call_args.args[0]))
+
+
+class TrendAlertBatchTests(unittest.TestCase):
+    @patch.object(periodic, "insert_observations")
+    @patch.object(periodic, "load_recent_observations")
+    @patch.object(periodic, "enqueue_notifications")
+    @patch.object(periodic, "evaluate_alert_batch")
+    @patch.object(periodic, "latest_scene_times")
+    def test_batch_reads_history_once_and_records_the_pass(self, mock_scenes, mock_batch, mock_enqueue,
+                                                            mock_history, mock_insert):
+        scene_at = datetime.datetime(2026, 10, 14, 14, 30, tzinfo=datetime.UTC)
+        alerts = [
+            SimpleNamespace(id=1, location_name="Estable", lat=-33.5, lng=-70.5, radius=1000, approach="agriculture",
+                            frequency="daily", trigger_type="zscore_anomaly", trigger_value=3, trigger_secondary_value=None,
+                            trigger_window=None, last_index_value=0.5, last_scene_at=None, zone_id=None,
+                            zone_lat=None, zone_lng=None, zone_radius=None, email="a@geofeedback.cl"),
+            SimpleNamespace(id=2, location_name="Nueva", lat=-33.5, lng=-70.5, radius=1000, approach="agriculture",
+                            frequency="daily", trigger_type="ndvi_drop_pct", trigger_value=20, trigger_secondary_value=None,
+                            trigger_window=None, last_index_value=0.6, last_scene_at=None, zone_id=None,
+                            zone_lat=None, zone_lng=None, zone_radius=None, email="b@geofeedback.cl"),
+        ]
+        mock_scenes.return_value = {1: scene_at, 2: scene_at}
+        mock_batch.return_value = {1: {"NDVI": 0.2, "NDWI": 0.1, "NDMI": 0.3}, 2: {"NDVI": 0.42, "NDWI": 0.1, "NDMI": 0.3}}
+        days = [datetime.date(2026, 9, d) for d in (1, 6, 11, 16, 21)]
+        mock_history.return_value = {
+            1: [{"date": d, "NDVI": v, "NDWI": None, "NDMI": None} for d, v in zip(days, [0.5, 0.52, 0.48, 0.51, 0.49])]
+            # La pasada actual ya guardada no cuenta como su propia base
+            + [{"date": scene_at.date(), "NDVI": 0.2, "NDWI": None, "NDMI": None}],
+        }
+        summary = {key: 0 for key in ("evaluated", "reused", "unchanged", "triggered", "failed")}
+
+        with patch.object(periodic, "Session"), patch.object(periodic, "redis_client", None), \
+                patch.object(periodic, "load_points_on_dates", return_value={}):
+            periodic._check_alert_batch(MagicMock(), alerts, MagicMock(), summary)
+
+        mock_history.assert_called_once()
+        self.assertEqual(sorted(mock_history.call_args.args[1]), [1, 2])
+        # Alerta 1: anomalía; alerta 2: sin historial, se compara con last_index_value (caída del 30 %)
+        self.assertEqual(summary["triggered"], 2)
+        queued = mock_enqueue.call_args.args[1]
+        self.assertEqual([row["to_email"] for row in queued], ["a@geofeedback.cl", "b@geofeedback.cl"])
+        rows = mock_insert.call_args.args[1]
+        self.assertEqual([(r["alert_id"], r["acquisition_date"], r["ndvi"]) for r in rows],
+                         [(1, scene_at.date(), 0.2), (2, scene_at.date(), 0.42)])
+
+
+if __name__ == "__main__":
+    unittest.main()
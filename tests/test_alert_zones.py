@@ -0,0 +1,139 @@
+"""Regresiones para las zonas compartidas de alertas (app/db/zone_store.py).
+
+Las alertas del mismo lugar (mismo radio, centros a menos de ALERT_ZONE_MAX_SHIFT × radio)
+comparten zona: se reducen una sola vez en GEE, cada una recibe el valor y se
+evalúa con su propia regla, y vencen juntas.
+"""
+import datetime
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import app.db.zone_store as zone_store
+import app.tasks.tasks_periodic as periodic
+from app.core.config import settings
+
+
+def _alert(alert_id, zone_id=None, trigger_type="ndvi_below", trigger_value=0.4, frequency="daily", lat=-33.5, lng=-70.5):
+    zone = {"zone_lat": -33.5, "zone_lng": -70.5, "zone_radius": 1000} if zone_id is not None else \
+        {"zone_lat": None, "zone_lng": None, "zone_radius": None}
+    return SimpleNamespace(
+        id=alert_id, location_name=f"Zona {alert_id}", lat=lat, lng=lng, radius=1000, approach="general",
+        frequency=frequency, trigger_type=trigger_type, trigger_value=trigger_value, trigger_secondary_value=None,
+        trigger_window=None, last_index_value=None, last_scene_at=None, zone_id=zone_id,
+        email=f"u{alert_id}@geofeedback.cl", **zone,
+    )
+
+
+class ZoneAssignmentTests(unittest.TestCase):
+    def _session(self, zones):
+        session = MagicMock()
+        session.exec.return_value.all.return_value = zones
+        return session
+
+    def test_a_nearby_zone_with_the_same_radius_is_reused(self):
+        # ~1,1 m al norte: muy por debajo del 5 % de 1000 m
+        session = self._session([SimpleNamespace(id=7, lat=-33.49999, lng=-70.5)])
+        zone_id = zone_store.assign_alert_zone(session, -33.5, -70.5, 1000)
+
+        self.assertEqual(zone_id, 7)
+        session.add.assert_not_called()
+        self.assertIn("member_count", str(session.execute.call_args.args[0]))
+
+    def test_zones_are_looked_up_by_the_exact_radius(self):
+        # 980 m y 1000 m caen en el mismo tramo de 100 m, pero cada una se evalúa con su radio
+        session = self._session([])
+        zone_store.assign_alert_zone(session, -33.5, -70.5, 980)
+
+        query = session.exec.call_args.args[0].compile()
+        self.assertIn("alert_zones.radius =", str(query))
+        self.assertIn(980, query.params.values())
+        self.assertEqual(session.add.call_args.args[0].radius, 980)
+
+    def test_a_shifted_center_starts_a_new_zone(self):
+        # ~111 m de distancia con radio 1000 m: la superposición ya no basta
+        session = self._session([SimpleNamespace(id=7, lat=-33.501, lng=-70.5)])
+        zone_store.assign_alert_zone(session, -33.5, -70.5, 1000)
+
+        zone = session.add.call_args.args[0]
+        self.assertEqual((zone.lat, zone.lng, zone.radius, zone.member_count), (-33.5, -70.5, 1000, 1))
+        session.flush.assert_called_once()
+
+    def test_release_drops_empty_zones_and_ignores_alerts_without_zone(self):
+        session = MagicMock()
+        zone_store.release_alert_zone(session, None)
+        session.execute.assert_not_called()
+
+        zone_store.release_alert_zone(session, 7)
+        update_sql, delete_sql = (str(c.args[0]) for c in session.execute.call_args_list)
+        self.assertIn("member_count", update_sql)
+        self.assertTrue(delete_sql.startswith("DELETE FROM metadata.alert_zones"))
+
+    def test_distance_is_in_meters(self):
+        self.assertAlmostEqual(zone_store.distance_m(-33.5, -70.5, -33.501, -70.5), 111.2, delta=0.5)
+
+
+class ZoneEvaluationTests(unittest.TestCase):
+    @patch("app.tasks.tasks_periodic.ee")
+    @patch("app.tasks.tasks_periodic.get_sentinel2_collection")
+    @patch("app.tasks.tasks_periodic.calculate_indices")
+    @patch("app.tasks.tasks_periodic.get_info_with_timeout")
+    @patch("app.tasks.tasks_periodic.cached_alert_values", return_value={})
+    @patch("app.tasks.tasks_periodic.enqueue_notifications")
+    def test_co_located_alerts_are_reduced_once_and_get_the_same_value(
+        self, mock_enqueue, mock_cached, mock_get_info, mock_calc_indices, mock_get_s2, mock_ee
+    ):
+        # Tres usuarios en la misma zona (umbrales distintos) y una alerta suelta
+        batch = [_alert(1, zone_id=9, trigger_value=0.4), _alert(2, zone_id=9, trigger_value=0.3),
+                 _alert(3, zone_id=9, trigger_type="ndwi_above", trigger_value=0.5), _alert(4, lat=-33.6)]
+        scene_ms = 1760000000000
+        mock_get_info.side_effect = [
+            {"features": [{"properties": {"alert_id": i, "latest_scene_ms": scene_ms}} for i in (1, 4)]},
+            {"features": [{"properties": {"alert_id": 1, "NDVI": 0.35, "NDWI": 0.1, "NDMI": 0.2}},
+                          {"properties": {"alert_id": 4, "NDVI": 0.6, "NDWI": 0.1, "NDMI": 0.2}}]},
+        ]
+        session = MagicMock()
+        summary = {"evaluated": 0, "reused": 0, "unchanged": 0, "triggered": 0, "failed": 0}
+
+        periodic._check_alert_batch(session, batch, MagicMock(), summary)
+
+        # Dos zonas por consulta (no cuatro), la compartida con su centro y radio
+        self.assertEqual(mock_ee.Feature.call_count, 4)
+        self.assertIn([-70.5, -33.5], [c.args[0] for c in mock_ee.Geometry.Point.call_args_list])
+        written = {row["id"]: row for c in session.execute.call_args_list if len(c.args) > 1 for row in c.args[1]}
+        self.assertEqual([written[i]["last_index_value"] for i in (1, 2, 3, 4)], [0.35, 0.35, 0.1, 0.6])
+        # Cada alerta con su propia regla: solo la de umbral 0.4 se dispara
+        queued = mock_enqueue.call_args.args[1]
+        self.assertEqual([row["alert_id"] for row in queued], [1])
+        self.assertEqual((summary["evaluated"], summary["triggered"]), (4, 1))
+        self.assertEqual(len({written[i]["next_due_at"] for i in (1, 2, 3)}), 1)
+
+
+class ZoneSchedulingTests(unittest.TestCase):
+    def test_zone_members_come_due_together(self):
+        now = datetime.datetime(2026, 1, 10, 12, 0, tzinfo=datetime.UTC)
+        daily = [periodic.next_alert_due_at(alert_id, "daily", now, zone_id=3) for alert_id in (1, 2, 50)]
+        weekly = periodic.next_alert_due_at(99, "weekly", now, zone_id=3)
+
+        self.assertEqual(len(set(daily)), 1)
+        # La semanal cae el día que le toca a la misma hora que las diarias de la zona
+        self.assertEqual(weekly.time(), daily[0].time())
+
+    def test_zone_members_share_a_scene_batch(self):
+        alerts = [_alert(1, zone_id=9), _alert(2), _alert(3, zone_id=9), _alert(4)]
+        with patch.object(settings, "ALERT_BATCH_MAX_FEATURES", 2):
+            batches = periodic.group_alerts_by_scene(alerts)
+
+        self.assertEqual([[a.id for a in batch] for batch in batches], [[1, 3, 2], [4]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 import os
 import sys
 import unittest
+from types import SimpleNamespace
 from unittest.mock import patch, MagicMock
 from fastapi.testclient import TestClient
 
@@ -13,7 +14,27 @@ from app.main import app
 import app.db.session as session_module
 import app.core.auth as auth_module
 from app.db.models import User, UserAlert, UserAnalysis
-from app.tasks.tasks_periodic import check_active_alerts
+from app.tasks.tasks_periodic import check_alert_shard, due_alerts_condition, next_alert_due_at
+
+
+def _alert_row(alert, email="testuser@geofeedback.cl"):
+    """Fila como la devuelve due_alerts_query: columnas de la alerta, el correo del dueño y la zona."""
+    return SimpleNamespace(**alert.model_dump(), email=email, zone_lat=None, zone_lng=None, zone_radius=None)
+
+
+def _bulk_updates(mock_session):
+    """Parámetros del UPDATE en bloque por clave primaria, por id de alerta."""
+    return {
+        params["id"]: params
+        for call in mock_session.execute.call_args_list if len(call.args) > 1
+        for params in call.args[1]
+    }
+
+
+def _queued(mock_enqueue):
+    """Correos encolados en notification_outbox, en orden."""
+    return [row for call in mock_enqueue.call_args_list for row in call.args[1]]
+
 
 class AlertsAndPdfTests(unittest.TestCase):
     def setUp(self):
@@ -168,12 +189,12 @@ class AlertsAndPdfTests(unittest.TestCase):
         self.assertIn("El suelo está estable.", response.text)
 
     @patch("app.tasks.tasks_periodic.ee")
-    @patch("app.tasks.tasks_periodic.init_gee")
-    @patch("app.tasks.tasks_periodic.get_sentinel2_image")
+    @patch("app.tasks.tasks_periodic.gee_session")
+    @patch("app.tasks.tasks_periodic.get_sentinel2_collection")
     @patch("app.tasks.tasks_periodic.calculate_indices")
     @patch("app.tasks.tasks_periodic.get_info_with_timeout")
-    @patch("app.tasks.tasks_periodic.send_alert_email")
-    def test_periodic_alerts_task_execution(self, mock_send_email, mock_get_info, mock_calc_indices, mock_get_s2, mock_init_gee, mock_ee):
+    @patch("app.tasks.tasks_periodic.enqueue_notifications")
+    def test_periodic_alerts_task_execution(self, mock_enqueue, mock_get_info, mock_calc_indices, mock_get_s2, mock_gee_session, mock_ee):
         # Configurar datos de simulación
         my_alert = UserAlert(
             id=3,
@@ -189,71 +210,225 @@ class AlertsAndPdfTests(unittest.TestCase):
         )
         
         # Mocks de base de datos
-        self.mock_session.exec.return_value.all.return_value = [my_alert]
-        self.mock_session.get.return_value = self.fake_user
+        self.mock_session.exec.return_value.all.return_value = [_alert_row(my_alert)]
         
         # Mock de Earth Engine
         mock_ee.Geometry.Point.return_value = MagicMock()
         mock_ee.Reducer.mean.return_value = MagicMock()
         
         mock_get_s2.return_value = MagicMock()
-        mock_calc_indices.return_value.select.return_value.reduceRegion.return_value = MagicMock()
+        mock_calc_indices.return_value.select.return_value.reduceRegions.return_value = MagicMock()
         
         # Simular que el NDVI promedio obtenido es 0.35 (menor que el trigger de 0.4)
-        mock_get_info.return_value = {"NDVI": 0.35}
+        # (la primera llamada es la consulta de escenas recientes)
+        mock_get_info.side_effect = [
+            {"features": [{"properties": {"alert_id": 3, "latest_scene_ms": 1760000000000}}]},
+            {"features": [{"properties": {"alert_id": 3, "NDVI": 0.35, "NDWI": -0.2, "NDMI": 0.1}}]},
+        ]
         
         # Ejecutar la tarea periódica
         with patch("app.tasks.tasks_periodic.Session", return_value=self.mock_session):
-            check_active_alerts()
+            summary = check_alert_shard([3])
             
-        # Verificar que se disparó la alerta y se envió el correo
-        mock_send_email.assert_called_once_with(
-            to_email=self.fake_user.email,
-            location_name=my_alert.location_name,
-            trigger_desc="NDVI menor a 0.4",
-            index_name="NDVI",
-            current_value=0.35
-        )
+        # Verificar que se disparó la alerta y se encoló el correo
+        queued = _queued(mock_enqueue)
+        self.assertEqual(len(queued), 1)
+        self.assertEqual(queued[0]["to_email"], self.fake_user.email)
+        self.assertEqual(queued[0]["payload"], {
+            "location_name": my_alert.location_name,
+            "trigger_desc": "NDVI menor a 0.4",
+            "index_name": "NDVI",
+            "current_value": 0.35,
+        })
         
         # Verificar que se actualizó el último valor en el registro de alerta
-        self.assertEqual(my_alert.last_index_value, 0.35)
-        self.assertIsNotNone(my_alert.last_checked_at)
+        written = _bulk_updates(self.mock_session)[3]
+        self.assertEqual(written["last_index_value"], 0.35)
+        self.assertIsNotNone(written["last_checked_at"])
+        self.assertEqual(written["last_scene_at"].timestamp(), 1760000000)
+        self.assertGreater(written["next_due_at"], written["last_checked_at"])
+
+    def test_alert_eligibility_is_filtered_in_sql(self):
+        import datetime
+        from sqlalchemy.dialects import postgresql
+        now = datetime.datetime(2026, 1, 10, tzinfo=datetime.UTC)
+        sql = str(due_alerts_condition(now).compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+        # Solo activas con la próxima revisión vencida (o nuevas) y dueño con correo
+        self.assertIn("metadata.user_alerts.is_active = true", sql)
+        self.assertIn("metadata.user_alerts.next_due_at IS NULL OR metadata.user_alerts.next_due_at <= '2026-01-10 00:00:00+00:00'", sql)
+        self.assertIn("metadata.users.email IS NOT NULL", sql)
+
+    def test_next_due_is_spread_across_the_frequency_window(self):
+        import datetime
+        now = datetime.datetime(2026, 1, 10, 12, 0, tzinfo=datetime.UTC)
+        due = [next_alert_due_at(alert_id, "daily", now) for alert_id in range(1, 201)]
+
+        self.assertTrue(all(now < d <= now + datetime.timedelta(days=1) for d in due))
+        # Cada hora del día recibe alguna alerta: no hay un pico diario
+        self.assertEqual(len({d.hour for d in due}), 24)
+        # Estable: la misma alerta cae a la misma hora en la ventana siguiente
+        self.assertEqual(next_alert_due_at(7, "daily", due[6]), due[6] + datetime.timedelta(days=1))
+        weekly = next_alert_due_at(7, "weekly", now)
+        self.assertTrue(now < weekly <= now + datetime.timedelta(days=7))
 
     @patch("app.tasks.tasks_periodic.ee")
-    @patch("app.tasks.tasks_periodic.init_gee")
-    @patch("app.tasks.tasks_periodic.get_sentinel2_image")
+    @patch("app.tasks.tasks_periodic.gee_session")
+    @patch("app.tasks.tasks_periodic.get_sentinel2_collection")
     @patch("app.tasks.tasks_periodic.calculate_indices")
     @patch("app.tasks.tasks_periodic.get_info_with_timeout")
-    @patch("app.tasks.tasks_periodic.send_alert_email")
-    def test_periodic_alerts_skips_recent_weekly_alert(self, mock_send_email, mock_get_info, mock_calc_indices, mock_get_s2, mock_init_gee, mock_ee):
-        import datetime
-        # Configurar una alerta semanal que ya se revisó hace 2 días
-        my_alert = UserAlert(
-            id=4,
-            user_id=self.fake_user.id,
-            location_name="Monitoreo Semanal Reciente",
-            lat=-33.5,
-            lng=-70.5,
-            radius=1000,
-            approach="agriculture",
-            trigger_type="ndvi_below",
-            trigger_value=0.4,
-            is_active=True,
-            frequency="weekly",
-            last_checked_at=datetime.datetime.now(datetime.UTC) - datetime.timedelta(days=2)
-        )
-        
-        # Mocks de base de datos
-        self.mock_session.exec.return_value.all.return_value = [my_alert]
-        self.mock_session.get.return_value = self.fake_user
-        
+    @patch("app.tasks.tasks_periodic.enqueue_notifications")
+    def test_periodic_alerts_skips_alerts_no_longer_eligible(self, mock_enqueue, mock_get_info, mock_calc_indices, mock_get_s2, mock_gee_session, mock_ee):
+        # La alerta 4 se desactivó entre el tick y el fragmento: la consulta no la trae
+        self.mock_session.exec.return_value.all.return_value = []
+
         # Ejecutar la tarea periódica
         with patch("app.tasks.tasks_periodic.Session", return_value=self.mock_session):
-            check_active_alerts()
+            summary = check_alert_shard([4])
             
-        # Verificar que NO se envió ningún correo ni se llamó a GEE
-        mock_send_email.assert_not_called()
+        # Verificar que NO se encoló ningún correo ni se llamó a GEE
+        self.assertEqual(_queued(mock_enqueue), [])
         mock_get_s2.assert_not_called()
+        self.mock_session.get.assert_not_called()
+        self.assertEqual(summary["skipped"], 1)
+
+    @patch("app.tasks.tasks_periodic.ee")
+    @patch("app.tasks.tasks_periodic.gee_session")
+    @patch("app.tasks.tasks_periodic.get_sentinel2_collection")
+    @patch("app.tasks.tasks_periodic.calculate_indices")
+    @patch("app.tasks.tasks_periodic.get_info_with_timeout")
+    @patch("app.tasks.tasks_periodic.enqueue_notifications")
+    def test_periodic_alerts_are_batched_per_scene_cell(self, mock_enqueue, mock_get_info, mock_calc_indices, mock_get_s2, mock_gee_session, mock_ee):
+        def make_alert(alert_id, lat, lng, trigger_type="ndvi_below"):
+            return UserAlert(
+                id=alert_id, user_id=self.fake_user.id, location_name=f"Zona {alert_id}",
+                lat=lat, lng=lng, radius=1000, approach="general",
+                trigger_type=trigger_type, trigger_value=0.4, is_active=True,
+            )
+        # Dos alertas en la misma celda de escena y una tercera en otra
+        alerts = [make_alert(1, -33.51, -70.52), make_alert(2, -33.48, -70.55, "ndwi_above"), make_alert(3, -38.7, -72.6)]
+        self.mock_session.exec.return_value.all.return_value = [_alert_row(a) for a in alerts]
+        scenes = lambda *ids: {"features": [{"properties": {"alert_id": i, "latest_scene_ms": 1760000000000}} for i in ids]}
+        mock_get_info.side_effect = [
+            scenes(1, 2),
+            {"features": [{"properties": {"alert_id": 1, "NDVI": 0.5, "NDWI": 0.1, "NDMI": 0.2}},
+                          {"properties": {"alert_id": 2, "NDVI": 0.3, "NDWI": 0.6, "NDMI": 0.2}}]},
+            scenes(3),
+            {"features": [{"properties": {"alert_id": 3}}]},  # Sin píxeles válidos
+        ]
+
+        with patch("app.tasks.tasks_periodic.Session", return_value=self.mock_session):
+            summary = check_alert_shard([1, 2, 3])
+
+        self.assertEqual(mock_get_info.call_count, 4)
+        queued = _queued(mock_enqueue)
+        self.assertEqual(len(queued), 1)
+        self.assertEqual(queued[0]["payload"]["index_name"], "NDWI")
+        written = _bulk_updates(self.mock_session)
+        self.assertEqual(written[1]["last_index_value"], 0.5)
+        self.assertEqual(written[2]["last_index_value"], 0.6)
+        self.assertNotIn(3, written)  # Falla de GEE: sigue vencida y se reintenta
+        self.assertEqual((summary["evaluated"], summary["triggered"], summary["failed"]), (2, 1, 1))
+
+    @patch("app.tasks.tasks_periodic.ee")
+    @patch("app.tasks.tasks_periodic.gee_session")
+    @patch("app.tasks.tasks_periodic.get_sentinel2_collection")
+    @patch("app.tasks.tasks_periodic.calculate_indices")
+    @patch("app.tasks.tasks_periodic.get_info_with_timeout")
+    @patch("app.tasks.tasks_periodic.enqueue_notifications")
+    def test_periodic_alerts_skip_evaluation_without_a_new_scene(self, mock_enqueue, mock_get_info, mock_calc_indices, mock_get_s2, mock_gee_session, mock_ee):
+        import datetime
+        last_scene = datetime.datetime(2025, 10, 9, 14, 30)  # Sin zona horaria, como vuelve de PostGIS
+        my_alert = UserAlert(
+            id=5, user_id=self.fake_user.id, location_name="Sin escena nueva",
+            lat=-33.5, lng=-70.5, radius=1000, approach="agriculture",
+            trigger_type="ndvi_below", trigger_value=0.4, is_active=True,
+            last_index_value=0.35, last_scene_at=last_scene,
+        )
+        self.mock_session.exec.return_value.all.return_value = [_alert_row(my_alert)]
+        scene_ms = int(last_scene.replace(tzinfo=datetime.UTC).timestamp() * 1000)
+        mock_get_info.return_value = {"features": [{"properties": {"alert_id": 5, "latest_scene_ms": scene_ms}}]}
+
+        with patch("app.tasks.tasks_periodic.Session", return_value=self.mock_session):
+            summary = check_alert_shard([5])
+
+        # Solo la consulta barata de escenas: sin reduceRegions ni correo repetido
+        mock_get_info.assert_called_once()
+        self.assertEqual(_queued(mock_enqueue), [])
+        self.assertEqual(summary["unchanged"], 1)
+        # Solo last_checked_at y la próxima revisión, sin valor ni escena nuevos
+        self.assertEqual(set(_bulk_updates(self.mock_session)[5]), {"id", "last_checked_at", "next_due_at"})
+
+    @patch("app.tasks.tasks_periodic.load_points_on_dates")
+    @patch("app.tasks.tasks_periodic.ee")
+    @patch("app.tasks.tasks_periodic.gee_session")
+    @patch("app.tasks.tasks_periodic.get_sentinel2_collection")
+    @patch("app.tasks.tasks_periodic.calculate_indices")
+    @patch("app.tasks.tasks_periodic.get_info_with_timeout")
+    @patch("app.tasks.tasks_periodic.enqueue_notifications")
+    def test_periodic_alerts_reuse_cached_results_for_the_same_scene(self, mock_enqueue, mock_get_info, mock_calc_indices, mock_get_s2, mock_gee_session, mock_ee, mock_points):
+        import datetime
+        import json
+        from app.core.cells import location_cell
+        import app.tasks.tasks_periodic as periodic
+        def make_alert(alert_id, lat):
+            return UserAlert(
+                id=alert_id, user_id=self.fake_user.id, location_name=f"Zona {alert_id}",
+                lat=lat, lng=-70.5, radius=1000, approach="agriculture",
+                trigger_type="ndvi_below", trigger_value=0.4, is_active=True,
+            )
+        alerts = [make_alert(1, -33.50), make_alert(2, -33.52), make_alert(3, -33.54)]
+        self.mock_session.exec.return_value.all.return_value = [_alert_row(a) for a in alerts]
+        scene_ms = int(datetime.datetime(2026, 10, 14, 14, 30, tzinfo=datetime.UTC).timestamp() * 1000)
+        mock_get_info.side_effect = [
+            {"features": [{"properties": {"alert_id": i, "latest_scene_ms": scene_ms}} for i in (1, 2, 3)]},
+            {"features": [{"properties": {"alert_id": 3, "NDVI": 0.7}}]},
+        ]
+        # Alerta 1: análisis de un usuario de la misma pasada; alerta 2: punto en la tabla compartida
+        analysis = {"status": "success", "meta": {"date": "2026-10-14", "indices": {"NDVI": 0.31}}}
+        stale_series = {"status": "success", "chart_data": [{"date": "2026-10-09", "ndvi": 0.9}]}
+        redis = MagicMock()
+        redis.mget.return_value = [json.dumps(analysis), None, None, json.dumps(stale_series), None, None]
+        mock_points.return_value = {
+            (location_cell(-33.52, -70.5), 1000, datetime.date(2026, 10, 14)): {"date": "2026-10-14", "ndvi": 0.55},
+        }
+
+        with patch("app.tasks.tasks_periodic.Session", return_value=self.mock_session), \
+                patch.object(periodic, "redis_client", redis):
+            summary = check_alert_shard([1, 2, 3])
+
+        # reduceRegions solo para la alerta 3
+        self.assertEqual(mock_get_info.call_count, 2)
+        self.assertEqual(len(mock_ee.Feature.call_args_list), 3 + 1)
+        written = _bulk_updates(self.mock_session)
+        self.assertEqual((written[1]["last_index_value"], written[1]["last_value_source"]), (0.31, "analysis_cache"))
+        self.assertEqual((written[2]["last_index_value"], written[2]["last_value_source"]), (0.55, "timeseries_store"))
+        self.assertEqual((written[3]["last_index_value"], written[3]["last_value_source"]), (0.7, "gee"))
+        self.assertEqual(summary["reused"], 2)
+        self.assertEqual([row["alert_id"] for row in _queued(mock_enqueue)], [1])  # Solo la alerta 1 (0.31 < 0.4)
+
+    @patch("app.tasks.tasks_periodic.load_points_on_dates")
+    def test_alerts_only_reuse_shared_points_of_their_exact_radius(self, mock_points):
+        import datetime
+        from app.core.cells import location_cell
+        import app.tasks.tasks_periodic as periodic
+        alert = UserAlert(
+            id=7, user_id=self.fake_user.id, location_name="Zona 7", lat=-33.5, lng=-70.5, radius=980,
+            approach="agriculture", trigger_type="ndvi_below", trigger_value=0.4, is_active=True,
+        )
+        # Punto guardado para 1000 m (mismo tramo de 100 m que 980 m): no es el valor de esta alerta
+        mock_points.side_effect = lambda _session, keys, _version: {
+            key: {"date": "2026-10-14", "ndvi": 0.55}
+            for key in keys if key == (location_cell(-33.5, -70.5), 1000, datetime.date(2026, 10, 14))
+        }
+        scene_at = datetime.datetime(2026, 10, 14, 14, 30, tzinfo=datetime.UTC)
+
+        with patch("app.tasks.tasks_periodic.Session", return_value=self.mock_session), \
+                patch.object(periodic, "redis_client", None):
+            found = periodic.cached_alert_values([alert], {7: scene_at})
+
+        self.assertEqual(found, {})
+        self.assertEqual(list(mock_points.call_args.args[1]), [(location_cell(-33.5, -70.5), 980, datetime.date(2026, 10, 14))])
 
     def test_update_preferences_success(self):
         # Configurar mock de base de datos
@@ -0,0 +1,278 @@
+"""Regresiones para la cache durable de análisis en PostGIS (tabla analysis_results).
+
+Tras un cache-miss de Redis, POST /analyze debe consultar la cache durable antes de
+encolar en Celery, y un hit ahí debe rehidratar Redis con la vigencia que le queda.
+"""
+import os
+import sys
+import json
+import datetime
+import unittest
+from unittest.mock import patch, MagicMock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from fastapi.testclient import TestClient
+from app.main import app
+import app.core.auth as auth_module
+import app.api.endpoints.analyze as analyze_module
+import app.tasks.worker as worker_module
+from sqlalchemy.dialects import postgresql
+from app.db.analysis_store import build_date_range, find_analysis_result, remaining_ttl_seconds, save_analysis_result
+from app.db.models import AnalysisResult
+
+
+class DurableAnalysisCacheEndpointTests(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        app.dependency_overrides[auth_module.get_optional_user] = lambda: None
+        self.durable_result = {"status": "success", "approach": "agriculture", "data": {"Vigor Vegetal (NDVI)": "0.61"},
+                               "meta": {"date": "2026-07-01", "scene_id": "20260701T143731_T19HBD"}}
+
+    def tearDown(self):
+        app.dependency_overrides.clear()
+
+    def _payload(self):
+        return {"lat": -33.45, "lng": -70.66, "radius": 2000, "approach": "agriculture", "location": "Test"}
+
+    @patch("app.tasks.worker.process_gee_analysis.delay")
+    @patch("app.api.endpoints.analyze.lookup_durable_analysis")
+    def test_durable_hit_after_redis_miss_skips_celery(self, mock_lookup, mock_delay):
+        mock_lookup.return_value = self.durable_result
+
+        with patch.object(analyze_module, "redis_client") as mock_redis:
+            mock_redis.get.return_value = None
+            response = self.client.post("/api/v1/analyze", json=self._payload())
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["status"], "complete")
+        self.assertEqual(body["result"], self.durable_result)
+        mock_delay.assert_not_called()
+        self.assertEqual(mock_lookup.call_args[0][-1], analyze_module.build_analysis_cache_key("agriculture", 2000, -33.45, -70.66))
+
+    @patch("app.tasks.worker.process_gee_analysis.delay")
+    @patch("app.api.endpoints.analyze.lookup_durable_analysis", return_value=None)
+    def test_durable_miss_enqueues_task(self, _mock_lookup, mock_delay):
+        mock_delay.return_value = MagicMock(id="task-xyz")
+
+        with patch.object(analyze_module, "redis_client") as mock_redis:
+            mock_redis.get.return_value = None
+            response = self.client.post("/api/v1/analyze", json=self._payload())
+
+        self.assertEqual(response.json()["status"], "queued")
+        mock_delay.assert_called_once()
+
+    @patch("app.api.endpoints.analyze.lookup_durable_analysis")
+    def test_redis_hit_does_not_touch_durable_cache(self, mock_lookup):
+        with patch.object(analyze_module, "redis_client") as mock_redis:
+            mock_redis.get.return_value = json.dumps(self.durable_result)
+            response = self.client.post("/api/v1/analyze", json=self._payload())
+
+        self.assertEqual(response.json()["status"], "complete")
+        mock_lookup.assert_not_called()
+
+
+class DurableAnalysisLookupTests(unittest.TestCase):
+    def _row(self, hours_left):
+        return AnalysisResult(
+            cell="-33.4500:-70.6600", approach="agriculture", radius=2000, radius_bucket=2000,
+            logic_version="v3", date_range="",
+            coordinates=None, payload={"status": "success"},
+            expires_at=datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=hours_left),
+        )
+
+    def test_hit_rehydrates_redis_with_remaining_ttl(self):
+        mock_session = MagicMock()
+        mock_session.__enter__.return_value = mock_session
+        row = self._row(hours_left=2)
+
+        with patch.object(worker_module, "Session", return_value=mock_session), \
+             patch.object(worker_module, "find_analysis_result", return_value=row), \
+             patch.object(worker_module, "redis_client") as mock_redis:
+            payload = worker_module.lookup_durable_analysis("agriculture", -33.45, -70.66, 2000, cache_key="analysis:k")
+
+        self.assertEqual(payload, {"status": "success"})
+        key, ttl, value = mock_redis.setex.call_args[0]
+        self.assertEqual(key, "analysis:k")
+        self.assertTrue(7000 < ttl <= 7200)
+        self.assertEqual(json.loads(value), {"status": "success"})
+
+    def test_database_failure_is_a_miss(self):
+        with patch.object(worker_module, "Session", side_effect=Exception("db down")):
+            self.assertIsNone(worker_module.lookup_durable_analysis("agriculture", -33.45, -70.66, 2000))
+
+    def test_date_range_requires_both_dates(self):
+        self.assertEqual(build_date_range("2026-01-01", "2026-02-01"), "2026-01-01:2026-02-01")
+        self.assertEqual(build_date_range("2026-01-01", None), "")
+
+    def test_remaining_ttl_never_negative(self):
+        self.assertEqual(remaining_ttl_seconds(self._row(hours_left=-1)), 0)
+
+
+class DurableAnalysisStoreTests(unittest.TestCase):
+    """Una fila por clave de Redis: celda y radio exacto, y recalcular reemplaza la fila."""
+
+    def _sql(self, statement):
+        return str(statement.compile(dialect=postgresql.dialect()))
+
+    def test_lookup_matches_the_exact_radius_and_cell(self):
+        session = MagicMock()
+        find_analysis_result(session, "agriculture", -33.45001, -70.66, 1990, "", "v3")
+
+        statement = session.exec.call_args.args[0]
+        params = statement.compile(dialect=postgresql.dialect()).params
+        self.assertIn(1990, params.values())          # no el tramo de 2000 m
+        self.assertIn("-33.4500:-70.6600", params.values())
+        self.assertNotIn("radius_bucket =", self._sql(statement))
+
+    def test_save_upserts_on_the_cache_key(self):
+        session = MagicMock()
+        save_analysis_result(session, "agriculture", -33.45, -70.66, 1990, "", "v3", {"meta": {"scene_id": "S2"}}, 3600)
+
+        statement = session.execute.call_args.args[0]
+        sql = self._sql(statement)
+        self.assertIn("ON CONFLICT (cell, approach, radius, date_range, logic_version) DO UPDATE", sql)
+        params = statement.compile(dialect=postgresql.dialect()).params
+        self.assertEqual((params["radius"], params["radius_bucket"], params["scene_id"]), (1990, 2000, "S2"))
+        session.add.assert_not_called()
+
+    def test_prune_deletes_rows_expired_beyond_retention(self):
+        from app.core.config import settings
+        from app.tasks import tasks_periodic
+        mock_session = MagicMock()
+        mock_session.__enter__.return_value = mock_session
+        mock_session.execute.return_value.rowcount = 3
+
+        with patch.object(tasks_periodic, "Session", return_value=mock_session):
+            summary = tasks_periodic.prune_analysis_results()
+
+        self.assertEqual(summary["deleted"], 3)
+        statement = mock_session.execute.call_args.args[0]
+        self.assertTrue(self._sql(statement).startswith("DELETE FROM metadata.analysis_results"))
+        cutoff = statement.compile(dialect=postgresql.dialect()).params["expires_at_1"]
+        expected = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=settings.ANALYSIS_RESULT_RETENTION_DAYS)
+        self.assertLess(abs((cutoff - expected).total_seconds()), 60)
+        mock_session.commit.assert_called_once()
+
+
+class UsageBufferTests(unittest.TestCase):
+    """Los cache-hits de /analyze se registran en Redis y se vuelcan por lotes, no en cada respuesta."""
+
+    def setUp(self):
+        self.client = TestClient(app)
+        app.dependency_overrides[auth_module.get_optional_user] = lambda: None
+
+    def tearDown(self):
+        app.dependency_overrides.clear()
+
+    def _entry(self, lat):
+        return json.dumps({"lat": lat, "lng": -70.66, "radius": 2000, "approach": "agriculture",
+                           "location_name": "Test", "status": "cache_hit", "timestamp": "2026-07-01T12:00:00+00:00"})
+
+    def _redis(self, entries):
+        mock_redis = MagicMock()
+        mock_redis.pipeline.return_value.execute.return_value = [entries, True]
+        return mock_redis
+
+    def test_cache_hit_is_buffered_without_touching_the_database(self):
+        payload = {"lat": -33.45, "lng": -70.66, "radius": 2000, "approach": "agriculture", "location": "Test"}
+        with patch.object(analyze_module, "redis_client") as mock_redis, \
+             patch.object(worker_module, "redis_client") as mock_worker_redis, \
+             patch.object(worker_module, "Session") as mock_session:
+            mock_redis.get.return_value = json.dumps({"status": "success"})
+            response = self.client.post("/api/v1/analyze", json=payload)
+
+        self.assertEqual(response.json()["status"], "complete")
+        mock_session.assert_not_called()
+        key, entry = mock_worker_redis.rpush.call_args.args
+        self.assertEqual(key, worker_module.USAGE_BUFFER_KEY)
+        self.assertEqual(json.loads(entry)["status"], "cache_hit")
+        # Misma referencia UTC que el `since` con que find_usage_hotspots filtra
+        self.assertEqual(datetime.datetime.fromisoformat(json.loads(entry)["timestamp"]).utcoffset(), datetime.timedelta(0))
+
+    def test_flush_writes_the_batch_in_one_insert(self):
+        mock_session = MagicMock()
+        mock_session.__enter__.return_value = mock_session
+        with patch.object(worker_module, "redis_client", self._redis([self._entry(-33.1), self._entry(-33.2)])), \
+             patch.object(worker_module, "Session", return_value=mock_session):
+            written = worker_module.flush_buffered_api_usage(100)
+
+        self.assertEqual(written, 2)
+        statement, rows = mock_session.execute.call_args.args
+        self.assertTrue(str(statement).startswith("INSERT INTO metadata.api_usage_logs"))
+        self.assertEqual([r["timestamp"] for r in rows], [datetime.datetime(2026, 7, 1, 12, 0, tzinfo=datetime.timezone.utc)] * 2)
+        mock_session.commit.assert_called_once()
+
+    def test_failed_flush_returns_entries_to_the_buffer(self):
+        entries = [self._entry(-33.1)]
+        mock_redis = self._redis(entries)
+        with patch.object(worker_module, "redis_client", mock_redis), \
+             patch.object(worker_module, "Session", side_effect=Exception("db down")):
+            with self.assertRaises(Exception):
+                worker_module.flush_buffered_api_usage(100)
+
+        mock_redis.rpush.assert_called_once_with(worker_module.USAGE_BUFFER_KEY, *entries)
+
+
+class PrewarmAnalysisCacheTests(unittest.TestCase):
+    """prewarm_analysis_cache debe refrescar primero lo vencido/próximo a vencer y respetar el presupuesto."""
+
+    def setUp(self):
+        from app.core.config import settings
+        self.settings = settings
+        self.original = (settings.PREWARM_GEE_BUDGET, settings.PREWARM_REFRESH_WITHIN_S)
+        settings.PREWARM_GEE_BUDGET = 2
+        settings.PREWARM_REFRESH_WITHIN_S = 3600
+        self.mock_session = MagicMock()
+        self.mock_session.__enter__.return_value = self.mock_session
+
+    def tearDown(self):
+        self.settings.PREWARM_GEE_BUDGET, self.settings.PREWARM_REFRESH_WITHIN_S = self.original
+
+    def _spot(self, lat, hits):
+        return {"lat": lat, "lng": -70.66, "approach": "agriculture", "radius": 2000, "hits": hits}
+
+    def test_refreshes_soonest_expiring_hotspots_within_budget(self):
+        from app.tasks import tasks_periodic
+        spots = [self._spot(-33.1, 50), self._spot(-33.2, 40), self._spot(-33.3, 30), self._spot(-33.4, 20)]
+        ttls = {-33.1: 10_000, -33.2: 1_800, -33.3: -2, -33.4: 600}
+
+        def fake_ttl(key):
+            return next(t for lat, t in ttls.items() if f":{lat}:" in key)
+
+        with patch.object(tasks_periodic, "Session", return_value=self.mock_session), \
+             patch.object(tasks_periodic, "find_usage_hotspots", return_value=spots), \
+             patch.object(tasks_periodic, "redis_client") as mock_redis, \
+             patch.object(tasks_periodic.process_gee_analysis, "delay") as mock_delay:
+            mock_redis.ttl.side_effect = fake_ttl
+            mock_redis.set.return_value = True
+            summary = tasks_periodic.prewarm_analysis_cache(force=True)
+
+        self.assertEqual(summary["candidates"], 3)  # -33.1 sigue vigente de sobra
+        self.assertEqual(summary["enqueued"], 2)
+        enqueued_lats = [c.kwargs["lat"] for c in mock_delay.call_args_list]
+        self.assertEqual(enqueued_lats, [-33.3, -33.4])  # primero el vencido, luego el más próximo a vencer
+        self.assertTrue(all(c.kwargs["prewarm"] for c in mock_delay.call_args_list))
+
+    def test_skips_outside_off_peak_hours(self):
+        from app.tasks import tasks_periodic
+        original_hours = self.settings.PREWARM_OFFPEAK_HOURS_UTC
+        self.settings.PREWARM_OFFPEAK_HOURS_UTC = "0-0"
+        try:
+            with patch.object(tasks_periodic, "redis_client", MagicMock()), \
+                 patch.object(tasks_periodic, "find_usage_hotspots") as mock_hotspots:
+                summary = tasks_periodic.prewarm_analysis_cache()
+        finally:
+            self.settings.PREWARM_OFFPEAK_HOURS_UTC = original_hours
+
+        self.assertEqual(summary["reason"], "peak_hours")
+        mock_hotspots.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -293,6 +293,7 @@ class MyAnalysesEndpointTests(unittest.TestCase):
         fake_row.created_at = datetime.datetime(2026, 7, 1, 10, 30)
         fake_row.indices = {"NDVI": 0.5}
         fake_row.chart_data = None
+        fake_row.timeseries_cell = None
         fake_row.map_layer_url = "https://example.com/tile"
         fake_row.image_date = "2026-07-01"
         fake_row.interpretation = None
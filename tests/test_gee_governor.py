@@ -0,0 +1,90 @@
+"""Regresiones para el gobernador de cuota GEE compartido entre workers (app/core/gee_governor.py).
+
+El script Lua corre en Redis; aquí se verifica el lado Python: esperar y reintentar cuando
+el script niega el slot, liberar el lease siempre, pausar a todos tras un 429 y seguir sin
+gobernar (fail-open) si Redis no responde.
+"""
+import os
+import sys
+import unittest
+from unittest.mock import patch, MagicMock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app.core import gee_governor as governor_module
+from app.core.config import settings
+
+
+class GeeGovernorTests(unittest.TestCase):
+    def setUp(self):
+        self.redis = MagicMock()
+        self.script = MagicMock(return_value=[1, 0])
+        self.redis.register_script.return_value = self.script
+        self.patchers = [
+            patch.object(governor_module, "redis_client", self.redis),
+            patch.object(governor_module.time, "sleep"),
+        ]
+        for p in self.patchers:
+            p.start()
+        self.governor = governor_module.GeeGovernor()
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+
+    def test_slot_holds_a_lease_and_releases_it(self):
+        with self.governor.slot("interactive"):
+            self.redis.zrem.assert_not_called()
+
+        kwargs = self.script.call_args.kwargs
+        lease_id = kwargs["args"][0]
+        self.assertEqual(kwargs["keys"][0], governor_module.GOVERNOR_SEMAPHORE_KEY)
+        self.redis.zrem.assert_called_once_with(governor_module.GOVERNOR_SEMAPHORE_KEY, lease_id)
+        self.assertEqual(self.governor.acquired, {"interactive": 1})
+
+    def test_lower_classes_only_get_their_share(self):
+        with self.governor.slot("alerts"):
+            pass
+        self.assertEqual(self.script.call_args.kwargs["args"][3], settings.gee_governor_class_shares["alerts"])
+        self.assertLess(settings.gee_governor_class_shares["alerts"], 1.0)
+
+    def test_waits_while_the_quota_is_exhausted(self):
+        self.script.side_effect = [[0, 200], [0, 50], [1, 0]]
+        with self.governor.slot("timeseries"):
+            pass
+        self.assertEqual(self.script.call_count, 3)
+        self.assertEqual(governor_module.time.sleep.call_count, 2)
+
+    def test_gives_up_after_max_wait(self):
+        self.script.return_value = [0, 1000]
+        with patch.object(governor_module, "MAX_WAIT_SECONDS", 0):
+            with self.assertRaises(governor_module.GeeQuotaWaitTimeout):
+                with self.governor.slot("alerts"):
+                    pass
+        self.assertEqual(self.governor.timeouts, {"alerts": 1})
+
+    def test_throttling_error_pauses_every_worker_and_releases_the_lease(self):
+        with self.assertRaises(Exception):
+            with self.governor.slot("interactive"):
+                raise Exception("Too many concurrent aggregations.")
+
+        self.redis.set.assert_called_once_with(
+            governor_module.GOVERNOR_BACKOFF_KEY, "1", px=governor_module.THROTTLE_BACKOFF_MS, nx=True
+        )
+        self.redis.zrem.assert_called_once()
+
+    def test_redis_failure_runs_the_call_ungoverned(self):
+        self.script.side_effect = ConnectionError("redis down")
+        ran = False
+        with self.governor.slot("interactive"):
+            ran = True
+        self.assertTrue(ran)
+        self.redis.zrem.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,214 @@
+"""Regresiones para las llamadas resilientes a GEE (app/core/gee_resilience.py).
+
+Un 429/5xx transitorio ya no debe tumbar el análisis completo, un getMapId rezagado debe
+poder duplicarse, y con el circuit breaker abierto POST /analyze debe servir la cache
+vencida (o un 503 con Retry-After) en vez de encolar tareas condenadas a fallar.
+"""
+import os
+import sys
+import concurrent.futures
+import unittest
+from unittest.mock import patch, MagicMock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from fastapi.testclient import TestClient
+from app.main import app
+import app.core.auth as auth_module
+import app.core.security as security_module
+from app.core import gee_resilience as resilience
+
+
+def _done(result=None, error=None):
+    future = concurrent.futures.Future()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+    return future
+
+
+class ScriptedSubmit:
+    """submit() del planificador que devuelve, en orden, los futures preparados por el test."""
+
+    def __init__(self, *futures):
+        self.futures = list(futures)
+        self.calls = 0
+
+    def __call__(self, fn, *args):
+        self.calls += 1
+        return self.futures.pop(0)
+
+
+class GeeCallTests(unittest.TestCase):
+    def setUp(self):
+        self.patchers = [
+            patch.object(resilience, "gee_breaker", resilience.GeeCircuitBreaker()),
+            patch.object(resilience, "latency_tracker", resilience._LatencyTracker()),
+            patch.object(resilience.time, "sleep"),
+        ]
+        for p in self.patchers:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+
+    def test_classifies_errors(self):
+        self.assertEqual(resilience.classify_gee_error(Exception("Too many concurrent aggregations.")), "quota")
+        self.assertEqual(resilience.classify_gee_error(Exception("HttpError 503 Service Unavailable")), "transient")
+        self.assertEqual(resilience.classify_gee_error(ConnectionError("reset")), "transient")
+        self.assertEqual(resilience.classify_gee_error(Exception("Image.select: Pattern 'B99' did not match")), "permanent")
+
+    def test_transient_error_is_retried(self):
+        submit = ScriptedSubmit(_done(error=Exception("Internal error")), _done({"NDVI": 0.5}))
+        call = resilience.GeeCall(submit, None, (), "reduceRegion")
+
+        self.assertEqual(call.result(timeout=30), {"NDVI": 0.5})
+        self.assertEqual(call.attempts, 2)
+        resilience.time.sleep.assert_called_once()
+
+    def test_permanent_error_is_not_retried(self):
+        submit = ScriptedSubmit(_done(error=Exception("Image.select: Pattern 'B99' did not match")))
+        call = resilience.GeeCall(submit, None, (), "reduceRegion")
+
+        with self.assertRaises(Exception):
+            call.result(timeout=30)
+        self.assertEqual(submit.calls, 1)
+
+    def test_gives_up_after_max_attempts(self):
+        submit = ScriptedSubmit(*[_done(error=Exception("429 Too Many Requests")) for _ in range(resilience.MAX_ATTEMPTS)])
+        call = resilience.GeeCall(submit, None, (), "getInfo")
+
+        with self.assertRaises(Exception):
+            call.result(timeout=60)
+        self.assertEqual(submit.calls, resilience.MAX_ATTEMPTS)
+
+    def test_straggler_is_hedged(self):
+        for _ in range(resilience.HEDGE_MIN_SAMPLES):
+            resilience.latency_tracker.record("getMapId", 0.001)
+        straggler = concurrent.futures.Future()
+        straggler.set_running_or_notify_cancel()
+        straggler.started_at = resilience.time.monotonic()
+        submit = ScriptedSubmit(straggler, _done({"mapid": "abc"}))
+        call = resilience.GeeCall(submit, None, (), "getMapId")
+
+        with patch.object(resilience, "HEDGE_MIN_DELAY_SECONDS", 0.01):
+            self.assertEqual(call.result(timeout=5), {"mapid": "abc"})
+        self.assertTrue(call.hedged)
+        self.assertFalse(straggler.cancelled())  # Ya corre en GEE: solo se ignora su respuesta
+
+    def test_attempt_still_queued_is_not_hedged(self):
+        for _ in range(resilience.HEDGE_MIN_SAMPLES):
+            resilience.latency_tracker.record("getMapId", 0.001)
+        queued = concurrent.futures.Future()
+        submit = ScriptedSubmit(queued, _done({"mapid": "abc"}))
+        call = resilience.GeeCall(submit, None, (), "getMapId")
+
+        with patch.object(resilience, "HEDGE_MIN_DELAY_SECONDS", 0.01), \
+                self.assertRaises(concurrent.futures.TimeoutError):
+            call.result(timeout=0.3)
+        self.assertFalse(call.hedged)
+        self.assertEqual(submit.calls, 1)
+
+    def test_latency_is_measured_from_the_start_in_gee(self):
+        future = concurrent.futures.Future()
+        call = resilience.GeeCall(ScriptedSubmit(future), None, (), "getInfo")
+        # Diez segundos en cola (planificador + cuota) y 50 ms en GEE
+        call._pending[future] = resilience.time.monotonic() - 10
+        future.set_running_or_notify_cancel()
+        future.started_at = resilience.time.monotonic() - 0.05
+        future.set_result({"ok": True})
+
+        call.result(timeout=5)
+
+        [latency] = resilience.latency_tracker._samples["getInfo"]
+        self.assertLess(latency, 1)
+
+    def _expire(self, future, timeout):
+        call = resilience.GeeCall(ScriptedSubmit(future), None, (), "getInfo")
+        with patch.object(resilience.gee_breaker, "record_failure") as mock_failure:
+            with self.assertRaises(concurrent.futures.TimeoutError):
+                call.result(timeout=timeout)
+        return mock_failure
+
+    def test_caller_deadline_on_a_queued_attempt_is_not_a_gee_failure(self):
+        # Presupuesto ya agotado (timeout=0) con el intento todavía en cola
+        mock_failure = self._expire(concurrent.futures.Future(), 0)
+
+        mock_failure.assert_not_called()
+
+    def test_attempt_stuck_in_gee_counts_as_a_failure(self):
+        running = concurrent.futures.Future()
+        running.set_running_or_notify_cancel()
+        running.started_at = resilience.time.monotonic() - resilience.BREAKER_SLOW_CALL_SECONDS - 1
+        mock_failure = self._expire(running, 0.01)
+
+        mock_failure.assert_called_once()
+
+    def test_recently_started_attempt_is_not_a_failure(self):
+        running = concurrent.futures.Future()
+        running.set_running_or_notify_cancel()
+        running.started_at = resilience.time.monotonic()
+        mock_failure = self._expire(running, 0.01)
+
+        mock_failure.assert_not_called()
+
+    def test_breaker_opens_after_consecutive_failures(self):
+        for _ in range(resilience.BREAKER_FAILURE_THRESHOLD):
+            resilience.gee_breaker.record_failure()
+        self.assertTrue(resilience.gee_breaker.is_open())
+
+        submit = ScriptedSubmit()
+        call = resilience.GeeCall(submit, None, (), "getInfo")
+        with self.assertRaises(resilience.GeeCircuitOpenError):
+            call.result(timeout=5)
+        self.assertEqual(submit.calls, 0)
+
+
+class CircuitOpenEndpointTests(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        app.dependency_overrides[auth_module.get_optional_user] = lambda: None
+        security_module.analysis_limiter._requests.clear()
+        self.payload = {"lat": -33.45, "lng": -70.66, "radius": 2000, "approach": "agriculture", "location": "Test"}
+
+    def tearDown(self):
+        app.dependency_overrides.clear()
+        security_module.analysis_limiter._requests.clear()
+
+    def _post(self, mock_lookup):
+        breaker = MagicMock()
+        breaker.is_open.return_value = True
+        breaker.retry_after_seconds.return_value = 12
+        with patch("app.api.endpoints.analyze.gee_breaker", breaker), \
+                patch("app.api.endpoints.analyze.redis_client", None), \
+                patch("app.api.endpoints.analyze.lookup_durable_analysis", mock_lookup), \
+                patch("app.tasks.worker.process_gee_analysis.delay") as mock_delay:
+            response = self.client.post("/api/v1/analyze", json=self.payload)
+        mock_delay.assert_not_called()
+        return response
+
+    def test_serves_stale_durable_result(self):
+        stale = {"status": "success", "approach": "agriculture", "data": {}}
+        mock_lookup = MagicMock(side_effect=lambda *a, include_expired=False, **kw: stale if include_expired else None)
+
+        response = self._post(mock_lookup)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["result"], stale)
+        self.assertTrue(response.json()["stale"])
+
+    def test_returns_503_with_retry_after_without_stale_result(self):
+        response = self._post(MagicMock(return_value=None))
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "12")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+"""Regresiones para el planificador de llamadas GEE (app/core/gee_scheduler.py).
+
+Reemplaza al ThreadPoolExecutor fijo de worker.py: las llamadas interactivas pasan antes
+que las de alertas, una sola tarea no acapara el pool y la concurrencia se adapta (AIMD)
+a los 429 de Earth Engine.
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import patch, PropertyMock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app.core import gee_scheduler as scheduler_module
+from app.core.gee_governor import GeeGovernor
+from app.core.gee_scheduler import GeeScheduler
+
+
+def _scheduler(**kwargs):
+    params = dict(max_concurrency=1, initial_concurrency=1, min_concurrency=1, per_task_concurrency=4)
+    params.update(kwargs)
+    return GeeScheduler(**params)
+
+
+class GeeSchedulerTests(unittest.TestCase):
+    def _block(self, scheduler, **kwargs):
+        """Ocupa el único hilo disponible hasta que el test libere el evento devuelto."""
+        release, started = threading.Event(), threading.Event()
+
+        def blocker():
+            started.set()
+            release.wait(5)
+
+        future = scheduler.submit(blocker, **kwargs)
+        self.assertTrue(started.wait(5))
+        return release, future
+
+    def test_interactive_calls_run_before_queued_alert_calls(self):
+        scheduler = _scheduler()
+        release, blocker = self._block(scheduler, priority="alerts", owner="alert-task")
+        order = []
+
+        alerts = [scheduler.submit(order.append, f"alert-{i}", priority="alerts", owner="alert-task") for i in range(3)]
+        interactive = scheduler.submit(order.append, "interactive", priority="interactive", owner="user-task")
+        self.assertEqual(scheduler.snapshot()["queue_depth"]["alerts"], 3)
+
+        release.set()
+        for f in [blocker, interactive, *alerts]:
+            f.result(timeout=5)
+        self.assertEqual(order[0], "interactive")
+
+    def test_per_task_cap_lets_other_tasks_through(self):
+        scheduler = _scheduler(max_concurrency=2, initial_concurrency=2, per_task_concurrency=1)
+        release, blocker = self._block(scheduler, priority="alerts", owner="batch")
+        order = []
+
+        batch = scheduler.submit(order.append, "batch-2", priority="alerts", owner="batch")
+        other = scheduler.submit(order.append, "other", priority="alerts", owner="other")
+        other.result(timeout=5)
+        # El segundo slot libre no lo toma "batch" (ya tiene su única llamada en vuelo).
+        self.assertEqual(order, ["other"])
+
+        release.set()
+        batch.result(timeout=5)
+        blocker.result(timeout=5)
+        self.assertEqual(order, ["other", "batch-2"])
+
+    def test_throttling_halves_the_limit_and_success_grows_it_back(self):
+        scheduler = _scheduler(max_concurrency=8, initial_concurrency=8, min_concurrency=2)
+
+        def throttled():
+            raise Exception("HttpError 429: Too Many Requests")
+
+        with self.assertRaises(Exception):
+            scheduler.submit(throttled).result(timeout=5)
+        self.assertEqual(scheduler.snapshot()["concurrency_limit"], 4)
+        self.assertEqual(scheduler.snapshot()["throttled"], 1)
+
+        for _ in range(10):
+            scheduler.submit(int, "1").result(timeout=5)
+        self.assertGreater(scheduler.snapshot()["concurrency_limit"], 4)
+
+    def test_waiting_for_the_shared_quota_is_not_gee_latency(self):
+        scheduler = _scheduler(max_concurrency=8, initial_concurrency=8, min_concurrency=2)
+
+        def slow_acquire(priority, abort=None):
+            time.sleep(0.2)
+            return None
+
+        with patch.object(scheduler_module, "GEE_CONGESTION_LATENCY_SECONDS", 0.1), \
+                patch.object(scheduler_module.gee_governor, "acquire", side_effect=slow_acquire):
+            scheduler.submit(int, "1").result(timeout=5)
+
+        self.assertEqual(scheduler.snapshot()["concurrency_limit"], 8)
+        self.assertLess(scheduler.snapshot()["latency"]["p50_s"], 0.1)
+
+    def test_cancelled_call_stops_waiting_for_quota(self):
+        scheduler = _scheduler()
+        ran = []
+        with patch.object(GeeGovernor, "enabled", new_callable=PropertyMock, return_value=True), \
+                patch.object(scheduler_module.gee_governor, "_try_acquire", return_value=50):
+            future = scheduler.submit(ran.append, "x")
+            time.sleep(0.1)
+            # Sigue pendiente mientras espera cuota: el llamador puede rendirse
+            self.assertTrue(future.cancel())
+            deadline = time.monotonic() + 5
+            while scheduler.snapshot()["inflight"] and time.monotonic() < deadline:
+                time.sleep(0.02)
+
+        self.assertEqual(scheduler.snapshot()["inflight"], 0)
+        self.assertEqual(ran, [])
+        self.assertEqual(scheduler.snapshot()["completed"], 0)
+
+    def test_calls_use_the_priority_bound_to_the_current_task(self):
+        scheduler = _scheduler()
+        release, blocker = self._block(scheduler)
+        scheduler_module.bind_task("timeseries", "task-1")
+        try:
+            queued = scheduler.submit(int, "1")
+            self.assertEqual(scheduler.snapshot()["queue_depth"]["timeseries"], 1)
+        finally:
+            scheduler_module.unbind_task()
+            release.set()
+        self.assertEqual(queued.result(timeout=5), 1)
+        blocker.result(timeout=5)
+
+    def test_throttling_error_detection(self):
+        self.assertTrue(scheduler_module.is_throttling_error(Exception("Earth Engine capacity exceeded: quota")))
+        self.assertFalse(scheduler_module.is_throttling_error(ValueError("bad geometry")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+"""Regresiones para la sesión de Earth Engine compartida por proceso (app/core/gee.py).
+
+Las tareas ya no llaman ee.Initialize() cada vez: la sesión se inicializa una sola vez
+por proceso, renueva el token antes de que expire e instala un pool HTTP propio.
+"""
+import os
+import sys
+import datetime
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import app.core.gee as gee_module
+import app.tasks.worker as worker_module
+
+
+def _utcnow_naive():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class GeeSessionManagerTests(unittest.TestCase):
+    def setUp(self):
+        self.credentials = MagicMock()
+        self.credentials.token = "tok"
+        self.credentials.expiry = _utcnow_naive() + datetime.timedelta(hours=1)
+        self.state = SimpleNamespace(credentials=self.credentials, requests_session=None)
+
+        self.patchers = [
+            patch.object(gee_module, "_ee_state", return_value=self.state),
+            patch.object(gee_module.GeeSessionManager, "_start_refresher"),
+        ]
+        for p in self.patchers:
+            p.start()
+        self.session = gee_module.GeeSessionManager()
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+
+    @patch.object(gee_module, "init_gee", return_value=True)
+    def test_initializes_once_per_process(self, mock_init):
+        self.assertTrue(self.session.initialize())
+        self.assertTrue(self.session.ensure_ready())
+        self.assertTrue(self.session.ensure_ready())
+
+        mock_init.assert_called_once()
+        adapter = self.state.requests_session.get_adapter("https://earthengine.googleapis.com")
+        self.assertEqual(adapter._pool_maxsize, gee_module.GEE_HTTP_POOL_SIZE)
+        self.assertTrue(self.session.snapshot()["ready"])
+
+    @patch.object(gee_module, "init_gee", return_value=True)
+    def test_refreshes_token_before_expiry(self, _mock_init):
+        self.session.initialize()
+        self.credentials.refresh.reset_mock()
+
+        self.credentials.expiry = _utcnow_naive() + datetime.timedelta(minutes=2)
+        self.assertTrue(self.session.ensure_ready())
+        self.credentials.refresh.assert_called_once()
+
+    @patch.object(gee_module, "init_gee", return_value=False)
+    def test_failed_initialization_is_not_retried_on_every_task(self, mock_init):
+        self.assertFalse(self.session.initialize())
+        self.assertFalse(self.session.ensure_ready())
+        self.assertFalse(self.session.ensure_ready())
+        mock_init.assert_called_once()
+        self.assertEqual(self.session.snapshot()["last_error"], "init_gee failed")
+
+    @patch.object(gee_module, "init_gee", return_value=True)
+    def test_reinitializes_after_fork(self, mock_init):
+        self.session.initialize()
+        parent_http = self.state.requests_session
+
+        with patch.object(gee_module.os, "getpid", return_value=os.getpid() + 1):
+            self.assertFalse(self.session.ready)
+            self.assertTrue(self.session.ensure_ready())
+
+        self.assertEqual(mock_init.call_count, 2)
+        self.assertIsNot(self.state.requests_session, parent_http)
+
+    @patch.object(gee_module, "init_gee", return_value=True)
+    def test_concurrent_tasks_share_one_initialization(self, mock_init):
+        # Perfil IO: muchas tareas arrancan a la vez en hilos del mismo proceso.
+        barrier = threading.Barrier(16)
+        results = []
+
+        def task():
+            barrier.wait()
+            results.append(self.session.ensure_ready())
+
+        threads = [threading.Thread(target=task) for _ in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+
+        self.assertEqual(results, [True] * 16)
+        mock_init.assert_called_once()
+
+
+class IoWorkerProfileTests(unittest.TestCase):
+    def test_pool_names(self):
+        self.assertEqual(worker_module.worker_pool_name(SimpleNamespace(pool_cls="threads")), "threads")
+        self.assertEqual(worker_module.worker_pool_name(SimpleNamespace(pool_cls="processes")), "prefork")
+        self.assertEqual(worker_module.worker_pool_name(SimpleNamespace(pool_cls=None)), "prefork")
+
+    @patch("app.tasks.worker.gee_session")
+    def test_io_pool_initializes_the_session_in_worker_init(self, mock_session):
+        worker_module.configure_gee_io_worker(sender=SimpleNamespace(pool_cls="threads"))
+        mock_session.initialize.assert_called_once()
+
+    @patch("app.tasks.worker.gee_session")
+    def test_prefork_waits_for_worker_process_init(self, mock_session):
+        worker_module.configure_gee_io_worker(sender=SimpleNamespace(pool_cls="prefork"))
+        mock_session.initialize.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
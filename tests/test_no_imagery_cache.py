@@ -0,0 +1,122 @@
+"""Regresiones para la cache negativa de "no hay imagen utilizable".
+
+Un análisis que termina sin imagen (colección vacía o ROI sin píxeles válidos) debe
+guardarse con TTL corto bajo la misma clave del análisis, y POST /analyze debe responder
+desde ahí sin encolar mientras no se haya visto una escena más nueva en la región.
+"""
+import os
+import sys
+import json
+import unittest
+from unittest.mock import patch, MagicMock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from fastapi.testclient import TestClient
+from app.main import app
+import app.core.auth as auth_module
+import app.api.endpoints.analyze as analyze_module
+import app.tasks.worker as worker_module
+
+
+class FakeRedis:
+    """Subconjunto mínimo de redis-py (get/mget/setex/delete) sobre un dict."""
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    def get(self, key):
+        value = self.data.get(key)
+        return value.encode() if isinstance(value, str) else value
+
+    def mget(self, *keys):
+        return [self.get(k) for k in keys]
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+        self.ttls[key] = ttl
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class NoImageryCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.patcher = patch.object(worker_module, "redis_client", self.redis)
+        self.patcher.start()
+        self.warning = worker_module.no_imagery_result("empty_collection", "Sin imágenes")
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_negative_entry_is_served_until_a_newer_scene_is_seen(self):
+        worker_module.note_scene_seen(-33.42, -70.66, "2026-07-01")
+        worker_module.cache_no_imagery_result("analysis:k", -33.42, -70.66, self.warning)
+        self.assertEqual(self.redis.ttls["noimagery:analysis:k"], worker_module.NO_IMAGERY_CACHE_TTL_SECONDS)
+
+        self.assertEqual(worker_module.read_no_imagery_cache("analysis:k", -33.42, -70.66)["reason"], "empty_collection")
+
+        # Otro análisis de la región vio la misma escena: la entrada sigue vigente.
+        worker_module.note_scene_seen(-33.41, -70.67, "2026-07-01")
+        self.assertIsNotNone(worker_module.read_no_imagery_cache("analysis:k", -33.42, -70.66))
+
+        # Llegó una pasada más nueva a la región: la entrada se descarta.
+        worker_module.note_scene_seen(-33.41, -70.67, "2026-07-06")
+        self.assertIsNone(worker_module.read_no_imagery_cache("analysis:k", -33.42, -70.66))
+        self.assertNotIn("noimagery:analysis:k", self.redis.data)
+
+    def test_historical_ranges_use_the_regular_ttl(self):
+        worker_module.cache_no_imagery_result("analysis:k", -33.45, -70.66, self.warning, historical=True)
+        self.assertEqual(self.redis.ttls["noimagery:analysis:k"], worker_module.ANALYSIS_CACHE_TTL_SECONDS)
+
+    @patch("app.tasks.worker.resolve_with_timeout")
+    @patch("app.tasks.worker.gee_session")
+    @patch("app.tasks.worker.ee")
+    def test_roi_without_valid_pixels_is_cached_as_negative(self, _mock_gee_session, _mock_ee, mock_resolve):
+        mock_resolve.return_value = {"NDVI": None, "NDMI": None, "SAVI": None, "NDRE": None, "BSI": None}
+
+        result = worker_module.process_gee_analysis.apply(kwargs={
+            "lat": -33.45, "lng": -70.66, "radius": 2000, "approach": "agriculture",
+            "location_name": "Costa nublada", "cache_key": "analysis:k",
+        }).get()
+
+        self.assertEqual(result["status"], "warning")
+        self.assertEqual(result["reason"], "no_valid_pixels")
+        self.assertEqual(json.loads(self.redis.data["noimagery:analysis:k"])["reason"], "no_valid_pixels")
+
+
+class NoImageryEndpointTests(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        app.dependency_overrides[auth_module.get_optional_user] = lambda: None
+
+    def tearDown(self):
+        app.dependency_overrides.clear()
+
+    @patch("app.tasks.worker.process_gee_analysis.delay")
+    @patch("app.api.endpoints.analyze.lookup_durable_analysis")
+    @patch("app.api.endpoints.analyze.read_no_imagery_cache")
+    def test_negative_hit_skips_durable_lookup_and_celery(self, mock_negative, mock_durable, mock_delay):
+        mock_negative.return_value = {"status": "warning", "reason": "empty_collection", "message": "x", "retry": False}
+
+        with patch.object(analyze_module, "redis_client") as mock_redis:
+            mock_redis.get.return_value = None
+            response = self.client.post("/api/v1/analyze", json={
+                "lat": -33.45, "lng": -70.66, "radius": 2000, "approach": "agriculture", "location": "Test"
+            })
+
+        body = response.json()
+        self.assertEqual(body["status"], "complete")
+        self.assertEqual(body["result"]["status"], "warning")
+        mock_durable.assert_not_called()
+        mock_delay.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+"""Regresiones para la bandeja de salida de correos (app/tasks/tasks_notifications.py).
+
+La revisión de alertas solo encola en notification_outbox; el drenaje agrupa por
+destinatario, envía lotes con un cliente asíncrono compartido y reintenta cada solicitud
+con su misma Idempotency-Key.
+"""
+import datetime
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import httpx
+from sqlalchemy.dialects import postgresql
+
+import app.core.notifications as notifications
+import app.db.outbox_store as outbox_store
+import app.tasks.tasks_notifications as drain_module
+from app.core.config import settings
+
+
+def _row(row_id, to_email, attempts=0, location="Zona"):
+    payload = {"location_name": f"{location} {row_id}", "trigger_desc": "NDVI menor a 0.4",
+               "index_name": "NDVI", "current_value": 0.35}
+    return {"id": row_id, "to_email": to_email, "payload": payload, "attempts": attempts}
+
+
+class OutboxStoreTests(unittest.TestCase):
+    def test_an_event_is_enqueued_once(self):
+        session = MagicMock()
+        outbox_store.enqueue_notifications(session, [{"event_key": "alert:1:2026-10-14", "alert_id": 1,
+                                                      "to_email": "a@geofeedback.cl", "payload": {}}])
+
+        sql = str(session.execute.call_args.args[0].compile(dialect=postgresql.dialect()))
+        self.assertIn("ON CONFLICT (event_key) DO NOTHING", sql)
+
+    def test_delivery_key_depends_only_on_the_rows(self):
+        self.assertEqual(outbox_store.delivery_key([3, 1, 2]), outbox_store.delivery_key([1, 2, 3]))
+        self.assertNotEqual(outbox_store.delivery_key([1, 2]), outbox_store.delivery_key([1, 2, 3]))
+
+    def test_a_retry_group_partly_locked_elsewhere_is_left_whole(self):
+        def outbox_row(row_id, key):
+            return SimpleNamespace(id=row_id, delivery_key=key, to_email="a@x.cl", payload={}, attempts=1)
+
+        # Otro drenaje tiene bloqueada la fila 3 de "k-split": solo 2 de sus 3 filas vencidas
+        session = MagicMock()
+        session.exec.return_value.all.side_effect = [
+            ["k-whole", "k-split"],
+            [outbox_row(1, "k-whole"), outbox_row(2, "k-split"), outbox_row(4, "k-split")],
+            [("k-whole", 1), ("k-split", 3)],
+            [],
+        ]
+        groups = outbox_store.claim_notifications(session, datetime.datetime.now(datetime.UTC), 10, 5, 60)
+
+        self.assertEqual({k: [r["id"] for r in rows] for k, rows in groups.items()}, {"k-whole": [1]})
+        locking = str(session.exec.call_args_list[1].args[0].compile(dialect=postgresql.dialect()))
+        self.assertIn("FOR UPDATE SKIP LOCKED", locking)
+        lease = session.execute.call_args.args[0].compile(dialect=postgresql.dialect()).params
+        self.assertEqual(lease["id_1"], [1])
+
+
+class DigestTests(unittest.TestCase):
+    def test_one_digest_per_recipient_and_batches_up_to_the_provider_limit(self):
+        rows = [_row(1, "a@x.cl"), _row(2, "b@x.cl"), _row(3, "a@x.cl"), _row(4, "c@x.cl")]
+        with patch.object(drain_module, "RESEND_BATCH_LIMIT", 2):
+            batches = drain_module.plan_batches(rows)
+
+        self.assertEqual([[r["id"] for r in rows] for rows in batches.values()], [[1, 3, 2], [4]])
+        emails = drain_module.batch_emails(next(iter(batches.values())))
+        self.assertEqual([e["to"] for e in emails], [["a@x.cl"], ["b@x.cl"]])
+        self.assertIn("2 Alertas", emails[0]["subject"])
+        self.assertIn("Zona 3", emails[0]["html"])
+        self.assertIn("Alerta de Anomalía Territorial en Zona 2", emails[1]["subject"])
+
+
+class SendBatchesTests(unittest.TestCase):
+    def test_batches_share_a_client_and_carry_their_idempotency_key(self):
+        seen = []
+
+        def handler(request):
+            seen.append(request.headers["Idempotency-Key"])
+            return httpx.Response({"k-ok": 200, "k-busy": 429, "k-bad": 422}[request.headers["Idempotency-Key"]],
+                                  json={})
+
+        real_client = httpx.AsyncClient
+        clients = []
+
+        def client_factory(**kwargs):
+            clients.append(kwargs)
+            return real_client(transport=httpx.MockTransport(handler), **kwargs)
+
+        with patch.object(notifications.httpx, "AsyncClient", side_effect=client_factory), \
+                patch.object(settings, "RESEND_API_KEY", "re_test"):
+            results = notifications.send_email_batches({"k-ok": [{}], "k-busy": [{}], "k-bad": [{}]})
+
+        self.assertEqual(len(clients), 1)
+        self.assertEqual(sorted(seen), ["k-bad", "k-busy", "k-ok"])
+        self.assertEqual({k: v[0] for k, v in results.items()},
+                         {"k-ok": "sent", "k-busy": "retry", "k-bad": "failed"})
+
+
+class DrainTests(unittest.TestCase):
+    def _drain(self, groups, results, api_key="re_test"):
+        session = MagicMock()
+        session.__enter__.return_value = session
+        with patch.object(drain_module, "Session", return_value=session), \
+                patch.object(drain_module, "claim_notifications", return_value=groups), \
+                patch.object(drain_module, "write_delivery_results") as mock_write, \
+                patch.object(drain_module, "send_email_batches", side_effect=lambda b: {k: results(k) for k in b}) as mock_send, \
+                patch.object(drain_module, "log_event"), \
+                patch.object(settings, "RESEND_API_KEY", api_key):
+            summary = drain_module.drain_notification_outbox()
+        return summary, mock_write, mock_send
+
+    def test_new_rows_get_a_key_before_sending_and_retries_reuse_theirs(self):
+        groups = {
+            "k-retry": [_row(1, "a@x.cl", attempts=2)],
+            "": [_row(5, "b@x.cl"), _row(6, "b@x.cl")],
+        }
+        new_key = outbox_store.delivery_key([5, 6])
+        summary, mock_write, mock_send = self._drain(
+            groups, lambda key: ("sent", "") if key == new_key else ("retry", "429 - demasiadas solicitudes"))
+
+        keyed, results = [c.args[1] for c in mock_write.call_args_list]
+        self.assertEqual(keyed, [{"id": 5, "delivery_key": new_key}, {"id": 6, "delivery_key": new_key}])
+        self.assertEqual(set(mock_send.call_args.args[0]), {"k-retry", new_key})
+        by_id = {row["id"]: row for row in results}
+        self.assertEqual((by_id[5]["status"], by_id[6]["status"]), ("sent", "sent"))
+        self.assertEqual((by_id[1]["status"], by_id[1]["attempts"]), ("pending", 3))
+        self.assertGreater(by_id[1]["next_attempt_at"], datetime.datetime.now(datetime.UTC))
+        self.assertEqual((summary["sent"], summary["retried"], summary["requests"]), (2, 1, 2))
+
+    def test_last_attempt_fails_for_good(self):
+        groups = {"k-retry": [_row(1, "a@x.cl", attempts=settings.NOTIFICATION_MAX_ATTEMPTS - 1)]}
+        summary, mock_write, _ = self._drain(groups, lambda key: ("retry", "500 - error"))
+
+        self.assertEqual(mock_write.call_args.args[1][0]["status"], "failed")
+        self.assertEqual(summary["failed"], 1)
+
+    def test_without_provider_rows_are_skipped(self):
+        summary, mock_write, mock_send = self._drain({"": [_row(1, "a@x.cl")]}, None, api_key=None)
+
+        mock_send.assert_not_called()
+        self.assertEqual(mock_write.call_args.args[1][0]["status"], "skipped")
+        self.assertEqual(summary["skipped"], 1)
+
+    def test_empty_outbox_is_idle(self):
+        summary, _, mock_send = self._drain({}, None)
+
+        mock_send.assert_not_called()
+        self.assertEqual(summary["status"], "idle")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -166,6 +166,13 @@ class ObservabilityRouteTests(unittest.TestCase):
         self.assertNotIn("optional_checks", payload)
         self.assertNotIn("analytics", payload)
 
+    def test_observability_runs_off_the_event_loop(self):
+        """Broker and Redis round-trips are blocking: the endpoint must run in the threadpool."""
+        import inspect
+        from app.api.endpoints.observability import get_observability_snapshot
+
+        self.assertFalse(inspect.iscoroutinefunction(get_observability_snapshot))
+
 
 class VisitLoggingRateLimitTests(unittest.TestCase):
     """POST /api/v1/visit must cap page visits writes to avoid DB flood."""
@@ -0,0 +1,100 @@
+"""Regresiones para la vigencia de la cache según el calendario de pasadas de Sentinel-2.
+
+La entrada de un análisis debe vivir hasta la próxima pasada esperada del tile (y no un
+TTL plano), re-chequearse seguido si la pasada ya ocurrió pero la escena no aparece, y
+saltarse una pasada en zonas donde casi nunca hay imagen utilizable.
+"""
+import os
+import sys
+import datetime
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app.core import revisit
+
+NOW = datetime.datetime(2026, 7, 10, 12, 0, tzinfo=datetime.timezone.utc)
+DAY = 24 * 60 * 60
+
+
+class FakeHashRedis:
+    """Subconjunto mínimo de redis-py para hashes (hget/hmget/hset) sobre un dict."""
+
+    def __init__(self):
+        self.data = {}
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def hmget(self, key, *fields):
+        return [self.data.get(key, {}).get(f) for f in fields]
+
+    def hset(self, key, mapping):
+        self.data.setdefault(key, {}).update(
+            {k: str(v).encode() for k, v in mapping.items()}
+        )
+
+
+class AdaptiveTtlTests(unittest.TestCase):
+    def test_ttl_runs_until_next_expected_pass(self):
+        ttl = revisit.adaptive_ttl_seconds("2026-07-09", 3600, now=NOW)
+        # Adquirida 2026-07-09 00:00 -> próxima pasada 2026-07-14 00:00.
+        self.assertEqual(ttl, 3 * DAY + 12 * 60 * 60)
+
+    def test_overdue_pass_within_ingestion_grace_rechecks_soon(self):
+        ttl = revisit.adaptive_ttl_seconds("2026-07-04", 3600, now=NOW)
+        self.assertEqual(ttl, revisit.POST_PASS_RECHECK_SECONDS)
+
+    def test_cloudy_area_skips_one_pass(self):
+        clear = revisit.adaptive_ttl_seconds("2026-07-09", 3600, usable_ratio=0.9, now=NOW)
+        cloudy = revisit.adaptive_ttl_seconds("2026-07-09", 3600, usable_ratio=0.1, now=NOW)
+        self.assertEqual(cloudy - clear, revisit.S2_REVISIT_DAYS * DAY)
+
+    def test_unknown_date_falls_back_to_default(self):
+        self.assertEqual(revisit.adaptive_ttl_seconds(None, 3600, now=NOW), 3600)
+        self.assertEqual(revisit.adaptive_ttl_seconds("n/a", 3600, now=NOW), 3600)
+
+    def test_ttl_is_clamped(self):
+        ttl = revisit.adaptive_ttl_seconds("2026-07-10", 3600, revisit_days=30, now=NOW)
+        self.assertEqual(ttl, revisit.MAX_TTL_SECONDS)
+
+    def test_usable_pass_ratio(self):
+        self.assertIsNone(revisit.usable_pass_ratio(0, 60))
+        self.assertAlmostEqual(revisit.usable_pass_ratio(3, 60), 0.25)
+        self.assertEqual(revisit.usable_pass_ratio(40, 60), 1.0)
+
+
+class TileCadenceTests(unittest.TestCase):
+    def test_tile_from_scene_id(self):
+        self.assertEqual(
+            revisit.tile_from_scene_id("20260701T143731_20260701T144052_T19HBD"), "19HBD"
+        )
+        self.assertIsNone(revisit.tile_from_scene_id("sin_tile"))
+        self.assertIsNone(revisit.tile_from_scene_id(None))
+
+    def test_learns_shorter_cadence_from_consecutive_passes(self):
+        fake = FakeHashRedis()
+        self.assertEqual(revisit.learned_revisit_days(fake, "19HBD"), revisit.S2_REVISIT_DAYS)
+
+        revisit.note_tile_pass(fake, "19HBD", "2026-07-01")
+        revisit.note_tile_pass(fake, "19HBD", "2026-07-03")
+        self.assertEqual(revisit.learned_revisit_days(fake, "19HBD"), 2)
+
+        # Un salto largo (pasadas nubladas no vistas) no alarga la cadencia aprendida,
+        # y una fecha anterior a la última registrada se ignora.
+        revisit.note_tile_pass(fake, "19HBD", "2026-07-20")
+        revisit.note_tile_pass(fake, "19HBD", "2026-07-10")
+        self.assertEqual(revisit.learned_revisit_days(fake, "19HBD"), 2)
+        self.assertEqual(fake.hget("s2tile:19HBD", "last_date"), b"2026-07-20")
+
+    def test_without_redis_uses_default_cadence(self):
+        revisit.note_tile_pass(None, "19HBD", "2026-07-01")
+        self.assertEqual(revisit.learned_revisit_days(None, "19HBD"), revisit.S2_REVISIT_DAYS)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""Regresiones para los resultados compactos en el backend de Celery (app/tasks/results.py).
+
+El resultado completo de un análisis vive una sola vez, en la cache de Redis; la tarea
+devuelve un registro de estado con un puntero a esa entrada y GET /analyze/status lo
+resuelve desde ahí.
+"""
+import os
+import sys
+import json
+import unittest
+from unittest.mock import patch, MagicMock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from fastapi.testclient import TestClient
+from app.main import app
+import app.core.security as security_module
+import app.tasks.results as results_module
+from app.core.config import settings
+
+
+FULL_RESULT = {"status": "success", "approach": "agriculture", "data": {"Vigor Vegetal (NDVI)": "0.61"}}
+
+
+class CompactResultTests(unittest.TestCase):
+    def test_cached_result_is_replaced_by_a_pointer(self):
+        compact = results_module.compact_task_result("analysis:k", FULL_RESULT, cached=True)
+        self.assertEqual(compact, {"status": "success", "result_ref": {"cache_key": "analysis:k"}})
+        self.assertLess(len(json.dumps(compact)), len(json.dumps(FULL_RESULT)))
+
+    def test_result_is_kept_inline_when_the_cache_write_failed(self):
+        self.assertIs(results_module.compact_task_result("analysis:k", FULL_RESULT, cached=False), FULL_RESULT)
+
+    def test_slim_mode_can_be_disabled(self):
+        with patch.object(settings, "CELERY_SLIM_RESULTS", False):
+            self.assertIs(results_module.compact_task_result("analysis:k", FULL_RESULT, cached=True), FULL_RESULT)
+
+    def test_resolve_reads_through_the_cache(self):
+        redis = MagicMock()
+        redis.get.return_value = json.dumps(FULL_RESULT)
+        with patch.object(results_module, "redis_client", redis):
+            resolved = results_module.resolve_task_result({"status": "success", "result_ref": {"cache_key": "analysis:k"}})
+        self.assertEqual(resolved, FULL_RESULT)
+        redis.get.assert_called_once_with("analysis:k")
+
+    def test_inline_results_pass_through(self):
+        self.assertEqual(results_module.resolve_task_result(FULL_RESULT), FULL_RESULT)
+
+
+class StatusEndpointTests(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        security_module.status_limiter._requests.clear()
+
+    def tearDown(self):
+        security_module.status_limiter._requests.clear()
+
+    def _status(self, cached_value):
+        task = MagicMock()
+        task.state = "SUCCESS"
+        task.result = {"status": "success", "result_ref": {"cache_key": "analysis:k"}}
+        redis = MagicMock()
+        redis.get.return_value = cached_value
+        with patch("app.api.endpoints.analyze.AsyncResult", return_value=task), \
+                patch.object(security_module, "redis_client", None), \
+                patch.object(results_module, "redis_client", redis):
+            return self.client.get("/api/v1/analyze/status/task-abc").json()
+
+    def test_status_resolves_the_pointer(self):
+        body = self._status(json.dumps(FULL_RESULT))
+        self.assertEqual(body["status"], "success")
+        self.assertEqual(body["result"], FULL_RESULT)
+
+    def test_expired_cache_entry_is_reported_as_failed(self):
+        body = self._status(None)
+        self.assertEqual(body["status"], "failed")
+        self.assertIn("expiró", body["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
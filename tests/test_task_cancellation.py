@@ -0,0 +1,276 @@
+"""Regresiones para la cancelación y el abandono de tareas (app/tasks/cancellation.py).
+
+Un análisis que nadie sondea durante el período de gracia, o que el usuario cancela con
+DELETE /analyze/{task_id}, se detiene antes de la próxima etapa de GEE, salvo que otra
+solicitud esté esperando el mismo resultado.
+"""
+import os
+import sys
+import unittest
+from unittest.mock import patch, MagicMock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from celery import states
+from fastapi.testclient import TestClient
+from app.main import app
+import app.core.auth as auth_module
+import app.core.security as security_module
+import app.tasks.cancellation as cancellation
+import app.tasks.worker as worker_module
+
+
+class FakePipeline:
+    """Acumula comandos y los corre en orden con execute(), como un pipeline de redis-py."""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        results = [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
+class FakeRedis:
+    """Subconjunto de redis-py usado por cancellation.py, sobre dicts (sin vencimientos)."""
+
+    def __init__(self):
+        self.data = {}
+        self.sets = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(k) for k in keys]
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return False
+        self.data[key] = str(value)
+        return True
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def expire(self, key, ttl):
+        return True
+
+    def sadd(self, key, member):
+        self.sets.setdefault(key, set()).add(member)
+
+    def srem(self, key, member):
+        self.sets.get(key, set()).discard(member)
+
+    def smembers(self, key):
+        return set(self.sets.get(key, set()))
+
+    def sismember(self, key, member):
+        return member in self.sets.get(key, set())
+
+    def expire_heartbeat(self, group):
+        """Simula que venció el período de gracia de un grupo."""
+        self.delete(f"{cancellation.ALIVE_KEY_PREFIX}{group}")
+
+
+class CancellationTests(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.patcher = patch.object(cancellation, "redis_client", self.redis)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_unpolled_task_is_abandoned_and_polling_keeps_it_alive(self):
+        group = cancellation.watch_tasks({"task-1": "analysis:k"})
+        self.assertFalse(cancellation.is_abandoned("task-1"))
+
+        self.redis.expire_heartbeat(group)
+        self.assertTrue(cancellation.is_abandoned("task-1"))
+
+        cancellation.note_task_polled("task-1", group)
+        self.assertFalse(cancellation.is_abandoned("task-1"))
+
+    def test_polls_renew_only_a_group_that_waits_on_the_task(self):
+        group = cancellation.watch_tasks({"task-1": "analysis:k"})
+        self.redis.expire_heartbeat(group)
+
+        cancellation.note_task_polled("task-1", None)
+        cancellation.note_task_polled("task-1", "otro-grupo")
+        self.assertTrue(cancellation.is_abandoned("task-1"))
+
+    def test_task_is_kept_while_another_request_waits_on_its_cache(self):
+        group = cancellation.watch_tasks({"task-1": "analysis:k"})
+        self.assertEqual(cancellation.inflight_task_for("analysis:k"), "task-1")
+        cancellation.attach_to_task("task-1", "analysis:k")
+
+        self.redis.expire_heartbeat(group)
+        self.assertFalse(cancellation.is_abandoned("task-1"))
+
+    def test_timeseries_shares_the_analysis_heartbeat(self):
+        group = cancellation.watch_tasks({"ts-1": None})
+        cancellation.watch_tasks({"task-1": "analysis:k"}, group=group)
+
+        self.redis.expire_heartbeat(group)
+        cancellation.note_task_polled("task-1", group)
+        self.assertFalse(cancellation.is_abandoned("ts-1"))
+
+    def test_attached_request_keeps_its_own_timeseries_and_task_alive(self):
+        owner = cancellation.watch_tasks({"task-1": "analysis:k"})
+        attached = cancellation.watch_tasks({"ts-2": None})
+        self.assertEqual(cancellation.attach_to_task("task-1", "analysis:k", group=attached), attached)
+
+        # El dueño se fue; la otra solicitud sigue sondeando con su wait_id
+        self.redis.expire_heartbeat(owner)
+        self.redis.expire_heartbeat(attached)
+        cancellation.note_task_polled("task-1", attached)
+        self.assertFalse(cancellation.is_abandoned("task-1"))
+        self.assertFalse(cancellation.is_abandoned("ts-2"))
+
+    def test_cancel_is_detached_when_someone_else_waits(self):
+        owner = cancellation.watch_tasks({"task-1": "analysis:k"})
+        attached = cancellation.attach_to_task("task-1", "analysis:k")
+
+        # Quien se enganchó cancela: solo se suelta su grupo y el dueño sigue esperando
+        self.assertEqual(cancellation.request_cancel("task-1", attached), cancellation.DETACHED)
+        cancellation.raise_if_cancelled("task-1")
+        self.assertEqual(cancellation.request_cancel("task-1", owner), cancellation.CANCELLED)
+
+    def test_cancel_requires_a_group_that_waits_on_the_task(self):
+        cancellation.watch_tasks({"task-1": "analysis:k"})
+
+        self.assertIsNone(cancellation.request_cancel("task-1", None))
+        self.assertIsNone(cancellation.request_cancel("task-1", "otro-grupo"))
+        cancellation.raise_if_cancelled("task-1")
+
+    def test_attached_request_is_returned_once(self):
+        cancellation.remember_attached_request("task-1", "g", {"user_id": 7})
+
+        self.assertEqual(cancellation.pop_attached_request("task-1", "g"), {"user_id": 7})
+        self.assertIsNone(cancellation.pop_attached_request("task-1", "g"))
+
+    def test_cancel_without_other_waiters_stops_the_task(self):
+        group = cancellation.watch_tasks({"task-1": "analysis:k"})
+
+        self.assertEqual(cancellation.request_cancel("task-1", group), cancellation.CANCELLED)
+        self.assertIsNone(cancellation.inflight_task_for("analysis:k"))
+        with self.assertRaises(cancellation.TaskCancelled):
+            cancellation.raise_if_cancelled("task-1")
+
+    def test_untracked_tasks_are_never_abandoned(self):
+        # Precalentamiento y alertas no se registran: nadie los sondea.
+        self.assertFalse(cancellation.is_abandoned("prewarm-task"))
+
+
+class CancelledTaskTests(unittest.TestCase):
+    @patch("app.tasks.worker.record_api_usage")
+    @patch("app.tasks.worker.resolve_with_timeout")
+    @patch("app.tasks.worker.gee_session")
+    @patch("app.tasks.worker.ee")
+    def test_cancelled_task_stops_before_calling_gee(self, _mock_ee, _mock_gee_session, mock_resolve, mock_usage):
+        with patch.object(cancellation, "redis_client", FakeRedis()), \
+                patch.object(worker_module.process_gee_analysis, "update_state") as mock_update:
+            cancellation.redis_client.set(f"{cancellation.CANCEL_KEY_PREFIX}task-x", 1)
+            result = worker_module.process_gee_analysis.apply(task_id="task-x", kwargs={
+                "lat": -33.45, "lng": -70.66, "radius": 2000, "approach": "agriculture",
+                "location_name": "Test", "cache_key": "analysis:k",
+            })
+
+        self.assertEqual(result.state, states.IGNORED)
+        mock_update.assert_called_once_with(state=states.REVOKED, meta={"reason": "cancelled"})
+        mock_resolve.assert_not_called()
+        mock_usage.assert_not_called()
+
+
+class CancelEndpointTests(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        self.redis = FakeRedis()
+        self.patcher = patch.object(cancellation, "redis_client", self.redis)
+        self.patcher.start()
+        app.dependency_overrides[auth_module.get_optional_user] = lambda: None
+        security_module.analysis_limiter._requests.clear()
+        security_module.status_limiter._requests.clear()
+
+    def tearDown(self):
+        self.patcher.stop()
+        app.dependency_overrides.clear()
+        security_module.analysis_limiter._requests.clear()
+        security_module.status_limiter._requests.clear()
+
+    def test_delete_revokes_the_task(self):
+        group = cancellation.watch_tasks({"task-1": "analysis:k"})
+        with patch.object(security_module, "redis_client", None), \
+                patch("app.api.endpoints.analyze.celery_app.control.revoke") as mock_revoke:
+            response = self.client.delete(f"/api/v1/analyze/task-1?wait_id={group}")
+
+        self.assertEqual(response.json(), {"task_id": "task-1", "status": "cancelled"})
+        mock_revoke.assert_called_once_with("task-1")
+
+    def test_delete_without_the_requests_wait_id_is_rejected(self):
+        cancellation.watch_tasks({"task-1": "analysis:k"})
+        with patch.object(security_module, "redis_client", None), \
+                patch("app.api.endpoints.analyze.celery_app.control.revoke") as mock_revoke:
+            forged = self.client.delete("/api/v1/analyze/task-1?wait_id=adivinado")
+            missing = self.client.delete("/api/v1/analyze/task-1")
+
+        self.assertEqual((forged.status_code, missing.status_code), (404, 422))
+        mock_revoke.assert_not_called()
+        self.assertFalse(cancellation.is_cancel_requested("task-1"))
+
+    def test_attached_user_gets_a_history_row_when_reading_the_result(self):
+        group = cancellation.attach_to_task("task-1", "analysis:k")
+        cancellation.remember_attached_request("task-1", group, {
+            "user_id": 7, "lat": -33.45, "lng": -70.66, "radius": 2000,
+            "approach": "agriculture", "location_name": "Test",
+        })
+        done = MagicMock(state="SUCCESS", result={"data": {}})
+        with patch.object(security_module, "redis_client", None), \
+                patch("app.api.endpoints.analyze.AsyncResult", return_value=done), \
+                patch("app.api.endpoints.analyze.resolve_task_result", return_value={"data": {"NDVI": 0.5}}), \
+                patch("app.api.endpoints.analyze.persist_user_analysis") as mock_persist:
+            self.client.get(f"/api/v1/analyze/status/task-1?wait_id={group}")
+            self.client.get(f"/api/v1/analyze/status/task-1?wait_id={group}")
+
+        mock_persist.assert_called_once_with(
+            7, "task-1", -33.45, -70.66, 2000, "agriculture", "Test", {"data": {"NDVI": 0.5}}
+        )
+
+    def test_identical_request_attaches_to_the_running_task(self):
+        payload = {"lat": -33.45, "lng": -70.66, "radius": 2000, "approach": "agriculture", "location": "Test"}
+        running = MagicMock()
+        running.ready.return_value = False
+        with patch("app.api.endpoints.analyze.redis_client", None), \
+                patch("app.api.endpoints.analyze.lookup_durable_analysis", return_value=None), \
+                patch("app.api.endpoints.analyze.inflight_task_for", return_value="task-1"), \
+                patch("app.api.endpoints.analyze.AsyncResult", return_value=running), \
+                patch("app.api.endpoints.analyze.attach_to_task", return_value="grupo-b") as mock_attach, \
+                patch("app.tasks.worker.process_gee_analysis.delay") as mock_delay:
+            response = self.client.post("/api/v1/analyze", json=payload)
+
+        self.assertEqual((response.json()["task_id"], response.json()["wait_id"]), ("task-1", "grupo-b"))
+        mock_attach.assert_called_once()
+        mock_delay.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
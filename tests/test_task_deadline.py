@@ -0,0 +1,85 @@
+"""Regresiones para el presupuesto de tiempo por tarea (app/tasks/deadline.py).
+
+Cada espera a GEE toma el mínimo entre su tope y lo que le queda a la tarea; sin
+presupuesto, el análisis omite la fecha y la capa de mapa y devuelve los datos con
+"meta.degraded" y cache corta, en vez de morir por el límite suave de Celery.
+"""
+import os
+import sys
+import concurrent.futures
+import unittest
+from unittest.mock import patch, MagicMock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import app.tasks.worker as worker_module
+from app.tasks.deadline import TaskDeadline
+
+
+class TaskDeadlineTests(unittest.TestCase):
+    def test_timeout_is_capped_by_the_remaining_budget(self):
+        deadline = TaskDeadline(60, reserve_seconds=20)
+        self.assertAlmostEqual(deadline.timeout(15), 15, places=1)
+        self.assertAlmostEqual(deadline.timeout(90), 40, delta=0.5)
+        self.assertTrue(deadline.allows(30))
+        self.assertFalse(deadline.allows(45))
+
+    def test_spent_budget_never_gives_negative_timeouts(self):
+        deadline = TaskDeadline(10, reserve_seconds=20)
+        self.assertTrue(deadline.expired)
+        self.assertEqual(deadline.timeout(30), 0.0)
+
+    def test_for_task_prefers_the_per_call_soft_limit(self):
+        task = MagicMock()
+        task.request.timelimit = (120, 90)
+        self.assertEqual(TaskDeadline.for_task(task).budget_seconds, 90)
+
+        task.request.timelimit = None
+        task.soft_time_limit = None
+        self.assertEqual(
+            TaskDeadline.for_task(task).budget_seconds,
+            worker_module.celery_app.conf.task_soft_time_limit,
+        )
+
+    def test_resolve_with_an_expired_deadline_times_out_and_cancels(self):
+        future = concurrent.futures.Future()
+        with self.assertRaises(TimeoutError):
+            worker_module.resolve_with_timeout(future, timeout=30, deadline=TaskDeadline(0, reserve_seconds=0))
+        self.assertTrue(future.cancelled())
+
+
+class DegradedAnalysisTests(unittest.TestCase):
+    @patch("app.tasks.worker.persist_user_analysis")
+    @patch("app.tasks.worker.record_api_usage")
+    @patch("app.tasks.worker.persist_durable_analysis")
+    @patch("app.tasks.worker.cache_analysis_result")
+    @patch("app.tasks.worker.resolve_with_timeout")
+    @patch("app.tasks.worker.gee_session")
+    @patch("app.tasks.worker.ee")
+    def test_optional_steps_are_skipped_without_budget(self, _mock_ee, _mock_gee_session, mock_resolve,
+                                                       mock_cache, mock_persist, _mock_usage, _mock_user):
+        mock_resolve.return_value = {"NDVI": 0.5, "NDMI": 0.2, "SAVI": 0.4, "NDRE": 0.3, "BSI": 0.1}
+        mock_cache.return_value = False  # Sin cache: la tarea devuelve el resultado completo
+
+        # Presupuesto justo para las estadísticas, no para los pasos opcionales.
+        with patch.object(TaskDeadline, "for_task", return_value=TaskDeadline(2, reserve_seconds=0)), \
+                patch.object(worker_module, "redis_client", None):
+            result = worker_module.process_gee_analysis.apply(kwargs={
+                "lat": -33.45, "lng": -70.66, "radius": 2000, "approach": "agriculture",
+                "location_name": "Test", "cache_key": "analysis:k",
+            }).get()
+
+        self.assertEqual(result["status"], "success")
+        self.assertIsNone(result["map_layer"])
+        self.assertEqual(result["meta"]["degraded"], ["image_date", "map_layer"])
+        self.assertEqual(mock_resolve.call_count, 1)
+        self.assertLessEqual(mock_cache.call_args.args[2], worker_module.DEGRADED_CACHE_TTL_SECONDS)
+        mock_persist.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+"""Regresiones para el ruteo de tareas de Celery a colas por clase de trabajo (celery_app.py).
+
+Un análisis interactivo no debe quedar en la misma cola que la corrida diaria de alertas,
+el precalentamiento o una ráfaga de series temporales; los análisis de radio grande van a
+"heavy" para no ocupar los slots interactivos.
+"""
+import os
+import sys
+import unittest
+from unittest.mock import patch, MagicMock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import app.tasks.celery_app as celery_module
+from app.core.config import settings
+
+
+def _queue(name, **kwargs):
+    route = celery_module.celery_app.amqp.router.route({}, name, args=(), kwargs=kwargs)
+    return route["queue"].name
+
+
+class TaskRoutingTests(unittest.TestCase):
+    def test_user_analysis_goes_to_the_interactive_queue(self):
+        self.assertEqual(_queue("app.tasks.worker.process_gee_analysis", radius=2000), "interactive")
+
+    def test_large_radius_analysis_goes_to_the_heavy_queue(self):
+        radius = settings.CELERY_HEAVY_RADIUS_M
+        self.assertEqual(_queue("app.tasks.worker.process_gee_analysis", radius=radius), "heavy")
+
+    def test_background_work_stays_off_the_interactive_queue(self):
+        self.assertEqual(_queue("app.tasks.worker.process_gee_analysis", radius=2000, prewarm=True), "batch")
+        self.assertEqual(_queue("app.tasks.worker.process_timeseries", radius=2000), "premium-timeseries")
+        self.assertEqual(_queue("app.tasks.tasks_periodic.check_active_alerts"), "periodic")
+        self.assertEqual(_queue("app.tasks.tasks_periodic.prewarm_analysis_cache"), "periodic")
+
+    def test_each_queue_publishes_to_its_own_binding(self):
+        for queue in celery_module.celery_app.conf.task_queues:
+            self.assertEqual(queue.routing_key, queue.name)
+            self.assertEqual(queue.exchange.name, queue.name)
+
+    def test_queue_depths_per_queue(self):
+        conn = MagicMock()
+        conn.__enter__.return_value = conn
+        conn.default_channel.queue_declare.side_effect = lambda queue, passive: MagicMock(
+            message_count={"interactive": 3, "periodic": 40}.get(queue, 0)
+        )
+        with patch.object(celery_module.celery_app, "connection_for_read", return_value=conn):
+            depths = celery_module.queue_depths()
+
+        self.assertEqual(set(depths), set(celery_module.TASK_QUEUES))
+        self.assertEqual(depths["interactive"], 3)
+        self.assertEqual(depths["periodic"], 40)
+
+    def test_queue_depths_without_broker(self):
+        with patch.object(celery_module.celery_app, "connection_for_read", side_effect=ConnectionError("down")):
+            depths = celery_module.queue_depths()
+        self.assertTrue(all(v is None for v in depths.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
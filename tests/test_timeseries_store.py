@@ -0,0 +1,196 @@
+"""Regresiones para la serie temporal compartida (tabla timeseries_points).
+
+process_timeseries debe reutilizar lo que ya está guardado para la celda+radio exacto y
+pedirle a GEE solo las pasadas nuevas; el historial del usuario debe referenciar la tabla
+compartida (celda, radio y versión de lógica) en vez de copiar el chart_data cuando los
+mismos puntos ya están guardados.
+"""
+import os
+import sys
+import datetime
+import unittest
+from unittest.mock import patch, MagicMock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from fastapi.testclient import TestClient
+from app.main import app
+import app.db.session as session_module
+import app.core.auth as auth_module
+from app.core.cells import location_cell, radius_bucket
+from app.db.models import UserAnalysis
+from sqlalchemy.dialects import postgresql
+from app.db.timeseries_store import (
+    load_history_chart_data,
+    merge_chart_data,
+    store_covers_chart_data,
+    upsert_timeseries_points,
+)
+from app.tasks.worker import TIMESERIES_LOGIC_VERSION, process_timeseries
+
+
+def _point(date, ndvi=0.5):
+    return {"date": date, "ndvi": ndvi, "ndwi": 0.1, "ndmi": 0.2, "clouds": 3.0}
+
+
+class CellHelpersTests(unittest.TestCase):
+    def test_location_cell_matches_cache_key_precision(self):
+        self.assertEqual(location_cell(-33.450004, -70.66), "-33.4500:-70.6600")
+        self.assertEqual(location_cell(-33.45001, -70.66), location_cell(-33.449996, -70.660001))
+
+    def test_radius_bucket_rounds_to_100m(self):
+        self.assertEqual(radius_bucket(2000), 2000)
+        self.assertEqual(radius_bucket(1990), 2000)
+        self.assertEqual(radius_bucket(30), 100)
+
+
+class MergeChartDataTests(unittest.TestCase):
+    def test_fresh_points_win_and_result_is_sorted(self):
+        stored = [_point("2026-07-01", 0.4), _point("2026-07-06", 0.41)]
+        fresh = [_point("2026-07-11", 0.5), _point("2026-07-06", 0.45)]
+        merged = merge_chart_data(stored, fresh)
+        self.assertEqual([p["date"] for p in merged], ["2026-07-01", "2026-07-06", "2026-07-11"])
+        self.assertEqual(merged[1]["ndvi"], 0.45)
+
+
+class ProcessTimeseriesStoreTests(unittest.TestCase):
+    @patch("app.tasks.worker.cache_analysis_result")
+    @patch("app.tasks.worker.store_timeseries_points")
+    @patch("app.tasks.worker.fetch_timeseries_points")
+    @patch("app.tasks.worker.read_stored_timeseries")
+    @patch("app.tasks.worker.gee_session")
+    @patch("app.tasks.worker.ee")
+    def test_only_fetches_passes_after_last_stored_point(self, _mock_gee_session, _mock_ee, mock_read, mock_fetch, mock_store, _mock_cache):
+        last = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=5)).date().isoformat()
+        new = datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+        mock_read.return_value = [_point(last)]
+        mock_fetch.return_value = [_point(new, 0.6)]
+
+        result = process_timeseries.apply(kwargs={"lat": -33.45, "lng": -70.66, "radius": 2000}).get()
+
+        fetch_start = mock_fetch.call_args[0][3]
+        self.assertEqual(fetch_start.date().isoformat(),
+                         (datetime.date.fromisoformat(last) + datetime.timedelta(days=1)).isoformat())
+        mock_store.assert_called_once_with("-33.4500:-70.6600", 2000, [_point(new, 0.6)])
+        self.assertEqual([p["date"] for p in result["chart_data"]], [last, new])
+
+    @patch("app.tasks.worker.cache_analysis_result")
+    @patch("app.tasks.worker.store_timeseries_points")
+    @patch("app.tasks.worker.fetch_timeseries_points", return_value=[])
+    @patch("app.tasks.worker.read_stored_timeseries", return_value=[])
+    @patch("app.tasks.worker.gee_session")
+    @patch("app.tasks.worker.ee")
+    def test_points_are_keyed_on_the_radius_they_were_computed_with(self, _mock_gee_session, _mock_ee, mock_read, mock_fetch, _mock_store, _mock_cache):
+        # 1960 m cae en el tramo de 2000 m, pero GEE calcula con 1960 m: no comparte puntos con 2000 m
+        process_timeseries.apply(kwargs={"lat": -33.45, "lng": -70.66, "radius": 1960}).get()
+
+        self.assertEqual(mock_read.call_args[0][:2], ("-33.4500:-70.6600", 1960))
+        self.assertEqual(mock_fetch.call_args[0][2], 1960)
+
+    @patch("app.tasks.worker.cache_analysis_result")
+    @patch("app.tasks.worker.store_timeseries_points")
+    @patch("app.tasks.worker.fetch_timeseries_points")
+    @patch("app.tasks.worker.read_stored_timeseries")
+    @patch("app.tasks.worker.gee_session")
+    @patch("app.tasks.worker.ee")
+    def test_skips_gee_when_store_is_up_to_date(self, _mock_gee_session, _mock_ee, mock_read, mock_fetch, mock_store, _mock_cache):
+        today = datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+        mock_read.return_value = [_point(today)]
+
+        result = process_timeseries.apply(kwargs={"lat": -33.45, "lng": -70.66, "radius": 2000}).get()
+
+        mock_fetch.assert_not_called()
+        mock_store.assert_not_called()
+        self.assertEqual(result["chart_data"], [_point(today)])
+
+
+class HistoryReferencesSharedStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        self.mock_session = MagicMock()
+        app.dependency_overrides[session_module.get_session] = lambda: self.mock_session
+        fake_user = MagicMock()
+        fake_user.id = 5
+        app.dependency_overrides[auth_module.get_current_user] = lambda: fake_user
+        self.row = UserAnalysis(
+            id=1, user_id=5, task_id="task-1", location_name="Papudo", lat=-32.5, lng=-71.4,
+            radius=2000, approach="environmental", created_at=datetime.datetime(2026, 7, 20, 10, 0),
+        )
+
+    def tearDown(self):
+        app.dependency_overrides.clear()
+
+    @patch("app.api.endpoints.auth.store_covers_chart_data", return_value=True)
+    def test_patch_stores_reference_when_points_are_shared(self, mock_covers):
+        self.mock_session.exec.return_value.first.return_value = self.row
+
+        response = self.client.patch("/api/v1/me/analyses/task-1", json={"chart_data": [_point("2026-07-15")]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(self.row.chart_data)
+        self.assertEqual(self.row.timeseries_cell, "-32.5000:-71.4000")
+        self.assertEqual(self.row.timeseries_radius, 2000)
+        self.assertEqual(self.row.timeseries_logic_version, TIMESERIES_LOGIC_VERSION)
+        self.assertEqual(mock_covers.call_args.args[3], TIMESERIES_LOGIC_VERSION)
+
+    @patch("app.api.endpoints.auth.store_covers_chart_data", return_value=False)
+    def test_patch_embeds_copy_when_store_is_missing_points(self, _mock_covers):
+        self.mock_session.exec.return_value.first.return_value = self.row
+        chart = [_point("2026-07-15")]
+
+        response = self.client.patch("/api/v1/me/analyses/task-1", json={"chart_data": chart})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.row.chart_data, chart)
+        self.assertIsNone(self.row.timeseries_cell)
+
+    def test_history_rebuilds_chart_from_shared_points_within_window(self):
+        self.row.timeseries_cell = "-32.5000:-71.4000"
+        self.row.timeseries_radius = 2000
+        self.row.timeseries_logic_version = "v2"
+        in_window = MagicMock(cell="-32.5000:-71.4000", radius=2000, logic_version="v2",
+                              acquisition_date=datetime.date(2026, 7, 15), ndvi=0.5, ndwi=0.1, ndmi=0.2, clouds=3.0)
+        newer_logic = MagicMock(cell="-32.5000:-71.4000", radius=2000, logic_version="v3",
+                                acquisition_date=datetime.date(2026, 7, 15), ndvi=0.9, ndwi=0.1, ndmi=0.2, clouds=3.0)
+        after_analysis = MagicMock(cell="-32.5000:-71.4000", radius=2000, logic_version="v2",
+                                   acquisition_date=datetime.date(2026, 7, 30), ndvi=0.6, ndwi=0.1, ndmi=0.2, clouds=1.0)
+        self.mock_session.exec.return_value.all.return_value = [in_window, newer_logic, after_analysis]
+
+        charts = load_history_chart_data(self.mock_session, [self.row])
+
+        self.assertEqual(charts, {1: [_point("2026-07-15")]})
+        self.mock_session.exec.assert_called_once()
+        query = self.mock_session.exec.call_args.args[0].compile(dialect=postgresql.dialect())
+        self.assertIn("timeseries_points.logic_version", str(query))
+
+    def test_covering_requires_the_same_values_for_the_logic_version(self):
+        self.mock_session.exec.return_value.all.return_value = [
+            MagicMock(acquisition_date=datetime.date(2026, 7, 15), ndvi=0.5, ndwi=0.1, ndmi=0.2, clouds=3.0),
+        ]
+
+        self.assertTrue(store_covers_chart_data(self.mock_session, self.row, [_point("2026-07-15")], "v2"))
+        self.assertFalse(store_covers_chart_data(self.mock_session, self.row, [_point("2026-07-15", 0.7)], "v2"))
+        self.assertFalse(store_covers_chart_data(self.mock_session, self.row, [_point("2026-07-20")], "v2"))
+        query = self.mock_session.exec.call_args.args[0].compile(dialect=postgresql.dialect())
+        self.assertIn("v2", query.params.values())
+        self.assertIn(2000, query.params.values())
+
+
+class UpsertTimeseriesPointsTests(unittest.TestCase):
+    def test_a_new_logic_version_adds_points_instead_of_overwriting(self):
+        session = MagicMock()
+        upsert_timeseries_points(session, "-32.5000:-71.4000", 1960, [_point("2026-07-15")], "v3")
+
+        statement = session.execute.call_args.args[0]
+        sql = str(statement.compile(dialect=postgresql.dialect()))
+        self.assertIn("ON CONFLICT (cell, radius, logic_version, acquisition_date) DO UPDATE", sql)
+        self.assertNotIn("logic_version = excluded.logic_version", sql)
+        self.assertEqual(statement.compile(dialect=postgresql.dialect()).params["radius_m0"], 1960)
+
+
+if __name__ == "__main__":
+    unittest.main()